@@ -0,0 +1,381 @@
+# archive.py
+# Tiered archival of old predictions and health records to Parquet.
+# Documents older than ARCHIVE_AFTER_DAYS (by ObjectId creation time, which every document
+# has even when its timestamp field is missing or malformed) are written to Parquet files
+# partitioned by collection and month, on local disk or any filesystem pyarrow can open
+# (s3://, gs://, ...). A manifest lists every file with its id/time range, a compact
+# per-file summary is kept in Mongo, and only then are the documents deleted, so an
+# interrupted run is simply repeated. query_table merges hot Mongo data with the archived
+# files for analytics and exports. Run one archival job at a time:
+#
+#   python -m app.archive run --older-than-days 180
+#   python -m app.archive export predictions predictions.parquet --since 2024-01-01
+
+import os
+import json
+import logging
+import argparse
+import posixpath
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+from bson import ObjectId, json_util
+
+from .database import (
+    get_database, HEALTH_RECORDS_COLLECTION, PREDICTIONS_COLLECTION,
+    ARCHIVE_SUMMARIES_COLLECTION, WORKLOAD_ANALYTICS
+)
+
+try:
+    from .cache import delete_cache, health_record_cache_key
+    REDIS_CACHE_AVAILABLE = True
+except ImportError:
+    REDIS_CACHE_AVAILABLE = False
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Archive configuration from environment variables
+ARCHIVE_URI = os.getenv("ARCHIVE_URI", os.path.abspath(os.path.join(os.path.dirname(__file__), '../archive')))
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))  # documents per Parquet file at most
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# Typed columns per collection. Fields that are absent from this list, or whose value does
+# not have the column's type, are kept losslessly in the "extra" column as extended JSON.
+ARCHIVE_SCHEMAS = {
+    PREDICTIONS_COLLECTION: pa.schema([
+        ("_id", pa.string()),
+        ("created", pa.timestamp("ms")),
+        ("prediction_id", pa.string()),
+        ("patient_id", pa.string()),
+        ("timestamp", pa.timestamp("ms")),
+        ("image_digest", pa.string()),
+        ("predicted_class", pa.string()),
+        ("confidence", pa.float64()),
+        ("model_version", pa.string()),
+        ("diagnosis", pa.string()),
+        ("localization", pa.string()),
+        ("sex", pa.string()),
+        ("embedding_id", pa.string()),
+        ("embedding", pa.binary()),
+        ("extra", pa.string())
+    ]),
+    HEALTH_RECORDS_COLLECTION: pa.schema([
+        ("_id", pa.string()),
+        ("created", pa.timestamp("ms")),
+        ("patient_id", pa.string()),
+        ("timestamp", pa.timestamp("ms")),
+        ("data", pa.string()),
+        ("signature_verified", pa.bool_()),
+        ("extra", pa.string())
+    ])
+}
+
+_PYTHON_TYPES = {
+    pa.string(): str,
+    pa.timestamp("ms"): datetime,
+    pa.float64(): float,
+    pa.binary(): bytes,
+    pa.bool_(): bool
+}
+
+
+def _matches(value: Any, arrow_type: pa.DataType) -> bool:
+    if arrow_type == pa.float64():
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, _PYTHON_TYPES[arrow_type])
+
+
+def _naive_utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=None) if value.tzinfo else value
+
+
+def _to_row(document: Dict[str, Any], schema: pa.Schema) -> Dict[str, Any]:
+    """Flatten a Mongo document into the collection's archive columns"""
+    extra = {key: value for key, value in document.items() if key != "_id"}
+    row = {"_id": str(document["_id"]), "created": None, "extra": None}
+    if isinstance(document["_id"], ObjectId):
+        row["created"] = _naive_utc(document["_id"].generation_time)
+    for column in schema:
+        if column.name in row or column.name not in extra:
+            continue
+        value = extra[column.name]
+        if value is None or _matches(value, column.type):
+            row[column.name] = bytes(value) if isinstance(value, bytes) else value
+            del extra[column.name]
+    if extra:
+        row["extra"] = json_util.dumps(extra)
+    return row
+
+
+def _to_document(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Inverse of _to_row"""
+    document = {"_id": ObjectId(row["_id"]) if ObjectId.is_valid(row["_id"]) else row["_id"]}
+    for key, value in row.items():
+        if key not in ("_id", "created", "extra") and value is not None:
+            document[key] = value
+    if row.get("extra"):
+        document.update(json_util.loads(row["extra"]))
+    return document
+
+
+def to_table(collection: str, documents: Sequence[Dict[str, Any]]) -> pa.Table:
+    """Arrow table of documents in the collection's archive schema"""
+    schema = ARCHIVE_SCHEMAS[collection]
+    return pa.Table.from_pylist([_to_row(document, schema) for document in documents], schema=schema)
+
+
+class ParquetArchive:
+    """Partitioned Parquet files plus a JSON manifest under ARCHIVE_URI"""
+
+    def __init__(self, uri: str = ARCHIVE_URI):
+        self.filesystem, self.root = pafs.FileSystem.from_uri(uri)
+
+    def _path(self, *parts: str) -> str:
+        return posixpath.join(self.root, *parts)
+
+    def manifest(self) -> Dict[str, Any]:
+        """Manifest of archived files (empty when nothing has been archived)"""
+        try:
+            with self.filesystem.open_input_stream(self._path(MANIFEST_NAME)) as stream:
+                return json.loads(stream.read())
+        except FileNotFoundError:
+            return {"version": MANIFEST_VERSION, "files": []}
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        # Write then move, so readers never see a partially written manifest
+        temporary = self._path(f"{MANIFEST_NAME}.tmp")
+        with self.filesystem.open_output_stream(temporary) as stream:
+            stream.write(json.dumps(manifest, indent=1, sort_keys=True).encode())
+        self.filesystem.move(temporary, self._path(MANIFEST_NAME))
+
+    def files(self, collection: str, start: Optional[datetime] = None,
+              end: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Manifest entries of a collection whose creation time range overlaps [start, end)"""
+        entries = []
+        for entry in self.manifest()["files"]:
+            if entry["collection"] != collection:
+                continue
+            if start is not None and datetime.fromisoformat(entry["max_created"]) < start:
+                continue
+            if end is not None and datetime.fromisoformat(entry["min_created"]) >= end:
+                continue
+            entries.append(entry)
+        return entries
+
+    def write(self, collection: str, table: pa.Table) -> List[Dict[str, Any]]:
+        """Write a table (sorted by _id) as one file per month; returns the new manifest entries"""
+        months = pc.strftime(table["created"], format="%Y-%m")
+        entries = []
+        for month in pc.unique(months).to_pylist():
+            part = table.filter(pc.equal(months, month))
+            year, month_number = month.split("-")
+            first_id, last_id = part["_id"][0].as_py(), part["_id"][-1].as_py()
+            # Deterministic name: re-running an interrupted batch overwrites the same file
+            path = self._path(collection, f"year={year}", f"month={month_number}",
+                              f"part-{first_id}-{last_id}.parquet")
+            self.filesystem.create_dir(posixpath.dirname(path), recursive=True)
+            pq.write_table(part, path, filesystem=self.filesystem, compression="zstd")
+            entries.append({
+                "collection": collection,
+                "partition": month,
+                "path": posixpath.relpath(path, self.root),
+                "rows": part.num_rows,
+                "min_id": first_id,
+                "max_id": last_id,
+                "min_created": pc.min(part["created"]).as_py().isoformat(),
+                "max_created": pc.max(part["created"]).as_py().isoformat(),
+                "archived_at": datetime.utcnow().isoformat()
+            })
+
+        manifest = self.manifest()
+        written = {entry["path"] for entry in entries}
+        manifest["files"] = [entry for entry in manifest["files"] if entry["path"] not in written] + entries
+        self._write_manifest(manifest)
+        return entries
+
+    def read(self, collection: str, filter_expression: Optional[ds.Expression] = None,
+             start: Optional[datetime] = None, end: Optional[datetime] = None) -> pa.Table:
+        """Archived rows of a collection, reading only files whose time range can match"""
+        schema = ARCHIVE_SCHEMAS[collection]
+        paths = [self._path(entry["path"]) for entry in self.files(collection, start, end)]
+        if not paths:
+            return schema.empty_table()
+        dataset = ds.dataset(paths, schema=schema, format="parquet", filesystem=self.filesystem)
+        return dataset.to_table(filter=filter_expression)
+
+
+# Global archive instance
+parquet_archive = ParquetArchive()
+
+
+def _summarize(entry: Dict[str, Any], part: pa.Table) -> Dict[str, Any]:
+    """Compact Mongo summary of one archived file"""
+    summary = {
+        **entry,
+        "_id": entry["path"],
+        "patients": pc.count_distinct(part["patient_id"]).as_py()
+    }
+    if "predicted_class" in part.column_names:
+        classes = pc.value_counts(part["predicted_class"].drop_null()).to_pylist()
+        summary["by_class"] = {item["values"]: item["counts"] for item in classes}
+        summary["mean_confidence"] = pc.mean(part["confidence"]).as_py()
+    return summary
+
+
+def archive_collection(collection: str, older_than: timedelta = timedelta(days=ARCHIVE_AFTER_DAYS),
+                       batch_size: int = ARCHIVE_BATCH_SIZE, archive: ParquetArchive = None,
+                       dry_run: bool = False) -> int:
+    """Move documents older than older_than to the archive; returns the number moved"""
+    archive = archive or parquet_archive
+    db = get_database()
+    if db is None:
+        raise Exception("Database not connected")
+
+    cutoff = ObjectId.from_datetime(datetime.utcnow() - older_than)
+    query = {"_id": {"$lt": cutoff}}
+    if dry_run:
+        return db[collection].count_documents(query)
+
+    moved = 0
+    while True:
+        documents = list(db[collection].find(query).sort("_id", 1).limit(batch_size))
+        if not documents:
+            break
+        table = to_table(collection, documents)
+        entries = archive.write(collection, table)
+
+        months = pc.strftime(table["created"], format="%Y-%m")
+        for entry in entries:
+            part = table.filter(pc.equal(months, entry["partition"]))
+            db[ARCHIVE_SUMMARIES_COLLECTION].replace_one({"_id": entry["path"]}, _summarize(entry, part), upsert=True)
+
+        # Only delete once the files, manifest and summaries are in place
+        db[collection].delete_many({"_id": {"$in": [document["_id"] for document in documents]}})
+        if collection == HEALTH_RECORDS_COLLECTION and REDIS_CACHE_AVAILABLE:
+            for patient_id in {document.get("patient_id") for document in documents} - {None}:
+                delete_cache(health_record_cache_key(patient_id))
+
+        moved += len(documents)
+        logger.info(f"Archived {len(documents)} {collection} documents ({moved} so far)")
+        if len(documents) < batch_size:
+            break
+    return moved
+
+
+def run_archival(collections: Sequence[str] = (PREDICTIONS_COLLECTION, HEALTH_RECORDS_COLLECTION),
+                 older_than_days: int = ARCHIVE_AFTER_DAYS, **options) -> Dict[str, int]:
+    """Archive every configured collection"""
+    return {collection: archive_collection(collection, timedelta(days=older_than_days), **options)
+            for collection in collections}
+
+
+def query_table(collection: str, patient_id: Optional[str] = None, start: Optional[datetime] = None,
+                end: Optional[datetime] = None, columns: Optional[Sequence[str]] = None,
+                limit: Optional[int] = None, archive: ParquetArchive = None) -> pa.Table:
+    """
+    Documents of a collection from Mongo and the archive as one table, newest first.
+
+    start/end bound the creation time (UTC). A document present in both tiers (archived but
+    not yet deleted) is taken from Mongo.
+    """
+    archive = archive or parquet_archive
+    query: Dict[str, Any] = {}
+    expression = None
+    if patient_id is not None:
+        query["patient_id"] = patient_id
+        expression = ds.field("patient_id") == patient_id
+    id_range = {}
+    if start is not None:
+        id_range["$gte"] = ObjectId.from_datetime(start)
+        created = ds.field("created") >= pa.scalar(start, pa.timestamp("ms"))
+        expression = created if expression is None else expression & created
+    if end is not None:
+        id_range["$lt"] = ObjectId.from_datetime(end)
+        created = ds.field("created") < pa.scalar(end, pa.timestamp("ms"))
+        expression = created if expression is None else expression & created
+    if id_range:
+        query["_id"] = id_range
+
+    db = get_database(WORKLOAD_ANALYTICS)
+    if db is None:
+        raise Exception("Database not connected")
+    cursor = db[collection].find(query).sort("_id", -1)
+    if limit:
+        cursor = cursor.limit(limit)
+    hot = to_table(collection, list(cursor))
+
+    cold = archive.read(collection, expression, start, end)
+    if hot.num_rows and cold.num_rows:
+        cold = cold.filter(pc.invert(pc.is_in(cold["_id"], value_set=hot["_id"])))
+    merged = pa.concat_tables([hot, cold]).sort_by([("created", "descending"), ("_id", "descending")])
+    if limit:
+        merged = merged.slice(0, limit)
+    return merged.select(list(columns)) if columns else merged
+
+
+def query_records(collection: str, **options) -> List[Dict[str, Any]]:
+    """query_table as Mongo-shaped documents"""
+    return [_to_document(row) for row in query_table(collection, **options).to_pylist()]
+
+
+def export(collection: str, destination: str, file_format: str = "parquet", **options) -> int:
+    """Write the merged hot and archived documents to a Parquet or CSV file; returns the row count"""
+    table = query_table(collection, **options)
+    if file_format == "csv":
+        import pyarrow.csv as pacsv
+        # CSV has no binary type
+        if "embedding" in table.column_names:
+            table = table.drop_columns(["embedding"])
+        pacsv.write_csv(table, destination)
+    else:
+        pq.write_table(table, destination, compression="zstd")
+    return table.num_rows
+
+
+def _date(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+def main():
+    """Archive old documents to Parquet, or export hot and archived documents"""
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Move old documents to the archive")
+    run.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    run.add_argument("--collections", nargs="+", choices=sorted(ARCHIVE_SCHEMAS),
+                     default=[PREDICTIONS_COLLECTION, HEALTH_RECORDS_COLLECTION])
+    run.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    run.add_argument("--dry-run", action="store_true", help="Only count the documents that would move")
+
+    export_parser = commands.add_parser("export", help="Export hot and archived documents")
+    export_parser.add_argument("collection", choices=sorted(ARCHIVE_SCHEMAS))
+    export_parser.add_argument("destination")
+    export_parser.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    export_parser.add_argument("--patient-id")
+    export_parser.add_argument("--since", type=_date, help="ISO date, UTC")
+    export_parser.add_argument("--until", type=_date, help="ISO date, UTC")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        moved = run_archival(args.collections, args.older_than_days,
+                             batch_size=args.batch_size, dry_run=args.dry_run)
+        print(json.dumps({"dry_run": args.dry_run, "documents": moved}))
+    else:
+        rows = export(args.collection, args.destination, args.format, patient_id=args.patient_id,
+                      start=args.since, end=args.until)
+        print(json.dumps({"rows": rows, "destination": args.destination}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+# autotune.py
+# CPU execution autotuner.
+# Benchmarks intra-op/inter-op thread counts, channels_last layout and oneDNN graph fusion
+# for the served model on synthetic inputs, then the batch size for the winning settings.
+# The best profile is stored per machine (CPU model + usable cores) and applied at boot.
+# Profiles are tuned for one process owning every core; serving processes that share the
+# machine (uvicorn's WEB_CONCURRENCY workers) each get their share of the threads.
+# Inter-op threads can only be set once per process, so each inter-op candidate is
+# benchmarked in its own spawned process.
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import statistics
+import multiprocessing
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import torch
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Autotune configuration from environment variables
+MODEL_DIR = os.path.join(os.path.dirname(__file__), '../model')
+AUTOTUNE_PROFILE_PATH = os.getenv("AUTOTUNE_PROFILE_PATH", os.path.join(MODEL_DIR, "cpu_profiles.json"))
+# off: library defaults, apply: use a stored profile if one exists, tune: benchmark at boot if none exists
+AUTOTUNE_MODE = os.getenv("AUTOTUNE_MODE", "apply").lower()
+AUTOTUNE_REPEATS = int(os.getenv("AUTOTUNE_REPEATS", "5"))
+AUTOTUNE_BATCH_SIZES = [int(b) for b in os.getenv("AUTOTUNE_BATCH_SIZES", "1,2,4,8,16").split(",")]
+# Processes sharing the cores at serving time
+AUTOTUNE_PROCESSES = int(os.getenv("AUTOTUNE_PROCESSES", os.getenv("WEB_CONCURRENCY", "1")))
+
+DEFAULT_PROFILE = {
+    "num_threads": None,
+    "interop_threads": None,
+    "channels_last": False,
+    "onednn_fusion": False,
+    "batch_size": 1
+}
+
+# Profile applied to this process, used for every model installed afterwards
+active_profile: Optional[Dict[str, Any]] = None
+
+
+def usable_cores() -> int:
+    """CPU cores this process may run on (respects affinity and container cpusets)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def cpu_model() -> str:
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def machine_key() -> str:
+    """Profile key: CPU model and usable core count"""
+    return f"{cpu_model()} x{usable_cores()}"
+
+
+def read_profiles(path: str = AUTOTUNE_PROFILE_PATH) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Failed to read CPU profiles from {path}: {e}")
+        return {}
+
+
+def save_profile(profile: Dict[str, Any], path: str = AUTOTUNE_PROFILE_PATH):
+    """Store the profile for this machine, keeping profiles of other machines"""
+    profiles = read_profiles(path)
+    profiles[machine_key()] = profile
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(profiles, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _thread_candidates(cores: int) -> List[int]:
+    candidates = {1, cores, max(1, cores // 2)}
+    n = 2
+    while n < cores:
+        candidates.add(n)
+        n *= 2
+    return sorted(candidates)
+
+
+def _interop_candidates(cores: int) -> List[int]:
+    return sorted({1, 2} | ({4} if cores >= 16 else set()))
+
+
+def _load_benchmark_model(checkpoint: Optional[str]):
+    from .model_registry import load_model_from_checkpoint, build_untrained_model
+    if checkpoint and os.path.exists(checkpoint):
+        return load_model_from_checkpoint(checkpoint)
+    return build_untrained_model()
+
+
+def _measure(loaded, batch_size: int, repeats: int) -> float:
+    """Median seconds per forward pass on synthetic inputs"""
+    images = torch.randn(batch_size, 3, 224, 224)
+    features = torch.rand(batch_size, loaded.feature_encoder.feature_dim)
+    timings = []
+    with torch.no_grad():
+        for i in range(repeats + 2):
+            start = time.perf_counter()
+            loaded.predict_proba(images, features)
+            if i >= 2:  # the first runs warm up allocators and fused graphs
+                timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def _benchmark_worker(interop_threads: int, configs: List[Dict[str, Any]], batch_sizes: List[int],
+                      checkpoint: Optional[str], repeats: int, results):
+    """Child process: fix inter-op threads, then time each config (and batch size)"""
+    torch.set_num_interop_threads(interop_threads)
+    loaded = _load_benchmark_model(checkpoint)
+    for config in configs:
+        try:
+            torch.set_num_threads(config["num_threads"])
+            loaded.model.to(memory_format=torch.contiguous_format)
+            loaded.apply_cpu_profile(config["channels_last"], config["onednn_fusion"])
+            for batch_size in batch_sizes:
+                seconds = _measure(loaded, batch_size, repeats)
+                results.append(dict(config, interop_threads=interop_threads, batch_size=batch_size,
+                                    latency_ms=round(seconds * 1000, 3),
+                                    images_per_second=round(batch_size / seconds, 2)))
+        except Exception as e:
+            results.append(dict(config, interop_threads=interop_threads, error=str(e)))
+
+
+def _run_in_child(interop_threads: int, configs, batch_sizes, checkpoint, repeats) -> List[Dict[str, Any]]:
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager:
+        results = manager.list()
+        process = context.Process(target=_benchmark_worker,
+                                  args=(interop_threads, configs, batch_sizes, checkpoint, repeats, results))
+        process.start()
+        process.join()
+        return list(results)
+
+
+def tune(checkpoint: Optional[str] = None, repeats: int = AUTOTUNE_REPEATS,
+         batch_sizes: Optional[List[int]] = None) -> Dict[str, Any]:
+    """
+    Benchmark the settings grid on this machine and return the best profile.
+
+    Settings are ranked by single-image latency (the /predict case); the batch size is then
+    chosen for throughput with the winning settings.
+    """
+    cores = usable_cores()
+    configs = [
+        {"num_threads": threads, "channels_last": channels_last, "onednn_fusion": fusion}
+        for threads in _thread_candidates(cores)
+        for channels_last in (False, True)
+        for fusion in (False, True)
+    ]
+    logger.info(f"Autotuning {len(configs)} settings x {len(_interop_candidates(cores))} inter-op "
+                f"thread counts on {machine_key()}")
+
+    results = []
+    for interop_threads in _interop_candidates(cores):
+        results += _run_in_child(interop_threads, configs, [1], checkpoint, repeats)
+    measured = [r for r in results if "error" not in r]
+    if not measured:
+        raise RuntimeError(f"Autotune failed for every setting: {results[:3]}")
+    best = min(measured, key=lambda r: r["latency_ms"])
+
+    best_config = {key: best[key] for key in ("num_threads", "channels_last", "onednn_fusion")}
+    batch_results = _run_in_child(best["interop_threads"], [best_config],
+                                  batch_sizes or AUTOTUNE_BATCH_SIZES, checkpoint, repeats)
+    batch_results = [r for r in batch_results if "error" not in r]
+    best_batch = max(batch_results, key=lambda r: r["images_per_second"]) if batch_results else best
+
+    default = next((r for r in measured if r["num_threads"] == cores and r["interop_threads"] == 1
+                    and not r["channels_last"] and not r["onednn_fusion"]), None)
+    return {
+        **best_config,
+        "interop_threads": best["interop_threads"],
+        "batch_size": best_batch["batch_size"],
+        "latency_ms": best["latency_ms"],
+        "default_latency_ms": default["latency_ms"] if default else None,
+        "images_per_second": best_batch["images_per_second"],
+        "machine": machine_key(),
+        "torch_version": torch.__version__,
+        "tuned_at": datetime.utcnow().isoformat(),
+        "results": results + batch_results
+    }
+
+
+def apply_profile(profile: Dict[str, Any], processes: int = AUTOTUNE_PROCESSES):
+    """Apply process-wide thread settings and remember the profile for model installs"""
+    global active_profile
+    processes = max(1, processes)
+    # The tuned thread counts assume one process; each of several gets an equal share
+    interop_threads = max(1, profile["interop_threads"] // processes) if profile.get("interop_threads") else None
+    num_threads = max(1, profile["num_threads"] // processes) if profile.get("num_threads") else None
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as e:
+            # Only possible before any inter-op parallel work has started
+            logger.warning(f"Could not set inter-op threads: {e}")
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    active_profile = {**profile, "num_threads": num_threads, "interop_threads": interop_threads,
+                      "processes": processes}
+    logger.info(f"CPU profile applied: threads={num_threads}, interop={interop_threads} "
+                f"({processes} process{'es' if processes > 1 else ''}), channels_last={profile.get('channels_last')}, "
+                f"onednn_fusion={profile.get('onednn_fusion')}, batch_size={profile.get('batch_size')}")
+
+
+def tuned_batch_size() -> Optional[int]:
+    """Batch size of the active profile, if one is applied"""
+    return active_profile.get("batch_size") if active_profile else None
+
+
+def optimize_model(loaded, fusion: bool = True):
+    """Apply the active profile's layout and (unless fusion=False) fusion settings to a newly loaded model"""
+    if active_profile is None:
+        return loaded
+    try:
+        loaded.apply_cpu_profile(bool(active_profile.get("channels_last")),
+                                 fusion and bool(active_profile.get("onednn_fusion")))
+    except Exception as e:
+        logger.warning(f"Failed to apply CPU profile to {loaded.architecture}: {e}")
+        loaded.apply_cpu_profile(False, False)
+    return loaded
+
+
+def configure_cpu(checkpoint: Optional[str] = None, mode: str = AUTOTUNE_MODE,
+                  path: str = AUTOTUNE_PROFILE_PATH) -> Optional[Dict[str, Any]]:
+    """Startup hook: apply (and in tune mode, create) the profile for this machine"""
+    if mode == "off":
+        return None
+    profile = read_profiles(path).get(machine_key())
+    if profile is None and mode == "tune":
+        try:
+            profile = tune(checkpoint)
+            save_profile(profile, path)
+        except Exception as e:
+            logger.error(f"Autotune failed, using library defaults: {e}")
+            return None
+    if profile is None:
+        return None
+    apply_profile(profile)
+    return active_profile
+
+
+def main():
+    """Benchmark CPU execution settings and store the best profile for this machine"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--checkpoint", default=os.path.join(MODEL_DIR, "best_multimodal_hqcnn.pth"),
+                        help="model to benchmark (random ResNet-50 weights if missing)")
+    parser.add_argument("--output", default=AUTOTUNE_PROFILE_PATH)
+    parser.add_argument("--repeats", type=int, default=AUTOTUNE_REPEATS)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=AUTOTUNE_BATCH_SIZES)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    profile = tune(args.checkpoint, repeats=args.repeats, batch_sizes=args.batch_sizes)
+    save_profile(profile, args.output)
+    summary = {key: value for key, value in profile.items() if key != "results"}
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
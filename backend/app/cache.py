@@ -1,10 +1,16 @@
 # cache.py
 import os
-import json
 import logging
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
 import redis
-from redis.exceptions import ConnectionError, TimeoutError, RedisError
+from redis.backoff import ExponentialBackoff, NoBackoff
+from redis.cluster import ClusterNode, RedisCluster
+from redis.exceptions import ClusterDownError, ConnectionError, ReadOnlyError, TimeoutError, RedisError
+from redis.retry import Retry
+from redis.sentinel import Sentinel
+
+from . import cache_codec
+from .circuit import circuit_breaker, health_prober, HEALTH_PROBE_TIMEOUT
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -17,52 +23,159 @@ REDIS_DB = int(os.getenv("REDIS_DB", "0"))
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", None)
 REDIS_DECODE_RESPONSES = True
 REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "10"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+
+# Topology: standalone (REDIS_HOST), cluster (REDIS_CLUSTER_NODES) or sentinel (REDIS_SENTINELS)
+REDIS_MODE = os.getenv("REDIS_MODE", "standalone").lower()
+REDIS_CLUSTER_NODES = os.getenv("REDIS_CLUSTER_NODES", f"{REDIS_HOST}:{REDIS_PORT}")  # startup nodes
+REDIS_SENTINELS = os.getenv("REDIS_SENTINELS", f"{REDIS_HOST}:26379")
+REDIS_SENTINEL_MASTER = os.getenv("REDIS_SENTINEL_MASTER", "mymaster")
+REDIS_SENTINEL_PASSWORD = os.getenv("REDIS_SENTINEL_PASSWORD", None)
+# Retries (with backoff) that carry a command across a failover or slot migration
+REDIS_FAILOVER_RETRIES = int(os.getenv("REDIS_FAILOVER_RETRIES", "3"))
 
 # Cache TTL settings (in seconds)
 DEFAULT_TTL = int(os.getenv("CACHE_DEFAULT_TTL", "3600"))  # 1 hour
 PREDICTION_TTL = int(os.getenv("CACHE_PREDICTION_TTL", "1800"))  # 30 minutes
 HEALTH_RECORD_TTL = int(os.getenv("CACHE_HEALTH_RECORD_TTL", "7200"))  # 2 hours
+SESSION_TTL = int(os.getenv("CACHE_SESSION_TTL", "28800"))  # 8 hours
+PATIENT_ACCESS_TTL = int(os.getenv("CACHE_PATIENT_ACCESS_TTL", "604800"))  # 7 days
+EXPLANATION_TTL = int(os.getenv("CACHE_EXPLANATION_TTL", "86400"))  # 24 hours
+VERSION_TTL = int(os.getenv("CACHE_VERSION_TTL", "86400"))  # 24 hours, refreshed on every write
 
 # Cache key prefixes
 PREDICTION_PREFIX = "prediction"
 HEALTH_RECORD_PREFIX = "health_record"
 SESSION_PREFIX = "session"
 PATIENT_PREFIX = "patient"
+LOCK_PREFIX = "lock"
+EXPLANATION_PREFIX = "explanation"
+PATIENT_ACCESS_KEY = "patient_access"  # sorted set of patient read counts
+PATIENT_VERSION_PREFIX = "patient_version"  # bumped after every write to a patient's data
+
+# Skips Redis while it is failing; fed by command errors and the health prober
+redis_breaker = circuit_breaker("redis")
+
+# Errors that mean Redis (or the shard owning a key) is unreachable, after retries
+UNAVAILABLE_ERRORS = (ConnectionError, TimeoutError, ClusterDownError)
+
+def tagged_key(prefix: str, tag: str) -> str:
+    """
+    Key whose cluster slot is chosen by tag alone (a {hash tag}), so all of a patient's
+    entries live on one shard and can be read, written or deleted in one multi-key command
+    """
+    return f"{prefix}:{{{tag}}}"
+
+def patient_cache_key(patient_id: str) -> str:
+    return tagged_key(PATIENT_PREFIX, patient_id)
+
+def health_record_cache_key(patient_id: str) -> str:
+    return tagged_key(HEALTH_RECORD_PREFIX, patient_id)
+
+def patient_version_key(patient_id: str) -> str:
+    return tagged_key(PATIENT_VERSION_PREFIX, patient_id)
+
+def _parse_nodes(nodes: str) -> List[Tuple[str, int]]:
+    """host:port,host:port -> [(host, port)]"""
+    parsed = []
+    for node in nodes.split(","):
+        host, _, port = node.strip().rpartition(":")
+        parsed.append((host, int(port)))
+    return parsed
+
+def build_redis_client(decode_responses: bool = REDIS_DECODE_RESPONSES, failover_retries: int = REDIS_FAILOVER_RETRIES,
+                       socket_connect_timeout: float = 5, socket_timeout: float = REDIS_SOCKET_TIMEOUT,
+                       max_connections: int = REDIS_MAX_CONNECTIONS):
+    """Client for the configured topology; the pool is per node in cluster mode"""
+    retry = Retry(ExponentialBackoff(cap=1.0, base=0.05), failover_retries) if failover_retries else Retry(NoBackoff(), 0)
+    options = dict(
+        password=REDIS_PASSWORD,
+        decode_responses=decode_responses,
+        max_connections=max_connections,
+        socket_connect_timeout=socket_connect_timeout,
+        socket_timeout=socket_timeout,
+        retry=retry
+    )
+    if REDIS_MODE == "cluster":
+        # Follows MOVED/ASK redirects and refreshes the slot map after a node failure
+        return RedisCluster(
+            startup_nodes=[ClusterNode(host, port) for host, port in _parse_nodes(REDIS_CLUSTER_NODES)],
+            **options
+        )
+    if REDIS_MODE == "sentinel":
+        # Every new connection asks the sentinels for the current master; a demoted master
+        # answers READONLY, which drops the connection and retries against the new one
+        sentinel = Sentinel(
+            _parse_nodes(REDIS_SENTINELS),
+            sentinel_kwargs={"password": REDIS_SENTINEL_PASSWORD,
+                             "socket_connect_timeout": socket_connect_timeout,
+                             "socket_timeout": socket_timeout,
+                             "retry": Retry(NoBackoff(), 0)}  # an unreachable sentinel is skipped, not retried
+        )
+        return sentinel.master_for(REDIS_SENTINEL_MASTER, db=REDIS_DB,
+                                   retry_on_error=[ReadOnlyError], **options)
+    if REDIS_MODE != "standalone":
+        raise ValueError(f"Unknown REDIS_MODE '{REDIS_MODE}'")
+    return redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, retry_on_timeout=True, **options)
+
+def redis_endpoint() -> str:
+    """Where the configured topology is, for logs"""
+    if REDIS_MODE == "cluster":
+        return f"cluster {REDIS_CLUSTER_NODES}"
+    if REDIS_MODE == "sentinel":
+        return f"sentinel master {REDIS_SENTINEL_MASTER} via {REDIS_SENTINELS}"
+    return f"{REDIS_HOST}:{REDIS_PORT}"
+
+class GuardedRedis:
+    """Redis client proxy that reports connection failures and successes to the circuit breaker"""
+
+    def __init__(self, client: redis.Redis):
+        self._client = client
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._client, name)
+        # Pipelines only buffer commands; their errors surface to the caller
+        if not callable(attribute) or name == "pipeline":
+            return attribute
+
+        def call(*args, **kwargs):
+            try:
+                result = attribute(*args, **kwargs)
+            except UNAVAILABLE_ERRORS as e:
+                redis_breaker.record_failure(e)
+                raise
+            redis_breaker.record_success()
+            return result
+        return call
 
 class CacheManager:
     def __init__(self):
         self.client = None
-        self.connection_pool = None
+        self.binary_client = None
+        self.probe_client = None
         self.connect()
     
     def connect(self):
         """Establish connection to Redis"""
         try:
-            # Create connection pool
-            self.connection_pool = redis.ConnectionPool(
-                host=REDIS_HOST,
-                port=REDIS_PORT,
-                db=REDIS_DB,
-                password=REDIS_PASSWORD,
-                decode_responses=REDIS_DECODE_RESPONSES,
-                max_connections=REDIS_MAX_CONNECTIONS,
-                socket_connect_timeout=5,
-                socket_timeout=5,
-                retry_on_timeout=True
-            )
-            
             # Create Redis client
-            self.client = redis.Redis(connection_pool=self.connection_pool)
+            self.client = GuardedRedis(build_redis_client())
+
+            # Second client without response decoding for raw bytes (e.g. embeddings)
+            self.binary_client = GuardedRedis(build_redis_client(decode_responses=False))
             
             # Test connection
             self.client.ping()
             
-            logger.info(f"Successfully connected to Redis: {REDIS_HOST}:{REDIS_PORT}")
+            logger.info(f"Successfully connected to Redis: {redis_endpoint()}")
             
         except Exception as e:
             logger.error(f"Failed to connect to Redis: {e}")
+            if self.client is None:
+                # Cluster and sentinel discovery fail before the guarded client exists
+                redis_breaker.record_failure(e)
             self.client = None
-            self.connection_pool = None
+            self.binary_client = None
     
     def is_connected(self) -> bool:
         """Check if Redis connection is active"""
@@ -74,52 +187,72 @@ class CacheManager:
         except Exception:
             return False
     
+    def probe(self):
+        """Ping Redis with a short timeout, reconnecting the shared clients once it answers"""
+        if self.probe_client is None:
+            # No retries: a probe reports the first failure
+            self.probe_client = build_redis_client(failover_retries=0, max_connections=None,
+                                                   socket_connect_timeout=HEALTH_PROBE_TIMEOUT,
+                                                   socket_timeout=HEALTH_PROBE_TIMEOUT)
+        if isinstance(self.probe_client, RedisCluster):
+            # Healthy only if every shard's primary answers
+            self.probe_client.ping(target_nodes=RedisCluster.PRIMARIES)
+        else:
+            self.probe_client.ping()
+        if self.client is None:
+            self.connect()
+
     def close_connection(self):
         """Close Redis connection"""
-        if self.connection_pool:
-            self.connection_pool.disconnect()
+        if self.client:
+            self.client.close()
+        if self.binary_client:
+            self.binary_client.close()
             logger.info("Redis connection closed")
 
 # Global cache manager instance
 cache_manager = CacheManager()
+health_prober.register("redis", cache_manager.probe)
 
 def get_redis_client():
-    """Get Redis client instance"""
-    if not cache_manager.is_connected():
+    """Get Redis client instance; None (without any I/O) while the Redis circuit is open"""
+    if not redis_breaker.allow():
+        return None
+    if cache_manager.client is None:
         cache_manager.connect()
     return cache_manager.client
 
+def get_binary_redis_client():
+    """Get Redis client instance that returns raw bytes; None while the Redis circuit is open"""
+    if not redis_breaker.allow():
+        return None
+    if cache_manager.client is None:
+        cache_manager.connect()
+    return cache_manager.binary_client
+
 # Redis client for backward compatibility
 redis_client = cache_manager.client
 
-def _serialize_value(value: Any) -> str:
-    """Serialize value for Redis storage"""
-    try:
-        if isinstance(value, (dict, list)):
-            return json.dumps(value, default=str)
-        elif isinstance(value, (int, float, bool)):
-            return json.dumps(value)
-        else:
-            return str(value)
-    except Exception as e:
-        logger.error(f"Failed to serialize value: {e}")
-        return str(value)
+def _serialize_value(value: Any, codec: Optional[str] = None) -> bytes:
+    """Serialize value for Redis storage (framed binary, see cache_codec)"""
+    return cache_codec.encode(value, codec)
 
-def _deserialize_value(value: str) -> Any:
-    """Deserialize value from Redis storage"""
+def _deserialize_value(value: Union[bytes, str]) -> Any:
+    """Deserialize value from Redis storage, including legacy JSON text"""
     try:
-        return json.loads(value)
-    except (json.JSONDecodeError, TypeError):
-        return value
+        return cache_codec.decode(value)
+    except Exception as e:
+        logger.error(f"Failed to deserialize cached value: {e}")
+        return None
 
-def set_cache(key: str, value: Any, ttl: int = DEFAULT_TTL) -> bool:
+def set_cache(key: str, value: Any, ttl: int = DEFAULT_TTL, codec: Optional[str] = None) -> bool:
     """Set a value in cache with TTL"""
     try:
-        client = get_redis_client()
+        client = get_binary_redis_client()
         if client is None:
             return False
         
-        serialized_value = _serialize_value(value)
+        serialized_value = _serialize_value(value, codec)
         result = client.setex(key, ttl, serialized_value)
         
         logger.debug(f"Cache set: {key} (TTL: {ttl}s)")
@@ -132,7 +265,7 @@ def set_cache(key: str, value: Any, ttl: int = DEFAULT_TTL) -> bool:
 def get_cache(key: str) -> Optional[Any]:
     """Get a value from cache"""
     try:
-        client = get_redis_client()
+        client = get_binary_redis_client()
         if client is None:
             return None
         
@@ -146,6 +279,183 @@ def get_cache(key: str) -> Optional[Any]:
         logger.error(f"Failed to get cache for key {key}: {e}")
         return None
 
+def set_binary_cache(key: str, value: bytes, ttl: int = DEFAULT_TTL) -> bool:
+    """Set raw bytes in cache with TTL"""
+    try:
+        client = get_binary_redis_client()
+        if client is None:
+            return False
+
+        result = client.setex(key, ttl, value)
+        logger.debug(f"Cache set: {key} ({len(value)} bytes, TTL: {ttl}s)")
+        return result
+
+    except Exception as e:
+        logger.error(f"Failed to set cache for key {key}: {e}")
+        return False
+
+def get_binary_cache(key: str) -> Optional[bytes]:
+    """Get raw bytes from cache"""
+    try:
+        client = get_binary_redis_client()
+        if client is None:
+            return None
+
+        return client.get(key)
+
+    except Exception as e:
+        logger.error(f"Failed to get cache for key {key}: {e}")
+        return None
+
+def get_many_cache(keys: Sequence[str]) -> Dict[str, Any]:
+    """Values of several keys in one pipelined round trip (one per shard in cluster mode); misses are left out"""
+    try:
+        client = get_binary_redis_client()
+        if client is None or not keys:
+            return {}
+
+        pipeline = client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.get(key)
+        values = pipeline.execute()
+        return {key: _deserialize_value(value) for key, value in zip(keys, values) if value is not None}
+
+    except Exception as e:
+        logger.error(f"Failed to get {len(keys)} cache keys: {e}")
+        return {}
+
+def set_many_cache(entries: Iterable[Tuple[str, Any, int]], codec: Optional[str] = None) -> bool:
+    """Set (key, value, ttl) entries in one pipelined round trip"""
+    try:
+        client = get_binary_redis_client()
+        if client is None:
+            return False
+
+        pipeline = client.pipeline(transaction=False)
+        count = 0
+        for key, value, ttl in entries:
+            pipeline.setex(key, ttl, _serialize_value(value, codec))
+            count += 1
+        if count:
+            pipeline.execute()
+        logger.debug(f"Cache set: {count} keys")
+        return True
+
+    except Exception as e:
+        logger.error(f"Failed to set cache keys: {e}")
+        return False
+
+# Compare-and-set: fill KEYS[1] only while the version in KEYS[2] (missing = "0") is still the
+# one the caller read before loading the value, so a fill that started before a write cannot
+# overwrite what the writer stored or invalidated. Both keys share a hash tag in cluster mode.
+_SET_IF_VERSION_SCRIPT = """
+if (redis.call("get", KEYS[2]) or "0") == ARGV[3] then
+    redis.call("setex", KEYS[1], ARGV[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+def get_cache_versions(version_keys: Sequence[str]) -> Dict[str, str]:
+    """Current versions of several keys in one pipelined round trip ("0" if never bumped); {} when Redis is unavailable"""
+    try:
+        client = get_redis_client()
+        if client is None or not version_keys:
+            return {}
+
+        pipeline = client.pipeline(transaction=False)
+        for key in version_keys:
+            pipeline.get(key)
+        return {key: value or "0" for key, value in zip(version_keys, pipeline.execute())}
+
+    except Exception as e:
+        logger.error(f"Failed to get {len(version_keys)} cache versions: {e}")
+        return {}
+
+def bump_cache_version(version_key: str, ttl: int = VERSION_TTL) -> bool:
+    """Advance a version after a write, so fills that read the previous version are dropped"""
+    try:
+        client = get_redis_client()
+        if client is None:
+            return False
+
+        pipeline = client.pipeline(transaction=False)
+        pipeline.incr(version_key)
+        pipeline.expire(version_key, ttl)
+        pipeline.execute()
+        return True
+
+    except Exception as e:
+        logger.error(f"Failed to bump cache version {version_key}: {e}")
+        return False
+
+def set_many_cache_if_version(entries: Iterable[Tuple[str, Any, int, str, str]], codec: Optional[str] = None) -> int:
+    """
+    Set (key, value, ttl, version_key, version) entries in one pipelined round trip, each only
+    while its version is unchanged; returns the number set
+    """
+    try:
+        client = get_binary_redis_client()
+        if client is None:
+            return 0
+
+        pipeline = client.pipeline(transaction=False)
+        count = 0
+        for key, value, ttl, version_key, version in entries:
+            pipeline.eval(_SET_IF_VERSION_SCRIPT, 2, key, version_key, _serialize_value(value, codec), ttl, version)
+            count += 1
+        stored = sum(pipeline.execute()) if count else 0
+        if stored < count:
+            logger.debug(f"Cache set: {count - stored} of {count} fills dropped after concurrent writes")
+        return stored
+
+    except Exception as e:
+        logger.error(f"Failed to set cache keys: {e}")
+        return 0
+
+def set_cache_if_version(key: str, value: Any, ttl: int, version_key: str, version: str,
+                         codec: Optional[str] = None) -> bool:
+    """set_cache that only stores the value while version_key still holds version"""
+    return set_many_cache_if_version([(key, value, ttl, version_key, version)], codec) == 1
+
+# Compare-and-delete, so a lease is only released by the holder that acquired it
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+def acquire_lock(key: str, token: str, ttl_ms: int) -> Optional[bool]:
+    """Try to take a short-lived lease; returns None when Redis is unavailable"""
+    try:
+        client = get_redis_client()
+        if client is None:
+            return None
+
+        return bool(client.set(f"{LOCK_PREFIX}:{key}", token, nx=True, px=ttl_ms))
+
+    except Exception as e:
+        logger.error(f"Failed to acquire lock {key}: {e}")
+        return None
+
+def release_lock(key: str, token: str) -> bool:
+    """Release a lease held with the given token"""
+    try:
+        client = get_redis_client()
+        if client is None:
+            return False
+
+        return bool(client.eval(_RELEASE_LOCK_SCRIPT, 1, f"{LOCK_PREFIX}:{key}", token))
+
+    except Exception as e:
+        logger.error(f"Failed to release lock {key}: {e}")
+        return False
+
+def lock_exists(key: str) -> bool:
+    """Check whether a lease is currently held"""
+    return exists_in_cache(f"{LOCK_PREFIX}:{key}")
+
 def delete_cache(key: str) -> bool:
     """Delete a key from cache"""
     try:
@@ -193,7 +503,7 @@ def cache_prediction(cache_key: str, prediction_data: Dict[str, Any], ttl: int =
     """Cache a prediction result"""
     try:
         full_key = f"{PREDICTION_PREFIX}:{cache_key}"
-        return set_cache(full_key, prediction_data, ttl)
+        return set_cache(full_key, prediction_data, ttl, codec="prediction")
     except Exception as e:
         logger.error(f"Failed to cache prediction: {e}")
         return False
@@ -207,11 +517,14 @@ def get_cached_prediction(cache_key: str) -> Optional[Dict[str, Any]]:
         logger.error(f"Failed to get cached prediction: {e}")
         return None
 
-def cache_health_record(patient_id: str, record_data: Dict[str, Any], ttl: int = HEALTH_RECORD_TTL) -> bool:
-    """Cache a health record"""
+def cache_health_record(patient_id: str, record_data: Dict[str, Any], ttl: int = HEALTH_RECORD_TTL,
+                        version: Optional[str] = None) -> bool:
+    """Cache a health record; with version, only while the patient's version is unchanged"""
     try:
-        full_key = f"{HEALTH_RECORD_PREFIX}:{patient_id}"
-        return set_cache(full_key, record_data, ttl)
+        if version is not None:
+            return set_cache_if_version(health_record_cache_key(patient_id), record_data, ttl,
+                                        patient_version_key(patient_id), version)
+        return set_cache(health_record_cache_key(patient_id), record_data, ttl)
     except Exception as e:
         logger.error(f"Failed to cache health record: {e}")
         return False
@@ -219,17 +532,19 @@ def cache_health_record(patient_id: str, record_data: Dict[str, Any], ttl: int =
 def get_cached_health_record(patient_id: str) -> Optional[Dict[str, Any]]:
     """Retrieve a cached health record"""
     try:
-        full_key = f"{HEALTH_RECORD_PREFIX}:{patient_id}"
-        return get_cache(full_key)
+        return get_cache(health_record_cache_key(patient_id))
     except Exception as e:
         logger.error(f"Failed to get cached health record: {e}")
         return None
 
-def cache_patient_data(patient_id: str, patient_data: Dict[str, Any], ttl: int = DEFAULT_TTL) -> bool:
-    """Cache patient data"""
+def cache_patient_data(patient_id: str, patient_data: Dict[str, Any], ttl: int = DEFAULT_TTL,
+                       version: Optional[str] = None) -> bool:
+    """Cache patient data; with version, only while the patient's version is unchanged"""
     try:
-        full_key = f"{PATIENT_PREFIX}:{patient_id}"
-        return set_cache(full_key, patient_data, ttl)
+        if version is not None:
+            return set_cache_if_version(patient_cache_key(patient_id), patient_data, ttl,
+                                        patient_version_key(patient_id), version)
+        return set_cache(patient_cache_key(patient_id), patient_data, ttl)
     except Exception as e:
         logger.error(f"Failed to cache patient data: {e}")
         return False
@@ -237,12 +552,77 @@ def cache_patient_data(patient_id: str, patient_data: Dict[str, Any], ttl: int =
 def get_cached_patient_data(patient_id: str) -> Optional[Dict[str, Any]]:
     """Retrieve cached patient data"""
     try:
-        full_key = f"{PATIENT_PREFIX}:{patient_id}"
-        return get_cache(full_key)
+        return get_cache(patient_cache_key(patient_id))
     except Exception as e:
         logger.error(f"Failed to get cached patient data: {e}")
         return None
 
+def cache_session_data(session_id: str, session_data: Dict[str, Any], ttl: int = SESSION_TTL) -> bool:
+    """Cache session data"""
+    try:
+        full_key = f"{SESSION_PREFIX}:{session_id}"
+        return set_cache(full_key, session_data, ttl)
+    except Exception as e:
+        logger.error(f"Failed to cache session data: {e}")
+        return False
+
+def get_cached_session_data(session_id: str) -> Optional[Dict[str, Any]]:
+    """Retrieve cached session data"""
+    try:
+        full_key = f"{SESSION_PREFIX}:{session_id}"
+        return get_cache(full_key)
+    except Exception as e:
+        logger.error(f"Failed to get cached session data: {e}")
+        return None
+
+def cache_explanation(cache_key: str, explanation: Dict[str, Any], ttl: int = EXPLANATION_TTL) -> bool:
+    """Cache a prediction explanation (Grad-CAM heatmap)"""
+    try:
+        full_key = f"{EXPLANATION_PREFIX}:{cache_key}"
+        return set_cache(full_key, explanation, ttl)
+    except Exception as e:
+        logger.error(f"Failed to cache explanation: {e}")
+        return False
+
+def get_cached_explanation(cache_key: str) -> Optional[Dict[str, Any]]:
+    """Retrieve a cached prediction explanation"""
+    try:
+        full_key = f"{EXPLANATION_PREFIX}:{cache_key}"
+        return get_cache(full_key)
+    except Exception as e:
+        logger.error(f"Failed to get cached explanation: {e}")
+        return None
+
+def record_patient_access(patient_id: str) -> bool:
+    """Count a patient read, for warming frequently accessed patients"""
+    try:
+        client = get_redis_client()
+        if client is None:
+            return False
+
+        pipeline = client.pipeline(transaction=False)
+        pipeline.zincrby(PATIENT_ACCESS_KEY, 1, patient_id)
+        pipeline.expire(PATIENT_ACCESS_KEY, PATIENT_ACCESS_TTL)
+        pipeline.execute()
+        return True
+
+    except Exception as e:
+        logger.error(f"Failed to record patient access: {e}")
+        return False
+
+def get_frequent_patients(limit: int = 20) -> List[str]:
+    """Most frequently read patient IDs"""
+    try:
+        client = get_redis_client()
+        if client is None:
+            return []
+
+        return list(client.zrevrange(PATIENT_ACCESS_KEY, 0, limit - 1))
+
+    except Exception as e:
+        logger.error(f"Failed to get frequent patients: {e}")
+        return []
+
 def invalidate_patient_cache(patient_id: str) -> bool:
     """Invalidate all cache entries for a patient"""
     try:
@@ -250,18 +630,8 @@ def invalidate_patient_cache(patient_id: str) -> bool:
         if client is None:
             return False
         
-        # Find all keys related to the patient
-        patterns = [
-            f"{PREDICTION_PREFIX}:*{patient_id}*",
-            f"{HEALTH_RECORD_PREFIX}:{patient_id}",
-            f"{PATIENT_PREFIX}:{patient_id}"
-        ]
-        
-        deleted_count = 0
-        for pattern in patterns:
-            keys = client.keys(pattern)
-            if keys:
-                deleted_count += client.delete(*keys)
+        # A patient's keys share a hash tag, so this is one DEL on one shard
+        deleted_count = client.delete(patient_cache_key(patient_id), health_record_cache_key(patient_id))
         
         logger.info(f"Invalidated {deleted_count} cache entries for patient {patient_id}")
         return True
@@ -270,6 +640,20 @@ def invalidate_patient_cache(patient_id: str) -> bool:
         logger.error(f"Failed to invalidate patient cache: {e}")
         return False
 
+def _server_info(client) -> Dict[str, Any]:
+    """INFO of the server, or summed over the primaries in cluster mode"""
+    if REDIS_MODE != "cluster":
+        return client.info()
+    per_node = client.info(target_nodes=RedisCluster.PRIMARIES)
+    infos = list(per_node.values())
+    total = {key: sum(info.get(key, 0) for info in infos)
+             for key in ("used_memory", "connected_clients", "total_commands_processed",
+                         "keyspace_hits", "keyspace_misses")}
+    total["redis_version"] = infos[0].get("redis_version", "unknown") if infos else "unknown"
+    total["used_memory_human"] = f"{total['used_memory'] / 2 ** 20:.2f}M"
+    total["nodes"] = len(infos)
+    return total
+
 def get_cache_stats() -> Dict[str, Any]:
     """Get cache statistics"""
     try:
@@ -277,7 +661,7 @@ def get_cache_stats() -> Dict[str, Any]:
         if client is None:
             return {"error": "Cache not connected", "connected": False}
         
-        info = client.info()
+        info = _server_info(client)
         
         stats = {
             "connected": True,
@@ -287,15 +671,17 @@ def get_cache_stats() -> Dict[str, Any]:
             "total_commands_processed": info.get("total_commands_processed", 0),
             "keyspace_hits": info.get("keyspace_hits", 0),
             "keyspace_misses": info.get("keyspace_misses", 0),
+            "mode": REDIS_MODE,
+            "nodes": info.get("nodes", 1),
+            "codec": cache_codec.codec_info(),
             "keys_by_prefix": {}
         }
         
         # Count keys by prefix
-        prefixes = [PREDICTION_PREFIX, HEALTH_RECORD_PREFIX, PATIENT_PREFIX, SESSION_PREFIX]
+        prefixes = [PREDICTION_PREFIX, HEALTH_RECORD_PREFIX, PATIENT_PREFIX, SESSION_PREFIX, EXPLANATION_PREFIX]
         for prefix in prefixes:
             pattern = f"{prefix}:*"
-            keys = client.keys(pattern)
-            stats["keys_by_prefix"][prefix] = len(keys)
+            stats["keys_by_prefix"][prefix] = sum(1 for _ in client.scan_iter(match=pattern, count=1000))
         
         # Calculate hit ratio
         hits = stats["keyspace_hits"]
@@ -317,7 +703,8 @@ def flush_cache(pattern: str = None) -> bool:
             return False
         
         if pattern:
-            keys = client.keys(pattern)
+            # SCAN covers every primary in cluster mode; DEL is split by slot
+            keys = list(client.scan_iter(match=pattern, count=1000))
             if keys:
                 deleted = client.delete(*keys)
                 logger.info(f"Flushed {deleted} cache entries matching pattern: {pattern}")
@@ -333,8 +720,9 @@ def flush_cache(pattern: str = None) -> bool:
 
 # Health check function
 def cache_health_check() -> bool:
-    """Cache health check"""
-    return cache_manager.is_connected()
+    """Cache health from the background prober; pings only if it has not run yet"""
+    healthy = health_prober.healthy("redis")
+    return cache_manager.is_connected() if healthy is None else healthy
 
 # Cleanup function
 def cleanup_cache():
@@ -0,0 +1,277 @@
+# cache_codec.py
+# Binary encodings for cache values.
+# Every value is framed as [version byte][codec id][compression id] + payload, so the
+# layout can change without breaking entries written by older workers. Prediction records
+# use a fixed binary layout that stores the encrypted prediction as raw bytes instead of
+# base64 text; other values use msgpack (JSON when msgpack is not installed). Payloads above
+# a size threshold are compressed with zstd or lz4 when available. Values written before
+# framing was introduced (plain JSON text) are still decoded.
+
+import os
+import json
+import base64
+import struct
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+try:
+    import lz4.frame
+    LZ4_AVAILABLE = True
+except ImportError:
+    LZ4_AVAILABLE = False
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Codec configuration from environment variables
+CACHE_CODEC = os.getenv("CACHE_CODEC", "msgpack" if MSGPACK_AVAILABLE else "json").lower()
+CACHE_COMPRESSION = os.getenv(
+    "CACHE_COMPRESSION", "zstd" if ZSTD_AVAILABLE else "lz4" if LZ4_AVAILABLE else "none"
+).lower()
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "512"))
+
+# Frame header. 0x81 is never the first byte of legacy values (JSON or UTF-8 text).
+FORMAT_VERSION = 0x81
+HEADER = struct.Struct("<BBB")
+
+
+class CodecError(ValueError):
+    """Raised when a value cannot be encoded with the requested codec"""
+
+
+class Codec(ABC):
+    """Converts cache values to and from bytes"""
+
+    name = ""
+    codec_id = 0
+
+    @abstractmethod
+    def encode(self, value: Any) -> bytes:
+        """Serialize value; raise CodecError if this codec cannot represent it"""
+
+    @abstractmethod
+    def decode(self, data: bytes) -> Any:
+        """Inverse of encode"""
+
+
+class JsonCodec(Codec):
+    name = "json"
+    codec_id = 1
+
+    def encode(self, value: Any) -> bytes:
+        return json.dumps(value, default=str, separators=(",", ":")).encode()
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    codec_id = 2
+
+    def encode(self, value: Any) -> bytes:
+        return msgpack.packb(value, default=str, use_bin_type=True)
+
+    def decode(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+class PredictionCodec(Codec):
+    """
+    Fixed layout for cached prediction records:
+
+        risk level (B), class count (B), flags (B), confidence (d),
+        per class: name length (B), UTF-8 name, probability (d),
+        predicted class index (B), encrypted prediction length (I) and bytes.
+
+    The encrypted prediction is stored without its base64 wrapper, and a Fernet token
+    inside it without its urlsafe-base64 encoding. Records of any other shape raise
+    CodecError so the caller can fall back to a generic codec.
+    """
+
+    name = "prediction"
+    codec_id = 3
+
+    RISK_LEVELS = ("Low", "Medium", "High")
+    FLAG_FERNET = 0x01
+    _head = struct.Struct("<BBBd")
+    _float = struct.Struct("<d")
+    _length = struct.Struct("<I")
+
+    def encode(self, value: Any) -> bytes:
+        try:
+            if set(value) != {"prediction", "confidence", "encrypted_prediction"}:
+                raise CodecError("unexpected record fields")
+            prediction = value["prediction"]
+            if set(prediction) != {"predicted_class", "probabilities", "risk_level"}:
+                raise CodecError("unexpected prediction fields")
+            probabilities = prediction["probabilities"]
+            names = list(probabilities)
+            predicted_index = names.index(prediction["predicted_class"])
+            risk = self.RISK_LEVELS.index(prediction["risk_level"])
+            token, flags = self._pack_token(value["encrypted_prediction"])
+        except CodecError:
+            raise
+        except Exception as e:
+            raise CodecError(f"not a prediction record: {e}")
+        if len(names) > 255:
+            raise CodecError("too many classes")
+
+        parts = [self._head.pack(risk, len(names), flags, float(value["confidence"]))]
+        for name in names:
+            encoded_name = name.encode()
+            if len(encoded_name) > 255:
+                raise CodecError("class name too long")
+            parts += [bytes([len(encoded_name)]), encoded_name, self._float.pack(float(probabilities[name]))]
+        parts += [bytes([predicted_index]), self._length.pack(len(token)), token]
+        return b"".join(parts)
+
+    def decode(self, data: bytes) -> Any:
+        risk, count, flags, confidence = self._head.unpack_from(data, 0)
+        offset = self._head.size
+        probabilities = {}
+        for _ in range(count):
+            length = data[offset]
+            name = data[offset + 1:offset + 1 + length].decode()
+            offset += 1 + length
+            probabilities[name] = self._float.unpack_from(data, offset)[0]
+            offset += self._float.size
+        predicted_index = data[offset]
+        (length,) = self._length.unpack_from(data, offset + 1)
+        offset += 1 + self._length.size
+        token = data[offset:offset + length]
+        return {
+            "prediction": {
+                "predicted_class": list(probabilities)[predicted_index],
+                "probabilities": probabilities,
+                "risk_level": self.RISK_LEVELS[risk]
+            },
+            "confidence": confidence,
+            "encrypted_prediction": self._unpack_token(token, flags)
+        }
+
+    def _pack_token(self, encrypted: str) -> Tuple[bytes, int]:
+        raw = base64.b64decode(encrypted, validate=True)
+        if base64.b64encode(raw).decode() != encrypted:
+            raise CodecError("non-canonical base64")
+        # Fernet tokens are urlsafe base64 themselves; store their binary form when lossless
+        try:
+            binary = base64.urlsafe_b64decode(raw)
+            if base64.urlsafe_b64encode(binary) == raw:
+                return binary, self.FLAG_FERNET
+        except Exception:
+            pass
+        return raw, 0
+
+    def _unpack_token(self, token: bytes, flags: int) -> str:
+        if flags & self.FLAG_FERNET:
+            token = base64.urlsafe_b64encode(token)
+        return base64.b64encode(token).decode()
+
+
+# Codec registry
+_codecs: Dict[str, Codec] = {}
+_codecs_by_id: Dict[int, Codec] = {}
+
+
+def register_codec(codec: Codec):
+    """Make a codec available by name for encoding and by id for decoding"""
+    _codecs[codec.name] = codec
+    _codecs_by_id[codec.codec_id] = codec
+
+
+register_codec(JsonCodec())
+register_codec(PredictionCodec())
+if MSGPACK_AVAILABLE:
+    register_codec(MsgpackCodec())
+
+# Compression registry: id -> (compress, decompress)
+COMPRESSION_NONE = 0
+_compressors: Dict[str, Tuple[int, Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {}
+if ZSTD_AVAILABLE:
+    _compressors["zstd"] = (1, zstandard.ZstdCompressor(level=3).compress,
+                            lambda data: zstandard.ZstdDecompressor().decompress(data))
+if LZ4_AVAILABLE:
+    _compressors["lz4"] = (2, lz4.frame.compress, lz4.frame.decompress)
+_decompressors = {compression_id: decompress for compression_id, _, decompress in _compressors.values()}
+
+
+def _default_codec() -> Codec:
+    codec = _codecs.get(CACHE_CODEC)
+    if codec is None:
+        logger.warning(f"Cache codec {CACHE_CODEC} unavailable, using json")
+        codec = _codecs["json"]
+    return codec
+
+
+def encode(value: Any, codec: Optional[str] = None) -> bytes:
+    """Frame a value with the named codec (default: CACHE_CODEC), compressing large payloads"""
+    selected = _codecs.get(codec) if codec else _default_codec()
+    if selected is None:
+        selected = _default_codec()
+    try:
+        payload = selected.encode(value)
+    except CodecError as e:
+        logger.debug(f"{selected.name} codec rejected value ({e}); using {_default_codec().name}")
+        selected = _default_codec()
+        payload = selected.encode(value)
+
+    compression_id = COMPRESSION_NONE
+    compressor = _compressors.get(CACHE_COMPRESSION)
+    if compressor is not None and len(payload) >= CACHE_COMPRESS_MIN_BYTES:
+        compressed = compressor[1](payload)
+        if len(compressed) < len(payload):
+            compression_id, payload = compressor[0], compressed
+    return HEADER.pack(FORMAT_VERSION, selected.codec_id, compression_id) + payload
+
+
+def decode(data: Any) -> Any:
+    """Decode a framed value; unframed values are read as legacy JSON text"""
+    if isinstance(data, str):
+        data = data.encode()
+    if not data or data[0] != FORMAT_VERSION:
+        return _decode_legacy(data)
+
+    _, codec_id, compression_id = HEADER.unpack_from(data, 0)
+    payload = data[HEADER.size:]
+    if compression_id != COMPRESSION_NONE:
+        decompress = _decompressors.get(compression_id)
+        if decompress is None:
+            raise CodecError(f"unsupported compression id {compression_id}")
+        payload = decompress(payload)
+    codec = _codecs_by_id.get(codec_id)
+    if codec is None:
+        raise CodecError(f"unsupported codec id {codec_id}")
+    return codec.decode(payload)
+
+
+def _decode_legacy(data: bytes) -> Any:
+    text = data.decode("utf-8", errors="replace")
+    try:
+        return json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        return text
+
+
+def codec_info() -> Dict[str, Any]:
+    """Active codec settings, for diagnostics"""
+    return {
+        "format_version": FORMAT_VERSION,
+        "codec": _default_codec().name,
+        "codecs": sorted(_codecs),
+        "compression": CACHE_COMPRESSION if CACHE_COMPRESSION in _compressors else "none",
+        "compress_min_bytes": CACHE_COMPRESS_MIN_BYTES
+    }
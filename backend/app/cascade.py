@@ -0,0 +1,417 @@
+# cascade.py
+# Two-stage early-exit inference.
+# A lightweight first stage (the notebook's DenseNet + QCNN model, or a distilled student)
+# answers the cases it is confident about, and only the rest escalate to the full model.
+# Per-class exit thresholds are calibrated on the validation split so that early exits
+# keep a target precision; classes without a threshold (e.g. Malignant) always escalate.
+
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from .model_registry import LoadedModel, ModelLoadError, load_model_from_checkpoint, feature_names
+
+try:
+    from prometheus_client import Counter
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Cascade configuration from environment variables
+MODEL_DIR = os.path.join(os.path.dirname(__file__), '../model')
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "false").lower() == "true"
+CASCADE_STAGE1_PATH = os.getenv("CASCADE_STAGE1_PATH", os.path.join(MODEL_DIR, "cascade_stage1.pth"))
+CASCADE_THRESHOLDS_PATH = os.getenv("CASCADE_THRESHOLDS_PATH", os.path.join(MODEL_DIR, "cascade_thresholds.json"))
+# Classes the first stage may answer on its own
+CASCADE_EXIT_CLASSES = [name.strip() for name in os.getenv("CASCADE_EXIT_CLASSES", "Benign").split(",") if name.strip()]
+# Used only when no calibration file exists
+CASCADE_DEFAULT_THRESHOLD = float(os.getenv("CASCADE_DEFAULT_THRESHOLD", "0.95"))
+CASCADE_TARGET_PRECISION = float(os.getenv("CASCADE_TARGET_PRECISION", "0.99"))
+CASCADE_MIN_EXITS = int(os.getenv("CASCADE_MIN_EXITS", "50"))
+
+STAGE1 = "stage1"
+STAGE2 = "stage2"
+
+if PROMETHEUS_AVAILABLE:
+    CASCADE_PREDICTIONS = Counter(
+        "cascade_predictions_total",
+        "Cascade predictions by the stage that produced the answer",
+        ["stage"]
+    )
+
+
+class CascadeFeatureEncoder:
+    """Encodes request clinical data for both stages, concatenated along the feature axis"""
+
+    def __init__(self, first: Any, second: Any):
+        self.first = first
+        self.second = second
+        self.split = first.feature_dim
+        self.feature_dim = first.feature_dim + second.feature_dim
+        self.feature_names = ([f"{STAGE1}.{name}" for name in feature_names(first)] +
+                              [f"{STAGE2}.{name}" for name in feature_names(second)])
+
+    def encode(self, clinical: Dict[str, Any]) -> List[float]:
+        return list(self.first.encode(clinical)) + list(self.second.encode(clinical))
+
+
+class CascadeStats:
+    """Thread-safe early-exit/escalation counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.exits = 0
+        self.escalations = 0
+
+    def record(self, exits: int, escalations: int):
+        with self._lock:
+            self.exits += exits
+            self.escalations += escalations
+        if PROMETHEUS_AVAILABLE:
+            if exits:
+                CASCADE_PREDICTIONS.labels(stage=STAGE1).inc(exits)
+            if escalations:
+                CASCADE_PREDICTIONS.labels(stage=STAGE2).inc(escalations)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.exits + self.escalations
+            return {
+                "predictions": total,
+                "early_exits": self.exits,
+                "escalations": self.escalations,
+                "escalation_rate": round(self.escalations / total, 4) if total else None
+            }
+
+
+class CascadeModel(LoadedModel):
+    """
+    Serves stage two's classes, answering from stage one when it clears an exit threshold.
+
+    Stage-one probabilities are mapped onto stage two's classes by name, so every stage-one
+    class must also exist in stage two. Both stages see the same image tensor, so they must
+    share an eval_resize.
+    """
+
+    def __init__(self, stage1: LoadedModel, stage2: LoadedModel, thresholds: Dict[str, float],
+                 calibration: Optional[Dict[str, Any]] = None):
+        missing = [name for name in stage1.class_names if name not in stage2.class_names]
+        if missing:
+            raise ModelLoadError(f"Cascade stage-one classes {missing} are not served by the final model")
+        unknown = [name for name in thresholds if name not in stage1.class_names]
+        if unknown:
+            raise ModelLoadError(f"Cascade thresholds reference unknown classes {unknown}")
+        if stage1.eval_resize != stage2.eval_resize:
+            raise ModelLoadError(f"Cascade stage one expects '{stage1.eval_resize}' inputs, "
+                                 f"the final model '{stage2.eval_resize}'")
+
+        super().__init__(
+            architecture=f"Cascade({stage1.architecture}->{stage2.architecture})",
+            model=nn.ModuleDict({STAGE1: stage1.model, STAGE2: stage2.model}),
+            class_names=stage2.class_names,
+            feature_encoder=CascadeFeatureEncoder(stage1.feature_encoder, stage2.feature_encoder),
+            returns_logits=False,
+            source=stage2.source,
+            metadata=dict(stage2.metadata, cascade={
+                "stage1_source": stage1.source,
+                "thresholds": thresholds,
+                "calibration": calibration or {}
+            }),
+            eval_resize=stage2.eval_resize
+        )
+        self.stage1 = stage1
+        self.stage2 = stage2
+        self.thresholds = dict(thresholds)
+        self._exit_rules = [(stage1.class_names.index(name), threshold)
+                            for name, threshold in thresholds.items() if threshold is not None]
+        self._columns = torch.tensor([stage2.class_names.index(name) for name in stage1.class_names])
+        self.stats = CascadeStats()
+
+    def apply_cpu_profile(self, channels_last: bool = False, onednn_fusion: bool = False):
+        self.stage1.apply_cpu_profile(channels_last, onednn_fusion)
+        self.stage2.apply_cpu_profile(channels_last, onednn_fusion)
+
+    @property
+    def index_model(self) -> LoadedModel:
+        return self.stage2
+
+    def exit_mask(self, stage1_probs: torch.Tensor) -> torch.Tensor:
+        """Rows stage one may answer: top class has a threshold and clears it"""
+        top = stage1_probs.argmax(dim=1)
+        mask = torch.zeros(stage1_probs.shape[0], dtype=torch.bool)
+        for index, threshold in self._exit_rules:
+            mask |= (top == index) & (stage1_probs[:, index] >= threshold)
+        return mask
+
+    def _from_stage1(self, stage1_probs: torch.Tensor) -> torch.Tensor:
+        """Map stage-one probabilities onto stage two's classes"""
+        probabilities = torch.zeros(stage1_probs.shape[0], len(self.class_names), dtype=stage1_probs.dtype)
+        probabilities[:, self._columns] = stage1_probs
+        return probabilities
+
+    def predict_proba(self, image_tensor: torch.Tensor, feature_tensor: torch.Tensor) -> torch.Tensor:
+        """Stage-one answers for confident rows, stage-two probabilities for the rest"""
+        split = self.feature_encoder.split
+        stage1_probs = self.stage1.predict_proba(image_tensor, feature_tensor[:, :split])
+        exits = self.exit_mask(stage1_probs)
+
+        probabilities = self._from_stage1(stage1_probs)
+        escalate = ~exits
+        if escalate.any():
+            probabilities[escalate] = self.stage2.predict_proba(
+                image_tensor[escalate], feature_tensor[escalate, split:]
+            ).to(probabilities.dtype)
+
+        num_exits = int(exits.sum())
+        self.stats.record(num_exits, image_tensor.shape[0] - num_exits)
+        return probabilities
+
+    def predict_cached(self, image_digest: str, load_image: Callable[[], torch.Tensor],
+                       feature_tensor: torch.Tensor, embeddings: Any) -> torch.Tensor:
+        """Single-image cascade on cached embeddings; the image is preprocessed at most once"""
+        image = []
+
+        def load_once():
+            if not image:
+                image.append(load_image())
+            return image[0]
+
+        split = self.feature_encoder.split
+        stage1_probs = self.stage1.predict_cached(image_digest, load_once, feature_tensor[:, :split], embeddings)
+        if bool(self.exit_mask(stage1_probs).all()):
+            self.stats.record(stage1_probs.shape[0], 0)
+            return self._from_stage1(stage1_probs)
+
+        self.stats.record(0, stage1_probs.shape[0])
+        return self.stage2.predict_cached(image_digest, load_once, feature_tensor[:, split:], embeddings)
+
+    def predict_cached_batch(self, image_digests: Sequence[str], load_images: Callable[[List[int]], torch.Tensor],
+                             feature_tensor: torch.Tensor, embeddings: Any) -> torch.Tensor:
+        """Batched cascade on cached embeddings; only the escalated rows reach stage two"""
+        images: Dict[int, torch.Tensor] = {}
+
+        def load_once(positions: List[int]) -> torch.Tensor:
+            needed = [position for position in positions if position not in images]
+            if needed:
+                for position, image in zip(needed, load_images(needed)):
+                    images[position] = image
+            return torch.stack([images[position] for position in positions])
+
+        split = self.feature_encoder.split
+        stage1_probs = self.stage1.predict_cached_batch(image_digests, load_once, feature_tensor[:, :split], embeddings)
+        exits = self.exit_mask(stage1_probs)
+
+        probabilities = self._from_stage1(stage1_probs)
+        escalate = (~exits).nonzero().flatten().tolist()
+        if escalate:
+            probabilities[escalate] = self.stage2.predict_cached_batch(
+                [image_digests[position] for position in escalate],
+                lambda positions: load_once([escalate[position] for position in positions]),
+                feature_tensor[escalate, split:], embeddings
+            ).to(probabilities.dtype)
+
+        self.stats.record(len(image_digests) - len(escalate), len(escalate))
+        return probabilities
+
+    def predict_explained(self, image_digest: str, load_image: Callable[[], torch.Tensor],
+                          feature_tensor: torch.Tensor, embeddings: Any):
+        """
+        Cascade prediction with a Grad-CAM map, which always comes from the final model.
+
+        On an early exit the probabilities are stage one's while the heatmap comes from stage
+        two (for stage one's predicted class); the stage-two embedding of that pass is cached
+        so later explained or similar-case requests for the image do not recompute it.
+        """
+        image = []
+
+        def load_once():
+            if not image:
+                image.append(load_image())
+            return image[0]
+
+        split = self.feature_encoder.split
+        stage1_probs = self.stage1.predict_cached(image_digest, load_once, feature_tensor[:, :split], embeddings)
+        if bool(self.exit_mask(stage1_probs).all()):
+            self.stats.record(stage1_probs.shape[0], 0)
+            probabilities = self._from_stage1(stage1_probs)
+            _, cam, embedding = self.stage2.explain(load_once(), feature_tensor[:, split:],
+                                                    class_index=int(probabilities[0].argmax()))
+            embeddings.put(self.stage2.embedding_id, image_digest, embedding)
+            return probabilities, cam
+
+        self.stats.record(0, stage1_probs.shape[0])
+        return self.stage2.predict_explained(image_digest, load_once, feature_tensor[:, split:], embeddings)
+
+    def serving_stats(self) -> Optional[Dict[str, Any]]:
+        return {"cascade": dict(self.stats.snapshot(), thresholds=self.thresholds)}
+
+
+def load_thresholds(path: str = CASCADE_THRESHOLDS_PATH):
+    """Read calibrated exit thresholds, falling back to CASCADE_DEFAULT_THRESHOLD"""
+    if os.path.exists(path):
+        with open(path) as f:
+            calibration = json.load(f)
+        return calibration["thresholds"], calibration
+    logger.warning(f"No cascade calibration at {path} - using uncalibrated threshold "
+                   f"{CASCADE_DEFAULT_THRESHOLD} for {CASCADE_EXIT_CLASSES}")
+    return {name: CASCADE_DEFAULT_THRESHOLD for name in CASCADE_EXIT_CLASSES}, None
+
+
+def with_cascade(final: LoadedModel, stage1_path: str = CASCADE_STAGE1_PATH,
+                 thresholds_path: str = CASCADE_THRESHOLDS_PATH) -> LoadedModel:
+    """Put the stage-one model in front of the final model when the cascade is enabled"""
+    if not CASCADE_ENABLED:
+        return final
+    if not os.path.exists(stage1_path):
+        logger.warning(f"Cascade enabled but stage-one checkpoint not found at {stage1_path} - serving without it")
+        return final
+    if final.source and os.path.exists(final.source) and os.path.samefile(stage1_path, final.source):
+        return final
+
+    stage1 = load_model_from_checkpoint(stage1_path)
+    thresholds, calibration = load_thresholds(thresholds_path)
+    cascade = CascadeModel(stage1, final, thresholds, calibration)
+    logger.info(f"Cascade enabled: {stage1.architecture} exits on {thresholds}, else {final.architecture}")
+    return cascade
+
+
+def calibrate_thresholds(stage1_probs: np.ndarray, labels: np.ndarray, class_names: Sequence[str],
+                         exit_classes: Sequence[str] = CASCADE_EXIT_CLASSES,
+                         target_precision: float = CASCADE_TARGET_PRECISION,
+                         min_exits: int = CASCADE_MIN_EXITS) -> Dict[str, Any]:
+    """
+    Lowest threshold per exit class whose early exits keep target_precision on validation data.
+
+    A class gets no threshold (always escalates) when no cut-off with at least min_exits
+    validation exits reaches the target.
+    """
+    stage1_probs = np.asarray(stage1_probs, dtype=np.float64)
+    labels = np.asarray(labels)
+    top = stage1_probs.argmax(axis=1)
+
+    thresholds, report = {}, {}
+    exited = np.zeros(len(labels), dtype=bool)
+    for name in exit_classes:
+        index = list(class_names).index(name)
+        candidates = np.flatnonzero(top == index)
+        scores = stage1_probs[candidates, index]
+        order = np.argsort(-scores, kind="stable")
+        scores = scores[order]
+        correct = (labels[candidates[order]] == index).astype(np.float64)
+
+        precision = np.cumsum(correct) / np.arange(1, len(correct) + 1)
+        # A threshold admits every tied score, so only the last position of a tie group is a valid cut
+        valid = np.append(scores[:-1] > scores[1:], True) if len(scores) else np.array([], dtype=bool)
+        ok = np.flatnonzero(valid & (precision >= target_precision) & (np.arange(1, len(scores) + 1) >= min_exits))
+
+        if len(ok):
+            cut = ok[-1]
+            thresholds[name] = float(scores[cut])
+            exited[candidates[order[:cut + 1]]] = True
+            report[name] = {"threshold": thresholds[name], "exits": int(cut + 1),
+                            "precision": round(float(precision[cut]), 4)}
+        else:
+            thresholds[name] = None
+            report[name] = {"threshold": None, "exits": 0, "precision": None}
+
+    return {
+        "thresholds": thresholds,
+        "classes": report,
+        "target_precision": target_precision,
+        "validation_size": int(len(labels)),
+        "exit_rate": round(float(exited.mean()), 4) if len(labels) else 0.0,
+        "calibrated_at": datetime.utcnow().isoformat()
+    }
+
+
+def _time_forward(loaded: LoadedModel, batch_size: int, repeats: int = 5) -> float:
+    """Mean seconds per image for one model on dummy inputs"""
+    images = torch.zeros(batch_size, 3, 224, 224)
+    features = torch.zeros(batch_size, loaded.feature_encoder.feature_dim)
+    with torch.no_grad():
+        loaded.predict_proba(images, features)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            loaded.predict_proba(images, features)
+    return (time.perf_counter() - start) / (repeats * batch_size)
+
+
+def main():
+    """Calibrate cascade exit thresholds on the HAM10000 validation split"""
+    from torch.utils.data import DataLoader
+    from .ham10000 import read_metadata, find_images, split_rows, HAM10000Dataset
+    from .model_registry import MetadataFeatureEncoder
+    from .preprocessing import HairRemovalCollate, array_eval_transform
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--stage1", default=CASCADE_STAGE1_PATH, help="stage-one checkpoint")
+    parser.add_argument("--metadata", required=True, help="HAM10000_metadata.csv")
+    parser.add_argument("--images", nargs="+", required=True, help="HAM10000 image directories")
+    parser.add_argument("--output", default=CASCADE_THRESHOLDS_PATH)
+    parser.add_argument("--target-precision", type=float, default=CASCADE_TARGET_PRECISION)
+    parser.add_argument("--min-exits", type=int, default=CASCADE_MIN_EXITS)
+    parser.add_argument("--exit-classes", nargs="+", default=CASCADE_EXIT_CLASSES)
+    parser.add_argument("--final", help="final-model checkpoint, to estimate the CPU saving")
+    parser.add_argument("--random-clinical", action="store_true",
+                        help="stand-in clinical inputs for stage-one models HAM10000 has no features for")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--num-workers", type=int, default=2)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    stage1 = load_model_from_checkpoint(args.stage1)
+    encoder = stage1.feature_encoder
+    if not isinstance(encoder, MetadataFeatureEncoder):
+        # HAM10000 only records sex, age and localization, not e.g. blood pressure
+        if not args.random_clinical:
+            parser.error(f"{args.stage1} takes {encoder.feature_dim} clinical features; HAM10000 only provides "
+                         f"sex, age and localization (use --random-clinical to calibrate on stand-in inputs)")
+        from .distill import RandomClinicalFeatures
+        logger.warning("Calibrating on random clinical inputs; thresholds may not hold for real patient data")
+        encoder = RandomClinicalFeatures(encoder.feature_dim, seed=1)
+    _, val_rows, _ = split_rows(read_metadata(args.metadata))
+    dataset = HAM10000Dataset(val_rows, find_images(args.images), encoder)
+    loader = DataLoader(dataset, batch_size=args.batch_size, num_workers=args.num_workers,
+                        collate_fn=HairRemovalCollate(transform=array_eval_transform(stage1.eval_resize)))
+
+    probabilities, labels = [], []
+    with torch.no_grad():
+        for images, features, batch_labels in loader:
+            probabilities.append(stage1.predict_proba(images, features))
+            labels.append(batch_labels)
+    probabilities = torch.cat(probabilities).numpy()
+    labels = torch.cat(labels).numpy()
+
+    calibration = calibrate_thresholds(probabilities, labels, stage1.class_names, args.exit_classes,
+                                       args.target_precision, args.min_exits)
+    calibration["stage1"] = os.path.basename(args.stage1)
+    if encoder is not stage1.feature_encoder:
+        calibration["random_clinical"] = True
+
+    if args.final:
+        stage1_cost = _time_forward(stage1, args.batch_size)
+        stage2_cost = _time_forward(load_model_from_checkpoint(args.final), args.batch_size)
+        escalation = 1.0 - calibration["exit_rate"]
+        calibration["estimated_speedup"] = round(stage2_cost / (stage1_cost + escalation * stage2_cost), 2)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(calibration, f, indent=2)
+    logger.info(f"Cascade calibration written to {args.output}: {json.dumps(calibration['classes'])}, "
+                f"exit rate {calibration['exit_rate']}")
+
+
+if __name__ == "__main__":
+    main()
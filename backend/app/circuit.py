@@ -0,0 +1,179 @@
+# circuit.py
+# Circuit breakers for external dependencies (Redis, Mongo) and the background prober
+# that feeds them. A breaker opens after consecutive connection failures; while it is open,
+# callers skip the dependency immediately instead of waiting for socket and server selection
+# timeouts. After CIRCUIT_RESET_TIMEOUT one trial call is let through (half-open), and the
+# prober closes the breaker as soon as a short-timeout probe succeeds. /health reads the
+# prober's cached results instead of pinging on every call.
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Circuit breaker configuration from environment variables
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))  # consecutive failures
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "10"))  # seconds before a trial call
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "2"))  # seconds, 0 disables
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "0.5"))  # seconds per probe
+
+# Breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open trial"""
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_started = 0.0
+        self.last_error: Optional[str] = None
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go to the dependency now"""
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN and now - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self.trial_started = now
+                return True
+            # A trial that never reported back does not keep the breaker half-open forever
+            if self.state == HALF_OPEN and now - self.trial_started >= self.reset_timeout:
+                self.trial_started = now
+                return True
+            if self.state == CLOSED:
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        if self.state == CLOSED and self.failures == 0:
+            return
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"Circuit {self.name} closed")
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self, error: Any = None):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error) if error is not None else None
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self._open()
+
+    def trip(self, error: Any = None):
+        """Open immediately, e.g. after a failed health probe"""
+        with self._lock:
+            self.last_error = str(error) if error is not None else None
+            self.failures = max(self.failures, self.failure_threshold)
+            self._open()
+
+    def _open(self):
+        if self.state != OPEN:
+            logger.warning(f"Circuit {self.name} opened: {self.last_error}")
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "rejected_calls": self.rejected,
+            "last_error": self.last_error
+        }
+
+
+# Global breakers, one per dependency
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(name: str) -> CircuitBreaker:
+    """Shared breaker for a dependency"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+class HealthProber:
+    """Probes registered dependencies on a background thread and caches the results"""
+
+    def __init__(self):
+        self.probes: Dict[str, Callable[[], Any]] = {}
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, name: str, probe: Callable[[], Any]):
+        """Add a probe; it should raise (or return False) when the dependency is unhealthy"""
+        self.probes[name] = probe
+
+    def probe_once(self):
+        for name, probe in list(self.probes.items()):
+            breaker = circuit_breaker(name)
+            start = time.perf_counter()
+            try:
+                healthy, error = probe() is not False, None
+            except Exception as e:
+                healthy, error = False, e
+            if healthy:
+                breaker.record_success()
+            else:
+                breaker.trip(error or "probe failed")
+            self.results[name] = {
+                "healthy": healthy,
+                "latency_ms": round((time.perf_counter() - start) * 1000, 2),
+                "checked_at": time.time(),
+                "error": str(error) if error is not None else None
+            }
+
+    def start(self, interval: float = HEALTH_PROBE_INTERVAL) -> Optional[threading.Thread]:
+        """Probe every interval seconds on a daemon thread (once per process)"""
+        if interval <= 0 or self._thread is not None:
+            return self._thread
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.probe_once()
+                except Exception as e:
+                    logger.error(f"Health probe failed: {e}")
+
+        # First round inline, so /health has results from the start
+        self.probe_once()
+
+        self._thread = threading.Thread(target=run, name="health-prober", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def healthy(self, name: str) -> Optional[bool]:
+        """Last probe result, or None if the dependency has not been probed yet"""
+        result = self.results.get(name)
+        return None if result is None else result["healthy"]
+
+    def status(self) -> Dict[str, Any]:
+        """Cached probe results with breaker states, per dependency"""
+        return {name: {**self.results.get(name, {"healthy": None}), "circuit": circuit_breaker(name).snapshot()}
+                for name in self.probes}
+
+
+# Global health prober instance
+health_prober = HealthProber()
@@ -1,13 +1,16 @@
 # database.py
 import os
 import json
+import uuid
 from datetime import datetime
 import logging
 from typing import Dict, List, Optional, Any
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
 import certifi
 
+from .circuit import circuit_breaker, health_prober, HEALTH_PROBE_TIMEOUT
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,50 +23,109 @@ MONGO_USERNAME = os.getenv("MONGO_USERNAME", "admin")
 MONGO_PASSWORD = os.getenv("MONGO_PASSWORD", "healthcare_admin_pass")
 MONGO_AUTH_DB = os.getenv("MONGO_AUTH_DB", "admin")
 
+# Replica set configuration. MONGO_HOSTS lists the seed nodes ("host1:27017,host2:27017");
+# when MONGO_REPLICA_SET is set, analytics and list reads go to secondaries.
+MONGO_HOSTS = os.getenv("MONGO_HOSTS", f"{MONGO_HOST}:{MONGO_PORT}")
+MONGO_REPLICA_SET = os.getenv("MONGO_REPLICA_SET", "")
+MONGO_MAX_STALENESS_SECONDS = int(os.getenv("MONGO_MAX_STALENESS_SECONDS", "90"))  # 90s is the driver minimum
+
+# Connection pool size per workload
+MONGO_PRIMARY_POOL_SIZE = int(os.getenv("MONGO_PRIMARY_POOL_SIZE", "50"))
+MONGO_ANALYTICS_POOL_SIZE = int(os.getenv("MONGO_ANALYTICS_POOL_SIZE", "10"))
+
+# Workloads: writes and read-your-writes reads use the primary,
+# dashboards and list reads may be served by a secondary within the staleness bound
+WORKLOAD_PRIMARY = "primary"
+WORKLOAD_ANALYTICS = "analytics"
+
 # Collections
 HEALTH_RECORDS_COLLECTION = "health_records"
 PREDICTIONS_COLLECTION = "predictions"
 PATIENTS_COLLECTION = "patients"
+ARCHIVE_SUMMARIES_COLLECTION = "archive_summaries"  # one document per archived Parquet file
+
+# Skips Mongo while it is failing; fed by network errors and the health prober
+mongo_breaker = circuit_breaker("mongo")
+
+class BreakerListener(monitoring.CommandListener):
+    """Reports network-level command failures and successes to the Mongo circuit breaker"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_breaker.record_success()
+
+    def failed(self, event):
+        # Client-side (network) errors carry errtype; server error replies do not
+        if "errtype" in event.failure:
+            mongo_breaker.record_failure(event.failure.get("errmsg"))
 
 class DatabaseManager:
     def __init__(self):
         self.client = None
         self.db = None
+        self.analytics_client = None
+        self.analytics_db = None
+        self.probe_client = None
         self.connect()
     
+    def _connection_string(self) -> str:
+        if MONGO_USERNAME and MONGO_PASSWORD:
+            return f"mongodb://{MONGO_USERNAME}:{MONGO_PASSWORD}@{MONGO_HOSTS}/{MONGO_AUTH_DB}"
+        return f"mongodb://{MONGO_HOSTS}/"
+
+    def _create_client(self, pool_size: int, **options) -> MongoClient:
+        if MONGO_REPLICA_SET:
+            options["replicaSet"] = MONGO_REPLICA_SET
+        options.setdefault("serverSelectionTimeoutMS", 5000)  # 5 second timeout
+        options.setdefault("connectTimeoutMS", 10000)
+        options.setdefault("socketTimeoutMS", 10000)
+        options.setdefault("event_listeners", [BreakerListener()])
+        return MongoClient(
+            self._connection_string(),
+            maxPoolSize=pool_size,
+            tlsCAFile=certifi.where() if os.getenv("MONGO_TLS", "false").lower() == "true" else None,
+            **options
+        )
+
     def connect(self):
         """Establish connection to MongoDB"""
         try:
-            # Build connection string
-            if MONGO_USERNAME and MONGO_PASSWORD:
-                connection_string = f"mongodb://{MONGO_USERNAME}:{MONGO_PASSWORD}@{MONGO_HOST}:{MONGO_PORT}/{MONGO_AUTH_DB}"
-            else:
-                connection_string = f"mongodb://{MONGO_HOST}:{MONGO_PORT}/"
-            
-            # Create MongoDB client with SSL options
-            self.client = MongoClient(
-                connection_string,
-                serverSelectionTimeoutMS=5000,  # 5 second timeout
-                connectTimeoutMS=10000,
-                socketTimeoutMS=10000,
-                tlsCAFile=certifi.where() if os.getenv("MONGO_TLS", "false").lower() == "true" else None
-            )
+            # Writes and read-your-writes reads always go to the primary
+            self.client = self._create_client(MONGO_PRIMARY_POOL_SIZE)
             
             # Test connection
             self.client.admin.command('ping')
             
             # Get database
             self.db = self.client[MONGO_DB]
+
+            # Analytics reads get their own pool, routed to secondaries on a replica set
+            if MONGO_REPLICA_SET:
+                self.analytics_client = self._create_client(
+                    MONGO_ANALYTICS_POOL_SIZE,
+                    readPreference="secondaryPreferred",
+                    maxStalenessSeconds=MONGO_MAX_STALENESS_SECONDS
+                )
+                self.analytics_db = self.analytics_client[MONGO_DB]
+            else:
+                self.analytics_client = None
+                self.analytics_db = self.db
             
             # Create indexes for better performance
             self._create_indexes()
             
-            logger.info(f"Successfully connected to MongoDB: {MONGO_HOST}:{MONGO_PORT}")
+            topology = f"replica set {MONGO_REPLICA_SET}" if MONGO_REPLICA_SET else "standalone"
+            logger.info(f"Successfully connected to MongoDB: {MONGO_HOSTS} ({topology})")
             
         except Exception as e:
             logger.error(f"Failed to connect to MongoDB: {e}")
+            mongo_breaker.record_failure(e)
             self.client = None
             self.db = None
+            self.analytics_client = None
+            self.analytics_db = None
     
     def _create_indexes(self):
         """Create necessary indexes for collections"""
@@ -77,9 +139,14 @@ class DatabaseManager:
                 self.db[PREDICTIONS_COLLECTION].create_index("patient_id")
                 self.db[PREDICTIONS_COLLECTION].create_index("timestamp")
                 self.db[PREDICTIONS_COLLECTION].create_index("prediction_id")
+                # Incremental vector index sync scans by embedding model in _id order
+                self.db[PREDICTIONS_COLLECTION].create_index([("embedding_id", 1), ("_id", 1)])
                 
                 # Index for patients
                 self.db[PATIENTS_COLLECTION].create_index("patient_id", unique=True)
+
+                # Index for archive summaries
+                self.db[ARCHIVE_SUMMARIES_COLLECTION].create_index([("collection", 1), ("partition", 1)])
                 
                 logger.info("Database indexes created successfully")
         except Exception as e:
@@ -95,24 +162,58 @@ class DatabaseManager:
         except Exception:
             return False
     
+    def probe(self):
+        """Ping the primary with a short timeout, reconnecting once it answers"""
+        if self.probe_client is None:
+            timeout_ms = int(HEALTH_PROBE_TIMEOUT * 1000)
+            self.probe_client = self._create_client(
+                1, serverSelectionTimeoutMS=timeout_ms, connectTimeoutMS=timeout_ms,
+                socketTimeoutMS=timeout_ms, event_listeners=[]
+            )
+        self.probe_client.admin.command('ping')
+        if self.client is None:
+            self.connect()
+
     def close_connection(self):
         """Close database connection"""
+        if self.analytics_client:
+            self.analytics_client.close()
+        if self.probe_client:
+            self.probe_client.close()
         if self.client:
             self.client.close()
             logger.info("MongoDB connection closed")
 
+    def topology(self) -> Dict[str, Any]:
+        """Replica set members as seen by the driver"""
+        if self.client is None:
+            return {}
+        return {
+            "replica_set": MONGO_REPLICA_SET or None,
+            "primary": "%s:%s" % self.client.primary if self.client.primary else None,
+            "secondaries": sorted("%s:%s" % node for node in self.client.secondaries),
+            "analytics_read_preference": self.analytics_db.read_preference.name if self.analytics_db is not None else None,
+            "max_staleness_seconds": MONGO_MAX_STALENESS_SECONDS if MONGO_REPLICA_SET else None
+        }
+
 # Global database manager instance
 db_manager = DatabaseManager()
+health_prober.register("mongo", db_manager.probe)
 
-def get_database():
-    """Get database instance"""
-    if not db_manager.is_connected():
+def get_database(workload: str = WORKLOAD_PRIMARY):
+    """Get database instance for a workload (primary or analytics); None while the Mongo circuit is open"""
+    if not mongo_breaker.allow():
+        return None
+    if db_manager.client is None:
         db_manager.connect()
+    if workload == WORKLOAD_ANALYTICS:
+        return db_manager.analytics_db
     return db_manager.db
 
 def health_check() -> bool:
-    """Database health check"""
-    return db_manager.is_connected()
+    """Database health from the background prober; pings only if it has not run yet"""
+    healthy = health_prober.healthy("mongo")
+    return db_manager.is_connected() if healthy is None else healthy
 
 def insert_health_record(record: Dict[str, Any]) -> Dict[str, Any]:
     """Insert a health record into the database"""
@@ -144,10 +245,10 @@ def insert_health_record(record: Dict[str, Any]) -> Dict[str, Any]:
         logger.error(f"Failed to insert health record: {e}")
         raise Exception(f"Database insert failed: {str(e)}")
 
-def get_health_records(patient_id: str, limit: int = 10) -> List[Dict[str, Any]]:
-    """Retrieve health records for a patient"""
+def get_health_records(patient_id: str, limit: int = 10, consistent: bool = False) -> List[Dict[str, Any]]:
+    """Retrieve health records for a patient (consistent=True reads from the primary)"""
     try:
-        db = get_database()
+        db = get_database(WORKLOAD_PRIMARY if consistent else WORKLOAD_ANALYTICS)
         if db is None:
             raise Exception("Database not connected")
         
@@ -178,7 +279,7 @@ def insert_prediction(prediction_data: Dict[str, Any]) -> Dict[str, Any]:
         
         # Add metadata
         prediction_data["timestamp"] = datetime.utcnow()
-        prediction_data["prediction_id"] = f"pred_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
+        prediction_data["prediction_id"] = f"pred_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
         
         # Insert prediction
         result = db[PREDICTIONS_COLLECTION].insert_one(prediction_data)
@@ -195,10 +296,10 @@ def insert_prediction(prediction_data: Dict[str, Any]) -> Dict[str, Any]:
         logger.error(f"Failed to insert prediction: {e}")
         raise Exception(f"Database insert failed: {str(e)}")
 
-def get_predictions(patient_id: str = None, limit: int = 10) -> List[Dict[str, Any]]:
-    """Retrieve predictions, optionally filtered by patient_id"""
+def get_predictions(patient_id: str = None, limit: int = 10, consistent: bool = False) -> List[Dict[str, Any]]:
+    """Retrieve predictions, optionally filtered by patient_id (consistent=True reads from the primary)"""
     try:
-        db = get_database()
+        db = get_database(WORKLOAD_PRIMARY if consistent else WORKLOAD_ANALYTICS)
         if db is None:
             raise Exception("Database not connected")
         
@@ -281,17 +382,24 @@ def get_patient(patient_id: str) -> Optional[Dict[str, Any]]:
 def get_database_stats() -> Dict[str, Any]:
     """Get database statistics"""
     try:
-        db = get_database()
+        db = get_database(WORKLOAD_ANALYTICS)
         if db is None:
             return {"error": "Database not connected"}
         
         stats = {
             "connected": True,
             "database_name": db.name,
+            "topology": db_manager.topology(),
+            # Collection metadata counts; a full count_documents scan grows with the collection
             "collections": {
-                "health_records": db[HEALTH_RECORDS_COLLECTION].count_documents({}),
-                "predictions": db[PREDICTIONS_COLLECTION].count_documents({}),
-                "patients": db[PATIENTS_COLLECTION].count_documents({})
+                "health_records": db[HEALTH_RECORDS_COLLECTION].estimated_document_count(),
+                "predictions": db[PREDICTIONS_COLLECTION].estimated_document_count(),
+                "patients": db[PATIENTS_COLLECTION].estimated_document_count()
+            },
+            "archived": {
+                item["_id"]: item["rows"] for item in db[ARCHIVE_SUMMARIES_COLLECTION].aggregate([
+                    {"$group": {"_id": "$collection", "rows": {"$sum": "$rows"}}}
+                ])
             }
         }
         
@@ -0,0 +1,324 @@
+# distill.py
+# Compresses a served model into a MultimodalStudent by knowledge distillation.
+# The student learns the teacher's temperature-softened class distribution on HAM10000
+# images (plus the binary labels where the teacher's classes include them), can then be
+# structurally pruned - the least important expansion channels of each inverted residual
+# block and of the head are removed - and fine-tuned by distillation again. The result is
+# a regular checkpoint the server loads like any other model (e.g. MODEL_PATH=...), and a
+# report compares teacher and student accuracy, agreement, latency and size.
+#
+#   python -m app.distill --metadata HAM10000_metadata.csv --images part_1 part_2 --prune 0.3
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import statistics
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+
+from .ham10000 import BINARY_CLASS_NAMES, read_metadata, find_images, split_rows, image_dataset, image_collate
+from .model_registry import LoadedModel, MetadataFeatureEncoder, build_model, read_checkpoint
+from .models import MultimodalStudent
+from .preprocessing import IMG_SIZE, array_eval_transform, array_train_transform
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Distillation configuration from environment variables
+MODEL_DIR = os.path.join(os.path.dirname(__file__), '../model')
+DISTILL_TEACHER_PATH = os.getenv("DISTILL_TEACHER_PATH", os.path.join(MODEL_DIR, "best_multimodal_hqcnn.pth"))
+DISTILL_OUTPUT_PATH = os.getenv("DISTILL_OUTPUT_PATH", os.path.join(MODEL_DIR, "student.pth"))
+DISTILL_REPORT_PATH = os.getenv("DISTILL_REPORT_PATH", os.path.join(MODEL_DIR, "student_report.json"))
+DISTILL_EPOCHS = int(os.getenv("DISTILL_EPOCHS", "10"))
+DISTILL_FINETUNE_EPOCHS = int(os.getenv("DISTILL_FINETUNE_EPOCHS", "3"))
+DISTILL_TEMPERATURE = float(os.getenv("DISTILL_TEMPERATURE", "4.0"))
+DISTILL_ALPHA = float(os.getenv("DISTILL_ALPHA", "0.7"))  # weight of the distillation term
+DISTILL_LEARNING_RATE = float(os.getenv("DISTILL_LEARNING_RATE", "0.001"))
+
+# Pruned channel counts are kept at multiples of this for vectorized kernels
+PRUNE_CHANNEL_MULTIPLE = 8
+
+
+class RandomClinicalFeatures:
+    """
+    Stand-in encoder for teacher inputs HAM10000 does not record (e.g. blood pressure).
+
+    Each sample gets fixed features drawn uniformly over the encoder's normalized [0, 1]
+    range, so the student learns the teacher's response across plausible clinical inputs.
+    """
+
+    def __init__(self, feature_dim: int, seed: int = 0):
+        self.feature_dim = feature_dim
+        self.rng = np.random.default_rng(seed)
+
+    def encode(self, clinical: Dict[str, Any]) -> List[float]:
+        return self.rng.random(self.feature_dim).tolist()
+
+
+def _label_map(teacher: LoadedModel) -> Optional[torch.Tensor]:
+    """Teacher class index of each HAM10000 binary label, if the teacher has those classes"""
+    if not all(name in teacher.class_names for name in BINARY_CLASS_NAMES):
+        return None
+    return torch.tensor([teacher.class_names.index(name) for name in BINARY_CLASS_NAMES])
+
+
+def distillation_loss(student_logits: torch.Tensor, teacher_probs: torch.Tensor, labels: Optional[torch.Tensor],
+                      temperature: float, alpha: float) -> torch.Tensor:
+    """Hinton et al. loss; teacher probabilities stand in for logits as log-probabilities"""
+    teacher_logits = teacher_probs.clamp_min(1e-8).log()
+    soft_targets = F.softmax(teacher_logits / temperature, dim=1)
+    soft_loss = F.kl_div(F.log_softmax(student_logits / temperature, dim=1), soft_targets,
+                         reduction="batchmean") * temperature ** 2
+    if labels is None or alpha >= 1.0:
+        return soft_loss
+    return alpha * soft_loss + (1 - alpha) * F.cross_entropy(student_logits, labels)
+
+
+def distill(student: MultimodalStudent, teacher: LoadedModel, loader: DataLoader, epochs: int, lr: float,
+            temperature: float, alpha: float, label_map: Optional[torch.Tensor]) -> MultimodalStudent:
+    """Train the student on the teacher's outputs"""
+    optimizer = torch.optim.AdamW(student.parameters(), lr=lr, weight_decay=1e-4)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=max(1, epochs * len(loader)))
+    teacher.model.eval()
+    for epoch in range(epochs):
+        student.train()
+        loss_sum, samples, start = 0.0, 0, time.perf_counter()
+        for images, features, labels in loader:
+            with torch.no_grad():
+                teacher_probs = teacher.predict_proba(images, features)
+            logits = student(images, features)[0]
+            mapped = label_map[labels] if label_map is not None else None
+            loss = distillation_loss(logits, teacher_probs, mapped, temperature, alpha)
+            optimizer.zero_grad(set_to_none=True)
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+            loss_sum += loss.item() * labels.size(0)
+            samples += labels.size(0)
+        seconds = time.perf_counter() - start
+        logger.info(f"Distillation epoch {epoch + 1}/{epochs}: loss {loss_sum / max(samples, 1):.4f}, "
+                    f"{samples / seconds:.1f} samples/s")
+    student.eval()
+    return student
+
+
+def _keep_channels(importance: torch.Tensor, ratio: float) -> torch.Tensor:
+    """Indices of the most important channels after removing about ratio of them"""
+    channels = importance.numel()
+    keep = int(round(channels * (1 - ratio) / PRUNE_CHANNEL_MULTIPLE)) * PRUNE_CHANNEL_MULTIPLE
+    keep = min(channels, max(PRUNE_CHANNEL_MULTIPLE, keep))
+    return importance.topk(keep).indices.sort().values
+
+
+def prune_student(student: MultimodalStudent, ratio: float) -> MultimodalStudent:
+    """
+    Structured pruning: drop the expansion channels (and head channels) whose batch-norm
+    scales are smallest. Block inputs and outputs keep their width, so residual
+    connections are unaffected.
+    """
+    old = student.state_dict()
+    state = dict(old)
+    config = dict(student.config, blocks=[list(block) for block in student.config["blocks"]])
+    bn_keys = ("weight", "bias", "running_mean", "running_var")
+
+    for i, block in enumerate(student.image_features.blocks):
+        prefix = f"image_features.blocks.{i}."
+        importance = block.expand[1].weight.detach().abs() + block.depthwise[1].weight.detach().abs()
+        keep = _keep_channels(importance, ratio)
+        state[prefix + "expand.0.weight"] = old[prefix + "expand.0.weight"][keep]
+        state[prefix + "depthwise.0.weight"] = old[prefix + "depthwise.0.weight"][keep]
+        state[prefix + "project.0.weight"] = old[prefix + "project.0.weight"][:, keep]
+        for norm in ("expand.1.", "depthwise.1."):
+            for key in bn_keys:
+                state[prefix + norm + key] = old[prefix + norm + key][keep]
+        config["blocks"][i][1] = len(keep)
+
+    head_norm = student.image_features.head[1]
+    keep = _keep_channels(head_norm.weight.detach().abs(), ratio)
+    state["image_features.head.0.weight"] = old["image_features.head.0.weight"][keep]
+    for key in bn_keys:
+        state["image_features.head.1." + key] = old["image_features.head.1." + key][keep]
+    state["image_processor.0.weight"] = old["image_processor.0.weight"][:, keep]
+    config["head_channels"] = len(keep)
+
+    pruned = MultimodalStudent(num_clinical_features=student.clinical_processor[0].in_features,
+                               num_classes=student.classifier.out_features, **config)
+    pruned.load_state_dict(state, strict=True)
+    pruned.eval()
+    return pruned
+
+
+def student_checkpoint(student: MultimodalStudent, teacher: LoadedModel, teacher_checkpoint: Dict[str, Any],
+                       **extra) -> Dict[str, Any]:
+    """Checkpoint the registry loads as a MultimodalStudent taking the teacher's inputs"""
+    uses_metadata = isinstance(teacher.feature_encoder, MetadataFeatureEncoder)
+    checkpoint = {
+        "model_state_dict": student.state_dict(),
+        "model_architecture": "MultimodalStudent",
+        "student_config": student.config,
+        "num_classes": len(teacher.class_names),
+        "class_names": teacher.class_names,
+        "feature_encoder": "metadata" if uses_metadata else "clinical",
+        "img_size": IMG_SIZE,
+        "eval_resize": teacher.eval_resize,
+        "teacher": os.path.basename(teacher.source or ""),
+        **extra
+    }
+    if uses_metadata:
+        checkpoint["encoders"] = teacher_checkpoint.get("encoders")
+        checkpoint["metadata_dim"] = teacher.feature_encoder.feature_dim
+    return checkpoint
+
+
+def evaluate(models: Dict[str, LoadedModel], teacher: LoadedModel, loader: DataLoader,
+             label_map: Optional[torch.Tensor]) -> Dict[str, Dict[str, Any]]:
+    """Accuracy on the binary labels (when mappable) and top-1 agreement with the teacher"""
+    counts = {name: {"correct": 0, "agree": 0} for name in models}
+    total = 0
+    with torch.no_grad():
+        for images, features, labels in loader:
+            teacher_pred = teacher.predict_proba(images, features).argmax(dim=1)
+            for name, loaded in models.items():
+                pred = teacher_pred if loaded is teacher else loaded.predict_proba(images, features).argmax(dim=1)
+                counts[name]["agree"] += (pred == teacher_pred).sum().item()
+                if label_map is not None:
+                    counts[name]["correct"] += (pred == label_map[labels]).sum().item()
+            total += labels.size(0)
+    return {
+        name: {
+            "accuracy": round(100.0 * c["correct"] / total, 2) if label_map is not None and total else None,
+            "teacher_agreement": round(100.0 * c["agree"] / total, 2) if total else None
+        }
+        for name, c in counts.items()
+    }
+
+
+def benchmark(loaded: LoadedModel, path: Optional[str] = None, repeats: int = 10) -> Dict[str, Any]:
+    """Single-image latency and model size"""
+    images = torch.randn(1, 3, IMG_SIZE, IMG_SIZE)
+    features = torch.rand(1, loaded.feature_encoder.feature_dim)
+    timings = []
+    with torch.no_grad():
+        for i in range(repeats + 2):
+            start = time.perf_counter()
+            loaded.predict_proba(images, features)
+            if i >= 2:
+                timings.append(time.perf_counter() - start)
+    parameters = sum(p.numel() for p in loaded.model.parameters())
+    tensor_bytes = sum(t.numel() * t.element_size() for t in loaded.model.state_dict().values())
+    return {
+        "latency_ms": round(statistics.median(timings) * 1000, 2),
+        "parameters": parameters,
+        "weights_mb": round(tensor_bytes / 2 ** 20, 2),
+        "checkpoint_mb": round(os.path.getsize(path) / 2 ** 20, 2) if path and os.path.exists(path) else None
+    }
+
+
+def main():
+    """Distill (and optionally prune) the served model into a compact student"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--teacher", default=DISTILL_TEACHER_PATH, help="teacher checkpoint")
+    parser.add_argument("--metadata", required=True, help="HAM10000_metadata.csv")
+    parser.add_argument("--images", nargs="*", default=[], help="HAM10000 image directories")
+    parser.add_argument("--image-store", action="store_true",
+                        help="read preprocessed inputs from the image store (keyed by the metadata's "
+                             "image_digest column, or by the digests of the --images files)")
+    parser.add_argument("--output", default=DISTILL_OUTPUT_PATH, help="student checkpoint")
+    parser.add_argument("--report", default=DISTILL_REPORT_PATH)
+    parser.add_argument("--epochs", type=int, default=DISTILL_EPOCHS)
+    parser.add_argument("--prune", type=float, default=0.0, help="fraction of expansion channels to remove")
+    parser.add_argument("--finetune-epochs", type=int, default=DISTILL_FINETUNE_EPOCHS,
+                        help="distillation epochs after pruning")
+    parser.add_argument("--temperature", type=float, default=DISTILL_TEMPERATURE)
+    parser.add_argument("--alpha", type=float, default=DISTILL_ALPHA)
+    parser.add_argument("--lr", type=float, default=DISTILL_LEARNING_RATE)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--num-workers", type=int, default=2)
+    args = parser.parse_args()
+    if not args.images and not args.image_store:
+        parser.error("--images is required unless --image-store is given")
+    logging.basicConfig(level=logging.INFO)
+    torch.manual_seed(0)
+
+    teacher_checkpoint = read_checkpoint(args.teacher)
+    teacher = build_model(teacher_checkpoint, source=args.teacher)
+    label_map = _label_map(teacher)
+    if label_map is None:
+        logger.info(f"Teacher classes {teacher.class_names} do not include the HAM10000 labels; "
+                    f"distilling from soft targets only")
+
+    # Transfer set: HAM10000 images with the teacher's own clinical inputs where available
+    if isinstance(teacher.feature_encoder, MetadataFeatureEncoder):
+        train_encoder, val_encoder = teacher.feature_encoder, teacher.feature_encoder
+    else:
+        train_encoder = RandomClinicalFeatures(teacher.feature_encoder.feature_dim, seed=0)
+        val_encoder = RandomClinicalFeatures(teacher.feature_encoder.feature_dim, seed=1)
+    train_rows, val_rows, _ = split_rows(read_metadata(args.metadata))
+    id2path = find_images(args.images)
+    train_dataset = image_dataset(train_rows, id2path, train_encoder, args.image_store, teacher.eval_resize)
+    val_dataset = image_dataset(val_rows, id2path, val_encoder, args.image_store, teacher.eval_resize)
+    train_loader = DataLoader(train_dataset, batch_size=args.batch_size,
+                              shuffle=True, num_workers=args.num_workers, drop_last=True,
+                              collate_fn=image_collate(train_dataset, array_train_transform))
+    val_loader = DataLoader(val_dataset, batch_size=args.batch_size,
+                            num_workers=args.num_workers,
+                            collate_fn=image_collate(val_dataset, array_eval_transform(teacher.eval_resize)))
+
+    student = MultimodalStudent(num_clinical_features=teacher.feature_encoder.feature_dim,
+                                num_classes=len(teacher.class_names))
+    student = distill(student, teacher, train_loader, args.epochs, args.lr, args.temperature, args.alpha, label_map)
+    stages = {"student": student}
+    if args.prune > 0:
+        pruned = prune_student(student, args.prune)
+        logger.info(f"Pruned {args.prune:.0%} of expansion channels: "
+                    f"{sum(p.numel() for p in student.parameters())} -> {sum(p.numel() for p in pruned.parameters())} "
+                    f"parameters")
+        stages["pruned_student"] = distill(pruned, teacher, train_loader, args.finetune_epochs, args.lr / 10,
+                                           args.temperature, args.alpha, label_map)
+
+    # Round-trip every student through a checkpoint, exactly as the server will load it
+    distillation = {"temperature": args.temperature, "alpha": args.alpha, "epochs": args.epochs,
+                    "prune_ratio": args.prune}
+    models, paths, checkpoints = {"teacher": teacher}, {"teacher": args.teacher}, {}
+    for name, model in stages.items():
+        final_stage = name == list(stages)[-1]
+        paths[name] = args.output if final_stage else os.path.splitext(args.output)[0] + f"_{name}.pth"
+        checkpoints[name] = student_checkpoint(model, teacher, teacher_checkpoint, distillation=distillation)
+        models[name] = build_model(checkpoints[name], source=paths[name])
+    metrics = evaluate(models, teacher, val_loader, label_map)
+    for name, checkpoint in checkpoints.items():
+        checkpoint.update(val_acc=metrics[name]["accuracy"], teacher_agreement=metrics[name]["teacher_agreement"])
+        os.makedirs(os.path.dirname(os.path.abspath(paths[name])), exist_ok=True)
+        torch.save(checkpoint, paths[name])
+
+    report = {name: {**metrics[name], **benchmark(loaded, paths[name]), "architecture": loaded.architecture,
+                     "path": os.path.basename(paths[name])}
+              for name, loaded in models.items()}
+    final = report[list(stages)[-1]]
+    report["summary"] = {
+        "speedup": round(report["teacher"]["latency_ms"] / final["latency_ms"], 2),
+        "parameter_reduction": round(report["teacher"]["parameters"] / final["parameters"], 2),
+        "validation_size": len(val_loader.dataset),
+        "created_at": datetime.utcnow().isoformat()
+    }
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for name, row in report.items():
+        if name != "summary":
+            logger.info(f"{name:>15}: acc {row['accuracy']}, agreement {row['teacher_agreement']}%, "
+                        f"{row['latency_ms']} ms, {row['parameters'] / 1e6:.2f}M params, {row['weights_mb']} MB")
+    logger.info(f"Student written to {args.output}, report to {args.report}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
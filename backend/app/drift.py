@@ -0,0 +1,396 @@
+# drift.py
+# Streaming statistics of what /predict is asked and what it answers, to spot shifts in the
+# input population or the model's output distribution. Each served prediction adds, per
+# model version and hour, in constant memory:
+#   - counts per predicted class and per risk level
+#   - a fixed-bin histogram (and sum) of the confidence, per predicted class
+#   - count, sum and sum of squares of every encoded (normalized) clinical feature
+# Everything is a plain sum, so workers merge exactly: each one adds its increments to an
+# hourly Redis hash every DRIFT_FLUSH_INTERVAL seconds, and snapshots read the hashes all
+# workers wrote (falling back to this process's own counts without Redis). Drift compares
+# the last DRIFT_WINDOW_HOURS with the DRIFT_REFERENCE_HOURS before them: the population
+# stability index (PSI) of the class and confidence distributions, and each feature's mean
+# shift in reference standard deviations.
+
+import os
+import math
+import time
+import logging
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from .model_manager import MODEL_NAME
+
+try:
+    from prometheus_client import Counter as PrometheusCounter, Gauge, Histogram
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+try:
+    from .cache import get_binary_redis_client, tagged_key
+    REDIS_CACHE_AVAILABLE = True
+except ImportError:
+    REDIS_CACHE_AVAILABLE = False
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Drift statistics configuration from environment variables
+DRIFT_ENABLED = os.getenv("DRIFT_ENABLED", "true").lower() == "true"
+DRIFT_FLUSH_INTERVAL = float(os.getenv("DRIFT_FLUSH_INTERVAL", "10"))  # seconds between Redis merges, 0 disables
+DRIFT_WINDOW_HOURS = int(os.getenv("DRIFT_WINDOW_HOURS", "1"))  # current window
+DRIFT_REFERENCE_HOURS = int(os.getenv("DRIFT_REFERENCE_HOURS", "24"))  # reference window before it
+DRIFT_CONFIDENCE_BINS = int(os.getenv("DRIFT_CONFIDENCE_BINS", "20"))  # histogram bins over [0, 1]
+DRIFT_PSI_THRESHOLD = float(os.getenv("DRIFT_PSI_THRESHOLD", "0.2"))
+DRIFT_FEATURE_SHIFT_THRESHOLD = float(os.getenv("DRIFT_FEATURE_SHIFT_THRESHOLD", "0.5"))  # reference stds
+DRIFT_MIN_SAMPLES = int(os.getenv("DRIFT_MIN_SAMPLES", "100"))  # per window before drift is reported
+
+DRIFT_PREFIX = "drift"
+HOUR = 3600
+PSI_FLOOR = 1e-4  # empty bins would make PSI infinite
+
+if PROMETHEUS_AVAILABLE:
+    PREDICTION_CONFIDENCE = Histogram(
+        "model_prediction_confidence",
+        "Confidence of served predictions per predicted class",
+        ["model", "version", "predicted_class"],
+        buckets=[i / DRIFT_CONFIDENCE_BINS for i in range(1, DRIFT_CONFIDENCE_BINS + 1)]
+    )
+    PREDICTION_RISK_LEVELS = PrometheusCounter(
+        "model_prediction_risk_levels_total",
+        "Served predictions per risk level",
+        ["model", "version", "risk_level"]
+    )
+    FEATURE_MEAN = Gauge(
+        "model_feature_mean",
+        "Mean of a normalized clinical feature over the current drift window (all workers)",
+        ["model", "version", "feature"]
+    )
+    FEATURE_SHIFT = Gauge(
+        "model_feature_shift",
+        "Feature mean shift from the reference window, in reference standard deviations",
+        ["model", "version", "feature"]
+    )
+    DISTRIBUTION_PSI = Gauge(
+        "model_drift_psi",
+        "Population stability index of the current window against the reference window",
+        ["model", "version", "distribution"]
+    )
+
+
+def _bin(confidence: float, bins: int = DRIFT_CONFIDENCE_BINS) -> int:
+    return min(bins - 1, max(0, int(confidence * bins)))
+
+
+def psi(current: Sequence[float], reference: Sequence[float]) -> Optional[float]:
+    """Population stability index of two count vectors over the same bins"""
+    current_total, reference_total = sum(current), sum(reference)
+    if not current_total or not reference_total:
+        return None
+    value = 0.0
+    for c, r in zip(current, reference):
+        p = max(c / current_total, PSI_FLOOR)
+        q = max(r / reference_total, PSI_FLOOR)
+        value += (p - q) * math.log(p / q)
+    return round(value, 4)
+
+
+def _histogram_quantile(histogram: Sequence[float], q: float) -> Optional[float]:
+    """Quantile of a [0, 1] histogram, interpolated within the bin"""
+    total = sum(histogram)
+    if not total:
+        return None
+    target, seen = q * total, 0.0
+    width = 1.0 / len(histogram)
+    for index, count in enumerate(histogram):
+        if count and seen + count >= target:
+            return round((index + (target - seen) / count) * width, 4)
+        seen += count
+    return 1.0
+
+
+def summarize(stats: Dict[str, float], class_names: Sequence[str], names: Sequence[str]) -> Dict[str, Any]:
+    """Rates, confidence sketches and feature moments from merged counters"""
+    total = stats.get("n", 0)
+    classes = sorted(set(class_names) | {key.split(":", 1)[1] for key in stats if key.startswith("class:")})
+    risks = sorted(key.split(":", 1)[1] for key in stats if key.startswith("risk:"))
+
+    confidence = {}
+    for name in classes:
+        count = stats.get(f"class:{name}", 0)
+        histogram = [stats.get(f"conf:{name}:{i}", 0) for i in range(DRIFT_CONFIDENCE_BINS)]
+        confidence[name] = {
+            "count": int(count),
+            "mean": round(stats.get(f"conf_sum:{name}", 0) / count, 4) if count else None,
+            "p10": _histogram_quantile(histogram, 0.10),
+            "p50": _histogram_quantile(histogram, 0.50),
+            "p90": _histogram_quantile(histogram, 0.90),
+            "histogram": [int(c) for c in histogram]
+        }
+
+    features = {}
+    for index, name in enumerate(names):
+        count = stats.get(f"feat:{index}:n", 0)
+        if not count:
+            continue
+        mean = stats.get(f"feat:{index}:sum", 0) / count
+        variance = max(0.0, stats.get(f"feat:{index}:sq", 0) / count - mean * mean)
+        features[name] = {"mean": round(mean, 6), "std": round(math.sqrt(variance), 6)}
+
+    return {
+        "predictions": int(total),
+        "class_rates": {name: round(stats.get(f"class:{name}", 0) / total, 4) if total else None for name in classes},
+        "risk_rates": {name: round(stats.get(f"risk:{name}", 0) / total, 4) if total else None for name in risks},
+        "confidence": confidence,
+        "features": features
+    }
+
+
+def compare(current: Dict[str, Any], reference: Dict[str, Any]) -> Dict[str, Any]:
+    """PSI of the class and confidence distributions and feature mean shifts, with alerts"""
+    enough = (current["predictions"] >= DRIFT_MIN_SAMPLES and reference["predictions"] >= DRIFT_MIN_SAMPLES)
+    classes = list(current["class_rates"])
+    class_psi = psi([current["confidence"][name]["count"] for name in classes],
+                    [reference["confidence"].get(name, {}).get("count", 0) for name in classes])
+    confidence_psi = {
+        name: psi(current["confidence"][name]["histogram"], reference["confidence"][name]["histogram"])
+        for name in classes if name in reference["confidence"]
+    }
+    feature_shift = {}
+    for name, moments in current["features"].items():
+        baseline = reference["features"].get(name)
+        if baseline and baseline["std"] > 0:
+            feature_shift[name] = round((moments["mean"] - baseline["mean"]) / baseline["std"], 4)
+
+    alerts = []
+    if enough:
+        if class_psi is not None and class_psi >= DRIFT_PSI_THRESHOLD:
+            alerts.append(f"class distribution PSI {class_psi}")
+        alerts += [f"{name} confidence PSI {value}" for name, value in confidence_psi.items()
+                   if value is not None and value >= DRIFT_PSI_THRESHOLD]
+        alerts += [f"{name} mean shifted {value} std" for name, value in feature_shift.items()
+                   if abs(value) >= DRIFT_FEATURE_SHIFT_THRESHOLD]
+    return {
+        "sufficient_samples": enough,
+        "class_psi": class_psi,
+        "confidence_psi": confidence_psi,
+        "feature_shift": feature_shift,
+        "alerts": alerts
+    }
+
+
+class _HourSketch:
+    """Counters of one version and hour, cheap to update on the request path"""
+
+    __slots__ = ("counts", "feature_sum", "feature_sq")
+
+    def __init__(self):
+        self.counts = Counter()
+        self.feature_sum: List[float] = []
+        self.feature_sq: List[float] = []
+
+    def add(self, predicted_class: str, confidence: float, risk_level: str, features: Sequence[float]):
+        counts = self.counts
+        counts["n"] += 1
+        counts[f"class:{predicted_class}"] += 1
+        counts[f"risk:{risk_level}"] += 1
+        counts[f"conf:{predicted_class}:{_bin(confidence)}"] += 1
+        counts[f"conf_sum:{predicted_class}"] += confidence
+        if len(features) > len(self.feature_sum):
+            missing = len(features) - len(self.feature_sum)
+            self.feature_sum += [0.0] * missing
+            self.feature_sq += [0.0] * missing
+        feature_sum, feature_sq = self.feature_sum, self.feature_sq
+        for index, value in enumerate(features):
+            feature_sum[index] += value
+            feature_sq[index] += value * value
+
+    def fields(self) -> Counter:
+        """Flat field -> value counters, as stored in the Redis hash"""
+        fields = Counter(self.counts)
+        for index, (total, squares) in enumerate(zip(self.feature_sum, self.feature_sq)):
+            fields[f"feat:{index}:n"] = self.counts["n"]
+            fields[f"feat:{index}:sum"] = total
+            fields[f"feat:{index}:sq"] = squares
+        return fields
+
+
+class DriftMonitor:
+    """Per-version, per-hour prediction counters, merged across workers through Redis"""
+
+    def __init__(self, model_name: str = MODEL_NAME, enabled: bool = DRIFT_ENABLED,
+                 retention_hours: int = DRIFT_WINDOW_HOURS + DRIFT_REFERENCE_HOURS):
+        self.model_name = model_name
+        self.enabled = enabled
+        self.retention_hours = retention_hours
+        self._lock = threading.Lock()
+        # (version, hour) -> counters recorded since the last flush
+        self._pending: Dict[tuple, _HourSketch] = {}
+        # (version, hour) -> everything this process recorded, and the part Redis has not taken yet
+        self._local: Dict[tuple, Counter] = {}
+        self._unsent: Dict[tuple, Counter] = {}
+        self._class_names: Dict[str, List[str]] = {}
+        self._feature_names: Dict[str, List[str]] = {}
+        self._metrics: Dict[tuple, tuple] = {}  # cached Prometheus children
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def key(version: str, hour: int) -> str:
+        # One hash tag per version keeps all of its hours on one shard in cluster mode
+        return f"{tagged_key(DRIFT_PREFIX, version)}:{hour}"
+
+    def record(self, version: str, predicted_class: str, confidence: float, risk_level: str,
+               features: Sequence[float], class_names: Sequence[str] = (), feature_names: Sequence[str] = ()):
+        """Add one served prediction; the names label the version's snapshots"""
+        if not self.enabled:
+            return
+        if version not in self._feature_names:
+            with self._lock:
+                self._class_names[version] = list(class_names)
+                self._feature_names[version] = list(feature_names) or [f"feature_{i}" for i in range(len(features))]
+        bucket = (version, int(time.time() // HOUR))
+        with self._lock:
+            sketch = self._pending.get(bucket)
+            if sketch is None:
+                sketch = self._pending[bucket] = _HourSketch()
+            sketch.add(predicted_class, confidence, risk_level, features)
+        if PROMETHEUS_AVAILABLE:
+            labels = (version, predicted_class, risk_level)
+            metrics = self._metrics.get(labels)
+            if metrics is None:
+                metrics = self._metrics[labels] = (
+                    PREDICTION_CONFIDENCE.labels(model=self.model_name, version=version,
+                                                 predicted_class=predicted_class),
+                    PREDICTION_RISK_LEVELS.labels(model=self.model_name, version=version, risk_level=risk_level)
+                )
+            metrics[0].observe(confidence)
+            metrics[1].inc()
+
+    def _expire(self, buckets: Dict[tuple, Any]):
+        oldest = int(time.time() // HOUR) - self.retention_hours
+        for bucket in [bucket for bucket in buckets if bucket[1] < oldest]:
+            del buckets[bucket]
+
+    def flush(self) -> bool:
+        """Add this process's increments to the shared hourly hashes"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            for bucket, sketch in pending.items():
+                fields = sketch.fields()
+                self._local.setdefault(bucket, Counter()).update(fields)
+                self._unsent.setdefault(bucket, Counter()).update(fields)
+            self._expire(self._local)
+            self._expire(self._unsent)
+            unsent, self._unsent = self._unsent, {}
+        if not unsent:
+            return True
+        client = get_binary_redis_client() if REDIS_CACHE_AVAILABLE else None
+        try:
+            if client is None:
+                raise ConnectionError("Redis not available")
+            pipeline = client.pipeline(transaction=False)
+            for (version, hour), fields in unsent.items():
+                key = self.key(version, hour)
+                for field, value in fields.items():
+                    if isinstance(value, int):
+                        pipeline.hincrby(key, field, value)
+                    else:
+                        pipeline.hincrbyfloat(key, field, value)
+                pipeline.expire(key, (self.retention_hours + 1) * HOUR)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            # Keep the increments for the next flush instead of losing them
+            with self._lock:
+                for bucket, fields in unsent.items():
+                    self._unsent.setdefault(bucket, Counter()).update(fields)
+            logger.debug(f"Drift statistics not flushed: {e}")
+            return False
+
+    def _hours(self, version: str, hours: Sequence[int]) -> Dict[int, Counter]:
+        """Merged counters of all workers per hour, or this process's own without Redis"""
+        flushed = self.flush()
+        client = get_binary_redis_client() if REDIS_CACHE_AVAILABLE else None
+        if client is not None and flushed:
+            try:
+                pipeline = client.pipeline(transaction=False)
+                for hour in hours:
+                    pipeline.hgetall(self.key(version, hour))
+                return {hour: Counter({field.decode(): float(value) for field, value in values.items()})
+                        for hour, values in zip(hours, pipeline.execute())}
+            except Exception as e:
+                logger.warning(f"Reading drift statistics from Redis failed: {e}")
+        with self._lock:
+            return {hour: Counter(self._local.get((version, hour), {})) for hour in hours}
+
+    def snapshot(self, version: str) -> Dict[str, Any]:
+        """Current and reference window summaries and their drift"""
+        current_hour = int(time.time() // HOUR)
+        window = list(range(current_hour - DRIFT_WINDOW_HOURS + 1, current_hour + 1))
+        reference = list(range(window[0] - DRIFT_REFERENCE_HOURS, window[0]))
+        per_hour = self._hours(version, reference + window)
+        current_stats, reference_stats = Counter(), Counter()
+        for hour in window:
+            current_stats.update(per_hour[hour])
+        for hour in reference:
+            reference_stats.update(per_hour[hour])
+
+        with self._lock:
+            class_names = self._class_names.get(version, [])
+            names = self._feature_names.get(version)
+        if names is None:
+            dims = {int(field.split(":")[1]) for field in set(current_stats) | set(reference_stats)
+                    if field.startswith("feat:")}
+            names = [f"feature_{i}" for i in range(max(dims) + 1)] if dims else []
+
+        current_summary = summarize(current_stats, class_names, names)
+        reference_summary = summarize(reference_stats, class_names, names)
+        drift = compare(current_summary, reference_summary)
+        if PROMETHEUS_AVAILABLE:
+            self._export(version, current_summary, drift)
+        return {
+            "version": version,
+            "window_hours": DRIFT_WINDOW_HOURS,
+            "reference_hours": DRIFT_REFERENCE_HOURS,
+            "current": current_summary,
+            "reference": reference_summary,
+            "drift": drift
+        }
+
+    def _export(self, version: str, current: Dict[str, Any], drift: Dict[str, Any]):
+        """Set the merged-window gauges, so every worker reports the same values"""
+        labels = {"model": self.model_name, "version": version}
+        for name, moments in current["features"].items():
+            FEATURE_MEAN.labels(feature=name, **labels).set(moments["mean"])
+        for name, shift in drift["feature_shift"].items():
+            FEATURE_SHIFT.labels(feature=name, **labels).set(shift)
+        if drift["class_psi"] is not None:
+            DISTRIBUTION_PSI.labels(distribution="class", **labels).set(drift["class_psi"])
+        for name, value in drift["confidence_psi"].items():
+            if value is not None:
+                DISTRIBUTION_PSI.labels(distribution=f"confidence:{name}", **labels).set(value)
+
+    def start(self, versions: Callable[[], Sequence[str]], interval: float = DRIFT_FLUSH_INTERVAL) -> Optional[threading.Thread]:
+        """Flush and refresh the gauges of versions() every interval seconds (once per process)"""
+        if not self.enabled or interval <= 0 or self._thread is not None:
+            return self._thread
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.flush()
+                    for version in versions():
+                        self.snapshot(version)
+                except Exception as e:
+                    logger.error(f"Drift statistics update failed: {e}")
+
+        self._thread = threading.Thread(target=run, name="drift-flush", daemon=True)
+        self._thread.start()
+        return self._thread
+
+
+# Global drift monitor instance
+drift_monitor = DriftMonitor()
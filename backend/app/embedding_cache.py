@@ -0,0 +1,132 @@
+# embedding_cache.py
+# Caches image embeddings by image digest, so a resubmitted image with edited clinical
+# data only costs the fusion head. Entries are keyed by the model's embedding-weight
+# fingerprint, live in an in-process LRU, and are shared through Redis as float16 bytes.
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+import torch
+
+try:
+    from .cache import set_binary_cache, get_binary_cache
+    REDIS_CACHE_AVAILABLE = True
+except ImportError:
+    REDIS_CACHE_AVAILABLE = False
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Embedding cache configuration from environment variables
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))  # in-process entries
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", "86400"))  # 24 hours
+EMBEDDING_CACHE_REDIS = os.getenv("EMBEDDING_CACHE_REDIS", "true").lower() == "true"
+
+# Cache key prefix
+EMBEDDING_PREFIX = "embedding"
+
+
+def encode_embedding(embedding: torch.Tensor) -> bytes:
+    """Pack a (1, D) embedding as float16 bytes"""
+    return embedding.detach().reshape(-1).to(torch.float16).numpy().tobytes()
+
+
+def decode_embedding(data: bytes) -> torch.Tensor:
+    """Unpack float16 bytes into a (1, D) float32 embedding"""
+    return torch.from_numpy(np.frombuffer(data, dtype=np.float16).astype(np.float32)).unsqueeze(0)
+
+
+class EmbeddingCache:
+    """Two-level (memory, Redis) cache of per-image embeddings"""
+
+    def __init__(self, max_entries: int = EMBEDDING_CACHE_SIZE, ttl: int = EMBEDDING_CACHE_TTL,
+                 use_redis: bool = EMBEDDING_CACHE_REDIS and REDIS_CACHE_AVAILABLE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.use_redis = use_redis
+        self._entries: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(embedding_id: str, image_digest: str) -> str:
+        return f"{EMBEDDING_PREFIX}:{embedding_id}:{image_digest}"
+
+    def _remember(self, key: str, embedding: torch.Tensor):
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, embedding_id: str, image_digest: str) -> Optional[torch.Tensor]:
+        """Cached embedding for an image, or None"""
+        key = self.key(embedding_id, image_digest)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return embedding
+
+        if self.use_redis:
+            data = get_binary_cache(key)
+            if data:
+                embedding = decode_embedding(data)
+                self._remember(key, embedding)
+                with self._lock:
+                    self.redis_hits += 1
+                return embedding
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def peek(self, embedding_id: str, image_digest: str) -> Optional[torch.Tensor]:
+        """In-process lookup that does not count towards the hit statistics"""
+        with self._lock:
+            return self._entries.get(self.key(embedding_id, image_digest))
+
+    def put(self, embedding_id: str, image_digest: str, embedding: torch.Tensor) -> torch.Tensor:
+        """Store an embedding in memory and, when enabled, in Redis; returns the stored value"""
+        key = self.key(embedding_id, image_digest)
+        data = encode_embedding(embedding)
+        # Keep the float16-rounded values in memory too, so memory and Redis hits agree
+        stored = decode_embedding(data)
+        self._remember(key, stored)
+        if self.use_redis:
+            set_binary_cache(key, data, self.ttl)
+        return stored
+
+    def get_or_compute(self, loaded: Any, image_digest: str,
+                       load_image: Callable[[], torch.Tensor]) -> torch.Tensor:
+        """Cached embedding for the image under this model, computing it on a miss"""
+        embedding_id = loaded.embedding_id
+        embedding = self.get(embedding_id, image_digest)
+        if embedding is None:
+            with torch.no_grad():
+                embedding = loaded.embed(load_image())
+            embedding = self.put(embedding_id, image_digest, embedding)
+        return embedding
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.redis_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "memory_hits": self.memory_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.redis_hits) / lookups, 4) if lookups else None
+            }
+
+
+# Global embedding cache instance
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,47 @@
+# explain.py
+# Grad-CAM explanations for /predict.
+# The map itself is computed by LoadedModel.explain during the prediction's own forward
+# pass; this module turns it into a small grayscale PNG heatmap that is cheap to cache
+# and to send to the frontend, which scales it up over the uploaded image.
+
+import os
+import io
+import base64
+import logging
+from typing import Any, Dict
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Heatmap configuration from environment variables
+EXPLAIN_HEATMAP_SIZE = int(os.getenv("EXPLAIN_HEATMAP_SIZE", "32"))  # pixels per side
+
+
+def heatmap_png(cam: torch.Tensor, size: int = EXPLAIN_HEATMAP_SIZE) -> bytes:
+    """Normalize a (H, W) class activation map to 0-255 and encode it as a size x size PNG"""
+    cam = F.interpolate(cam.float()[None, None], size=(size, size), mode="bilinear", align_corners=False)[0, 0]
+    cam = cam - cam.min()
+    peak = cam.max()
+    if peak > 0:
+        cam = cam / peak
+    pixels = (cam * 255).round().to(torch.uint8).numpy()
+
+    buffer = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(pixels), mode="L").save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def build_explanation(cam: torch.Tensor, explained_class: str, layer: str) -> Dict[str, Any]:
+    """Response/cache payload for a Grad-CAM map"""
+    return {
+        "method": "grad-cam",
+        "explained_class": explained_class,
+        "layer": layer,
+        "heatmap_size": EXPLAIN_HEATMAP_SIZE,
+        "heatmap_png": base64.b64encode(heatmap_png(cam)).decode()
+    }
@@ -0,0 +1,177 @@
+# ham10000.py
+# HAM10000 dataset access shared by the offline tools (calibration, training, distillation).
+# Labels, missing-value handling and the stratified 70/20/10 split follow the training
+# notebook, so validation metrics computed here refer to the same held-out images.
+# Images come either from the HAM10000 image directories or, with --image-store, as the
+# preprocessed inputs the image store keeps, which skips JPEG decoding and hair removal.
+
+import os
+import csv
+import glob
+import hashlib
+import logging
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+from PIL import Image
+
+from .preprocessing import IMG_SIZE, DEFAULT_EVAL_RESIZE, HairRemovalCollate
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Diagnoses counted as malignant in the notebook's binary setup
+MALIGNANT_DX = ("mel", "bcc", "akiec")
+BINARY_CLASS_NAMES = ["Benign", "Malignant"]
+
+SPLIT_SEED = 42
+TEST_FRACTION = 0.10
+VAL_FRACTION = 0.20
+
+
+def read_metadata(metadata_path: str) -> List[Dict[str, Any]]:
+    """Read HAM10000_metadata.csv into rows with a binary label, filling missing values"""
+    with open(metadata_path, newline="") as f:
+        rows = [dict(row) for row in csv.DictReader(f)]
+
+    ages = sorted(float(row["age"]) for row in rows if row.get("age"))
+    median_age = float(np.median(ages)) if ages else 0.0
+    for row in rows:
+        row["sex"] = row.get("sex") or "unknown"
+        row["age"] = float(row["age"]) if row.get("age") else median_age
+        row["localization"] = row.get("localization") or "unknown"
+        row["label"] = 1 if row["dx"] in MALIGNANT_DX else 0
+    return rows
+
+
+def find_images(image_dirs: Sequence[str]) -> Dict[str, str]:
+    """Map image IDs to file paths across the HAM10000 image directories"""
+    id2path = {}
+    for directory in image_dirs:
+        if not os.path.isdir(directory):
+            logger.warning(f"Image directory not found: {directory}")
+            continue
+        for path in glob.glob(os.path.join(directory, "*.[jJ][pP][gG]")):
+            id2path[os.path.splitext(os.path.basename(path))[0]] = path
+    return id2path
+
+
+def split_rows(rows: List[Dict[str, Any]], seed: int = SPLIT_SEED
+               ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Stratified train/validation/test split, identical to the notebook's"""
+    from sklearn.model_selection import train_test_split
+
+    labels = [row["label"] for row in rows]
+    train_val, test = train_test_split(rows, test_size=TEST_FRACTION, stratify=labels, random_state=seed)
+    train_val_labels = [row["label"] for row in train_val]
+    train, val = train_test_split(train_val, test_size=VAL_FRACTION / (1 - TEST_FRACTION),
+                                  stratify=train_val_labels, random_state=seed)
+    return train, val, test
+
+
+def clinical_fields(row: Dict[str, Any]) -> Dict[str, Any]:
+    """The ClinicalData fields a metadata row provides, in the form /predict receives them"""
+    return {
+        "age": row["age"],
+        "gender": {"female": 0, "male": 1}.get(row["sex"]),
+        "localization": row["localization"]
+    }
+
+
+class HAM10000Dataset(Dataset):
+    """
+    Image/metadata/label samples for HAM10000.
+
+    Images are returned as RGB uint8 HWC arrays so HairRemovalCollate can remove hair for
+    the whole batch; metadata is encoded with the model's own feature encoder.
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]], id2path: Dict[str, str],
+                 feature_encoder: Any, image_transform: Optional[Callable] = None):
+        self.rows = [row for row in rows if row["image_id"] in id2path]
+        if len(self.rows) < len(rows):
+            logger.warning(f"{len(rows) - len(self.rows)} metadata rows have no image file")
+        self.id2path = id2path
+        self.features = torch.tensor([feature_encoder.encode(clinical_fields(row)) for row in self.rows],
+                                     dtype=torch.float32)
+        self.labels = torch.tensor([row["label"] for row in self.rows], dtype=torch.long)
+        self.image_transform = image_transform
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        path = self.id2path[self.rows[idx]["image_id"]]
+        try:
+            image = Image.open(path).convert("RGB")
+        except Exception as e:
+            logger.warning(f"Failed to load image {path}: {e}")
+            image = Image.new("RGB", (IMG_SIZE, IMG_SIZE))
+        if self.image_transform is not None:
+            image = self.image_transform(image)
+        return np.asarray(image), self.features[idx], self.labels[idx]
+
+
+def attach_digests(rows: List[Dict[str, Any]], id2path: Dict[str, str]) -> List[Dict[str, Any]]:
+    """
+    Fill each row's image_digest (the image store key): taken from an image_digest metadata
+    column when present, otherwise the SHA-256 of the image file
+    """
+    for row in rows:
+        if not row.get("image_digest") and row.get("image_id") in id2path:
+            with open(id2path[row["image_id"]], "rb") as f:
+                row["image_digest"] = hashlib.sha256(f.read()).hexdigest()
+    return rows
+
+
+class StoredInputDataset(Dataset):
+    """
+    Image/metadata/label samples whose images are the image store's preprocessed inputs.
+
+    Rows need an image_digest (see attach_digests); rows whose input is not stored with
+    eval_resize are dropped. Images are hair-removed 224x224 uint8 HWC arrays, so they are
+    collated with HairRemovalCollate(remove_hair=False).
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]], feature_encoder: Any, store: Any = None,
+                 eval_resize: str = DEFAULT_EVAL_RESIZE):
+        if store is None:
+            from .image_store import image_store as store
+        digests = [row["image_digest"] for row in rows if row.get("image_digest")]
+        stored = store.stored_inputs(digests, eval_resize=eval_resize)
+        self.rows = [row for row in rows if row.get("image_digest") in stored]
+        if len(self.rows) < len(rows):
+            logger.warning(f"{len(rows) - len(self.rows)} metadata rows have no stored image input")
+        self.store = store
+        self.eval_resize = eval_resize
+        self.features = torch.tensor([feature_encoder.encode(clinical_fields(row)) for row in self.rows],
+                                     dtype=torch.float32)
+        self.labels = torch.tensor([row["label"] for row in self.rows], dtype=torch.long)
+        self._pid = os.getpid()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        if os.getpid() != self._pid:
+            # DataLoader worker: MongoClient is not fork-safe, so reconnect in this process
+            from .database import db_manager
+            db_manager.client = None
+            self._pid = os.getpid()
+        image = self.store.load_arrays([self.rows[idx]["image_digest"]], eval_resize=self.eval_resize)[0]
+        return image, self.features[idx], self.labels[idx]
+
+
+def image_dataset(rows: List[Dict[str, Any]], id2path: Dict[str, str], feature_encoder: Any,
+                  from_store: bool = False, eval_resize: str = DEFAULT_EVAL_RESIZE) -> Dataset:
+    """HAM10000Dataset over the image files, or StoredInputDataset over their stored inputs"""
+    if from_store:
+        return StoredInputDataset(attach_digests(rows, id2path), feature_encoder, eval_resize=eval_resize)
+    return HAM10000Dataset(rows, id2path, feature_encoder)
+
+
+def image_collate(dataset: Dataset, transform: Optional[Callable] = None) -> HairRemovalCollate:
+    """Collate for image_dataset: stored inputs have had hair removal already"""
+    return HairRemovalCollate(transform=transform, remove_hair=not isinstance(dataset, StoredInputDataset))
@@ -0,0 +1,319 @@
+# head_train.py
+# Retrains only the heads of a served model on cached image embeddings.
+# The frozen image-embedding modules (EMBEDDING_MODULES: backbone and image projection)
+# run once over HAM10000 and their outputs are written to a memory-mapped feature store,
+# keyed by the model's embedding_id so later runs against the same backbone skip the
+# extraction. The clinical branch, fusion and classifier are then trained on the cached
+# arrays for many epochs - seconds per epoch instead of a backbone pass per image - with
+# class-weighted loss and early stopping on the validation split. The checkpoint written
+# combines the unchanged backbone with the new heads in the base checkpoint's own format,
+# so the server loads it like any other model (MODEL_PATH=..., or as a candidate).
+#
+#   python -m app.head_train --base model/best_multimodal_hqcnn.pth \
+#       --metadata HAM10000_metadata.csv --images part_1 part_2 --epochs 200
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, Dataset
+
+from .ham10000 import BINARY_CLASS_NAMES, read_metadata, find_images, split_rows, image_dataset, image_collate
+from .model_registry import LoadedModel, MetadataFeatureEncoder, build_model, read_checkpoint
+from .preprocessing import array_eval_transform
+from .train import class_weights, _save_atomic
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Head training configuration from environment variables
+MODEL_DIR = os.path.join(os.path.dirname(__file__), '../model')
+HEAD_TRAIN_BASE_PATH = os.getenv("HEAD_TRAIN_BASE_PATH", os.path.join(MODEL_DIR, "best_multimodal_hqcnn.pth"))
+HEAD_TRAIN_OUTPUT_PATH = os.getenv("HEAD_TRAIN_OUTPUT_PATH", os.path.join(MODEL_DIR, "head_retrained.pth"))
+HEAD_TRAIN_FEATURE_DIR = os.getenv("HEAD_TRAIN_FEATURE_DIR", os.path.join(MODEL_DIR, "feature_store"))
+HEAD_TRAIN_EPOCHS = int(os.getenv("HEAD_TRAIN_EPOCHS", "200"))
+HEAD_TRAIN_BATCH_SIZE = int(os.getenv("HEAD_TRAIN_BATCH_SIZE", "256"))
+HEAD_TRAIN_LEARNING_RATE = float(os.getenv("HEAD_TRAIN_LEARNING_RATE", "0.001"))
+HEAD_TRAIN_WEIGHT_DECAY = float(os.getenv("HEAD_TRAIN_WEIGHT_DECAY", "1e-4"))
+HEAD_TRAIN_PATIENCE = int(os.getenv("HEAD_TRAIN_PATIENCE", "20"))  # early stopping
+HEAD_TRAIN_SEED = 42
+
+SPLITS = ("train", "val", "test")
+
+
+def _label_map(loaded: LoadedModel) -> torch.Tensor:
+    """Model class index of each HAM10000 binary label"""
+    missing = [name for name in BINARY_CLASS_NAMES if name not in loaded.class_names]
+    if missing:
+        raise ValueError(f"Model classes {loaded.class_names} do not include the HAM10000 labels {missing}")
+    return torch.tensor([loaded.class_names.index(name) for name in BINARY_CLASS_NAMES])
+
+
+def embedding_modules(loaded: LoadedModel) -> Tuple[str, ...]:
+    """Prefixes of the frozen state_dict entries; everything else is head"""
+    modules = getattr(loaded.model, "EMBEDDING_MODULES", ())
+    if not modules:
+        raise ValueError(f"{loaded.architecture} does not separate image embedding from its heads")
+    return tuple(f"{name}." for name in modules)
+
+
+def _row_id(row: Dict[str, Any]) -> str:
+    return row.get("image_id") or row["image_digest"]
+
+
+class FeatureStore:
+    """
+    Cached image embeddings, one memory-mapped .npy file per split.
+
+    Files live under <directory>/<embedding_id>/, with a JSON sidecar recording a digest of the
+    image ids in row order. The sidecar is written last, so an interrupted extraction is redone.
+    """
+
+    def __init__(self, directory: str, embedding_id: str):
+        self.directory = os.path.join(directory, embedding_id)
+
+    def _paths(self, split: str) -> Tuple[str, str]:
+        return os.path.join(self.directory, f"{split}.npy"), os.path.join(self.directory, f"{split}.json")
+
+    @staticmethod
+    def _rows_digest(image_ids: List[str]) -> str:
+        return hashlib.blake2b("\n".join(image_ids).encode(), digest_size=16).hexdigest()
+
+    def load(self, split: str, image_ids: List[str]) -> Optional[np.ndarray]:
+        """The split's embeddings if they were extracted for exactly these images"""
+        array_path, meta_path = self._paths(split)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("rows_digest") != self._rows_digest(image_ids):
+            return None
+        return np.load(array_path, mmap_mode="r")
+
+    def extract(self, split: str, loaded: LoadedModel, dataset: Dataset, batch_size: int,
+                num_workers: int) -> np.ndarray:
+        """Run the frozen embedding once over the split, streaming batches into the file"""
+        os.makedirs(self.directory, exist_ok=True)
+        array_path, meta_path = self._paths(split)
+        loader = DataLoader(dataset, batch_size=batch_size, num_workers=num_workers,
+                            collate_fn=image_collate(dataset, array_eval_transform(loaded.eval_resize)))
+        features = None
+        row, start = 0, time.perf_counter()
+        loaded.model.eval()
+        with torch.no_grad():
+            for images, _, _ in loader:
+                embedding = loaded.embed(images).float().numpy()
+                if features is None:
+                    features = np.lib.format.open_memmap(array_path + ".tmp", mode="w+", dtype=np.float32,
+                                                         shape=(len(dataset), embedding.shape[1]))
+                features[row:row + len(embedding)] = embedding
+                row += len(embedding)
+        features.flush()
+        del features
+        os.replace(array_path + ".tmp", array_path)
+
+        image_ids = [_row_id(r) for r in dataset.rows]
+        seconds = time.perf_counter() - start
+        with open(meta_path, "w") as f:
+            json.dump({"split": split, "rows": len(image_ids), "rows_digest": self._rows_digest(image_ids),
+                       "architecture": loaded.architecture, "seconds": round(seconds, 1),
+                       "created_at": datetime.utcnow().isoformat()}, f, indent=2)
+        logger.info(f"Extracted {len(image_ids)} {split} embeddings in {seconds:.1f}s ({len(image_ids) / seconds:.1f} "
+                    f"images/s) to {array_path}")
+        return np.load(array_path, mmap_mode="r")
+
+    def get(self, split: str, loaded: LoadedModel, dataset: Dataset, batch_size: int,
+            num_workers: int) -> np.ndarray:
+        """Cached embeddings for the split, extracting them first if needed"""
+        features = self.load(split, [_row_id(r) for r in dataset.rows])
+        if features is not None:
+            logger.info(f"Reusing {len(features)} cached {split} embeddings from {self.directory}")
+            return features
+        return self.extract(split, loaded, dataset, batch_size, num_workers)
+
+
+def head_loss(loaded: LoadedModel, output: Any, labels: torch.Tensor, weights: torch.Tensor) -> torch.Tensor:
+    """Weighted cross-entropy on logits, or on log-probabilities for softmax heads"""
+    if loaded.returns_logits:
+        return F.cross_entropy(output[0], labels, weight=weights)
+    return F.nll_loss(output.clamp_min(1e-8).log(), labels, weight=weights)
+
+
+def evaluate(loaded: LoadedModel, features: torch.Tensor, clinical: torch.Tensor, labels: torch.Tensor,
+             weights: torch.Tensor, batch_size: int) -> Dict[str, float]:
+    """Loss and accuracy of the current heads on cached embeddings"""
+    loaded.model.eval()
+    loss_sum, correct = 0.0, 0
+    with torch.no_grad():
+        for i in range(0, len(labels), batch_size):
+            output = loaded.model.fuse(features[i:i + batch_size], clinical[i:i + batch_size])
+            target = labels[i:i + batch_size]
+            loss_sum += head_loss(loaded, output, target, weights).item() * len(target)
+            probs = torch.softmax(output[0], dim=1) if loaded.returns_logits else output
+            correct += (probs.argmax(dim=1) == target).sum().item()
+    return {"loss": loss_sum / max(len(labels), 1), "accuracy": round(100.0 * correct / max(len(labels), 1), 2)}
+
+
+def train_heads(loaded: LoadedModel, train: Tuple[torch.Tensor, ...], val: Tuple[torch.Tensor, ...],
+                epochs: int, batch_size: int, lr: float, weight_decay: float, patience: int
+                ) -> Dict[str, Any]:
+    """Fit the non-embedding parameters on cached features, keeping the best validation epoch"""
+    prefixes = embedding_modules(loaded)
+    head = {name: param for name, param in loaded.model.named_parameters() if not name.startswith(prefixes)}
+    for name, param in loaded.model.named_parameters():
+        param.requires_grad_(name in head)
+    optimizer = torch.optim.AdamW(head.values(), lr=lr, weight_decay=weight_decay)
+    scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode="min", factor=0.5,
+                                                           patience=max(1, patience // 4))
+    features, clinical, labels = train
+    weights = class_weights(labels, len(loaded.class_names))
+    generator = torch.Generator().manual_seed(HEAD_TRAIN_SEED)
+
+    best = {"epoch": 0, **evaluate(loaded, *val, weights, batch_size)}
+    best_state = {name: param.detach().clone() for name, param in head.items()}
+    best_buffers = {name: buf.clone() for name, buf in loaded.model.named_buffers() if not name.startswith(prefixes)}
+    logger.info(f"Base heads: val loss {best['loss']:.4f}, val acc {best['accuracy']}%")
+    history, stale, start = [], 0, time.perf_counter()
+    for epoch in range(1, epochs + 1):
+        # Only the heads run, so train mode leaves the frozen modules untouched
+        loaded.model.train()
+        order = torch.randperm(len(labels), generator=generator)
+        loss_sum = 0.0
+        for i in range(0, len(order), batch_size):
+            batch = order[i:i + batch_size]
+            if len(batch) < 2:
+                continue  # batch norm in the heads needs more than one sample
+            loss = head_loss(loaded, loaded.model.fuse(features[batch], clinical[batch]), labels[batch], weights)
+            optimizer.zero_grad(set_to_none=True)
+            loss.backward()
+            optimizer.step()
+            loss_sum += loss.item() * len(batch)
+        metrics = evaluate(loaded, *val, weights, batch_size)
+        scheduler.step(metrics["loss"])
+        history.append({"epoch": epoch, "train_loss": round(loss_sum / len(labels), 4),
+                        "val_loss": round(metrics["loss"], 4), "val_acc": metrics["accuracy"]})
+        if metrics["loss"] < best["loss"]:
+            best, stale = {"epoch": epoch, **metrics}, 0
+            best_state = {name: param.detach().clone() for name, param in head.items()}
+            best_buffers = {name: buf.clone() for name, buf in loaded.model.named_buffers()
+                            if not name.startswith(prefixes)}
+        else:
+            stale += 1
+        if epoch == 1 or epoch % 10 == 0:
+            logger.info(f"Epoch {epoch}/{epochs}: train loss {history[-1]['train_loss']:.4f}, "
+                        f"val loss {metrics['loss']:.4f}, val acc {metrics['accuracy']}%")
+        if stale >= patience:
+            logger.info(f"Early stopping after epoch {epoch}")
+            break
+
+    with torch.no_grad():
+        for name, param in head.items():
+            param.copy_(best_state[name])
+        for name, buf in loaded.model.named_buffers():
+            if name in best_buffers:
+                buf.copy_(best_buffers[name])
+    for param in loaded.model.parameters():
+        param.requires_grad_(True)
+    loaded.model.eval()
+    seconds = time.perf_counter() - start
+    logger.info(f"Trained heads for {len(history)} epochs in {seconds:.1f}s; best epoch {best['epoch']} "
+                f"(val acc {best['accuracy']}%)")
+    return {"best_epoch": best["epoch"], "epochs_run": len(history), "seconds": round(seconds, 1),
+            "val_loss": round(best["loss"], 4), "val_acc": best["accuracy"], "history": history}
+
+
+def main():
+    """Retrain the heads of a checkpoint on cached, frozen backbone features"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--base", default=HEAD_TRAIN_BASE_PATH, help="checkpoint whose backbone is kept")
+    parser.add_argument("--metadata", required=True, help="HAM10000_metadata.csv")
+    parser.add_argument("--images", nargs="*", default=[], help="HAM10000 image directories")
+    parser.add_argument("--image-store", action="store_true",
+                        help="read preprocessed inputs from the image store (keyed by the metadata's "
+                             "image_digest column, or by the digests of the --images files)")
+    parser.add_argument("--output", default=HEAD_TRAIN_OUTPUT_PATH, help="retrained checkpoint")
+    parser.add_argument("--feature-dir", default=HEAD_TRAIN_FEATURE_DIR, help="memory-mapped feature store")
+    parser.add_argument("--epochs", type=int, default=HEAD_TRAIN_EPOCHS)
+    parser.add_argument("--batch-size", type=int, default=HEAD_TRAIN_BATCH_SIZE, help="head training batch size")
+    parser.add_argument("--lr", type=float, default=HEAD_TRAIN_LEARNING_RATE)
+    parser.add_argument("--weight-decay", type=float, default=HEAD_TRAIN_WEIGHT_DECAY)
+    parser.add_argument("--patience", type=int, default=HEAD_TRAIN_PATIENCE)
+    parser.add_argument("--extract-batch-size", type=int, default=32, help="backbone batch size for extraction")
+    parser.add_argument("--num-workers", type=int, default=2)
+    args = parser.parse_args()
+    if not args.images and not args.image_store:
+        parser.error("--images is required unless --image-store is given")
+    logging.basicConfig(level=logging.INFO)
+    torch.manual_seed(HEAD_TRAIN_SEED)
+
+    base_checkpoint = read_checkpoint(args.base)
+    loaded = build_model(base_checkpoint, source=args.base)
+    try:
+        label_map = _label_map(loaded)
+        embedding_modules(loaded)
+    except ValueError as e:
+        parser.error(str(e))
+    if not isinstance(loaded.feature_encoder, MetadataFeatureEncoder):
+        parser.error(f"{args.base} takes {loaded.feature_encoder.feature_dim} clinical features; "
+                     f"HAM10000 only provides sex, age and localization")
+    embedding_id = loaded.embedding_id
+
+    # Embeddings are extracted once per backbone and split; clinical features are cheap to re-encode
+    rows = dict(zip(SPLITS, split_rows(read_metadata(args.metadata))))
+    id2path = find_images(args.images)
+    # Embeddings depend on the eval resize, and stored inputs had hair removal at 224x224,
+    # so both are kept apart
+    store = FeatureStore(args.feature_dir, f"{embedding_id}-{loaded.eval_resize}" + ("-stored" if args.image_store else ""))
+    data = {}
+    for split, split_rows_ in rows.items():
+        dataset = image_dataset(split_rows_, id2path, loaded.feature_encoder, args.image_store, loaded.eval_resize)
+        features = store.get(split, loaded, dataset, args.extract_batch_size, args.num_workers)
+        data[split] = (torch.from_numpy(np.ascontiguousarray(features)), dataset.features, label_map[dataset.labels])
+
+    weights = class_weights(data["train"][2], len(loaded.class_names))
+    base_test = evaluate(loaded, *data["test"], weights, args.batch_size)
+    result = train_heads(loaded, data["train"], data["val"], args.epochs, args.batch_size, args.lr,
+                         args.weight_decay, args.patience)
+    test = evaluate(loaded, *data["test"], weights, args.batch_size)
+    logger.info(f"Test accuracy: base heads {base_test['accuracy']}%, retrained heads {test['accuracy']}%")
+
+    # Same checkpoint format as the base, with the frozen backbone and the new heads
+    checkpoint = dict(base_checkpoint)
+    checkpoint.update(
+        model_state_dict=loaded.model.state_dict(),
+        eval_resize=loaded.eval_resize,
+        val_acc=result["val_acc"],
+        test_acc=test["accuracy"],
+        trained_at=datetime.utcnow().isoformat(),
+        head_training={
+            "base": os.path.basename(args.base),
+            "embedding_id": embedding_id,
+            "frozen_modules": list(loaded.model.EMBEDDING_MODULES),
+            "lr": args.lr,
+            "weight_decay": args.weight_decay,
+            "base_test_acc": base_test["accuracy"],
+            **result
+        }
+    )
+    _save_atomic(checkpoint, args.output)
+
+    # Round-trip through the loader the server uses; the backbone must be bit-identical
+    reloaded = build_model(read_checkpoint(args.output), source=args.output)
+    if reloaded.embedding_id != embedding_id:
+        raise RuntimeError(f"Backbone of {args.output} differs from {args.base}")
+    logger.info(f"Retrained checkpoint written to {args.output} (embedding {embedding_id[:12]})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+# image_store.py
+# Content-addressed lesion image store in GridFS.
+# Originals are keyed by the SHA-256 of their bytes, so a re-upload of the same file only
+# bumps its upload count instead of being stored again. Next to each original the store
+# keeps its preprocessed model input (hair removal + the serving model's eval resize to
+# 224x224, kept as uint8 before normalization, which is lossless and half the size of
+# float16), so retraining and re-inference skip decoding and hair removal. Inputs record
+# their eval_resize; those stored before it was recorded were squashed to 224x224.
+# Originals support byte-range reads.
+
+import os
+import io
+import hashlib
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+from gridfs import GridFSBucket
+from gridfs.errors import FileExists, NoFile
+from pymongo.errors import DuplicateKeyError
+
+from .database import get_database, WORKLOAD_ANALYTICS
+from .preprocessing import IMG_SIZE, DEFAULT_EVAL_RESIZE, EVAL_RESIZE_SQUASH, prepare_images, inputs_from_arrays
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Image store configuration from environment variables
+IMAGE_STORE_ENABLED = os.getenv("IMAGE_STORE_ENABLED", "true").lower() == "true"
+IMAGE_CHUNK_SIZE = int(os.getenv("IMAGE_CHUNK_SIZE", str(255 * 1024)))  # GridFS default chunk size
+
+# GridFS buckets
+IMAGE_BUCKET = "images"
+IMAGE_INPUT_BUCKET = "image_inputs"
+
+INPUT_SHAPE = (IMG_SIZE, IMG_SIZE, 3)
+
+
+def image_digest(image_bytes: bytes) -> str:
+    """Content address of an image (same digest /predict reports)"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def parse_byte_range(header: str, size: int) -> Tuple[int, int]:
+    """Inclusive (start, end) of a single-range HTTP Range header; raises ValueError if unsatisfiable"""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        raise ValueError(f"unsupported range {header}")
+    first, _, last = spec.strip().partition("-")
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start, end = max(size - int(last), 0), size - 1
+    if start > end or start >= size:
+        raise ValueError(f"unsatisfiable range {header}")
+    return start, end
+
+
+class ImageStore:
+    """Deduplicating GridFS store for original images and their preprocessed inputs"""
+
+    def __init__(self, chunk_size: int = IMAGE_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+
+    def _bucket(self, name: str, workload: Optional[str] = None) -> GridFSBucket:
+        db = get_database(workload) if workload else get_database()
+        if db is None:
+            raise Exception("Database not connected")
+        return GridFSBucket(db, bucket_name=name, chunk_size_bytes=self.chunk_size)
+
+    def _files(self, name: str = IMAGE_BUCKET, workload: Optional[str] = None):
+        db = get_database(workload) if workload else get_database()
+        if db is None:
+            raise Exception("Database not connected")
+        return db[f"{name}.files"]
+
+    def exists(self, digest: str) -> bool:
+        """Whether the original image is stored"""
+        return self._files().count_documents({"_id": digest}, limit=1) > 0
+
+    def _record_upload(self, digest: str):
+        self._files().update_one(
+            {"_id": digest},
+            {"$inc": {"metadata.uploads": 1}, "$set": {"metadata.last_uploaded": datetime.utcnow()}}
+        )
+
+    def put(self, image_bytes: bytes, digest: Optional[str] = None,
+            model_input: Optional[np.ndarray] = None, eval_resize: str = DEFAULT_EVAL_RESIZE) -> Dict[str, Any]:
+        """
+        Store an uploaded image unless its content is already stored.
+
+        model_input is the image's prepare_images output (with eval_resize) when the caller
+        already computed it; otherwise it is computed here, only for images that are new to the store.
+        """
+        digest = digest or image_digest(image_bytes)
+        if self.exists(digest):
+            self._record_upload(digest)
+            return {"digest": digest, "stored": False}
+
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            content_type = Image.MIME.get(image.format, "application/octet-stream")
+            width, height = image.size
+            if model_input is None:
+                model_input = prepare_images([image], eval_resize)[0]
+
+        # The input is written first: once the original is visible, so is its input
+        if self._files(IMAGE_INPUT_BUCKET).count_documents({"_id": digest}, limit=1) == 0:
+            try:
+                self._bucket(IMAGE_INPUT_BUCKET).upload_from_stream_with_id(
+                    digest, digest, np.ascontiguousarray(model_input, dtype=np.uint8).tobytes(),
+                    metadata={"shape": list(INPUT_SHAPE), "dtype": "uint8", "eval_resize": eval_resize}
+                )
+            except (FileExists, DuplicateKeyError):
+                pass  # written by a concurrent upload of the same content
+
+        now = datetime.utcnow()
+        try:
+            self._bucket(IMAGE_BUCKET).upload_from_stream_with_id(
+                digest, digest, image_bytes,
+                metadata={"content_type": content_type, "width": width, "height": height,
+                          "uploads": 1, "first_uploaded": now, "last_uploaded": now}
+            )
+        except (FileExists, DuplicateKeyError):
+            # A concurrent upload of the same content won the race
+            self._record_upload(digest)
+            return {"digest": digest, "stored": False}
+
+        logger.info(f"Stored image {digest} ({len(image_bytes)} bytes)")
+        return {"digest": digest, "stored": True}
+
+    def info(self, digest: str) -> Optional[Dict[str, Any]]:
+        """Size, type and upload history of a stored image"""
+        document = self._files().find_one({"_id": digest})
+        if document is None:
+            return None
+        metadata = document.get("metadata", {})
+        return {
+            "digest": digest,
+            "length": document["length"],
+            "chunk_size": document["chunkSize"],
+            "upload_date": document["uploadDate"],
+            **metadata
+        }
+
+    def read(self, digest: str, start: int = 0, length: Optional[int] = None) -> bytes:
+        """Bytes of the original image from start; GridFS only fetches the chunks in range"""
+        try:
+            with self._bucket(IMAGE_BUCKET).open_download_stream(digest) as stream:
+                stream.seek(start)
+                return stream.read(-1 if length is None else length)
+        except NoFile:
+            raise KeyError(digest)
+
+    def load_arrays(self, digests: Sequence[str], workload: Optional[str] = WORKLOAD_ANALYTICS,
+                    eval_resize: str = DEFAULT_EVAL_RESIZE) -> List[np.ndarray]:
+        """
+        Preprocessed (hair removed, resized) HWC uint8 inputs of stored images, before normalization.
+
+        An input stored with another eval_resize is recomputed from the original image.
+        """
+        bucket = self._bucket(IMAGE_INPUT_BUCKET, workload)
+        arrays: List[np.ndarray] = []
+        for digest in digests:
+            try:
+                with bucket.open_download_stream(digest) as stream:
+                    stored_resize = (stream.metadata or {}).get("eval_resize", EVAL_RESIZE_SQUASH)
+                    data = stream.read() if stored_resize == eval_resize else None
+            except NoFile:
+                raise KeyError(digest)
+            if data is None:
+                with Image.open(io.BytesIO(self.read(digest))) as image:
+                    arrays.append(prepare_images([image], eval_resize)[0])
+            else:
+                arrays.append(np.frombuffer(data, dtype=np.uint8).reshape(INPUT_SHAPE).copy())
+        return arrays
+
+    def load_inputs(self, digests: Sequence[str], workload: Optional[str] = WORKLOAD_ANALYTICS,
+                    eval_resize: str = DEFAULT_EVAL_RESIZE) -> torch.Tensor:
+        """Normalized (N, 3, 224, 224) model inputs of stored images, usually without decoding them"""
+        return inputs_from_arrays(self.load_arrays(digests, workload, eval_resize))
+
+    def stored_inputs(self, digests: Sequence[str], workload: Optional[str] = WORKLOAD_ANALYTICS,
+                      eval_resize: str = DEFAULT_EVAL_RESIZE) -> set:
+        """The subset of digests whose preprocessed input is stored with eval_resize"""
+        files = self._files(IMAGE_INPUT_BUCKET, workload)
+        # Inputs written before eval_resize was recorded were squashed
+        resize_filter = [eval_resize, None] if eval_resize == EVAL_RESIZE_SQUASH else [eval_resize]
+        stored = set()
+        for start in range(0, len(digests), 10000):
+            batch = list(digests[start:start + 10000])
+            query = {"_id": {"$in": batch}, "metadata.eval_resize": {"$in": resize_filter}}
+            stored.update(doc["_id"] for doc in files.find(query, {"_id": 1}))
+        return stored
+
+    def stats(self) -> Dict[str, Any]:
+        """Unique images, stored bytes and total uploads"""
+        totals = list(self._files(workload=WORKLOAD_ANALYTICS).aggregate([
+            {"$group": {"_id": None, "images": {"$sum": 1}, "bytes": {"$sum": "$length"},
+                        "uploads": {"$sum": "$metadata.uploads"}}}
+        ]))
+        input_bytes = list(self._files(IMAGE_INPUT_BUCKET, WORKLOAD_ANALYTICS).aggregate([
+            {"$group": {"_id": None, "bytes": {"$sum": "$length"}}}
+        ]))
+        summary = totals[0] if totals else {"images": 0, "bytes": 0, "uploads": 0}
+        return {
+            "unique_images": summary["images"],
+            "uploads": summary["uploads"],
+            "original_bytes": summary["bytes"],
+            "input_bytes": input_bytes[0]["bytes"] if input_bytes else 0
+        }
+
+
+# Global image store instance
+image_store = ImageStore()
@@ -0,0 +1,601 @@
+# inference_queue.py
+# Work queue between the API and separately scaled inference workers.
+# With INFERENCE_QUEUE_MODE=redis, /predict preprocesses the image (hair removal and resize;
+# the job carries the uint8 pixels), adds a job to a Redis stream and waits for the result
+# on its process's reply list. Inference workers (python -m app.inference_queue worker) read
+# jobs through a consumer group in batches, run each batch through the embedding cache with
+# one forward pass for the misses, push every result to its reply list and only then
+# acknowledge the jobs. Jobs held by a worker that died are claimed by the others after
+# INFERENCE_CLAIM_IDLE_MS, and jobs whose caller has already given up are dropped unprocessed.
+# INFERENCE_QUEUE_MODE=local runs the same worker loop on threads inside the API process with
+# an in-memory broker, for development without Redis.
+#
+#   python -m app.inference_queue worker --batch-size 16
+#   python -m app.inference_queue status
+
+import os
+import json
+import time
+import uuid
+import queue
+import base64
+import signal
+import socket
+import logging
+import argparse
+import itertools
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from redis.exceptions import ResponseError
+
+from .cache import get_binary_redis_client, UNAVAILABLE_ERRORS
+from .model_manager import model_manager, MODEL_NAME, MODEL_CANDIDATE_PATH, MODEL_WATCH_INTERVAL, CANDIDATE
+from .model_registry import build_untrained_model
+from .cascade import with_cascade
+from .autotune import configure_cpu, tuned_batch_size
+from .preprocessing import inputs_from_arrays
+from .embedding_cache import embedding_cache, encode_embedding
+from .explain import build_explanation
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Inference queue configuration from environment variables
+INFERENCE_QUEUE_MODE = os.getenv("INFERENCE_QUEUE_MODE", "off").lower()  # off, redis or local
+INFERENCE_STREAM = os.getenv("INFERENCE_STREAM", "inference:jobs")
+INFERENCE_GROUP = os.getenv("INFERENCE_GROUP", "inference-workers")
+# Jobs per forward pass at most; 0 uses the CPU profile's tuned batch size (16 without a profile)
+INFERENCE_BATCH_SIZE = int(os.getenv("INFERENCE_BATCH_SIZE", "0"))
+DEFAULT_BATCH_SIZE = 16
+INFERENCE_BATCH_WAIT_MS = int(os.getenv("INFERENCE_BATCH_WAIT_MS", "5"))  # wait for a batch to fill
+INFERENCE_REPLY_TIMEOUT = float(os.getenv("INFERENCE_REPLY_TIMEOUT", "30"))  # seconds /predict waits
+INFERENCE_REPLY_TTL = int(os.getenv("INFERENCE_REPLY_TTL", "60"))  # seconds an unread reply list is kept
+INFERENCE_CLAIM_IDLE_MS = int(os.getenv("INFERENCE_CLAIM_IDLE_MS", "30000"))  # reclaim jobs of dead workers, 0 disables
+INFERENCE_MAX_DELIVERIES = int(os.getenv("INFERENCE_MAX_DELIVERIES", "3"))  # then a job is failed, not retried
+INFERENCE_QUEUE_MAX_DEPTH = int(os.getenv("INFERENCE_QUEUE_MAX_DEPTH", "1000"))  # queued jobs before 503, 0 = no limit
+INFERENCE_LOCAL_WORKERS = int(os.getenv("INFERENCE_LOCAL_WORKERS", "1"))  # worker threads in local mode
+INFERENCE_FALLBACK_LOCAL = os.getenv("INFERENCE_FALLBACK_LOCAL", "true").lower() == "true"
+
+MODEL_PATH = os.getenv("MODEL_PATH", os.path.join(os.path.dirname(__file__), '../model/best_multimodal_hqcnn.pth'))
+
+# Idle wait for new jobs; kept below the Redis socket timeout
+READ_BLOCK_MS = 1000
+REPLY_POLL_SECONDS = 1
+
+
+class QueueFull(Exception):
+    """Too many queued jobs; the caller should retry later"""
+
+
+class QueueUnavailable(Exception):
+    """The queue (or a worker for the requested model version) cannot be reached"""
+
+
+def encode_job(job_id: str, version: str, image_digest: str, image: np.ndarray, features: torch.Tensor,
+               explain: bool, reply_to: str, deadline: float) -> Dict[str, bytes]:
+    """Stream entry for one prediction: JSON metadata plus the raw pixel and feature buffers"""
+    meta = {
+        "job_id": job_id,
+        "version": version,
+        "image_digest": image_digest,
+        "image_shape": list(image.shape),
+        "explain": explain,
+        "reply_to": reply_to,
+        "enqueued_at": time.time(),
+        "deadline": deadline
+    }
+    return {
+        "meta": json.dumps(meta).encode(),
+        "image": np.ascontiguousarray(image, dtype=np.uint8).tobytes(),
+        "features": features.detach().to(torch.float32).contiguous().numpy().tobytes()
+    }
+
+
+def decode_job(fields: Dict[Any, bytes]) -> Dict[str, Any]:
+    """Inverse of encode_job; Redis returns the field names as bytes"""
+    fields = {key.decode() if isinstance(key, bytes) else key: value for key, value in fields.items()}
+    job = json.loads(fields["meta"])
+    job["image"] = np.frombuffer(fields["image"], dtype=np.uint8).reshape(job["image_shape"]).copy()
+    job["features"] = torch.from_numpy(np.frombuffer(fields["features"], dtype=np.float32).copy()).unsqueeze(0)
+    return job
+
+
+class RedisStreamBroker:
+    """Jobs in a Redis stream read through a consumer group; replies in per-process lists"""
+
+    def __init__(self, stream: str = INFERENCE_STREAM, group: str = INFERENCE_GROUP):
+        self.stream = stream
+        self.group = group
+
+    def _client(self):
+        client = get_binary_redis_client()
+        if client is None:
+            raise QueueUnavailable("Redis circuit is open")
+        return client
+
+    def ensure_group(self):
+        """Create the stream and consumer group unless they exist"""
+        try:
+            self._client().xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def submit(self, fields: Dict[str, bytes], max_depth: int = INFERENCE_QUEUE_MAX_DEPTH):
+        client = self._client()
+        try:
+            if max_depth and client.xlen(self.stream) >= max_depth:
+                raise QueueFull(f"{max_depth} jobs queued")
+            client.xadd(self.stream, fields)
+        except UNAVAILABLE_ERRORS as e:
+            raise QueueUnavailable(str(e))
+
+    def read(self, consumer: str, count: int, block_ms: int) -> List[Tuple[Any, Dict]]:
+        """New jobs for this consumer; waits up to block_ms when there are none"""
+        client = self._client()
+        try:
+            response = client.xreadgroup(self.group, consumer, {self.stream: ">"},
+                                         count=count, block=max(1, block_ms))
+        except ResponseError as e:
+            # Stream or group gone, e.g. after a Redis restart without persistence
+            if "NOGROUP" not in str(e):
+                raise
+            self.ensure_group()
+            return []
+        return [(message_id, fields) for _, entries in response or [] for message_id, fields in entries]
+
+    def claim(self, consumer: str, count: int, min_idle_ms: int) -> List[Tuple[Any, Dict, int]]:
+        """Jobs other consumers took but did not acknowledge within min_idle_ms, with delivery counts"""
+        client = self._client()
+        try:
+            response = client.xautoclaim(self.stream, self.group, consumer, min_idle_ms, start_id="0-0", count=count)
+        except ResponseError as e:
+            if "NOGROUP" not in str(e):
+                raise
+            return []
+        claimed = []
+        for message_id, fields in response[1]:
+            if not fields:
+                continue
+            pending = client.xpending_range(self.stream, self.group, min=message_id, max=message_id, count=1)
+            claimed.append((message_id, fields, pending[0]["times_delivered"] if pending else 1))
+        return claimed
+
+    def ack(self, message_ids: List[Any]):
+        if not message_ids:
+            return
+        # Acknowledged jobs are deleted as well, so the stream length is the backlog
+        pipeline = self._client().pipeline(transaction=False)
+        pipeline.xack(self.stream, self.group, *message_ids)
+        pipeline.xdel(self.stream, *message_ids)
+        pipeline.execute()
+
+    def reply(self, reply_to: str, payload: bytes, ttl: int = INFERENCE_REPLY_TTL):
+        pipeline = self._client().pipeline(transaction=False)
+        pipeline.rpush(reply_to, payload)
+        # Lists of API processes that are gone expire
+        pipeline.expire(reply_to, ttl)
+        pipeline.execute()
+
+    def pop_reply(self, reply_to: str, timeout: float) -> Optional[bytes]:
+        try:
+            response = self._client().blpop([reply_to], timeout=timeout)
+        except UNAVAILABLE_ERRORS as e:
+            raise QueueUnavailable(str(e))
+        return response[1] if response else None
+
+    def depth(self) -> int:
+        return self._client().xlen(self.stream)
+
+    def status(self) -> Dict[str, Any]:
+        client = self._client()
+        status = {"broker": "redis", "stream": self.stream, "group": self.group, "depth": client.xlen(self.stream)}
+        try:
+            status["pending"] = client.xpending(self.stream, self.group)["pending"]
+            status["consumers"] = len(client.xinfo_consumers(self.stream, self.group))
+        except ResponseError:
+            status["pending"], status["consumers"] = 0, 0
+        return status
+
+
+class LocalBroker:
+    """In-process stand-in for RedisStreamBroker (single API process, nothing survives a restart)"""
+
+    def __init__(self):
+        self._jobs: "queue.Queue[Tuple[str, Dict]]" = queue.Queue()
+        self._replies: Dict[str, queue.Queue] = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def ensure_group(self):
+        pass
+
+    def submit(self, fields: Dict[str, bytes], max_depth: int = INFERENCE_QUEUE_MAX_DEPTH):
+        if max_depth and self._jobs.qsize() >= max_depth:
+            raise QueueFull(f"{max_depth} jobs queued")
+        self._jobs.put((f"{next(self._ids)}-0", fields))
+
+    def read(self, consumer: str, count: int, block_ms: int) -> List[Tuple[Any, Dict]]:
+        try:
+            messages = [self._jobs.get(timeout=max(1, block_ms) / 1000)]
+        except queue.Empty:
+            return []
+        while len(messages) < count:
+            try:
+                messages.append(self._jobs.get_nowait())
+            except queue.Empty:
+                break
+        return messages
+
+    def claim(self, consumer: str, count: int, min_idle_ms: int) -> List[Tuple[Any, Dict, int]]:
+        return []
+
+    def ack(self, message_ids: List[Any]):
+        pass
+
+    def _reply_queue(self, reply_to: str) -> queue.Queue:
+        with self._lock:
+            return self._replies.setdefault(reply_to, queue.Queue())
+
+    def reply(self, reply_to: str, payload: bytes, ttl: int = INFERENCE_REPLY_TTL):
+        self._reply_queue(reply_to).put(payload)
+
+    def pop_reply(self, reply_to: str, timeout: float) -> Optional[bytes]:
+        try:
+            return self._reply_queue(reply_to).get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def depth(self) -> int:
+        return self._jobs.qsize()
+
+    def status(self) -> Dict[str, Any]:
+        return {"broker": "local", "depth": self._jobs.qsize()}
+
+
+def build_broker(mode: str = INFERENCE_QUEUE_MODE):
+    """Broker for the configured mode, or None when the queue is off"""
+    if mode == "redis":
+        return RedisStreamBroker()
+    if mode == "local":
+        return LocalBroker()
+    if mode != "off":
+        raise ValueError(f"Unknown INFERENCE_QUEUE_MODE '{mode}'")
+    return None
+
+
+class InferenceWorker:
+    """Consumes prediction jobs in batches and replies with the results"""
+
+    def __init__(self, broker, manager=model_manager, name: str = MODEL_NAME, consumer: Optional[str] = None,
+                 batch_size: int = INFERENCE_BATCH_SIZE, batch_wait_ms: int = INFERENCE_BATCH_WAIT_MS,
+                 claim_idle_ms: int = INFERENCE_CLAIM_IDLE_MS):
+        self.broker = broker
+        self.manager = manager
+        self.name = name
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.batch_size = batch_size or tuned_batch_size() or DEFAULT_BATCH_SIZE
+        self.batch_wait_ms = batch_wait_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.batches = 0
+        self.jobs = 0
+        self.expired = 0
+        self.failed = 0
+        self.claimed = 0
+
+    def _read_batch(self) -> List[Tuple[Any, Dict]]:
+        """Block for the first job, then give the batch INFERENCE_BATCH_WAIT_MS to fill"""
+        messages = self.broker.read(self.consumer, self.batch_size, READ_BLOCK_MS)
+        deadline = time.monotonic() + self.batch_wait_ms / 1000
+        while messages and len(messages) < self.batch_size:
+            remaining_ms = int((deadline - time.monotonic()) * 1000)
+            if remaining_ms <= 0:
+                break
+            more = self.broker.read(self.consumer, self.batch_size - len(messages), remaining_ms)
+            if not more:
+                break
+            messages.extend(more)
+        return messages
+
+    def _reclaim(self) -> List[Tuple[Any, Dict]]:
+        """Take over jobs of dead workers; a job that keeps killing its worker is failed instead"""
+        messages = []
+        for message_id, fields, deliveries in self.broker.claim(self.consumer, self.batch_size, self.claim_idle_ms):
+            if deliveries <= INFERENCE_MAX_DELIVERIES:
+                messages.append((message_id, fields))
+                continue
+            self.failed += 1
+            try:
+                job = decode_job(fields)
+                self._send(job, {"job_id": job["job_id"], "error": f"Job failed after {deliveries - 1} deliveries"})
+            except Exception as e:
+                logger.error(f"Could not fail job {message_id}: {e}")
+            self.broker.ack([message_id])
+        self.claimed += len(messages)
+        return messages
+
+    def _send(self, job: Dict[str, Any], reply: Dict[str, Any]):
+        self.broker.reply(job["reply_to"], json.dumps(reply).encode())
+
+    def _predict(self, served, jobs: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Results for jobs of one model version: plain jobs as one batch, explanations one by one"""
+        loaded = served.loaded
+        start = time.perf_counter()
+        outputs = {}
+        plain = [job for job in jobs if not job["explain"]]
+        if plain:
+            with torch.no_grad():
+                probabilities = loaded.predict_cached_batch(
+                    [job["image_digest"] for job in plain],
+                    lambda positions: inputs_from_arrays([plain[position]["image"] for position in positions]),
+                    torch.cat([job["features"] for job in plain]), embedding_cache
+                )
+            for job, row in zip(plain, probabilities):
+                outputs[job["job_id"]] = (row.tolist(), None)
+
+        layer = getattr(loaded.index_model.model, "GRADCAM_LAYER", None)
+        for job in jobs:
+            if not job["explain"]:
+                continue
+            with torch.no_grad():
+                prediction, cam = loaded.predict_explained(
+                    job["image_digest"], lambda: inputs_from_arrays([job["image"]]), job["features"], embedding_cache
+                )
+            outputs[job["job_id"]] = (prediction.squeeze(0).tolist(), cam)
+
+        latency = (time.perf_counter() - start) / len(jobs)
+        index_model = loaded.index_model
+        replies = {}
+        for job in jobs:
+            probabilities, cam = outputs[job["job_id"]]
+            predicted_class = loaded.class_names[probabilities.index(max(probabilities))]
+            served.record(latency, predicted_class)
+            # The API stores the case with this embedding for similar-case retrieval
+            embedding = embedding_cache.peek(index_model.embedding_id, job["image_digest"])
+            replies[job["job_id"]] = {
+                "job_id": job["job_id"],
+                "version": served.version,
+                "probabilities": probabilities,
+                "embedding_id": index_model.embedding_id,
+                "embedding": base64.b64encode(encode_embedding(embedding)).decode() if embedding is not None else None,
+                "explanation": build_explanation(cam, predicted_class, layer) if cam is not None else None,
+                "worker": self.consumer,
+                "batch_size": len(jobs),
+                "queued_ms": round((time.time() - job["enqueued_at"]) * 1000, 2)
+            }
+        return replies
+
+    def process(self, messages: List[Tuple[Any, Dict]]):
+        """Run one batch, reply to every job and acknowledge them"""
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        now = time.time()
+        for message_id, fields in messages:
+            try:
+                job = decode_job(fields)
+            except Exception as e:
+                logger.error(f"Dropping malformed job {message_id}: {e}")
+                self.failed += 1
+                continue
+            # Nobody is waiting for the result any more
+            if job["deadline"] < now:
+                self.expired += 1
+                continue
+            groups.setdefault(job["version"], []).append(job)
+
+        for version, jobs in groups.items():
+            served = self.manager.get(self.name, version)
+            try:
+                if served is None:
+                    raise QueueUnavailable(f"Model version {version} is not loaded on worker {self.consumer}")
+                replies = self._predict(served, jobs)
+            except Exception as e:
+                logger.error(f"Inference batch of {len(jobs)} jobs failed: {e}")
+                self.failed += len(jobs)
+                replies = {job["job_id"]: {"job_id": job["job_id"], "error": str(e),
+                                           "unavailable": isinstance(e, QueueUnavailable)} for job in jobs}
+            for job in jobs:
+                self._send(job, replies[job["job_id"]])
+            self.jobs += len(jobs)
+
+        # Acknowledged only after replying: a worker that dies mid-batch leaves its jobs to be claimed
+        self.broker.ack([message_id for message_id, _ in messages])
+        self.batches += 1
+
+    def run(self, stop: Optional[threading.Event] = None):
+        """Consume jobs until stop is set"""
+        self.broker.ensure_group()
+        last_claim = time.monotonic()
+        while stop is None or not stop.is_set():
+            try:
+                messages = []
+                if self.claim_idle_ms > 0 and time.monotonic() - last_claim >= self.claim_idle_ms / 1000:
+                    last_claim = time.monotonic()
+                    messages = self._reclaim()
+                if not messages:
+                    messages = self._read_batch()
+                if messages:
+                    self.process(messages)
+            except (QueueUnavailable,) + UNAVAILABLE_ERRORS as e:
+                logger.warning(f"Inference queue unavailable: {e}")
+                time.sleep(REPLY_POLL_SECONDS)
+            except Exception as e:
+                logger.error(f"Inference worker error: {e}")
+                time.sleep(REPLY_POLL_SECONDS)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "consumer": self.consumer,
+            "batches": self.batches,
+            "jobs": self.jobs,
+            "mean_batch_size": round(self.jobs / self.batches, 2) if self.batches else None,
+            "expired": self.expired,
+            "failed": self.failed,
+            "claimed": self.claimed
+        }
+
+
+class _Waiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.reply: Optional[Dict[str, Any]] = None
+
+
+class InferenceQueue:
+    """API side: submits jobs and hands replies to the requests waiting for them"""
+
+    def __init__(self, mode: str = INFERENCE_QUEUE_MODE):
+        self.mode = mode
+        self.broker = build_broker(mode)
+        # One reply list per API process, read by a single listener thread
+        self.reply_to = f"inference:reply:{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.workers: List[InferenceWorker] = []
+        self._waiters: Dict[str, _Waiter] = {}
+        self._lock = threading.Lock()
+        self._listener: Optional[threading.Thread] = None
+        self.submitted = 0
+        self.completed = 0
+        self.timed_out = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.broker is not None
+
+    def start_local_workers(self, manager=model_manager, count: int = INFERENCE_LOCAL_WORKERS):
+        """Worker threads inside this process (local mode)"""
+        for index in range(count):
+            worker = InferenceWorker(self.broker, manager, consumer=f"local-{index}")
+            threading.Thread(target=worker.run, name=f"inference-worker-{index}", daemon=True).start()
+            self.workers.append(worker)
+
+    def _listen(self):
+        while True:
+            try:
+                payload = self.broker.pop_reply(self.reply_to, REPLY_POLL_SECONDS)
+            except Exception as e:
+                logger.warning(f"Inference reply listener: {e}")
+                time.sleep(REPLY_POLL_SECONDS)
+                continue
+            if payload is None:
+                continue
+            reply = json.loads(payload)
+            with self._lock:
+                waiter = self._waiters.pop(reply.get("job_id"), None)
+            # Late replies (the request already timed out) are dropped
+            if waiter is not None:
+                waiter.reply = reply
+                waiter.event.set()
+
+    def _ensure_listener(self):
+        if self._listener is None:
+            with self._lock:
+                if self._listener is None:
+                    self._listener = threading.Thread(target=self._listen, name="inference-replies", daemon=True)
+                    self._listener.start()
+
+    def infer(self, version: str, image_digest: str, image: np.ndarray, features: torch.Tensor,
+              explain: bool = False, timeout: float = INFERENCE_REPLY_TIMEOUT) -> Dict[str, Any]:
+        """Queue one prediction and wait for a worker's reply"""
+        self._ensure_listener()
+        job_id = uuid.uuid4().hex
+        waiter = _Waiter()
+        with self._lock:
+            self._waiters[job_id] = waiter
+        try:
+            try:
+                self.broker.submit(encode_job(job_id, version, image_digest, image, features, explain,
+                                              self.reply_to, time.time() + timeout))
+            except QueueFull:
+                self.rejected += 1
+                raise
+            self.submitted += 1
+            if not waiter.event.wait(timeout):
+                self.timed_out += 1
+                raise TimeoutError(f"No inference result within {timeout:.0f}s")
+        finally:
+            with self._lock:
+                self._waiters.pop(job_id, None)
+
+        self.completed += 1
+        reply = waiter.reply
+        if reply.get("error"):
+            if reply.get("unavailable"):
+                raise QueueUnavailable(reply["error"])
+            raise RuntimeError(reply["error"])
+        return reply
+
+    def status(self) -> Dict[str, Any]:
+        status = {
+            "mode": self.mode,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "timed_out": self.timed_out,
+            "rejected": self.rejected,
+            "waiting": len(self._waiters)
+        }
+        if self.broker is not None:
+            try:
+                status.update(self.broker.status())
+            except Exception as e:
+                status["error"] = str(e)
+        if self.workers:
+            status["workers"] = [worker.stats() for worker in self.workers]
+        return status
+
+
+# Global inference queue instance
+inference_queue = InferenceQueue()
+
+
+def load_worker_models():
+    """Load the same primary (and candidate) versions the API serves"""
+    if os.path.exists(MODEL_PATH):
+        model_manager.load(MODEL_NAME, MODEL_PATH)
+    else:
+        # Random weights differ between processes, so results will not match the API's own fallback
+        logger.warning(f"Model file not found at {MODEL_PATH} - worker serves randomly initialized weights")
+        model_manager.install(MODEL_NAME, "untrained", with_cascade(build_untrained_model()))
+    if MODEL_CANDIDATE_PATH:
+        model_manager.load(MODEL_NAME, MODEL_CANDIDATE_PATH, role=CANDIDATE)
+    if MODEL_WATCH_INTERVAL > 0:
+        model_manager.watch(MODEL_NAME, MODEL_PATH)
+
+
+def main():
+    """Run an inference worker against the Redis stream, or show the queue status"""
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    worker_parser = commands.add_parser("worker", help="Consume /predict jobs")
+    worker_parser.add_argument("--consumer", help="Consumer name, unique per worker (default: host-pid)")
+    worker_parser.add_argument("--batch-size", type=int, default=INFERENCE_BATCH_SIZE)
+    worker_parser.add_argument("--batch-wait-ms", type=int, default=INFERENCE_BATCH_WAIT_MS)
+    commands.add_parser("status", help="Stream depth, pending jobs and consumers")
+    args = parser.parse_args()
+
+    broker = RedisStreamBroker()
+    if args.command == "status":
+        print(json.dumps(broker.status()))
+        return
+
+    configure_cpu(MODEL_PATH)
+    load_worker_models()
+
+    worker = InferenceWorker(broker, consumer=args.consumer, batch_size=args.batch_size,
+                             batch_wait_ms=args.batch_wait_ms)
+    stop = threading.Event()
+    # Finish the current batch on SIGTERM; unacknowledged jobs would otherwise wait to be claimed
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    logger.info(f"Inference worker {worker.consumer} consuming {broker.stream} as group {broker.group} "
+                f"in batches of up to {worker.batch_size}")
+    worker.run(stop)
+    logger.info(f"Inference worker {worker.consumer} stopped: {json.dumps(worker.stats())}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,16 +4,33 @@ import io
 import base64
 import hashlib
 import json
-from fastapi import FastAPI, HTTPException, Depends
+import time
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import List, Optional
 from PIL import Image
 import torch
-import torch.nn as nn
-import torchvision.transforms as transforms
-import torchvision.models as models
 from dotenv import load_dotenv
 
+from .model_registry import load_model_from_checkpoint, build_untrained_model, feature_names
+from .model_manager import (
+    model_manager, checkpoint_version, MODEL_NAME, MODEL_CANDIDATE_PATH,
+    MODEL_CANDIDATE_TRAFFIC, MODEL_WATCH_INTERVAL, PRIMARY, CANDIDATE
+)
+from .preprocessing import prepare_images, inputs_from_arrays, upload_capabilities, check_upload
+from .cascade import with_cascade
+from .embedding_cache import embedding_cache, encode_embedding
+from .autotune import configure_cpu
+from .singleflight import prediction_flights
+from .vector_index import vector_index, start_sync, VECTOR_INDEX_SYNC_INTERVAL
+from .explain import build_explanation
+from .circuit import health_prober
+from .traffic import TrafficRecorder, TrafficCaptureMiddleware, TRAFFIC_CAPTURE_DIR
+from .shared_weights import shared_weights
+from .drift import drift_monitor
+from .inference_queue import inference_queue, QueueFull, QueueUnavailable, INFERENCE_FALLBACK_LOCAL
+
 # Load environment variables
 load_dotenv()
 
@@ -29,122 +46,80 @@ except ImportError:
     def verify_signature(msg, sig, pk): return True
 
 try:
-    from .database import insert_health_record, health_check as db_health_check
+    from .database import insert_prediction, health_check as db_health_check, WORKLOAD_PRIMARY
+    # Patient and record access goes through the cache layer
+    from .patient_store import (
+        insert_health_record, get_patient, upsert_patient, get_health_records, start_session, warm_patients
+    )
+    from .image_store import image_store, parse_byte_range, IMAGE_STORE_ENABLED
     DB_AVAILABLE = True
 except ImportError:
     print("Database module not available - will use fallback")
     DB_AVAILABLE = False
     def insert_health_record(record): return {"success": True, "message": "Database not available"}
+    def insert_prediction(prediction_data): return {"success": True, "message": "Database not available"}
     def db_health_check(): return False
+    IMAGE_STORE_ENABLED = False
 
 try:
-    from .cache import cache_prediction, get_cached_prediction, redis_client, cache_health_check
+    from .cache import (
+        cache_prediction, get_cached_prediction, cache_explanation, get_cached_explanation,
+        cache_health_check
+    )
     CACHE_AVAILABLE = True
 except ImportError:
     print("Cache module not available - will use fallback")
     CACHE_AVAILABLE = False
     def cache_prediction(key, data, ttl=None): return True
     def get_cached_prediction(key): return None
+    def cache_explanation(key, data, ttl=None): return True
+    def get_cached_explanation(key): return None
     def cache_health_check(): return False
 
-MODEL_PATH = os.path.join(os.path.dirname(__file__), '../model/best_multimodal_hqcnn.pth')
-
-# Complete Multimodal HQCNN Model Architecture
-class MultimodalHQCNN(nn.Module):
-    def __init__(self, num_clinical_features=10, num_classes=3):
-        super(MultimodalHQCNN, self).__init__()
-        
-        # Image feature extractor (CNN backbone)
-        self.backbone = models.resnet50(weights=None)
-        self.backbone.fc = nn.Identity()  # Remove final classification layer
-        
-        # Image feature processor
-        self.image_processor = nn.Sequential(
-            nn.Linear(2048, 512),
-            nn.ReLU(),
-            nn.Dropout(0.3),
-            nn.Linear(512, 256),
-            nn.ReLU(),
-            nn.Dropout(0.2)
-        )
-        
-        # Clinical data processor
-        self.clinical_processor = nn.Sequential(
-            nn.Linear(num_clinical_features, 128),
-            nn.ReLU(),
-            nn.Dropout(0.2),
-            nn.Linear(128, 64),
-            nn.ReLU(),
-            nn.Dropout(0.1)
-        )
-        
-        # Fusion layer
-        self.fusion = nn.Sequential(
-            nn.Linear(256 + 64, 128),  # Image features + Clinical features
-            nn.ReLU(),
-            nn.Dropout(0.3),
-            nn.Linear(128, 64),
-            nn.ReLU(),
-            nn.Dropout(0.2)
-        )
-        
-        # Final classifier
-        self.classifier = nn.Sequential(
-            nn.Linear(64, 32),
-            nn.ReLU(),
-            nn.Dropout(0.1),
-            nn.Linear(32, num_classes),
-            nn.Softmax(dim=1)
-        )
-        
-    def forward(self, image_tensor, clinical_tensor):
-        # Process image
-        image_features = self.backbone(image_tensor)
-        image_features = self.image_processor(image_features)
-        
-        # Process clinical data
-        clinical_features = self.clinical_processor(clinical_tensor)
-        
-        # Fuse features
-        fused_features = torch.cat([image_features, clinical_features], dim=1)
-        fused_features = self.fusion(fused_features)
-        
-        # Final prediction
-        output = self.classifier(fused_features)
-        return output
+MODEL_PATH = os.getenv("MODEL_PATH", os.path.join(os.path.dirname(__file__), '../model/best_multimodal_hqcnn.pth'))
+MODEL_DIR = os.path.dirname(MODEL_PATH)
 
 def load_model():
-    try:
-        model = MultimodalHQCNN(num_clinical_features=10, num_classes=3)
-        if os.path.exists(MODEL_PATH):
-            # Suppress sklearn version warnings when loading checkpoint
-            import warnings
-            with warnings.catch_warnings():
-                warnings.filterwarnings("ignore", category=UserWarning, module="sklearn")
-                # Load checkpoint (which contains model_state_dict and other metadata)
-                checkpoint = torch.load(MODEL_PATH, map_location=torch.device('cpu'), weights_only=False)
-            
-            # Extract model state dict from checkpoint
-            if 'model_state_dict' in checkpoint:
-                model_state_dict = checkpoint['model_state_dict']
-            else:
-                # Fallback: assume the file contains only the state_dict
-                model_state_dict = checkpoint
-            
-            # Load the state dict with strict=False to ignore missing keys
-            model.load_state_dict(model_state_dict, strict=False)
-            print(f"Model loaded successfully from {MODEL_PATH}")
-        else:
-            print(f"Warning: Model file not found at {MODEL_PATH}. Using randomly initialized weights.")
-        model.eval()
-        return model
-    except Exception as e:
-        print(f"Error loading model: {e}")
-        # Return a dummy model if loading fails
-        return MultimodalHQCNN(num_clinical_features=10, num_classes=3)
+    """Load the trained model from MODEL_PATH, rebuilding the architecture it was trained with"""
+    if not os.path.exists(MODEL_PATH):
+        print(f"Warning: Model file not found at {MODEL_PATH}. Using randomly initialized weights.")
+        return with_cascade(build_untrained_model())
+
+    # A checkpoint that does not match its architecture raises ModelLoadError here
+    loaded = load_model_from_checkpoint(MODEL_PATH)
+    print(f"Model loaded successfully from {MODEL_PATH} ({loaded.architecture})")
+    # Optionally answer confident cases with the lightweight stage-one model
+    return with_cascade(loaded)
+
+# Apply (or with AUTOTUNE_MODE=tune, first create) the CPU execution profile for this machine
+cpu_profile = configure_cpu(MODEL_PATH)
+
+# Global model versions: primary from MODEL_PATH, optional candidate for A/B traffic
+model_manager.install(
+    MODEL_NAME,
+    checkpoint_version(MODEL_PATH) if os.path.exists(MODEL_PATH) else "untrained",
+    load_model()
+)
+if MODEL_CANDIDATE_PATH:
+    model_manager.load_async(MODEL_NAME, MODEL_CANDIDATE_PATH, role=CANDIDATE,
+                             traffic_percent=MODEL_CANDIDATE_TRAFFIC)
+if MODEL_WATCH_INTERVAL > 0:
+    model_manager.watch(MODEL_NAME, MODEL_PATH)
+
+# With INFERENCE_QUEUE_MODE=local, queued predictions run on worker threads of this process
+if inference_queue.mode == "local":
+    inference_queue.start_local_workers(model_manager)
 
-# Global model instance
-model = load_model()
+# Similar-case index, kept in sync with the embeddings stored alongside predictions
+vector_index.load()
+if DB_AVAILABLE and VECTOR_INDEX_SYNC_INTERVAL > 0:
+    start_sync(vector_index, lambda: model_manager.primary().loaded.index_model.embedding_id)
+
+# Merge the drift statistics of all workers through Redis and keep their gauges current
+drift_monitor.start(lambda: [served.version for served in (model_manager.primary(),) if served is not None])
+
+# Probe Redis and Mongo in the background; /health and the circuit breakers use the results
+health_prober.start()
 
 # FastAPI app initialization
 app = FastAPI(
@@ -171,6 +146,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in, de-identified capture of /predict and /upload_record traffic for replay (app.traffic)
+traffic_recorder = TrafficRecorder(TRAFFIC_CAPTURE_DIR) if TRAFFIC_CAPTURE_DIR else None
+if traffic_recorder is not None:
+    app.add_middleware(TrafficCaptureMiddleware, recorder=traffic_recorder)
+
 # --- Request/Response Schemas ---
 class ClinicalData(BaseModel):
     age: float
@@ -183,16 +163,24 @@ class ClinicalData(BaseModel):
     smoking: int  # 0: No, 1: Yes
     family_history: int  # 0: No, 1: Yes
     symptoms_severity: float
+    localization: Optional[str] = None  # Lesion site, used by the hybrid QCNN model
 
 class PredictRequest(BaseModel):
     clinical_data: ClinicalData
     image_base64: str
+    explain: bool = False  # Also return a Grad-CAM heatmap for the predicted class
+    image_max_side: Optional[int] = None  # upload.max_side from /capabilities the image was downscaled to
 
 class PredictResponse(BaseModel):
+    model_config = {"protected_namespaces": ()}
+
     prediction: dict
     confidence: float
     encrypted_prediction: str
     cache_hit: bool
+    model_version: Optional[str] = None
+    image_digest: Optional[str] = None  # Pass to /similar_cases to retrieve similar lesions
+    explanation: Optional[dict] = None  # Grad-CAM heatmap, only when requested
 
 class UploadRecordRequest(BaseModel):
     patient_id: str
@@ -200,6 +188,26 @@ class UploadRecordRequest(BaseModel):
     signature: str
     public_key: str
 
+class ModelLoadRequest(BaseModel):
+    name: str = MODEL_NAME
+    checkpoint: str  # File name inside the model directory
+    version: Optional[str] = None
+    role: str = CANDIDATE
+    traffic_percent: Optional[float] = None
+
+class ModelTrafficRequest(BaseModel):
+    name: str = MODEL_NAME
+    traffic_percent: float
+
+class SimilarCasesRequest(BaseModel):
+    image_digest: str
+    k: int = 5
+    filters: Optional[dict] = None  # e.g. {"predicted_class": "Malignant", "localization": ["back", "trunk"]}
+
+class SessionRequest(BaseModel):
+    user_id: str
+    patient_ids: List[str] = []  # patients the session is expected to open
+
 class HealthResponse(BaseModel):
     model_config = {"protected_namespaces": ()}
     
@@ -207,107 +215,215 @@ class HealthResponse(BaseModel):
     model_loaded: bool
     database_connected: bool
     cache_connected: bool
+    dependencies: Optional[dict] = None  # Cached probe results and circuit breaker states
 
 @app.post("/predict", response_model=PredictResponse)
-def predict(request: PredictRequest):
+def predict(request: PredictRequest, background_tasks: BackgroundTasks):
     try:
-        # Preprocess image
+        # Pick the model version (primary or A/B candidate) for this request
+        served = model_manager.route()
+        model = served.loaded
+
+        # Decode image; preprocessing is deferred until an embedding actually has to be computed
         try:
             image_bytes = base64.b64decode(request.image_base64)
-            image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-            transform = transforms.Compose([
-                transforms.Resize((224, 224)),
-                transforms.ToTensor(),
-                transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-            ])
-            image_tensor = transform(image).unsqueeze(0)
+            image = Image.open(io.BytesIO(image_bytes))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid image data: {str(e)}")
+        # Size and format are checked from the header, before the pixels are decoded
+        try:
+            check_upload(image, request.image_max_side)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"Image does not match the negotiated upload: {e}")
+        try:
+            image = image.convert('RGB')
+            image_digest = hashlib.sha256(image_bytes).hexdigest()
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Invalid image data: {str(e)}")
 
-        # Preprocess clinical data
+        # Keep the upload for audit and retraining (deduplicated by digest) after responding
+        prepared = []
+        if DB_AVAILABLE and IMAGE_STORE_ENABLED:
+            background_tasks.add_task(store_image, image_bytes, image_digest, prepared, model.eval_resize)
+
+        def prepare():
+            """Hair removal and the model's eval resize, at most once; the result is kept for the image store"""
+            if not prepared:
+                prepared.extend(prepare_images([image], model.eval_resize))
+            return prepared
+
+        def load_image():
+            """Model input on an embedding miss"""
+            return inputs_from_arrays(prepare())
+
+        # Preprocess clinical data into the loaded model's feature layout
         try:
-            clinical_values = [
-                request.clinical_data.age / 100.0,  # Normalize age
-                request.clinical_data.gender,
-                request.clinical_data.bmi / 50.0,  # Normalize BMI
-                request.clinical_data.blood_pressure_systolic / 200.0,
-                request.clinical_data.blood_pressure_diastolic / 120.0,
-                request.clinical_data.cholesterol / 300.0,
-                request.clinical_data.glucose / 200.0,
-                request.clinical_data.smoking,
-                request.clinical_data.family_history,
-                request.clinical_data.symptoms_severity / 10.0
-            ]
-            clinical_tensor = torch.tensor(clinical_values, dtype=torch.float32).unsqueeze(0)
+            clinical_tensor = model.encode_features(request.clinical_data.model_dump())
+            clinical_values = clinical_tensor.squeeze(0).tolist()
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Invalid clinical data: {str(e)}")
 
-        # Create cache key
-        data_hash = hashlib.md5(
-            (str(clinical_values) + request.image_base64[:100]).encode()
+        # Create cache key from the full image digest and the encoded clinical features
+        data_hash = hashlib.sha256(
+            (json.dumps(clinical_values) + image_digest).encode()
         ).hexdigest()
-        cache_key = f"predict:{data_hash}"
+        cache_key = f"predict:{served.version}:{data_hash}"
+
+        # The heatmap comes from the model serving the final prediction
+        explain_layer = getattr(model.index_model.model, "GRADCAM_LAYER", None)
+        if request.explain and explain_layer is None:
+            raise HTTPException(status_code=400, detail=f"Explanations are not supported by {model.architecture}")
+
+        def lookup():
+            """Cached result; in explain mode only when the explanation is cached as well"""
+            cached = get_cached_prediction(cache_key)
+            if cached and request.explain:
+                explanation = get_cached_explanation(cache_key)
+                cached = {**cached, "explanation": explanation} if explanation else None
+            return cached
         
+        def record_drift(data: dict):
+            """Drift statistics count every served prediction, cached or computed"""
+            prediction = data['prediction']
+            drift_monitor.record(served.version, prediction['predicted_class'], data['confidence'],
+                                 prediction['risk_level'], clinical_values, class_names=model.class_names,
+                                 feature_names=feature_names(model.feature_encoder))
+
         # Check cache
         if CACHE_AVAILABLE:
-            cached = get_cached_prediction(cache_key)
+            cached = lookup()
             if cached:
+                record_drift(cached)
                 return PredictResponse(
                     prediction=cached['prediction'],
                     confidence=cached['confidence'],
                     encrypted_prediction=cached['encrypted_prediction'],
-                    cache_hit=True
+                    cache_hit=True,
+                    model_version=served.version,
+                    image_digest=image_digest,
+                    explanation=cached.get('explanation')
                 )
         else:
             print("Cache not available, skipping cache check")
 
-        # Inference
-        with torch.no_grad():
-            prediction_tensor = model(image_tensor, clinical_tensor)
-            probabilities = prediction_tensor.squeeze().tolist()
+        def infer_queued():
+            """Result from an inference worker, or None to infer in this process instead"""
+            try:
+                return inference_queue.infer(served.version, image_digest, prepare()[0], clinical_tensor, request.explain)
+            except QueueFull as e:
+                raise HTTPException(status_code=503, detail=f"Inference queue full: {e}", headers={"Retry-After": "1"})
+            except TimeoutError as e:
+                raise HTTPException(status_code=504, detail=str(e))
+            except QueueUnavailable as e:
+                if not INFERENCE_FALLBACK_LOCAL:
+                    raise HTTPException(status_code=503, detail=f"Inference queue unavailable: {e}")
+                print(f"Inference queue unavailable, predicting in the API process: {e}")
+                return None
+
+        def run_inference():
+            # Inference
+            inference_start = time.perf_counter()
+            # Preprocessed pixels go to the inference workers when the queue is enabled
+            reply = infer_queued() if inference_queue.enabled else None
+            if reply is not None:
+                probabilities = reply["probabilities"]
+            else:
+                with torch.no_grad():
+                    # Same hair removal as training, then resize and normalize - only on an embedding miss
+                    if request.explain:
+                        # Grad-CAM is computed from the activations of this same forward pass
+                        prediction_tensor, cam = model.predict_explained(
+                            image_digest, load_image, clinical_tensor, embedding_cache
+                        )
+                    else:
+                        prediction_tensor = model.predict_cached(
+                            image_digest, load_image, clinical_tensor, embedding_cache
+                        )
+                    probabilities = prediction_tensor.squeeze(0).tolist()
             
             # Map predictions to disease classes
-            class_names = ["Benign", "Malignant", "Suspicious"]
+            class_names = model.class_names
             prediction_dict = {
                 class_names[i]: prob for i, prob in enumerate(probabilities)
             }
             confidence = max(probabilities)
             predicted_class = class_names[probabilities.index(max(probabilities))]
+            served.record(time.perf_counter() - inference_start, predicted_class)
 
-        # Prepare result
-        result = {
-            "predicted_class": predicted_class,
-            "probabilities": prediction_dict,
-            "risk_level": "High" if confidence > 0.7 and predicted_class == "Malignant" else "Medium" if confidence > 0.5 else "Low"
-        }
+            # Prepare result
+            result = {
+                "predicted_class": predicted_class,
+                "probabilities": prediction_dict,
+                "risk_level": "High" if confidence > 0.7 and predicted_class == "Malignant" else "Medium" if confidence > 0.5 else "Low"
+            }
 
-        # Encrypt prediction using PQC
-        try:
-            if PQC_AVAILABLE:
-                kyber = KyberCipher()
-                prediction_json = json.dumps(result)
-                ciphertext, _ = kyber.encrypt(prediction_json.encode())
-                encrypted_prediction = base64.b64encode(ciphertext).decode()
-            else:
+            # Encrypt prediction using PQC
+            try:
+                if PQC_AVAILABLE:
+                    kyber = KyberCipher()
+                    prediction_json = json.dumps(result)
+                    ciphertext, _ = kyber.encrypt(prediction_json.encode())
+                    encrypted_prediction = base64.b64encode(ciphertext).decode()
+                else:
+                    encrypted_prediction = base64.b64encode(json.dumps(result).encode()).decode()
+            except Exception as e:
+                # Fallback to simple base64 encoding if PQC fails
                 encrypted_prediction = base64.b64encode(json.dumps(result).encode()).decode()
-        except Exception as e:
-            # Fallback to simple base64 encoding if PQC fails
-            encrypted_prediction = base64.b64encode(json.dumps(result).encode()).decode()
 
-        # Cache result
-        if CACHE_AVAILABLE:
+            # Cache result
             cache_data = {
                 "prediction": result,
                 "confidence": confidence,
                 "encrypted_prediction": encrypted_prediction
             }
-            cache_prediction(cache_key, cache_data)
+            if CACHE_AVAILABLE:
+                cache_prediction(cache_key, cache_data)
+
+            # Store the case with its embedding so it can be retrieved as a similar case later
+            if DB_AVAILABLE:
+                index_model = model.index_model
+                if reply is not None:
+                    # Computed on the worker, which sends it along with the result
+                    index_embedding = base64.b64decode(reply["embedding"]) if reply.get("embedding") else None
+                else:
+                    index_embedding = embedding_cache.peek(index_model.embedding_id, image_digest)
+                    index_embedding = encode_embedding(index_embedding) if index_embedding is not None else None
+                case = {
+                    "image_digest": image_digest,
+                    "predicted_class": predicted_class,
+                    "confidence": confidence,
+                    "model_version": served.version,
+                    "localization": request.clinical_data.localization,
+                    "sex": {0: "female", 1: "male"}.get(request.clinical_data.gender)
+                }
+                if index_embedding is not None:
+                    case["embedding_id"] = index_model.embedding_id
+                    case["embedding"] = index_embedding
+                # Without one (a cascade early exit never runs the index model) it is computed after responding
+                background_tasks.add_task(store_case, case, index_model, load_image)
+
+            if request.explain:
+                explanation = reply["explanation"] if reply is not None else build_explanation(cam, predicted_class, explain_layer)
+                if CACHE_AVAILABLE:
+                    cache_explanation(cache_key, explanation)
+                return {**cache_data, "explanation": explanation}
+            return cache_data
+
+        # Duplicate in-flight requests (retries, resubmits) share a single computation
+        cache_data, coalesced = prediction_flights.run(
+            f"{cache_key}:explain" if request.explain else cache_key, run_inference,
+            lookup=lookup if CACHE_AVAILABLE else lambda: None
+        )
+        record_drift(cache_data)
 
         return PredictResponse(
-            prediction=result,
-            confidence=confidence,
-            encrypted_prediction=encrypted_prediction,
-            cache_hit=False
+            prediction=cache_data['prediction'],
+            confidence=cache_data['confidence'],
+            encrypted_prediction=cache_data['encrypted_prediction'],
+            cache_hit=coalesced,
+            model_version=served.version,
+            image_digest=image_digest,
+            explanation=cache_data.get('explanation')
         )
         
     except HTTPException:
@@ -315,6 +431,68 @@ def predict(request: PredictRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
+def store_image(image_bytes: bytes, image_digest: str, prepared: list, eval_resize: str):
+    """Store an uploaded image unless its content is already stored; runs after the response"""
+    try:
+        image_store.put(image_bytes, image_digest, model_input=prepared[0] if prepared else None,
+                        eval_resize=eval_resize)
+    except Exception as e:
+        print(f"Failed to store image: {e}")
+
+def store_case(case: dict, index_model=None, load_image=None):
+    """
+    Persist a served prediction; runs after the response has been sent.
+
+    Cases served without the index model's embedding get it here, so they are still indexed.
+    """
+    if "embedding" not in case and index_model is not None:
+        try:
+            embedding = embedding_cache.get_or_compute(index_model, case["image_digest"], load_image)
+            case["embedding_id"] = index_model.embedding_id
+            case["embedding"] = encode_embedding(embedding)
+        except Exception as e:
+            print(f"Failed to embed case for similar-case retrieval: {e}")
+    try:
+        insert_prediction(case)
+    except Exception as e:
+        print(f"Failed to store prediction: {e}")
+
+@app.post("/similar_cases")
+def similar_cases(request: SimilarCasesRequest):
+    """Most similar stored cases, reusing the embedding computed during /predict"""
+    primary = model_manager.primary()
+    if primary is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    index_model = primary.loaded.index_model
+    embedding = embedding_cache.get(index_model.embedding_id, request.image_digest)
+    if embedding is None and DB_AVAILABLE and IMAGE_STORE_ENABLED:
+        # Not embedded by the index model yet (e.g. a cascade early exit): embed the stored input.
+        # Read from the primary, since the image may have been stored moments ago.
+        try:
+            inputs = image_store.load_inputs([request.image_digest], WORKLOAD_PRIMARY, index_model.eval_resize)
+        except KeyError:
+            inputs = None
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"Image store unavailable: {e}")
+        if inputs is not None:
+            with torch.no_grad():
+                embedding = embedding_cache.put(index_model.embedding_id, request.image_digest,
+                                                index_model.embed(inputs))
+    if embedding is None:
+        raise HTTPException(status_code=404, detail="No embedding for this image - submit it to /predict first")
+
+    k = max(1, min(request.k, 50))
+    search_start = time.perf_counter()
+    # The query image's own stored cases would otherwise be its nearest neighbours
+    cases = vector_index.search(embedding.squeeze(0).numpy(), k=k, filters=request.filters,
+                                exclude_digests=[request.image_digest])
+    return {
+        "image_digest": request.image_digest,
+        "cases": cases,
+        "search_ms": round((time.perf_counter() - search_start) * 1000, 2),
+        "index": vector_index.stats()
+    }
+
 @app.post("/upload_record")
 def upload_record(request: UploadRecordRequest):
     try:
@@ -371,12 +549,98 @@ def upload_record(request: UploadRecordRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload error: {str(e)}")
 
+@app.get("/patients/{patient_id}")
+def read_patient(patient_id: str):
+    """Patient details, served from the cache when hot"""
+    if not DB_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Database not available")
+    try:
+        patient = get_patient(patient_id)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if patient is None:
+        raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
+    return patient
+
+@app.put("/patients/{patient_id}")
+def write_patient(patient_id: str, patient_data: dict):
+    """Create or update a patient"""
+    if not DB_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Database not available")
+    try:
+        return upsert_patient({**patient_data, "patient_id": patient_id})
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@app.get("/patients/{patient_id}/records")
+def read_health_records(patient_id: str, limit: int = 10):
+    """Most recent health records of a patient"""
+    if not DB_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Database not available")
+    try:
+        return {"patient_id": patient_id, "records": get_health_records(patient_id, limit)}
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@app.post("/sessions")
+def create_session(request: SessionRequest, background_tasks: BackgroundTasks):
+    """Start a session and warm the cache for its patients and the most frequently read ones"""
+    if not DB_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Database not available")
+    session = start_session(request.user_id, request.patient_ids)
+    background_tasks.add_task(warm_patients, session["warm_patient_ids"])
+    return session
+
+@app.get("/images/{image_digest}")
+def read_image(image_digest: str, range_header: Optional[str] = Header(None, alias="Range")):
+    """Stored original image; supports single byte-range requests"""
+    if not DB_AVAILABLE or not IMAGE_STORE_ENABLED:
+        raise HTTPException(status_code=503, detail="Image store not available")
+    try:
+        info = image_store.info(image_digest)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if info is None:
+        raise HTTPException(status_code=404, detail=f"Image {image_digest} not found")
+
+    size = info["length"]
+    headers = {"Accept-Ranges": "bytes"}
+    media_type = info.get("content_type", "application/octet-stream")
+    if range_header is None:
+        return Response(image_store.read(image_digest), media_type=media_type, headers=headers)
+    try:
+        start, end = parse_byte_range(range_header, size)
+    except ValueError as e:
+        raise HTTPException(status_code=416, detail=str(e), headers={"Content-Range": f"bytes */{size}"})
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(image_store.read(image_digest, start, end - start + 1), status_code=206,
+                    media_type=media_type, headers=headers)
+
+@app.get("/images/{image_digest}/info")
+def read_image_info(image_digest: str):
+    """Size, type and upload count of a stored image"""
+    if not DB_AVAILABLE or not IMAGE_STORE_ENABLED:
+        raise HTTPException(status_code=503, detail="Image store not available")
+    try:
+        info = image_store.info(image_digest)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if info is None:
+        raise HTTPException(status_code=404, detail=f"Image {image_digest} not found")
+    return info
+
+@app.get("/capabilities")
+def capabilities(response: Response):
+    """Model input size and the upload size, formats and quality clients should send"""
+    response.headers["Cache-Control"] = "public, max-age=3600"
+    return upload_capabilities()
+
 @app.get("/health", response_model=HealthResponse)
 def health_check():
-    """Comprehensive health check endpoint"""
+    """Health check from the background prober's cached results (no synchronous pings)"""
     try:
         # Check model
-        model_loaded = model is not None
+        model_loaded = model_manager.primary() is not None
         
         # Check database connection
         database_connected = False
@@ -400,11 +664,67 @@ def health_check():
             status=status,
             model_loaded=model_loaded,
             database_connected=database_connected,
-            cache_connected=cache_connected
+            cache_connected=cache_connected,
+            dependencies=health_prober.status()
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Health check failed: {str(e)}")
 
+@app.get("/models")
+def list_models():
+    """Loaded model versions, traffic split and per-version metrics"""
+    status = model_manager.status()
+    status["embedding_cache"] = embedding_cache.stats()
+    status["prediction_coalescing"] = prediction_flights.stats()
+    status["cpu_profile"] = {key: value for key, value in (cpu_profile or {}).items() if key != "results"}
+    if traffic_recorder is not None:
+        status["traffic_capture"] = traffic_recorder.stats()
+    status["worker"] = shared_weights.status()
+    if inference_queue.enabled:
+        status["inference_queue"] = inference_queue.status()
+    return status
+
+@app.get("/drift")
+def drift_statistics(version: Optional[str] = None):
+    """Prediction-distribution and clinical-feature statistics of all workers, with drift against the reference window"""
+    if version is None:
+        primary = model_manager.primary()
+        if primary is None:
+            raise HTTPException(status_code=503, detail="Model not loaded")
+        version = primary.version
+    return drift_monitor.snapshot(version)
+
+@app.post("/models/load", status_code=202)
+def load_model_version(request: ModelLoadRequest):
+    """Load a checkpoint in the background and swap it in once warmed up"""
+    if request.role not in (PRIMARY, CANDIDATE):
+        raise HTTPException(status_code=400, detail=f"Unknown role: {request.role}")
+
+    # Only checkpoints inside the model directory may be loaded
+    model_dir = os.path.realpath(MODEL_DIR)
+    path = os.path.realpath(os.path.join(model_dir, request.checkpoint))
+    if not path.startswith(model_dir + os.sep) or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"Checkpoint not found: {request.checkpoint}")
+
+    model_manager.load_async(request.name, path, version=request.version, role=request.role,
+                             traffic_percent=request.traffic_percent)
+    return {"status": "loading", "name": request.name, "checkpoint": request.checkpoint, "role": request.role}
+
+@app.post("/models/promote")
+def promote_model(name: str = MODEL_NAME):
+    """Promote the candidate version to primary"""
+    try:
+        promoted = model_manager.promote(name)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"status": "promoted", "name": name, "version": promoted.version}
+
+@app.post("/models/traffic")
+def set_model_traffic(request: ModelTrafficRequest):
+    """Set the percentage of /predict traffic routed to the candidate version"""
+    model_manager.set_traffic(request.name, request.traffic_percent)
+    return {"status": "updated", "name": request.name, "traffic_percent": request.traffic_percent}
+
 @app.get("/")
 def root():
     """Root endpoint with API information"""
@@ -414,7 +734,15 @@ def root():
         "endpoints": [
             "/predict - POST: Make health predictions",
             "/upload_record - POST: Upload patient records",
+            "/patients/{patient_id} - GET/PUT: Patient details",
+            "/patients/{patient_id}/records - GET: Recent health records",
+            "/sessions - POST: Start a session and warm its patients",
             "/health - GET: Health check",
+            "/capabilities - GET: Upload size, formats and quality to downscale images to",
+            "/models - GET: Loaded model versions and metrics",
+            "/drift - GET: Prediction and input drift statistics",
+            "/similar_cases - POST: Similar previously diagnosed cases",
+            "/images/{image_digest} - GET: Stored original image (byte ranges supported)",
             "/docs - GET: API documentation"
         ]
     }
@@ -0,0 +1,320 @@
+# model_manager.py
+# Hosts several named, versioned models in one process.
+# New checkpoints are loaded and warmed up in the background and then swapped in
+# atomically, so in-flight requests finish on the version they started with. A candidate
+# version can receive a configurable share of traffic next to the primary, and each
+# version keeps its own latency and prediction-distribution metrics.
+
+import os
+import time
+import random
+import hashlib
+import logging
+import threading
+import weakref
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import torch
+
+from .model_registry import LoadedModel, load_model_from_checkpoint
+from .cascade import with_cascade
+from .autotune import optimize_model
+from .shared_weights import shared_weights
+
+try:
+    from prometheus_client import Counter, Histogram
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Model hosting configuration from environment variables
+MODEL_NAME = os.getenv("MODEL_NAME", "hqcnn")
+MODEL_CANDIDATE_PATH = os.getenv("MODEL_CANDIDATE_PATH")
+MODEL_CANDIDATE_TRAFFIC = float(os.getenv("MODEL_CANDIDATE_TRAFFIC", "0"))  # percent of /predict
+MODEL_WATCH_INTERVAL = int(os.getenv("MODEL_WATCH_INTERVAL", "0"))  # seconds, 0 disables
+LATENCY_WINDOW = int(os.getenv("MODEL_LATENCY_WINDOW", "1000"))
+
+PRIMARY = "primary"
+CANDIDATE = "candidate"
+
+if PROMETHEUS_AVAILABLE:
+    MODEL_INFERENCE_LATENCY = Histogram(
+        "model_inference_duration_seconds",
+        "Model inference latency in seconds",
+        ["model", "version"]
+    )
+    MODEL_PREDICTIONS = Counter(
+        "model_predictions_total",
+        "Predictions served per model version and class",
+        ["model", "version", "predicted_class"]
+    )
+
+
+def checkpoint_version(path: str) -> str:
+    """Version label for a checkpoint file, derived from its name and modification time"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    modified = datetime.fromtimestamp(os.path.getmtime(path))
+    return f"{stem}@{modified.strftime('%Y%m%d%H%M%S')}"
+
+
+class ModelVersion:
+    """One loaded model version plus its serving metrics"""
+
+    def __init__(self, name: str, version: str, loaded: LoadedModel):
+        self.name = name
+        self.version = version
+        self.loaded = loaded
+        self.loaded_at = datetime.utcnow()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.request_count = 0
+        self.class_counts = {name: 0 for name in loaded.class_names}
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}:{self.version}"
+
+    def record(self, latency: float, predicted_class: str):
+        """Record one served prediction"""
+        with self._lock:
+            self._latencies.append(latency)
+            self.request_count += 1
+            self.class_counts[predicted_class] = self.class_counts.get(predicted_class, 0) + 1
+        if PROMETHEUS_AVAILABLE:
+            MODEL_INFERENCE_LATENCY.labels(model=self.name, version=self.version).observe(latency)
+            MODEL_PREDICTIONS.labels(model=self.name, version=self.version,
+                                     predicted_class=predicted_class).inc()
+
+    def stats(self) -> Dict[str, Any]:
+        """Latency percentiles over the recent window and the class distribution"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            count = self.request_count
+            class_counts = dict(self.class_counts)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2)
+
+        stats = {
+            "version": self.version,
+            "architecture": self.loaded.architecture,
+            "source": self.loaded.source,
+            "loaded_at": self.loaded_at.isoformat(),
+            "requests": count,
+            "latency_ms": {
+                "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+                "p50": percentile(0.50),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99)
+            },
+            "class_counts": class_counts,
+            "class_distribution": {
+                name: round(n / count, 4) if count else 0.0 for name, n in class_counts.items()
+            }
+        }
+        stats.update(self.loaded.serving_stats() or {})
+        return stats
+
+
+class ModelManager:
+    """Registry of loaded model versions with primary/candidate routing per model name"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._versions: Dict[str, ModelVersion] = {}
+        self._roles: Dict[str, Dict[str, str]] = {}  # name -> {role: version key}
+        self._traffic: Dict[str, float] = {}  # name -> candidate traffic percent
+        self._loading: Dict[str, str] = {}  # version key -> load status
+        # Identical tensors across versions (e.g. a frozen backbone) are stored once
+        self._tensor_pool = weakref.WeakValueDictionary()
+        self._watchers: Dict[str, threading.Thread] = {}
+
+    def _share_tensors(self, model: torch.nn.Module) -> int:
+        """Point parameters and buffers at identical tensors already held by other versions"""
+        shared = 0
+        for module in model.modules():
+            for store in (module._parameters, module._buffers):
+                for attr, tensor in store.items():
+                    if tensor is None or tensor.device.type != "cpu":
+                        continue
+                    data = tensor.detach().contiguous()
+                    raw = data.reshape(-1).view(torch.uint8).numpy()
+                    digest = hashlib.blake2b(raw, digest_size=16).hexdigest()
+                    pool_key = (tuple(data.shape), str(data.dtype), digest)
+                    existing = self._tensor_pool.get(pool_key)
+                    if existing is not None and existing is not tensor:
+                        tensor.data = existing.data
+                        shared += 1
+                    elif existing is None:
+                        self._tensor_pool[pool_key] = tensor
+        return shared
+
+    def _warm_up(self, loaded: LoadedModel):
+        """Run one dummy forward pass so the first real request does not pay for lazy init"""
+        feature_dim = getattr(loaded.feature_encoder, "feature_dim", 0)
+        with torch.no_grad():
+            loaded.predict_proba(torch.zeros(1, 3, 224, 224), torch.zeros(1, feature_dim))
+
+    def install(self, name: str, version: str, loaded: LoadedModel, role: str = PRIMARY,
+                traffic_percent: Optional[float] = None, warmup: bool = True) -> ModelVersion:
+        """Warm up a loaded model and atomically make it the primary or candidate version"""
+        if role not in (PRIMARY, CANDIDATE):
+            raise ValueError(f"Unknown role '{role}'")
+
+        # Layout/fusion settings from the machine's CPU profile, before tensors are shared.
+        # A frozen oneDNN graph folds its own private copy of the weights, so it is skipped
+        # when workers map shared weights.
+        optimize_model(loaded, fusion=not shared_weights.enabled)
+        shared_weights.attach(loaded.model, name, version)
+        with torch.no_grad():
+            shared = self._share_tensors(loaded.model)
+        if warmup:
+            self._warm_up(loaded)
+
+        entry = ModelVersion(name, version, loaded)
+        with self._lock:
+            self._versions[entry.key] = entry
+            previous = self._roles.setdefault(name, {}).get(role)
+            self._roles[name][role] = entry.key
+            if traffic_percent is not None:
+                self._traffic[name] = max(0.0, min(100.0, float(traffic_percent)))
+            self._loading.pop(entry.key, None)
+            # Drop versions that no longer hold any role; requests still using them finish normally
+            if previous and previous != entry.key and previous not in self._roles[name].values():
+                self._versions.pop(previous, None)
+
+        logger.info(f"Model {entry.key} installed as {role} ({shared} tensors shared)")
+        shared_weights.sweep()
+        return entry
+
+    def load(self, name: str, path: str, version: Optional[str] = None, role: str = PRIMARY,
+             traffic_percent: Optional[float] = None) -> ModelVersion:
+        """Load a checkpoint, warm it up and install it"""
+        version = version or checkpoint_version(path)
+        key = f"{name}:{version}"
+        with self._lock:
+            self._loading[key] = "loading"
+        try:
+            loaded = with_cascade(load_model_from_checkpoint(path))
+            return self.install(name, version, loaded, role=role, traffic_percent=traffic_percent)
+        except Exception as e:
+            with self._lock:
+                self._loading[key] = f"failed: {e}"
+            logger.error(f"Failed to load model {key} from {path}: {e}")
+            raise
+
+    def load_async(self, name: str, path: str, version: Optional[str] = None, role: str = PRIMARY,
+                   traffic_percent: Optional[float] = None) -> threading.Thread:
+        """Load and install a checkpoint on a background thread"""
+        def run():
+            try:
+                self.load(name, path, version=version, role=role, traffic_percent=traffic_percent)
+            except Exception:
+                pass  # already logged and recorded in the load status
+
+        thread = threading.Thread(target=run, name=f"model-load-{name}", daemon=True)
+        thread.start()
+        return thread
+
+    def promote(self, name: str) -> ModelVersion:
+        """Make the candidate the primary version"""
+        with self._lock:
+            roles = self._roles.get(name, {})
+            if CANDIDATE not in roles:
+                raise KeyError(f"No candidate model for '{name}'")
+            previous = roles.get(PRIMARY)
+            roles[PRIMARY] = roles.pop(CANDIDATE)
+            self._traffic[name] = 0.0
+            if previous and previous != roles[PRIMARY]:
+                self._versions.pop(previous, None)
+            promoted = self._versions[roles[PRIMARY]]
+        shared_weights.sweep()
+        return promoted
+
+    def set_traffic(self, name: str, percent: float):
+        """Set the percentage of requests routed to the candidate version"""
+        with self._lock:
+            self._traffic[name] = max(0.0, min(100.0, float(percent)))
+
+    def remove_candidate(self, name: str):
+        """Stop routing to and unload the candidate version"""
+        with self._lock:
+            key = self._roles.get(name, {}).pop(CANDIDATE, None)
+            self._traffic[name] = 0.0
+            if key:
+                self._versions.pop(key, None)
+        shared_weights.sweep()
+
+    def primary(self, name: str = MODEL_NAME) -> Optional[ModelVersion]:
+        """The primary version for a model name"""
+        with self._lock:
+            key = self._roles.get(name, {}).get(PRIMARY)
+            return self._versions.get(key) if key else None
+
+    def get(self, name: str, version: str) -> Optional[ModelVersion]:
+        """A loaded version by name and version label"""
+        with self._lock:
+            return self._versions.get(f"{name}:{version}")
+
+    def route(self, name: str = MODEL_NAME) -> ModelVersion:
+        """Pick the version that serves the next request"""
+        with self._lock:
+            roles = self._roles.get(name, {})
+            candidate = roles.get(CANDIDATE)
+            traffic = self._traffic.get(name, 0.0)
+            if candidate and traffic > 0 and random.random() * 100 < traffic:
+                return self._versions[candidate]
+            key = roles.get(PRIMARY)
+            if key is None:
+                raise LookupError(f"No model loaded for '{name}'")
+            return self._versions[key]
+
+    def watch(self, name: str, path: str, interval: int = MODEL_WATCH_INTERVAL) -> threading.Thread:
+        """Reload the primary version whenever the checkpoint file changes"""
+        def run():
+            last_modified = os.path.getmtime(path) if os.path.exists(path) else None
+            while True:
+                time.sleep(interval)
+                try:
+                    if not os.path.exists(path):
+                        continue
+                    modified = os.path.getmtime(path)
+                    if modified != last_modified:
+                        last_modified = modified
+                        logger.info(f"Checkpoint {path} changed - reloading {name}")
+                        self.load(name, path, role=PRIMARY)
+                except Exception as e:
+                    logger.error(f"Model watcher for {name} failed to reload: {e}")
+
+        thread = threading.Thread(target=run, name=f"model-watch-{name}", daemon=True)
+        thread.start()
+        self._watchers[name] = thread
+        return thread
+
+    def status(self) -> Dict[str, Any]:
+        """Roles, traffic split, load status and per-version metrics"""
+        with self._lock:
+            roles = {name: dict(r) for name, r in self._roles.items()}
+            traffic = dict(self._traffic)
+            loading = dict(self._loading)
+            versions = dict(self._versions)
+
+        models = {}
+        for name, name_roles in roles.items():
+            models[name] = {
+                "candidate_traffic_percent": traffic.get(name, 0.0),
+                "versions": {role: versions[key].stats() for role, key in name_roles.items()
+                             if key in versions}
+            }
+        return {"models": models, "loading": loading}
+
+
+# Global model manager instance
+model_manager = ModelManager()
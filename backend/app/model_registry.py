@@ -0,0 +1,544 @@
+# model_registry.py
+# Reconstructs servable models from training checkpoints.
+# The architecture is taken from checkpoint metadata (model_architecture, metadata_dim,
+# quantum_info, encoders) when present and otherwise inferred from the state_dict layout.
+# The eval-time resize comes from the checkpoint's eval_resize, defaulting per architecture
+# to the transform the family was validated with (the notebook's centre crop for the hybrid).
+# Weights are always loaded strictly so a mismatched checkpoint fails at startup instead
+# of silently serving randomly initialized layers.
+
+import hashlib
+import logging
+import warnings
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import torch
+import torch.nn as nn
+
+from .models import MultimodalHQCNN, HybridMultimodalHQCNN, MultimodalStudent
+from .preprocessing import EVAL_RESIZE_CENTER_CROP, EVAL_RESIZE_SQUASH, EVAL_RESIZE_TRANSFORMS
+from .quantum import NUM_QUBITS, NUM_WEIGHTS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_CLASS_NAMES = {
+    2: ["Benign", "Malignant"],
+    3: ["Benign", "Malignant", "Suspicious"],
+}
+
+# Encoder classes fitted on HAM10000 in the notebook, used when a checkpoint has no encoders
+DEFAULT_SEX_CLASSES = ["female", "male", "unknown"]
+DEFAULT_LOCALIZATION_CLASSES = [
+    "abdomen", "acral", "back", "chest", "ear", "face", "foot", "genital", "hand",
+    "lower extremity", "neck", "scalp", "trunk", "unknown", "upper extremity"
+]
+DEFAULT_AGE_RANGE = (0.0, 85.0)
+
+
+class ModelLoadError(Exception):
+    """Raised when a checkpoint cannot be reconstructed into a servable model"""
+
+
+class ClinicalFeatureEncoder:
+    """Normalizes the 10 ClinicalData fields consumed by the ResNet-50 model"""
+
+    feature_dim = 10
+    feature_names = [
+        "age", "gender", "bmi", "blood_pressure_systolic", "blood_pressure_diastolic",
+        "cholesterol", "glucose", "smoking", "family_history", "symptoms_severity"
+    ]
+
+    def encode(self, clinical: Dict[str, Any]) -> List[float]:
+        return [
+            clinical["age"] / 100.0,  # Normalize age
+            clinical["gender"],
+            clinical["bmi"] / 50.0,  # Normalize BMI
+            clinical["blood_pressure_systolic"] / 200.0,
+            clinical["blood_pressure_diastolic"] / 120.0,
+            clinical["cholesterol"] / 300.0,
+            clinical["glucose"] / 200.0,
+            clinical["smoking"],
+            clinical["family_history"],
+            clinical["symptoms_severity"] / 10.0
+        ]
+
+
+class MetadataFeatureEncoder:
+    """
+    Encodes [sex, age, localization] like the notebook's fitted encoders.
+
+    The sklearn encoders are reduced to lookup tables and scale/offset once, so encoding
+    a request does not call into sklearn.
+    """
+
+    feature_dim = 3
+    feature_names = ["sex", "age", "localization"]
+
+    def __init__(self, encoders: Optional[Dict[str, Any]] = None):
+        encoders = encoders or {}
+
+        sex_encoder = encoders.get("sex_encoder")
+        sex_classes = list(sex_encoder.classes_) if sex_encoder is not None else DEFAULT_SEX_CLASSES
+        self.sex_index = {str(name): i for i, name in enumerate(sex_classes)}
+
+        localization_encoder = encoders.get("localization_encoder")
+        localization_classes = (list(localization_encoder.classes_) if localization_encoder is not None
+                                else DEFAULT_LOCALIZATION_CLASSES)
+        self.localization_index = {str(name): i for i, name in enumerate(localization_classes)}
+
+        age_scaler = encoders.get("age_scaler")
+        if age_scaler is not None:
+            self.age_scale = float(age_scaler.scale_[0])
+            self.age_min = float(age_scaler.min_[0])
+        else:
+            low, high = DEFAULT_AGE_RANGE
+            self.age_scale = 1.0 / (high - low)
+            self.age_min = -low * self.age_scale
+
+    def _lookup(self, index: Dict[str, int], value: Optional[str]) -> float:
+        if value is not None and value in index:
+            return float(index[value])
+        return float(index.get("unknown", 0))
+
+    def encode(self, clinical: Dict[str, Any]) -> List[float]:
+        sex = {0: "female", 1: "male"}.get(clinical.get("gender"))
+        age = clinical["age"] * self.age_scale + self.age_min
+        localization = clinical.get("localization")
+        if localization is not None:
+            localization = localization.strip().lower()
+        return [
+            self._lookup(self.sex_index, sex),
+            age,
+            self._lookup(self.localization_index, localization)
+        ]
+
+
+def feature_names(encoder: Any) -> List[str]:
+    """Names of an encoder's features, positional for encoders that do not name them"""
+    names = getattr(encoder, "feature_names", None)
+    return list(names) if names else [f"feature_{i}" for i in range(encoder.feature_dim)]
+
+
+class LoadedModel:
+    """A model together with the metadata needed to serve it"""
+
+    def __init__(self, architecture: str, model: nn.Module, class_names: List[str],
+                 feature_encoder: Any, returns_logits: bool,
+                 source: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None,
+                 eval_resize: str = EVAL_RESIZE_CENTER_CROP):
+        self.architecture = architecture
+        self.model = model
+        self.class_names = class_names
+        self.feature_encoder = feature_encoder
+        self.returns_logits = returns_logits
+        # Name of the preprocessing resize (see preprocessing.EVAL_RESIZE_TRANSFORMS) images need
+        self.eval_resize = eval_resize
+        self.source = source
+        self.metadata = metadata or {}
+        self._embedding_id = None
+        # Set by apply_cpu_profile
+        self.channels_last = False
+        self._compiled_embed = None
+
+    def encode_features(self, clinical: Dict[str, Any]) -> torch.Tensor:
+        """Encode request clinical data into a (1, D) feature tensor"""
+        values = self.feature_encoder.encode(clinical)
+        return torch.tensor(values, dtype=torch.float32).unsqueeze(0)
+
+    @property
+    def embedding_id(self) -> str:
+        """Fingerprint of the image-embedding weights, so cached embeddings survive head-only changes"""
+        if self._embedding_id is None:
+            digest = hashlib.blake2b(self.architecture.encode(), digest_size=16)
+            prefixes = tuple(f"{name}." for name in getattr(self.model, "EMBEDDING_MODULES", ()))
+            for key, tensor in self.model.state_dict().items():
+                if not prefixes or key.startswith(prefixes):
+                    digest.update(key.encode())
+                    digest.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy())
+            self._embedding_id = digest.hexdigest()
+        return self._embedding_id
+
+    @property
+    def index_model(self) -> "LoadedModel":
+        """The model whose embeddings are used for similar-case retrieval"""
+        return self
+
+    def embed(self, image_tensor: torch.Tensor) -> torch.Tensor:
+        """Image-only features of shape (batch, embedding_dim)"""
+        if self.channels_last:
+            image_tensor = image_tensor.contiguous(memory_format=torch.channels_last)
+        if self._compiled_embed is not None:
+            return self._compiled_embed(image_tensor)
+        return self.model.embed_image(image_tensor)
+
+    def apply_cpu_profile(self, channels_last: bool = False, onednn_fusion: bool = False):
+        """Switch the embedding stage to channels_last and/or a frozen, oneDNN-fused graph"""
+        if channels_last:
+            self.model.to(memory_format=torch.channels_last)
+        self.channels_last = channels_last
+        self._compiled_embed = None
+        if onednn_fusion:
+            self._compiled_embed = compile_embedding(self.model, channels_last)
+
+    def predict_from_embedding(self, embedding: torch.Tensor, feature_tensor: torch.Tensor) -> torch.Tensor:
+        """Class probabilities from precomputed image embeddings"""
+        output = self.model.fuse(embedding, feature_tensor)
+        if self.returns_logits:
+            return torch.softmax(output[0], dim=1)
+        return output
+
+    def predict_proba(self, image_tensor: torch.Tensor, feature_tensor: torch.Tensor) -> torch.Tensor:
+        """Class probabilities of shape (batch, num_classes)"""
+        return self.predict_from_embedding(self.embed(image_tensor), feature_tensor)
+
+    def predict_cached(self, image_digest: str, load_image: Callable[[], torch.Tensor],
+                       feature_tensor: torch.Tensor, embeddings: Any) -> torch.Tensor:
+        """Class probabilities for one image, reusing its cached embedding when available"""
+        embedding = embeddings.get_or_compute(self, image_digest, load_image)
+        return self.predict_from_embedding(embedding, feature_tensor)
+
+    def predict_cached_batch(self, image_digests: Sequence[str], load_images: Callable[[List[int]], torch.Tensor],
+                             feature_tensor: torch.Tensor, embeddings: Any) -> torch.Tensor:
+        """
+        predict_cached for a batch: cached embeddings are reused and the misses are embedded
+        in one forward pass. load_images receives the positions of the rows it has to load.
+        """
+        embedding_id = self.embedding_id
+        rows = [embeddings.get(embedding_id, digest) for digest in image_digests]
+        # Each missing image is embedded once, even when it appears in several rows
+        missing: Dict[str, List[int]] = {}
+        for position, (digest, embedding) in enumerate(zip(image_digests, rows)):
+            if embedding is None:
+                missing.setdefault(digest, []).append(position)
+        if missing:
+            with torch.no_grad():
+                computed = self.embed(load_images([positions[0] for positions in missing.values()]))
+            for index, (digest, positions) in enumerate(missing.items()):
+                stored = embeddings.put(embedding_id, digest, computed[index:index + 1])
+                for position in positions:
+                    rows[position] = stored
+        return self.predict_from_embedding(torch.cat(rows), feature_tensor)
+
+    def explain(self, image_tensor: torch.Tensor, feature_tensor: torch.Tensor,
+                class_index: Optional[int] = None):
+        """
+        Probabilities, Grad-CAM map and image embedding for one image, in a single forward pass.
+
+        Everything up to the model's GRADCAM_LAYER runs without autograd; gradients of the
+        target class log-probability (default: the predicted class) flow back only
+        through the layers after it.
+        """
+        layer_name = getattr(self.model, "GRADCAM_LAYER", None)
+        if layer_name is None:
+            raise ValueError(f"{self.architecture} does not support explanations")
+        captured = {}
+
+        def capture(module, inputs, output):
+            torch.set_grad_enabled(True)  # restored when the enclosing no_grad block exits
+            captured["activation"] = output.detach().requires_grad_()
+            return captured["activation"]
+
+        handle = self.model.get_submodule(layer_name).register_forward_hook(capture)
+        try:
+            with torch.no_grad():
+                # Eager path: a compiled embedding stage would not run the hook
+                image_tensor = image_tensor.contiguous(
+                    memory_format=torch.channels_last if self.channels_last else torch.contiguous_format
+                )
+                embedding = self.model.embed_image(image_tensor)
+                probabilities = self.predict_from_embedding(embedding, feature_tensor)
+                if class_index is None:
+                    class_index = int(probabilities[0].argmax())
+                activation = captured["activation"]
+                gradient, = torch.autograd.grad(probabilities[0, class_index].clamp_min(1e-12).log(), activation)
+        finally:
+            handle.remove()
+
+        weights = gradient.mean(dim=(2, 3), keepdim=True)
+        cam = torch.relu((weights * activation.detach()).sum(dim=1))[0]
+        return probabilities.detach(), cam, embedding.detach()
+
+    def predict_explained(self, image_digest: str, load_image: Callable[[], torch.Tensor],
+                          feature_tensor: torch.Tensor, embeddings: Any):
+        """predict_cached plus a Grad-CAM map of the predicted class from the same forward pass"""
+        _, cam, embedding = self.explain(load_image(), feature_tensor)
+        # Predict from the stored (float16-rounded) embedding, exactly as later cache hits will
+        embedding = embeddings.put(self.embedding_id, image_digest, embedding)
+        return self.predict_from_embedding(embedding, feature_tensor), cam
+
+    def serving_stats(self) -> Optional[Dict[str, Any]]:
+        """Model-specific serving metrics reported next to the version stats"""
+        return None
+
+
+class _EmbeddingStage(nn.Module):
+    """Traceable wrapper around a model's embed_image"""
+
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, image_tensor):
+        return self.model.embed_image(image_tensor)
+
+
+def compile_embedding(model: nn.Module, channels_last: bool = False) -> Callable:
+    """Trace and freeze the embedding stage so oneDNN can fuse conv/norm/activation ops"""
+    torch.jit.enable_onednn_fusion(True)
+    example = torch.zeros(1, 3, 224, 224)
+    if channels_last:
+        example = example.contiguous(memory_format=torch.channels_last)
+    with torch.no_grad(), warnings.catch_warnings():
+        # Shape checks in the dense layers are constant for a fixed input size
+        warnings.filterwarnings("ignore", category=torch.jit.TracerWarning)
+        warnings.filterwarnings("ignore", category=FutureWarning, module="torch.jit")
+        traced = torch.jit.trace(_EmbeddingStage(model).eval(), example, check_trace=False)
+        frozen = torch.jit.freeze(traced)
+        # Profiling runs let the fuser specialize the graph before the first request
+        for _ in range(2):
+            frozen(example)
+    return frozen
+
+
+class ModelArchitecture:
+    """How to rebuild, feed and interpret one model family"""
+
+    def __init__(self, name: str, marker_key: str, classifier_key: str,
+                 build: Callable[[Dict[str, Any], Dict[str, torch.Tensor]], nn.Module],
+                 feature_encoder: Callable[[Dict[str, Any]], Any],
+                 returns_logits: bool, eval_resize: str = EVAL_RESIZE_CENTER_CROP):
+        self.name = name
+        self.marker_key = marker_key
+        self.classifier_key = classifier_key
+        self.build = build
+        self.feature_encoder = feature_encoder
+        self.returns_logits = returns_logits
+        # Used for checkpoints that do not record their eval_resize
+        self.eval_resize = eval_resize
+
+
+# Registered architectures, keyed by checkpoint model_architecture name
+ARCHITECTURES: Dict[str, ModelArchitecture] = {}
+
+
+def register_architecture(architecture: ModelArchitecture):
+    """Register a model family so checkpoints naming it can be served"""
+    ARCHITECTURES[architecture.name] = architecture
+
+
+def _num_classes(checkpoint: Dict[str, Any], state_dict: Dict[str, torch.Tensor], key: str) -> int:
+    if checkpoint.get("num_classes") is not None:
+        return int(checkpoint["num_classes"])
+    return int(state_dict[key].shape[0])
+
+
+def _build_resnet(checkpoint: Dict[str, Any], state_dict: Dict[str, torch.Tensor]) -> nn.Module:
+    num_clinical_features = int(state_dict["clinical_processor.0.weight"].shape[1])
+    num_classes = _num_classes(checkpoint, state_dict, "classifier.3.weight")
+    return MultimodalHQCNN(num_clinical_features=num_clinical_features, num_classes=num_classes)
+
+
+def _build_hybrid(checkpoint: Dict[str, Any], state_dict: Dict[str, torch.Tensor]) -> nn.Module:
+    quantum_info = checkpoint.get("quantum_info") or {}
+    num_qubits = quantum_info.get("num_qubits", NUM_QUBITS)
+    num_quantum_params = quantum_info.get("num_quantum_params", NUM_WEIGHTS)
+    if "qnn.weight" in state_dict:
+        num_quantum_params = state_dict["qnn.weight"].numel()
+    if num_qubits != NUM_QUBITS or num_quantum_params != NUM_WEIGHTS:
+        raise ModelLoadError(
+            f"Unsupported quantum head: {num_qubits} qubits / {num_quantum_params} weights "
+            f"(simulator supports {NUM_QUBITS} qubits / {NUM_WEIGHTS} weights)"
+        )
+
+    # DenseNet hyperparameters are recovered from the tensor shapes
+    block_config = []
+    while True:
+        prefix = f"image_features.denseblock{len(block_config) + 1}.block."
+        layers = {key[len(prefix):].split(".")[0] for key in state_dict if key.startswith(prefix)}
+        if not layers:
+            break
+        block_config.append(len(layers))
+    first_layer = "image_features.denseblock1.block.0."
+    growth_rate = int(state_dict[first_layer + "conv2.weight"].shape[0])
+    bn_size = int(state_dict[first_layer + "conv1.weight"].shape[0]) // growth_rate
+
+    metadata_dim = checkpoint.get("metadata_dim") or int(state_dict["metadata_fc1.weight"].shape[1])
+    return HybridMultimodalHQCNN(
+        num_classes=_num_classes(checkpoint, state_dict, "classifier.weight"),
+        metadata_dim=int(metadata_dim),
+        growth_rate=growth_rate,
+        block_config=tuple(block_config),
+        num_init_features=int(state_dict["image_features.0.weight"].shape[0]),
+        bn_size=bn_size
+    )
+
+
+register_architecture(ModelArchitecture(
+    name="MultimodalHQCNN",  # name written by the training notebook
+    marker_key="qnn.weight",
+    classifier_key="classifier.weight",
+    build=_build_hybrid,
+    feature_encoder=lambda checkpoint: MetadataFeatureEncoder(checkpoint.get("encoders")),
+    returns_logits=True,
+    eval_resize=EVAL_RESIZE_CENTER_CROP  # the notebook's val_transforms
+))
+
+register_architecture(ModelArchitecture(
+    name="MultimodalResNet50",
+    marker_key="backbone.conv1.weight",
+    classifier_key="classifier.3.weight",
+    build=_build_resnet,
+    feature_encoder=lambda checkpoint: ClinicalFeatureEncoder(),
+    returns_logits=False,
+    eval_resize=EVAL_RESIZE_SQUASH  # served with a plain 224x224 resize before the registry
+))
+
+
+def _build_student(checkpoint: Dict[str, Any], state_dict: Dict[str, torch.Tensor]) -> nn.Module:
+    config = checkpoint.get("student_config")
+    if config is None:
+        raise ModelLoadError("Student checkpoint has no student_config")
+    return MultimodalStudent(
+        num_clinical_features=int(state_dict["clinical_processor.0.weight"].shape[1]),
+        num_classes=_num_classes(checkpoint, state_dict, "classifier.weight"),
+        **config
+    )
+
+
+def _student_feature_encoder(checkpoint: Dict[str, Any]) -> Any:
+    """Students take the inputs of the teacher they were distilled from"""
+    if checkpoint.get("feature_encoder") == "metadata":
+        return MetadataFeatureEncoder(checkpoint.get("encoders"))
+    return ClinicalFeatureEncoder()
+
+
+register_architecture(ModelArchitecture(
+    name="MultimodalStudent",
+    marker_key="image_features.stem.0.weight",
+    classifier_key="classifier.weight",
+    build=_build_student,
+    feature_encoder=_student_feature_encoder,
+    returns_logits=True,
+    eval_resize=EVAL_RESIZE_CENTER_CROP  # distilled on the teacher's validation transform
+))
+
+
+def read_checkpoint(path: str) -> Dict[str, Any]:
+    """Load a checkpoint file into a dict with a model_state_dict entry"""
+    try:
+        # Suppress sklearn version warnings when unpickling the fitted encoders
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", category=UserWarning, module="sklearn")
+            checkpoint = torch.load(path, map_location=torch.device('cpu'), weights_only=False)
+    except Exception as e:
+        raise ModelLoadError(f"Failed to read checkpoint {path}: {e}") from e
+
+    if not isinstance(checkpoint, dict):
+        raise ModelLoadError(f"Unsupported checkpoint format in {path}: {type(checkpoint).__name__}")
+    if "model_state_dict" not in checkpoint:
+        # The file contains only the state_dict
+        checkpoint = {"model_state_dict": checkpoint}
+    return checkpoint
+
+
+def resolve_architecture(checkpoint: Dict[str, Any]) -> ModelArchitecture:
+    """Pick the architecture named in the checkpoint, or infer it from its keys"""
+    name = checkpoint.get("model_architecture")
+    if name is not None:
+        if name not in ARCHITECTURES:
+            raise ModelLoadError(f"Unknown model_architecture '{name}'")
+        return ARCHITECTURES[name]
+
+    state_dict = checkpoint["model_state_dict"]
+    for architecture in ARCHITECTURES.values():
+        if architecture.marker_key in state_dict:
+            return architecture
+    raise ModelLoadError("Could not infer model architecture from checkpoint keys")
+
+
+def _strip_prefix(state_dict: Dict[str, torch.Tensor], prefix: str = "module.") -> Dict[str, torch.Tensor]:
+    """Remove the DataParallel/DistributedDataParallel key prefix if present"""
+    if state_dict and all(key.startswith(prefix) for key in state_dict):
+        return {key[len(prefix):]: value for key, value in state_dict.items()}
+    return state_dict
+
+
+def _format_keys(keys: List[str], limit: int = 10) -> str:
+    shown = ", ".join(keys[:limit])
+    return shown + (f" ... (+{len(keys) - limit} more)" if len(keys) > limit else "")
+
+
+def build_model(checkpoint: Dict[str, Any], source: Optional[str] = None) -> LoadedModel:
+    """Reconstruct and strictly load the model described by a checkpoint dict"""
+    checkpoint = dict(checkpoint)
+    checkpoint["model_state_dict"] = _strip_prefix(checkpoint["model_state_dict"])
+    architecture = resolve_architecture(checkpoint)
+    state_dict = checkpoint["model_state_dict"]
+
+    try:
+        model = architecture.build(checkpoint, state_dict)
+    except ModelLoadError:
+        raise
+    except Exception as e:
+        raise ModelLoadError(f"Failed to build {architecture.name} from checkpoint: {e}") from e
+
+    model_keys = set(model.state_dict().keys())
+    missing = sorted(model_keys - set(state_dict))
+    unexpected = sorted(set(state_dict) - model_keys)
+    if missing or unexpected:
+        raise ModelLoadError(
+            f"Checkpoint does not match {architecture.name}: "
+            f"missing keys [{_format_keys(missing)}], unexpected keys [{_format_keys(unexpected)}]"
+        )
+    try:
+        model.load_state_dict(state_dict, strict=True)
+    except RuntimeError as e:
+        raise ModelLoadError(f"Checkpoint does not match {architecture.name}: {e}") from e
+    model.eval()
+
+    eval_resize = checkpoint.get("eval_resize") or architecture.eval_resize
+    if eval_resize not in EVAL_RESIZE_TRANSFORMS:
+        raise ModelLoadError(f"Unknown eval_resize '{eval_resize}', expected one of {sorted(EVAL_RESIZE_TRANSFORMS)}")
+
+    num_classes = _num_classes(checkpoint, state_dict, architecture.classifier_key)
+    class_names = checkpoint.get("class_names")
+    if class_names is None:
+        class_names = DEFAULT_CLASS_NAMES.get(num_classes, [f"class_{i}" for i in range(num_classes)])
+    class_names = [str(name) for name in class_names]
+
+    metadata = {key: value for key, value in checkpoint.items()
+                if key in ("model_architecture", "metadata_dim", "quantum_info", "img_size",
+                           "best_val_acc", "test_acc", "epoch", "val_acc", "teacher", "teacher_agreement")}
+    metadata["eval_resize"] = eval_resize
+    return LoadedModel(
+        architecture=architecture.name,
+        model=model,
+        class_names=class_names,
+        feature_encoder=architecture.feature_encoder(checkpoint),
+        returns_logits=architecture.returns_logits,
+        source=source,
+        metadata=metadata,
+        eval_resize=eval_resize
+    )
+
+
+def load_model_from_checkpoint(path: str) -> LoadedModel:
+    """Read a checkpoint file and reconstruct the trained model it contains"""
+    loaded = build_model(read_checkpoint(path), source=path)
+    logger.info(f"Loaded {loaded.architecture} from {path} (classes: {loaded.class_names})")
+    return loaded
+
+
+def build_untrained_model() -> LoadedModel:
+    """Randomly initialized ResNet-50 model, used when no checkpoint is available"""
+    model = MultimodalHQCNN(num_clinical_features=10, num_classes=3)
+    model.eval()
+    return LoadedModel(
+        architecture="MultimodalResNet50",
+        model=model,
+        class_names=DEFAULT_CLASS_NAMES[3],
+        feature_encoder=ClinicalFeatureEncoder(),
+        returns_logits=False,
+        eval_resize=EVAL_RESIZE_SQUASH
+    )
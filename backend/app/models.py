@@ -0,0 +1,381 @@
+# models.py
+# Model architectures served by the backend.
+# MultimodalHQCNN is the ResNet-50 + clinical MLP model; HybridMultimodalHQCNN is the
+# lightweight GroupNorm DenseNet + 4-qubit QCNN model trained in the notebook;
+# MultimodalStudent is the compact model distilled from either of them (see distill.py).
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torchvision.models as models
+
+from .quantum import QCNNSimulator, NUM_QUBITS
+
+
+# Complete Multimodal HQCNN Model Architecture
+class MultimodalHQCNN(nn.Module):
+    # Modules that only see the image; their output is what embed_image returns
+    EMBEDDING_MODULES = ("backbone", "image_processor")
+    # Last convolutional stage, used for Grad-CAM explanations
+    GRADCAM_LAYER = "backbone.layer4"
+
+    def __init__(self, num_clinical_features=10, num_classes=3):
+        super(MultimodalHQCNN, self).__init__()
+
+        # Image feature extractor (CNN backbone)
+        self.backbone = models.resnet50(weights=None)
+        self.backbone.fc = nn.Identity()  # Remove final classification layer
+
+        # Image feature processor
+        self.image_processor = nn.Sequential(
+            nn.Linear(2048, 512),
+            nn.ReLU(),
+            nn.Dropout(0.3),
+            nn.Linear(512, 256),
+            nn.ReLU(),
+            nn.Dropout(0.2)
+        )
+
+        # Clinical data processor
+        self.clinical_processor = nn.Sequential(
+            nn.Linear(num_clinical_features, 128),
+            nn.ReLU(),
+            nn.Dropout(0.2),
+            nn.Linear(128, 64),
+            nn.ReLU(),
+            nn.Dropout(0.1)
+        )
+
+        # Fusion layer
+        self.fusion = nn.Sequential(
+            nn.Linear(256 + 64, 128),  # Image features + Clinical features
+            nn.ReLU(),
+            nn.Dropout(0.3),
+            nn.Linear(128, 64),
+            nn.ReLU(),
+            nn.Dropout(0.2)
+        )
+
+        # Final classifier
+        self.classifier = nn.Sequential(
+            nn.Linear(64, 32),
+            nn.ReLU(),
+            nn.Dropout(0.1),
+            nn.Linear(32, num_classes),
+            nn.Softmax(dim=1)
+        )
+
+    def embed_image(self, image_tensor):
+        """256-d image features; depends only on the image"""
+        image_features = self.backbone(image_tensor)
+        return self.image_processor(image_features)
+
+    def fuse(self, image_features, clinical_tensor):
+        """Class probabilities from image features and clinical data"""
+        # Process clinical data
+        clinical_features = self.clinical_processor(clinical_tensor)
+
+        # Fuse features
+        fused_features = torch.cat([image_features, clinical_features], dim=1)
+        fused_features = self.fusion(fused_features)
+
+        # Final prediction
+        output = self.classifier(fused_features)
+        return output
+
+    def forward(self, image_tensor, clinical_tensor):
+        return self.fuse(self.embed_image(image_tensor), clinical_tensor)
+
+
+# Helper function for GroupNorm compatibility
+def get_valid_num_groups(num_channels, max_groups=4):
+    """Get a valid number of groups for GroupNorm that divides num_channels."""
+    if num_channels < max_groups:
+        max_groups = num_channels
+    for g in range(max_groups, 0, -1):
+        if num_channels % g == 0:
+            return g
+    return 1
+
+
+# Lightweight DenseNet Components (same layout as the training notebook)
+class _DenseLayer(nn.Module):
+    """Single dense layer with GroupNorm. Safely aligns spatial dims before concatenation."""
+    def __init__(self, num_input_features, growth_rate, bn_size):
+        super().__init__()
+        num_groups = get_valid_num_groups(num_input_features)
+        self.norm1 = nn.GroupNorm(num_groups, num_input_features)
+        self.relu1 = nn.ReLU(inplace=True)
+        self.conv1 = nn.Conv2d(num_input_features, bn_size * growth_rate,
+                               kernel_size=1, stride=1, bias=False)
+
+        num_groups2 = get_valid_num_groups(bn_size * growth_rate)
+        self.norm2 = nn.GroupNorm(num_groups2, bn_size * growth_rate)
+        self.relu2 = nn.ReLU(inplace=True)
+        self.conv2 = nn.Conv2d(bn_size * growth_rate, growth_rate,
+                               kernel_size=3, stride=1, padding=1, bias=False)
+
+    def forward(self, x):
+        out = self.conv1(self.relu1(self.norm1(x)))
+        out = self.conv2(self.relu2(self.norm2(out)))
+        # Align spatial dims if necessary (rare) using bilinear interpolation
+        if out.shape[2:] != x.shape[2:]:
+            out = F.interpolate(out, size=x.shape[2:], mode='bilinear', align_corners=False)
+        return torch.cat([x, out], 1)
+
+
+class _DenseBlock(nn.Module):
+    """Dense block with multiple dense layers."""
+    def __init__(self, num_layers, num_input_features, bn_size, growth_rate):
+        super().__init__()
+        layers = []
+        for i in range(num_layers):
+            layer = _DenseLayer(num_input_features + i * growth_rate, growth_rate, bn_size)
+            layers.append(layer)
+        self.block = nn.Sequential(*layers)
+
+    def forward(self, x):
+        return self.block(x)
+
+
+class _Transition(nn.Module):
+    """Transition layer between dense blocks."""
+    def __init__(self, num_input_features, num_output_features):
+        super().__init__()
+        num_groups = get_valid_num_groups(num_input_features)
+        self.norm = nn.GroupNorm(num_groups, num_input_features)
+        self.relu = nn.ReLU(inplace=True)
+        self.conv = nn.Conv2d(num_input_features, num_output_features,
+                              kernel_size=1, stride=1, bias=False)
+        self.pool = nn.AvgPool2d(kernel_size=2, stride=2)
+
+    def forward(self, x):
+        return self.pool(self.conv(self.relu(self.norm(x))))
+
+
+class HybridMultimodalHQCNN(nn.Module):
+    """
+    DenseNet + QCNN image branch with a metadata MLP, as trained in the notebook.
+
+    The quantum head runs on QCNNSimulator, which is numerically identical to the
+    qiskit TorchConnector used for training and shares its state_dict layout.
+    Returns (logits, quantum_output, image_features, metadata_features).
+    """
+    # Modules that only see the image; their output is what embed_image returns
+    EMBEDDING_MODULES = ("image_features", "image_fc1", "image_fc2")
+    # Last convolutional stage, used for Grad-CAM explanations
+    GRADCAM_LAYER = "image_features.norm5"
+
+    def __init__(self, num_classes=2, metadata_dim=3,
+                 growth_rate=24, block_config=(6, 12, 24, 16),
+                 num_init_features=32, bn_size=4):
+        super().__init__()
+
+        self.num_classes = num_classes
+        self.metadata_dim = metadata_dim
+
+        # === IMAGE BRANCH (DenseNet + QCNN) ===
+        num_groups = get_valid_num_groups(num_init_features)
+        self.image_features = nn.Sequential(
+            nn.Conv2d(3, num_init_features, kernel_size=7, stride=2, padding=3, bias=False),
+            nn.GroupNorm(num_groups, num_init_features),
+            nn.ReLU(inplace=True),
+            nn.MaxPool2d(kernel_size=3, stride=2, padding=1)
+        )
+
+        # Dense blocks
+        num_features = num_init_features
+        for i, num_layers in enumerate(block_config):
+            block = _DenseBlock(num_layers, num_features, bn_size, growth_rate)
+            self.image_features.add_module(f'denseblock{i+1}', block)
+            num_features = num_features + num_layers * growth_rate
+
+            if i != len(block_config) - 1:
+                trans = _Transition(num_input_features=num_features,
+                                    num_output_features=num_features // 2)
+                self.image_features.add_module(f'transition{i+1}', trans)
+                num_features = num_features // 2
+
+        # Final normalization
+        num_groups_final = get_valid_num_groups(num_features)
+        self.image_features.add_module('norm5', nn.GroupNorm(num_groups_final, num_features))
+
+        # Image feature processing
+        self.global_pool = nn.AdaptiveAvgPool2d(1)
+        self.image_flatten = nn.Flatten()
+        self.image_fc1 = nn.Linear(num_features, 128)
+        self.image_dropout1 = nn.Dropout(0.3)
+        self.image_fc2 = nn.Linear(128, 64)
+        self.image_dropout2 = nn.Dropout(0.2)
+
+        # Quantum feature extraction
+        self.quantum_input = nn.Linear(64, NUM_QUBITS)  # Map to 4 qubits
+        self.qnn = QCNNSimulator()
+
+        # === METADATA BRANCH ===
+        self.metadata_fc1 = nn.Linear(metadata_dim, 32)
+        self.metadata_dropout1 = nn.Dropout(0.2)
+        self.metadata_fc2 = nn.Linear(32, 16)
+        self.metadata_dropout2 = nn.Dropout(0.1)
+
+        # === FUSION LAYER ===
+        # Combine quantum output (1D) + metadata features (16D)
+        self.fusion_fc1 = nn.Linear(1 + 16, 32)
+        self.fusion_dropout = nn.Dropout(0.3)
+        self.fusion_fc2 = nn.Linear(32, 16)
+
+        # Final classification
+        self.classifier = nn.Linear(16, num_classes)
+
+    def embed_image(self, images):
+        """64-d image features ahead of the quantum head; depends only on the image"""
+        x = self.image_features(images)
+        img_features = self.global_pool(x)
+        img_features = self.image_flatten(img_features)
+
+        # Process image features
+        img_features = torch.relu(self.image_fc1(img_features))
+        img_features = self.image_dropout1(img_features)
+        img_features = torch.relu(self.image_fc2(img_features))
+        img_features = self.image_dropout2(img_features)
+        return img_features
+
+    def fuse(self, img_features, metadata):
+        """Quantum head, metadata branch and fusion on precomputed image features"""
+        # Quantum head on 4 features
+        quantum_output = self.qnn(self.quantum_input(img_features))
+
+        # === METADATA BRANCH ===
+        meta_features = torch.relu(self.metadata_fc1(metadata))
+        meta_features = self.metadata_dropout1(meta_features)
+        meta_features = torch.relu(self.metadata_fc2(meta_features))
+        meta_features = self.metadata_dropout2(meta_features)
+
+        # === FUSION ===
+        combined_features = torch.cat([quantum_output, meta_features], dim=1)
+        fused = torch.relu(self.fusion_fc1(combined_features))
+        fused = self.fusion_dropout(fused)
+        fused = torch.relu(self.fusion_fc2(fused))
+
+        # Final classification
+        final_output = self.classifier(fused)
+
+        return final_output, quantum_output, img_features, meta_features
+
+    def forward(self, images, metadata):
+        return self.fuse(self.embed_image(images), metadata)
+
+
+# MobileNetV2-style components for the distilled student
+class _InvertedResidual(nn.Module):
+    """1x1 expansion, depthwise 3x3, linear 1x1 projection; residual when shapes allow"""
+    def __init__(self, in_channels, hidden_channels, out_channels, stride):
+        super().__init__()
+        self.expand = nn.Sequential(
+            nn.Conv2d(in_channels, hidden_channels, kernel_size=1, bias=False),
+            nn.BatchNorm2d(hidden_channels),
+            nn.ReLU6(inplace=True)
+        )
+        self.depthwise = nn.Sequential(
+            nn.Conv2d(hidden_channels, hidden_channels, kernel_size=3, stride=stride, padding=1,
+                      groups=hidden_channels, bias=False),
+            nn.BatchNorm2d(hidden_channels),
+            nn.ReLU6(inplace=True)
+        )
+        self.project = nn.Sequential(
+            nn.Conv2d(hidden_channels, out_channels, kernel_size=1, bias=False),
+            nn.BatchNorm2d(out_channels)
+        )
+        self.use_residual = stride == 1 and in_channels == out_channels
+
+    def forward(self, x):
+        out = self.project(self.depthwise(self.expand(x)))
+        return x + out if self.use_residual else out
+
+
+class MultimodalStudent(nn.Module):
+    """
+    Compact MobileNetV2-style image branch with a clinical MLP, distilled from a larger model.
+
+    blocks lists (in_channels, hidden_channels, out_channels, stride) per inverted residual
+    block; structured pruning shrinks hidden_channels, so the list is stored in the
+    checkpoint to rebuild the exact shapes. Returns (logits, fused_features).
+    """
+    # Modules that only see the image; their output is what embed_image returns
+    EMBEDDING_MODULES = ("image_features", "image_processor")
+    # Last convolutional stage, used for Grad-CAM explanations
+    GRADCAM_LAYER = "image_features.head"
+
+    DEFAULT_BLOCKS = (
+        (16, 16, 16, 1),
+        (16, 64, 24, 2), (24, 96, 24, 1),
+        (24, 96, 32, 2), (32, 128, 32, 1), (32, 128, 32, 1),
+        (32, 192, 64, 2), (64, 256, 64, 1), (64, 256, 64, 1),
+        (64, 384, 96, 1), (96, 384, 96, 1),
+        (96, 576, 160, 2), (160, 640, 160, 1)
+    )
+
+    def __init__(self, num_clinical_features=10, num_classes=3, blocks=None,
+                 stem_channels=16, head_channels=512, embedding_dim=256):
+        super().__init__()
+        blocks = [tuple(int(v) for v in block) for block in (blocks or self.DEFAULT_BLOCKS)]
+        self.config = {
+            "blocks": [list(block) for block in blocks],
+            "stem_channels": stem_channels,
+            "head_channels": head_channels,
+            "embedding_dim": embedding_dim
+        }
+
+        # Image branch
+        self.image_features = nn.Sequential()
+        self.image_features.add_module('stem', nn.Sequential(
+            nn.Conv2d(3, stem_channels, kernel_size=3, stride=2, padding=1, bias=False),
+            nn.BatchNorm2d(stem_channels),
+            nn.ReLU6(inplace=True)
+        ))
+        self.image_features.add_module('blocks', nn.Sequential(
+            *[_InvertedResidual(*block) for block in blocks]
+        ))
+        self.image_features.add_module('head', nn.Sequential(
+            nn.Conv2d(blocks[-1][2], head_channels, kernel_size=1, bias=False),
+            nn.BatchNorm2d(head_channels),
+            nn.ReLU6(inplace=True)
+        ))
+        self.image_features.add_module('pool', nn.AdaptiveAvgPool2d(1))
+        self.image_features.add_module('flatten', nn.Flatten())
+
+        self.image_processor = nn.Sequential(
+            nn.Linear(head_channels, embedding_dim),
+            nn.ReLU(),
+            nn.Dropout(0.2)
+        )
+
+        # Clinical branch
+        self.clinical_processor = nn.Sequential(
+            nn.Linear(num_clinical_features, 64),
+            nn.ReLU(),
+            nn.Dropout(0.1),
+            nn.Linear(64, 32),
+            nn.ReLU()
+        )
+
+        # Fusion and classification
+        self.fusion = nn.Sequential(
+            nn.Linear(embedding_dim + 32, 64),
+            nn.ReLU(),
+            nn.Dropout(0.2)
+        )
+        self.classifier = nn.Linear(64, num_classes)
+
+    def embed_image(self, image_tensor):
+        """Image embedding; depends only on the image"""
+        return self.image_processor(self.image_features(image_tensor))
+
+    def fuse(self, image_features, clinical_tensor):
+        """Logits from image embeddings and clinical data"""
+        clinical_features = self.clinical_processor(clinical_tensor)
+        fused = self.fusion(torch.cat([image_features, clinical_features], dim=1))
+        return self.classifier(fused), fused
+
+    def forward(self, image_tensor, clinical_tensor):
+        return self.fuse(self.embed_image(image_tensor), clinical_tensor)
@@ -0,0 +1,181 @@
+# patient_store.py
+# Read-through / write-through caching around the patient and health record queries.
+# Patient documents and each patient's most recent health records are served from Redis;
+# misses are filled from the Mongo primary (so a fill right after a write never caches
+# a lagging secondary's view), writes refresh or invalidate the cached entries, and
+# unknown patient IDs are cached briefly as misses. Starting a session warms the
+# session's patients and the most frequently read ones.
+# Every write bumps a per-patient version after it reaches Mongo. Fills read the version
+# before loading and only store their copy while it is unchanged, so a reader that loaded
+# before a write cannot put its stale copy back after the writer's refresh or invalidation.
+
+import os
+import uuid
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import database
+
+try:
+    from .cache import (
+        cache_patient_data, get_cached_patient_data, cache_health_record, get_cached_health_record,
+        cache_session_data, record_patient_access, get_frequent_patients, delete_cache,
+        get_many_cache, patient_cache_key, health_record_cache_key, patient_version_key,
+        get_cache_versions, bump_cache_version, set_many_cache_if_version
+    )
+    REDIS_CACHE_AVAILABLE = True
+except ImportError:
+    REDIS_CACHE_AVAILABLE = False
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Patient cache configuration from environment variables
+PATIENT_CACHE_TTL = int(os.getenv("PATIENT_CACHE_TTL", "3600"))  # 1 hour
+PATIENT_NEGATIVE_TTL = int(os.getenv("PATIENT_NEGATIVE_TTL", "60"))  # unknown patient IDs
+HEALTH_RECORD_CACHE_TTL = int(os.getenv("HEALTH_RECORD_CACHE_TTL", "7200"))  # 2 hours
+HEALTH_RECORD_CACHE_DEPTH = int(os.getenv("HEALTH_RECORD_CACHE_DEPTH", "50"))  # records cached per patient
+PATIENT_WARM_TOP_N = int(os.getenv("PATIENT_WARM_TOP_N", "20"))
+
+# Cached in place of a patient that does not exist
+MISSING = {"_missing": True}
+
+
+def _json_ready(document: Dict[str, Any]) -> Dict[str, Any]:
+    """Same representation whether a document comes from Mongo or from the cache"""
+    return {key: value.isoformat() if isinstance(value, datetime) else value
+            for key, value in document.items()}
+
+
+def _load_patient(patient_id: str) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any], int]:
+    """Patient from the primary, plus the cache entry and TTL to store for it"""
+    patient = database.get_patient(patient_id)  # primary read
+    if patient is None:
+        return None, MISSING, PATIENT_NEGATIVE_TTL
+    patient = _json_ready(patient)
+    return patient, patient, PATIENT_CACHE_TTL
+
+
+def _patient_version(patient_id: str) -> Optional[str]:
+    """Version to fill the patient's entries under, read before loading; None without Redis"""
+    if not REDIS_CACHE_AVAILABLE:
+        return None
+    return get_cache_versions([patient_version_key(patient_id)]).get(patient_version_key(patient_id))
+
+
+def _fill_patient(patient_id: str) -> Optional[Dict[str, Any]]:
+    version = _patient_version(patient_id)
+    patient, entry, ttl = _load_patient(patient_id)
+    if version is not None:
+        cache_patient_data(patient_id, entry, ttl, version=version)
+    return patient
+
+
+def get_patient(patient_id: str) -> Optional[Dict[str, Any]]:
+    """Patient document, from the cache when present"""
+    if REDIS_CACHE_AVAILABLE:
+        record_patient_access(patient_id)
+        cached = get_cached_patient_data(patient_id)
+        if cached is not None:
+            return None if cached == MISSING else cached
+    return _fill_patient(patient_id)
+
+
+def upsert_patient(patient_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Write the patient to Mongo and refresh its cache entry"""
+    result = database.upsert_patient(patient_data)
+    if REDIS_CACHE_AVAILABLE:
+        # Fills that loaded the patient before this write can no longer store it
+        bump_cache_version(patient_version_key(patient_data["patient_id"]))
+        # Re-read the stored document so the cache holds exactly what Mongo has
+        # (this also replaces a cached miss)
+        try:
+            _fill_patient(patient_data["patient_id"])
+        except Exception as e:
+            logger.warning(f"Failed to refresh cached patient {patient_data['patient_id']}: {e}")
+            delete_cache(patient_cache_key(patient_data["patient_id"]))
+    return result
+
+
+def _load_health_records(patient_id: str, limit: int) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """A patient's most recent records from the primary, plus the cache entry for them"""
+    depth = max(limit, HEALTH_RECORD_CACHE_DEPTH)
+    records = [_json_ready(record) for record in
+               database.get_health_records(patient_id, limit=depth, consistent=True)]
+    return records[:limit], {"records": records, "complete": len(records) < depth}
+
+
+def _fill_health_records(patient_id: str, limit: int) -> List[Dict[str, Any]]:
+    version = _patient_version(patient_id)
+    records, entry = _load_health_records(patient_id, limit)
+    if version is not None:
+        cache_health_record(patient_id, entry, HEALTH_RECORD_CACHE_TTL, version=version)
+    return records
+
+
+def get_health_records(patient_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """Most recent health records of a patient, from the cache when it holds enough of them"""
+    if REDIS_CACHE_AVAILABLE:
+        cached = get_cached_health_record(patient_id)
+        if cached is not None and (limit <= len(cached["records"]) or cached["complete"]):
+            return cached["records"][:limit]
+    return _fill_health_records(patient_id, limit)
+
+
+def insert_health_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Write the record to Mongo and invalidate the patient's cached records"""
+    result = database.insert_health_record(record)
+    if REDIS_CACHE_AVAILABLE:
+        bump_cache_version(patient_version_key(record["patient_id"]))
+        delete_cache(health_record_cache_key(record["patient_id"]))
+    return result
+
+
+def warm_patients(patient_ids: List[str], records_limit: int = 10) -> int:
+    """Load patients and their recent records into the cache; returns the number warmed"""
+    if not REDIS_CACHE_AVAILABLE:
+        return 0
+    patient_ids = list(dict.fromkeys(patient_ids))
+    # Versions are read before anything is loaded, like a single fill
+    versions = get_cache_versions([patient_version_key(patient_id) for patient_id in patient_ids])
+    if not versions:
+        return 0
+    # One pipelined read for every patient's entries; only the misses go to Mongo
+    cached = get_many_cache([key for patient_id in patient_ids
+                             for key in (patient_cache_key(patient_id), health_record_cache_key(patient_id))])
+    entries = []
+    warmed = 0
+    for patient_id in patient_ids:
+        version_key = patient_version_key(patient_id)
+        try:
+            if patient_cache_key(patient_id) not in cached:
+                _, entry, ttl = _load_patient(patient_id)
+                entries.append((patient_cache_key(patient_id), entry, ttl, version_key, versions[version_key]))
+            if health_record_cache_key(patient_id) not in cached:
+                _, entry = _load_health_records(patient_id, records_limit)
+                entries.append((health_record_cache_key(patient_id), entry, HEALTH_RECORD_CACHE_TTL,
+                                version_key, versions[version_key]))
+            warmed += 1
+        except Exception as e:
+            logger.warning(f"Failed to warm patient {patient_id}: {e}")
+    set_many_cache_if_version(entries)
+    logger.info(f"Warmed cache for {warmed} patients")
+    return warmed
+
+
+def start_session(user_id: str, patient_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Create a session and return it with the patients that should be warmed for it"""
+    session = {
+        "session_id": uuid.uuid4().hex,
+        "user_id": user_id,
+        "patient_ids": list(patient_ids or []),
+        "started_at": datetime.utcnow().isoformat()
+    }
+    if REDIS_CACHE_AVAILABLE:
+        cache_session_data(session["session_id"], session)
+        frequent = get_frequent_patients(PATIENT_WARM_TOP_N)
+    else:
+        frequent = []
+    session["warm_patient_ids"] = list(dict.fromkeys(session["patient_ids"] + frequent))
+    return session
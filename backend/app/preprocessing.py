@@ -0,0 +1,323 @@
+# preprocessing.py
+# Shared image preprocessing for training and serving.
+# Hair removal follows the training notebook (black-hat morphology, threshold, Telea inpaint)
+# but runs the morphology and thresholding on a whole batch as tensor ops.
+
+import os
+import logging
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+import torchvision.transforms as transforms
+from torch.utils.data import default_collate
+from PIL import Image
+
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Hair removal configuration (defaults match remove_hair in the training notebook)
+HAIR_KERNEL_SIZE = int(os.getenv("HAIR_KERNEL_SIZE", "17"))
+HAIR_THRESHOLD = int(os.getenv("HAIR_THRESHOLD", "10"))
+HAIR_INPAINT_RADIUS = int(os.getenv("HAIR_INPAINT_RADIUS", "1"))
+# Fraction of pixels that must be flagged as hair before inpainting is worth its cost
+HAIR_COVERAGE_THRESHOLD = float(os.getenv("HAIR_COVERAGE_THRESHOLD", "0.005"))
+# The kernel size is tuned for HAM10000 resolution (600x450), so larger uploads are
+# downscaled to this longest side before hair removal
+HAIR_REMOVAL_MAX_SIDE = int(os.getenv("HAIR_REMOVAL_MAX_SIDE", "600"))
+HAIR_REMOVAL_ENABLED = os.getenv("HAIR_REMOVAL_ENABLED", "true").lower() == "true"
+
+# Model input settings
+IMG_SIZE = 224
+EVAL_RESIZE_SIDE = int(IMG_SIZE * 1.15)  # short side before the centre crop, as in the notebook
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+# Upload negotiation: clients downscale to the largest side the server still uses (the
+# hair removal resolution, or without it the long side of a 4:3 HAM10000 image whose short
+# side is still EVAL_RESIZE_SIDE) and re-encode before upload
+UPLOAD_MAX_SIDE = HAIR_REMOVAL_MAX_SIDE if HAIR_REMOVAL_ENABLED else round(EVAL_RESIZE_SIDE * 4 / 3)
+UPLOAD_FORMATS = [f.strip() for f in os.getenv("UPLOAD_FORMATS", "image/jpeg,image/webp,image/png").split(",")]
+UPLOAD_QUALITY = float(os.getenv("UPLOAD_QUALITY", "0.9"))  # lossy encoder quality, 0-1
+# Reject oversized uploads even from clients that did not negotiate a size
+UPLOAD_SIZE_ENFORCED = os.getenv("UPLOAD_SIZE_ENFORCED", "false").lower() == "true"
+
+# ITU-R BT.601 luma weights in the 15-bit fixed point cv2.COLOR_RGB2GRAY computes with
+# (its R2GRAY, G2GRAY, B2GRAY and gray_shift)
+_GRAY_WEIGHTS = torch.tensor([9798, 19235, 3735], dtype=torch.int32).view(1, 3, 1, 1)
+_GRAY_SHIFT = 15
+
+if not CV2_AVAILABLE:
+    logger.warning("OpenCV not available - hair masks will be computed but not inpainted")
+
+# Eval-time resizing to the model input, by the name checkpoints record as eval_resize.
+# "center_crop" is the notebook's val_transforms (short side to EVAL_RESIZE_SIDE, then the
+# central IMG_SIZE square); "squash" stretches to IMG_SIZE x IMG_SIZE, as the server did
+# before it served notebook checkpoints.
+EVAL_RESIZE_CENTER_CROP = "center_crop"
+EVAL_RESIZE_SQUASH = "squash"
+DEFAULT_EVAL_RESIZE = EVAL_RESIZE_CENTER_CROP
+EVAL_RESIZE_TRANSFORMS = {
+    EVAL_RESIZE_CENTER_CROP: transforms.Compose([
+        transforms.Resize(EVAL_RESIZE_SIDE),
+        transforms.CenterCrop(IMG_SIZE)
+    ]),
+    EVAL_RESIZE_SQUASH: transforms.Resize((IMG_SIZE, IMG_SIZE)),
+}
+
+# Serving transform applied after hair removal, in two steps: resizing (whose uint8 output
+# is what the image store keeps) and conversion to a normalized tensor
+resize_transform = EVAL_RESIZE_TRANSFORMS[DEFAULT_EVAL_RESIZE]
+tensor_transform = transforms.Compose([
+    transforms.ToTensor(),
+    transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+])
+inference_transform = transforms.Compose([resize_transform, tensor_transform])
+
+# Same transform for HWC uint8 arrays, e.g. as the HairRemovalCollate transform
+array_inference_transform = transforms.Compose([transforms.ToPILImage(), inference_transform])
+
+# Training augmentation from the notebook, applied after hair removal to HWC uint8 arrays
+array_train_transform = transforms.Compose([
+    transforms.ToPILImage(),
+    transforms.RandomResizedCrop(IMG_SIZE, scale=(0.8, 1.0)),
+    transforms.RandomHorizontalFlip(p=0.5),
+    transforms.RandomVerticalFlip(p=0.2),
+    transforms.RandomRotation(degrees=20),
+    transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.1),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+])
+
+
+def eval_resize_transform(eval_resize: str = DEFAULT_EVAL_RESIZE) -> Callable:
+    """PIL resize to the model input for an eval_resize name; raises ValueError for unknown names"""
+    try:
+        return EVAL_RESIZE_TRANSFORMS[eval_resize]
+    except KeyError:
+        raise ValueError(f"unknown eval_resize '{eval_resize}', expected one of {sorted(EVAL_RESIZE_TRANSFORMS)}")
+
+
+def array_eval_transform(eval_resize: str = DEFAULT_EVAL_RESIZE) -> Callable:
+    """array_inference_transform with the given eval_resize"""
+    return transforms.Compose([transforms.ToPILImage(), eval_resize_transform(eval_resize), tensor_transform])
+
+
+def _to_nchw_uint8(images: Union[torch.Tensor, np.ndarray, Sequence[np.ndarray]]) -> torch.Tensor:
+    """Convert a batch of RGB images (NHWC arrays or NCHW tensor) to an NCHW uint8 tensor"""
+    if isinstance(images, torch.Tensor):
+        batch = images
+        if batch.dim() == 3:
+            batch = batch.unsqueeze(0)
+        if batch.shape[-1] == 3 and batch.shape[1] != 3:
+            batch = batch.permute(0, 3, 1, 2)
+        return batch.to(torch.uint8).contiguous()
+
+    if isinstance(images, np.ndarray):
+        array = images if images.ndim == 4 else images[None]
+    else:
+        array = np.stack([np.asarray(img) for img in images])
+    return torch.from_numpy(np.ascontiguousarray(array)).permute(0, 3, 1, 2).contiguous()
+
+
+def _dilate(x: torch.Tensor, kernel_size: int) -> torch.Tensor:
+    """Grey dilation with a square kernel, computed as two separable max-pools"""
+    pad = kernel_size // 2
+    x = F.max_pool2d(F.pad(x, (pad, pad, 0, 0), value=float("-inf")), (1, kernel_size), stride=1)
+    return F.max_pool2d(F.pad(x, (0, 0, pad, pad), value=float("-inf")), (kernel_size, 1), stride=1)
+
+
+def _erode(x: torch.Tensor, kernel_size: int) -> torch.Tensor:
+    """Grey erosion with a square kernel"""
+    return -_dilate(-x, kernel_size)
+
+
+def hair_masks(images: Union[torch.Tensor, np.ndarray, Sequence[np.ndarray]],
+               kernel_size: int = HAIR_KERNEL_SIZE,
+               threshold: int = HAIR_THRESHOLD) -> torch.Tensor:
+    """Compute binary hair masks (N, H, W) for a batch of same-sized RGB uint8 images"""
+    batch = _to_nchw_uint8(images).to(torch.int32)
+
+    # Grayscale in cv2's fixed point, so the threshold sees exactly the same integer levels
+    gray = ((batch * _GRAY_WEIGHTS).sum(dim=1, keepdim=True) + (1 << (_GRAY_SHIFT - 1))) >> _GRAY_SHIFT
+    gray = gray.float()
+
+    # Black-hat: morphological closing minus the original highlights thin dark hair
+    closed = _erode(_dilate(gray, kernel_size), kernel_size)
+    blackhat = closed - gray
+
+    return (blackhat > threshold).squeeze(1)
+
+
+def compare_hair_masks_with_cv2(num_samples: int = 8, height: int = 97, width: int = 120, seed: int = 0,
+                                kernel_size: int = HAIR_KERNEL_SIZE, threshold: int = HAIR_THRESHOLD) -> int:
+    """
+    Number of pixels where hair_masks differs from the OpenCV pipeline it replaces
+    (RGB2GRAY, MORPH_BLACKHAT with a square kernel, binary threshold) on random images.
+
+    Requires OpenCV; used to validate hair_masks.
+    """
+    rng = np.random.default_rng(seed)
+    images = rng.integers(0, 256, size=(num_samples, height, width, 3), dtype=np.uint8)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
+
+    masks = hair_masks(images, kernel_size, threshold).numpy()
+    differing = 0
+    for img, mask in zip(images, masks):
+        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+        blackhat = cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, kernel)
+        _, expected = cv2.threshold(blackhat, threshold, 255, cv2.THRESH_BINARY)
+        differing += int(np.count_nonzero(mask != (expected > 0)))
+    return differing
+
+
+def remove_hair_batch(images: Union[torch.Tensor, np.ndarray, Sequence[np.ndarray]],
+                      coverage_threshold: float = HAIR_COVERAGE_THRESHOLD) -> List[np.ndarray]:
+    """
+    Remove hair artifacts from a batch of same-sized RGB uint8 images.
+
+    Masks are computed for the whole batch at once; OpenCV inpainting only runs on
+    images whose hair coverage exceeds coverage_threshold. Returns HWC uint8 arrays.
+    """
+    batch = _to_nchw_uint8(images)
+    masks = hair_masks(batch)
+    coverage = masks.flatten(1).float().mean(dim=1)
+
+    results = []
+    rgb = batch.permute(0, 2, 3, 1).numpy()
+    for i in range(batch.shape[0]):
+        img = np.ascontiguousarray(rgb[i])
+        if CV2_AVAILABLE and coverage[i].item() > coverage_threshold:
+            try:
+                mask = masks[i].numpy().astype(np.uint8) * 255
+                img = cv2.inpaint(img, mask, HAIR_INPAINT_RADIUS, cv2.INPAINT_TELEA)
+            except Exception as e:
+                logger.warning(f"Hair removal failed: {e}")
+        results.append(img)
+    return results
+
+
+def remove_hair(img: np.ndarray) -> np.ndarray:
+    """Remove hair artifacts from a single RGB uint8 image"""
+    return remove_hair_batch(np.asarray(img)[None])[0]
+
+
+def remove_hair_grouped(images: Sequence[np.ndarray],
+                        coverage_threshold: float = HAIR_COVERAGE_THRESHOLD) -> List[np.ndarray]:
+    """Remove hair from mixed-size images, batching together images of the same shape"""
+    results = list(images)
+    groups = {}
+    for idx, img in enumerate(results):
+        groups.setdefault(img.shape, []).append(idx)
+    for indices in groups.values():
+        cleaned = remove_hair_batch(np.stack([results[i] for i in indices]),
+                                    coverage_threshold=coverage_threshold)
+        for idx, img in zip(indices, cleaned):
+            results[idx] = img
+    return results
+
+
+def prepare_images(images: Sequence[Image.Image], eval_resize: str = DEFAULT_EVAL_RESIZE) -> List[np.ndarray]:
+    """Apply hair removal and resize PIL images to the model input size (HWC uint8, not normalized)"""
+    resize = eval_resize_transform(eval_resize)
+    prepared = []
+    for image in images:
+        image = image.convert("RGB")
+        if max(image.size) > HAIR_REMOVAL_MAX_SIDE:
+            image = image.copy()
+            image.thumbnail((HAIR_REMOVAL_MAX_SIDE, HAIR_REMOVAL_MAX_SIDE), Image.BILINEAR)
+        prepared.append(np.asarray(image))
+
+    if HAIR_REMOVAL_ENABLED:
+        prepared = remove_hair_grouped(prepared)
+
+    return [np.array(resize(Image.fromarray(arr))) for arr in prepared]
+
+
+def upload_capabilities() -> Dict[str, Any]:
+    """Input size and encoding clients should downscale and re-encode uploads to"""
+    return {
+        "model_input": {"width": IMG_SIZE, "height": IMG_SIZE},
+        "upload": {
+            "max_side": UPLOAD_MAX_SIDE,
+            "resize": "fit",  # keep the aspect ratio; the longest side is at most max_side
+            "formats": UPLOAD_FORMATS,
+            "preferred_format": UPLOAD_FORMATS[0],
+            "quality": UPLOAD_QUALITY,
+            "enforced": UPLOAD_SIZE_ENFORCED
+        }
+    }
+
+
+def check_upload(image: Image.Image, max_side: Optional[int] = None):
+    """
+    Raise ValueError if an opened (not yet decoded) upload breaks the negotiated limits.
+
+    max_side is the size the client negotiated; without one, only UPLOAD_SIZE_ENFORCED
+    uploads are checked.
+    """
+    if max_side is None and not UPLOAD_SIZE_ENFORCED:
+        return
+    if max_side is not None and max_side != UPLOAD_MAX_SIDE:
+        raise ValueError(f"negotiated max side {max_side} is stale, /capabilities now advertises {UPLOAD_MAX_SIDE}")
+    mime = Image.MIME.get(image.format or "")
+    if mime not in UPLOAD_FORMATS:
+        raise ValueError(f"format {mime or image.format} not accepted, use one of {UPLOAD_FORMATS}")
+    if max(image.size) > UPLOAD_MAX_SIDE:
+        width, height = image.size
+        raise ValueError(f"image is {width}x{height}, longest side must be at most {UPLOAD_MAX_SIDE}")
+
+
+def inputs_from_arrays(arrays: Sequence[np.ndarray]) -> torch.Tensor:
+    """Normalized NCHW model input from prepare_images output"""
+    for arr in arrays:
+        if arr.shape != (IMG_SIZE, IMG_SIZE, 3):
+            raise ValueError(f"expected a prepared {IMG_SIZE}x{IMG_SIZE} RGB input, got shape {arr.shape}")
+    return torch.stack([tensor_transform(arr) for arr in arrays])
+
+
+def preprocess_images(images: Sequence[Image.Image], eval_resize: str = DEFAULT_EVAL_RESIZE) -> torch.Tensor:
+    """Apply hair removal and the serving transform to PIL images, returning an NCHW batch"""
+    return inputs_from_arrays(prepare_images(images, eval_resize))
+
+
+def preprocess_image(image: Image.Image, eval_resize: str = DEFAULT_EVAL_RESIZE) -> torch.Tensor:
+    """Preprocess a single PIL image into a (1, 3, 224, 224) model input"""
+    return preprocess_images([image], eval_resize)
+
+
+class HairRemovalCollate:
+    """
+    DataLoader collate_fn that removes hair from a whole batch at once.
+
+    Expects samples of (image, *rest) where image is an RGB uint8 HWC array; the
+    per-sample transform (augmentation, ToTensor, Normalize) runs after hair removal.
+    With remove_hair=False the images are taken as already prepared (e.g. stored inputs).
+    """
+
+    def __init__(self, transform: Optional[Callable] = None,
+                 coverage_threshold: float = HAIR_COVERAGE_THRESHOLD, remove_hair: bool = True):
+        self.transform = transform
+        self.coverage_threshold = coverage_threshold
+        self.remove_hair = remove_hair
+
+    def __call__(self, samples: List[Tuple]) -> Tuple:
+        images = [np.asarray(sample[0]) for sample in samples]
+        if self.remove_hair:
+            images = remove_hair_grouped(images, coverage_threshold=self.coverage_threshold)
+
+        if self.transform is not None:
+            images = [self.transform(img) for img in images]
+        else:
+            images = [torch.from_numpy(img).permute(2, 0, 1) for img in images]
+
+        rest = [default_collate([sample[i] for sample in samples])
+                for i in range(1, len(samples[0]))]
+        return (torch.stack(images), *rest)
@@ -0,0 +1,272 @@
+# quantum.py
+# Native batched statevector simulator for the 4-qubit QCNN head of the hybrid model.
+# Reproduces ZFeatureMap(4) followed by the conv_layer/pool_layer ansatz from the training
+# notebook and the Z expectation on qubit 3 measured by its EstimatorQNN, but evaluates
+# it as dense complex tensor contractions in torch with autograd instead of qiskit
+# circuit binding and parameter-shift gradients.
+
+import math
+import logging
+from typing import Optional, Sequence
+
+import torch
+import torch.nn as nn
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+NUM_QUBITS = 4
+FEATURE_MAP_REPS = 2  # ZFeatureMap default
+
+# Two-qubit blocks of the ansatz in circuit order: (kind, first qubit, second qubit, weight offset).
+# Weight offsets follow EstimatorQNN's weight_params order, which sorts the ansatz parameters
+# by name: c1[0..11], c2[0..5], p1[0..5], p2[0..2].
+ANSATZ_BLOCKS = (
+    # conv_layer(4, "c1"): adjacent pairs, then overlapping pairs
+    ("conv", 0, 1, 0),
+    ("conv", 2, 3, 3),
+    ("conv", 1, 2, 6),
+    ("conv", 3, 0, 9),
+    # pool_layer([0, 1], [2, 3], "p1")
+    ("pool", 0, 2, 18),
+    ("pool", 1, 3, 21),
+    # conv_layer(2, "c2") on qubits 2, 3
+    ("conv", 2, 3, 12),
+    ("conv", 3, 2, 15),
+    # pool_layer([0], [1], "p2") on qubits 2, 3
+    ("pool", 2, 3, 24),
+)
+NUM_WEIGHTS = 27
+# SparsePauliOp "ZIII" is little-endian, so Z acts on qubit 3 (the final pooling sink)
+MEASURED_QUBIT = 3
+
+_DTYPE = torch.complex128
+
+# Fixed gates in the |a b> basis of a two-qubit block (a is the more significant bit)
+_I2 = torch.eye(2, dtype=_DTYPE)
+_CX_AB = torch.tensor([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]], dtype=_DTYPE)
+_CX_BA = torch.tensor([[1, 0, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0], [0, 1, 0, 0]], dtype=_DTYPE)
+
+
+def _rz(theta: torch.Tensor) -> torch.Tensor:
+    """RZ gates for a batch of angles, shape (..., 2, 2)"""
+    half = theta.to(torch.float64) / 2
+    phase = torch.polar(torch.ones_like(half), half)
+    zero = torch.zeros_like(phase)
+    return torch.stack([torch.stack([phase.conj(), zero], -1),
+                        torch.stack([zero, phase], -1)], -2)
+
+
+def _ry(theta: torch.Tensor) -> torch.Tensor:
+    """RY gates for a batch of angles, shape (..., 2, 2)"""
+    half = theta.to(torch.float64) / 2
+    c, s = torch.cos(half).to(_DTYPE), torch.sin(half).to(_DTYPE)
+    return torch.stack([torch.stack([c, -s], -1), torch.stack([s, c], -1)], -2)
+
+
+def _on_a(gate: torch.Tensor) -> torch.Tensor:
+    """Lift a batch of single-qubit gates to the first qubit of a two-qubit block"""
+    return torch.einsum("nij,kl->nikjl", gate, _I2).reshape(-1, 4, 4)
+
+
+def _on_b(gate: torch.Tensor) -> torch.Tensor:
+    """Lift a batch of single-qubit gates to the second qubit of a two-qubit block"""
+    return torch.einsum("ij,nkl->nikjl", _I2, gate).reshape(-1, 4, 4)
+
+
+def _block_unitaries(params: torch.Tensor, pool: bool) -> torch.Tensor:
+    """
+    Dense 4x4 unitaries for a batch of conv_circuit/pool_circuit blocks.
+
+    params has shape (n, 3); the gate sequence matches conv_circuit/pool_circuit in the
+    notebook, where local qubit 0 is a and local qubit 1 is b.
+    """
+    n = params.shape[0]
+    quarter = torch.full((n,), math.pi / 2, dtype=torch.float64)
+    u = _on_b(_rz(-quarter))                      # rz(-pi/2, 1)
+    u = _CX_BA @ u                                # cx(1, 0)
+    u = _on_a(_rz(params[:, 0])) @ u              # rz(p0, 0)
+    u = _on_b(_ry(params[:, 1])) @ u              # ry(p1, 1)
+    u = _CX_AB @ u                                # cx(0, 1)
+    u = _on_b(_ry(params[:, 2])) @ u              # ry(p2, 1)
+    if not pool:
+        u = _CX_BA @ u                            # cx(1, 0)
+        u = _on_a(_rz(quarter)) @ u               # rz(pi/2, 0)
+    return u
+
+
+def _apply_block(state: torch.Tensor, gate: torch.Tensor, a: int, b: int) -> torch.Tensor:
+    """Apply a 4x4 gate to qubits (a, b) of states shaped (n, 2, 2, 2, 2)"""
+    moved = state.movedim((a + 1, b + 1), (-2, -1))
+    shape = moved.shape
+    moved = (moved.reshape(*shape[:-2], 4) @ gate.transpose(0, 1)).reshape(shape)
+    return moved.movedim((-2, -1), (a + 1, b + 1))
+
+
+def ansatz_unitary(weights: torch.Tensor) -> torch.Tensor:
+    """Compose the full 16x16 ansatz unitary for a weight vector in EstimatorQNN order"""
+    weights = weights.to(torch.float64)
+    conv_idx = [offset for kind, _, _, offset in ANSATZ_BLOCKS if kind == "conv"]
+    pool_idx = [offset for kind, _, _, offset in ANSATZ_BLOCKS if kind == "pool"]
+    conv = _block_unitaries(torch.stack([weights[i:i + 3] for i in conv_idx]), pool=False)
+    pool = _block_unitaries(torch.stack([weights[i:i + 3] for i in pool_idx]), pool=True)
+
+    # Evolve every computational basis state at once; column j of U is U|j>
+    dim = 2 ** NUM_QUBITS
+    state = torch.eye(dim, dtype=_DTYPE).reshape(dim, *([2] * NUM_QUBITS))
+    conv_i = pool_i = 0
+    for kind, a, b, _ in ANSATZ_BLOCKS:
+        if kind == "conv":
+            gate, conv_i = conv[conv_i], conv_i + 1
+        else:
+            gate, pool_i = pool[pool_i], pool_i + 1
+        state = _apply_block(state, gate, a, b)
+    return state.reshape(dim, dim).transpose(0, 1)
+
+
+def measured_observable(weights: torch.Tensor) -> torch.Tensor:
+    """Heisenberg-picture observable U^dagger Z_3 U for the given ansatz weights"""
+    u = ansatz_unitary(weights)
+    z = torch.ones([2] * NUM_QUBITS, dtype=torch.float64)
+    z.select(MEASURED_QUBIT, 1).fill_(-1)
+    return u.conj().transpose(0, 1) @ (z.reshape(-1, 1).to(_DTYPE) * u)
+
+
+def encode_features(x: torch.Tensor) -> torch.Tensor:
+    """
+    ZFeatureMap statevectors for a batch of 4-dim inputs, shape (batch, 16).
+
+    The feature map has no entangling gates, so each qubit evolves independently under
+    reps x (H, P(2x)) and the full state is the tensor product of the qubit states.
+    """
+    x = x.to(torch.float64)
+    amp0 = torch.ones_like(x, dtype=_DTYPE)
+    amp1 = torch.zeros_like(x, dtype=_DTYPE)
+    phase = torch.polar(torch.ones_like(x), 2.0 * x)
+    inv_sqrt2 = 1 / math.sqrt(2)
+    for _ in range(FEATURE_MAP_REPS):
+        amp0, amp1 = (amp0 + amp1) * inv_sqrt2, (amp0 - amp1) * inv_sqrt2
+        amp1 = amp1 * phase
+    qubits = torch.stack([amp0, amp1], dim=-1)  # (batch, 4, 2)
+    state = torch.einsum("bi,bj,bk,bl->bijkl", qubits[:, 0], qubits[:, 1],
+                         qubits[:, 2], qubits[:, 3])
+    return state.reshape(x.shape[0], -1)
+
+
+class QCNNSimulator(nn.Module):
+    """
+    Drop-in replacement for TorchConnector(EstimatorQNN) over the notebook's QCNN.
+
+    Registers its weights as "weight" like TorchConnector, so checkpoints trained with
+    qiskit load unchanged. Maps inputs of shape (batch, 4) to expectations (batch, 1).
+    """
+
+    def __init__(self, initial_weights: Optional[Sequence[float]] = None):
+        super().__init__()
+        self.weight = nn.Parameter(torch.zeros(NUM_WEIGHTS))
+        if initial_weights is None:
+            self.weight.data.uniform_(-1, 1)
+        else:
+            self.weight.data = torch.tensor(initial_weights, dtype=torch.float)
+
+        # Observable cache for inference, keyed on the weight tensor version
+        self._observable = None
+        self._observable_key = None
+
+    def observable(self) -> torch.Tensor:
+        """U^dagger Z U for the current weights, cached while weights are unchanged"""
+        if torch.is_grad_enabled() and self.weight.requires_grad:
+            return measured_observable(self.weight)
+
+        key = (self.weight.data_ptr(), self.weight._version)
+        if self._observable is None or self._observable_key != key:
+            with torch.no_grad():
+                self._observable = measured_observable(self.weight)
+            self._observable_key = key
+        return self._observable
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if x.dim() == 1:
+            x = x.unsqueeze(0)
+        psi = encode_features(x)
+        observable = self.observable()
+        expectation = (psi.conj() * (psi @ observable.transpose(0, 1))).sum(dim=-1).real
+        return expectation.unsqueeze(-1).to(x.dtype)
+
+
+def compare_with_qiskit(num_samples: int = 32, seed: int = 0) -> float:
+    """
+    Maximum absolute difference between QCNNSimulator and the qiskit EstimatorQNN.
+
+    Requires qiskit and qiskit-machine-learning; used to validate the simulator. The
+    simulator returns exact expectations, i.e. the EstimatorQNN with precision 0.
+    """
+    import numpy as np
+    from qiskit import QuantumCircuit
+    from qiskit.circuit import ParameterVector
+    from qiskit.circuit.library import ZFeatureMap
+    from qiskit.primitives import StatevectorEstimator
+    from qiskit.quantum_info import SparsePauliOp
+    from qiskit_machine_learning.neural_networks import EstimatorQNN
+
+    # Circuit construction mirrors conv_layer/pool_layer/create_qcnn in the notebook
+    def block(params, pool):
+        qc = QuantumCircuit(2)
+        qc.rz(-np.pi / 2, 1)
+        qc.cx(1, 0)
+        qc.rz(params[0], 0)
+        qc.ry(params[1], 1)
+        qc.cx(0, 1)
+        qc.ry(params[2], 1)
+        if not pool:
+            qc.cx(1, 0)
+            qc.rz(np.pi / 2, 0)
+        return qc
+
+    def conv_layer(num_qubits, prefix):
+        qc = QuantumCircuit(num_qubits)
+        qubits = list(range(num_qubits))
+        params = ParameterVector(prefix, length=num_qubits * 3)
+        index = 0
+        for q1, q2 in zip(qubits[0::2], qubits[1::2]):
+            qc = qc.compose(block(params[index:index + 3], False), [q1, q2])
+            index += 3
+        for q1, q2 in zip(qubits[1::2], qubits[2::2] + [0]):
+            qc = qc.compose(block(params[index:index + 3], False), [q1, q2])
+            index += 3
+        return qc
+
+    def pool_layer(sources, sinks, prefix):
+        qc = QuantumCircuit(len(sources) + len(sinks))
+        params = ParameterVector(prefix, length=len(sources) * 3)
+        for index, (source, sink) in enumerate(zip(sources, sinks)):
+            qc = qc.compose(block(params[3 * index:3 * index + 3], True), [source, sink])
+        return qc
+
+    feature_map = ZFeatureMap(NUM_QUBITS)
+    ansatz = QuantumCircuit(NUM_QUBITS)
+    ansatz.compose(conv_layer(4, "c1"), list(range(4)), inplace=True)
+    ansatz.compose(pool_layer([0, 1], [2, 3], "p1"), list(range(4)), inplace=True)
+    ansatz.compose(conv_layer(2, "c2"), list(range(2, 4)), inplace=True)
+    ansatz.compose(pool_layer([0], [1], "p2"), list(range(2, 4)), inplace=True)
+
+    circuit = QuantumCircuit(NUM_QUBITS)
+    circuit.compose(feature_map, range(NUM_QUBITS), inplace=True)
+    circuit.compose(ansatz, range(NUM_QUBITS), inplace=True)
+    qnn = EstimatorQNN(
+        circuit=circuit.decompose(),
+        observables=SparsePauliOp.from_list([("Z" + "I" * (NUM_QUBITS - 1), 1)]),
+        input_params=feature_map.parameters,
+        weight_params=ansatz.parameters,
+        estimator=StatevectorEstimator(),
+        # Exact expectations; the default precision adds Gaussian shot noise
+        default_precision=0.0,
+    )
+
+    generator = torch.Generator().manual_seed(seed)
+    inputs = torch.randn(num_samples, NUM_QUBITS, generator=generator, dtype=torch.float64)
+    simulator = QCNNSimulator().double()
+    reference = qnn.forward(inputs.numpy(), simulator.weight.detach().numpy())
+    with torch.no_grad():
+        ours = simulator(inputs).numpy()
+    return float(np.abs(reference - ours).max())
@@ -0,0 +1,191 @@
+# shared_weights.py
+# One copy of the model weights per node instead of one per worker process.
+# uvicorn starts its workers with spawn, so weights loaded before the workers start are not
+# inherited. Instead, the first worker to install a model version writes its prepared
+# state_dict (after the CPU profile's layout change) to a file in SHARED_WEIGHTS_DIR, a
+# tmpfs such as /dev/shm, and every worker - that one included - maps the file and points
+# its parameters and buffers at the mapping. The pages sit once in memory and are shared by
+# all workers. The mapping is private, so an in-place write would only copy the touched page
+# in that worker and never reach the file or the other workers.
+# Segments are named after their contents, and each worker holds a shared flock on the
+# segments its loaded models map. Segments nobody holds any more (superseded versions,
+# crashed workers) are deleted when a model is published or a version is dropped.
+
+import os
+import gc
+import time
+import ctypes
+import fcntl
+import hashlib
+import logging
+import threading
+import weakref
+from typing import Any, Dict, Optional
+
+import psutil
+import torch
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Shared weights configuration from environment variables
+SHARED_WEIGHTS_DIR = os.getenv("SHARED_WEIGHTS_DIR", "")  # e.g. /dev/shm/quantum-dermo, empty disables
+
+SEGMENT_SUFFIX = ".pt"
+
+
+def memory_usage() -> Dict[str, float]:
+    """RSS of this process in MB, plus USS/PSS/shared where the platform reports them"""
+    process = psutil.Process()
+    try:
+        info = process.memory_full_info()
+    except (psutil.AccessDenied, psutil.ZombieProcess):
+        info = process.memory_info()
+    return {f"{field}_mb": round(getattr(info, field) / 2 ** 20, 1)
+            for field in ("rss", "uss", "pss", "shared") if hasattr(info, field)}
+
+
+def _release_freed_memory():
+    """Collect garbage and hand freed heap pages back to the OS (glibc keeps them otherwise)"""
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def segment_key(model: torch.nn.Module, name: str) -> str:
+    """File name for one prepared state_dict: same weights and layout, same segment"""
+    digest = hashlib.blake2b(name.encode(), digest_size=16)
+    for key, tensor in model.state_dict().items():
+        digest.update(f"{key}:{tuple(tensor.shape)}:{tensor.stride()}:{tensor.dtype};".encode())
+        digest.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy())
+    return f"{name}-{digest.hexdigest()}"
+
+
+class SharedWeights:
+    """Publishes prepared state_dicts to a tmpfs and maps them into every worker"""
+
+    def __init__(self, directory: str = SHARED_WEIGHTS_DIR):
+        self.directory = directory
+        self.segments: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def _publish(self, model: torch.nn.Module, path: str) -> bool:
+        """Write the segment unless another worker already has; True if this process wrote it"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(f"{path}.lock", "a") as lock:
+            # Workers starting together wait here for the first one instead of all writing
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                published = not os.path.exists(path)
+                if published:
+                    temporary = f"{path}.{os.getpid()}.tmp"
+                    torch.save({key: tensor.detach().cpu() for key, tensor in model.state_dict().items()},
+                               temporary)
+                    os.replace(temporary, path)
+                # Held until the model is garbage collected, so sweep() leaves the segment alone
+                hold = os.open(path, os.O_RDONLY)
+                fcntl.flock(hold, fcntl.LOCK_SH)
+                weakref.finalize(model, os.close, hold)
+                return published
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def sweep(self) -> int:
+        """Delete segments no worker holds any more; returns how many were removed"""
+        if not self.enabled or not os.path.isdir(self.directory):
+            return 0
+        # Versions this process has dropped release their holds once collected
+        gc.collect()
+        removed = 0
+        for entry in os.listdir(self.directory):
+            if not entry.endswith(SEGMENT_SUFFIX):
+                continue
+            path = os.path.join(self.directory, entry)
+            with open(f"{path}.lock", "a") as lock:
+                try:
+                    # Busy: being published or attached right now
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                try:
+                    segment = os.open(path, os.O_RDONLY)
+                    try:
+                        fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # still mapped by a worker
+                    finally:
+                        os.close(segment)
+                    os.unlink(path)
+                    os.unlink(f"{path}.lock")
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        if removed:
+            logger.info(f"Removed {removed} unused shared weight segments from {self.directory}")
+        return removed
+
+    def attach(self, model: torch.nn.Module, name: str, version: str) -> Optional[Dict[str, Any]]:
+        """Replace the model's parameters and buffers with views of the shared segment"""
+        if not self.enabled:
+            return None
+        key = segment_key(model, name)
+        path = os.path.join(self.directory, key + SEGMENT_SUFFIX)
+        before = memory_usage()
+        start = time.perf_counter()
+        published = self._publish(model, path)
+
+        mapped = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+        tensors, mapped_bytes, storages = 0, 0, set()
+        with torch.no_grad():
+            for tensor_name, tensor in model.state_dict(keep_vars=True).items():
+                shared = mapped.get(tensor_name)
+                if shared is None or shared.shape != tensor.shape or shared.dtype != tensor.dtype:
+                    raise ValueError(f"Shared weights segment {path} does not match {tensor_name}")
+                tensor.data = shared
+                tensors += 1
+                storage = shared.untyped_storage()
+                if storage.data_ptr() not in storages:
+                    storages.add(storage.data_ptr())
+                    mapped_bytes += storage.nbytes()
+        del mapped
+        _release_freed_memory()
+        self.sweep()
+
+        info = {
+            "segment": path,
+            "published": published,
+            "tensors": tensors,
+            "mapped_mb": round(mapped_bytes / 2 ** 20, 1),
+            "attach_seconds": round(time.perf_counter() - start, 3),
+            "memory_before": before,
+            "memory_after": memory_usage()
+        }
+        with self._lock:
+            self.segments[f"{name}:{version}"] = info
+        logger.info(f"Model {name}:{version} mapped from {path} ({tensors} tensors, "
+                     f"RSS {before['rss_mb']} -> {info['memory_after']['rss_mb']} MB)")
+        return info
+
+    def status(self) -> Dict[str, Any]:
+        """Worker pid, current memory and the segments this worker has mapped"""
+        with self._lock:
+            segments = dict(self.segments)
+        return {
+            "enabled": self.enabled,
+            "directory": self.directory or None,
+            "pid": os.getpid(),
+            "memory": memory_usage(),
+            "segments": segments
+        }
+
+
+# Global shared weights instance
+shared_weights = SharedWeights()
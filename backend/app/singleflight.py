@@ -0,0 +1,147 @@
+# singleflight.py
+# Coalesces identical in-flight computations.
+# Within a process, concurrent callers with the same key wait for the first caller's
+# result. Across workers, the first caller takes a short Redis lease; callers in other
+# workers poll the result cache until the lease holder has written it, and take over the
+# computation themselves if the lease expires without a result.
+
+import os
+import time
+import uuid
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    from .cache import acquire_lock, release_lock, lock_exists
+    REDIS_LOCKS_AVAILABLE = True
+except ImportError:
+    REDIS_LOCKS_AVAILABLE = False
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Coalescing configuration from environment variables
+SINGLEFLIGHT_LEASE_MS = int(os.getenv("SINGLEFLIGHT_LEASE_MS", "30000"))
+SINGLEFLIGHT_WAIT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_WAIT_TIMEOUT", "30"))  # seconds
+SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv("SINGLEFLIGHT_POLL_INTERVAL", "0.05"))  # seconds
+SINGLEFLIGHT_MAX_POLL_INTERVAL = 0.5
+
+
+class _Call:
+    """One in-flight computation that other callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Runs at most one computation per key at a time, sharing its result with duplicates"""
+
+    def __init__(self, lease_ms: int = SINGLEFLIGHT_LEASE_MS, wait_timeout: float = SINGLEFLIGHT_WAIT_TIMEOUT,
+                 use_redis: bool = REDIS_LOCKS_AVAILABLE):
+        self.lease_ms = lease_ms
+        self.wait_timeout = wait_timeout
+        self.use_redis = use_redis
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.computed = 0
+        self.coalesced_local = 0
+        self.coalesced_remote = 0
+
+    def run(self, key: str, compute: Callable[[], Any],
+            lookup: Optional[Callable[[], Any]] = None) -> Tuple[Any, bool]:
+        """
+        Return (result, coalesced) for key.
+
+        compute must publish its result where lookup can find it (e.g. the prediction
+        cache) for cross-worker coalescing; coalesced is True when another caller did the work.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            if not call.done.wait(self.wait_timeout):
+                logger.warning(f"Timed out waiting for in-flight computation {key}; computing")
+                return compute(), False
+            if call.error is not None:
+                raise call.error
+            with self._lock:
+                self.coalesced_local += 1
+            return call.result, True
+
+        try:
+            call.result, coalesced = self._run_leased(key, compute, lookup)
+            return call.result, coalesced
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _run_leased(self, key: str, compute: Callable[[], Any],
+                    lookup: Optional[Callable[[], Any]]) -> Tuple[Any, bool]:
+        """Compute under a Redis lease, or wait for the worker that holds it"""
+        if not self.use_redis or lookup is None:
+            return self._compute(compute), False
+
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_timeout
+        interval = SINGLEFLIGHT_POLL_INTERVAL
+        while True:
+            acquired = acquire_lock(key, token, self.lease_ms)
+            if acquired is None or acquired:
+                # Redis unavailable (no coordination possible) or we hold the lease
+                try:
+                    return self._compute(compute), False
+                finally:
+                    if acquired:
+                        release_lock(key, token)
+
+            # Another worker is computing: wait for its result or for the lease to lapse
+            while lock_exists(key) and time.monotonic() < deadline:
+                time.sleep(interval)
+                interval = min(interval * 2, SINGLEFLIGHT_MAX_POLL_INTERVAL)
+                result = lookup()
+                if result is not None:
+                    with self._lock:
+                        self.coalesced_remote += 1
+                    return result, True
+
+            result = lookup()
+            if result is not None:
+                with self._lock:
+                    self.coalesced_remote += 1
+                return result, True
+            if time.monotonic() >= deadline:
+                logger.warning(f"Timed out waiting for lease holder of {key}; computing")
+                return self._compute(compute), False
+            # Lease released or expired without a result (e.g. holder failed): try to take over
+
+    def _compute(self, compute: Callable[[], Any]) -> Any:
+        result = compute()
+        with self._lock:
+            self.computed += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "computed": self.computed,
+                "coalesced_local": self.coalesced_local,
+                "coalesced_remote": self.coalesced_remote
+            }
+
+
+# Global single-flight instance for predictions
+prediction_flights = SingleFlight()
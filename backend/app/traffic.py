@@ -0,0 +1,385 @@
+# traffic.py
+# Opt-in capture of /predict and /upload_record traffic, and deterministic replay of it.
+# With TRAFFIC_CAPTURE_DIR set, an ASGI middleware records each request's arrival time,
+# server-side latency, status and cache outcome. A background thread de-identifies the
+# request before it is written: images become a keyed hash plus their size, dimensions and
+# format, clinical values and patient IDs become keyed hashes, and record payloads keep
+# only their sizes. Identical inputs map to identical references, so replay, which rebuilds
+# size-matched synthetic content from those references, reproduces the cache-hit pattern.
+#
+#   python -m app.traffic replay captures/ --target http://localhost:8001 --speed 2
+
+import os
+import io
+import json
+import hmac
+import time
+import queue
+import base64
+import hashlib
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from PIL import Image
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Capture configuration from environment variables
+TRAFFIC_CAPTURE_DIR = os.getenv("TRAFFIC_CAPTURE_DIR", "")  # empty disables capture
+TRAFFIC_CAPTURE_QUEUE = int(os.getenv("TRAFFIC_CAPTURE_QUEUE", "1000"))  # pending records; extra are dropped
+CAPTURE_PATHS = ("/predict", "/upload_record")
+
+SALT_FILE = ".salt"  # keys the hashed references; not needed for replay
+LOG_VERSION = 1
+
+
+def _load_salt(directory: str) -> bytes:
+    """Per-capture-directory key, shared by all workers writing to it"""
+    path = os.path.join(directory, SALT_FILE)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(os.urandom(32))
+    except FileExistsError:
+        pass
+    for _ in range(50):
+        with open(path, "rb") as f:
+            salt = f.read()
+        if len(salt) == 32:
+            return salt
+        time.sleep(0.01)  # another worker is still writing it
+    raise RuntimeError(f"Unreadable capture salt {path}")
+
+
+class TrafficRecorder:
+    """De-identifies captured requests on a background thread and appends them to a JSONL log"""
+
+    def __init__(self, directory: str, max_pending: int = TRAFFIC_CAPTURE_QUEUE):
+        os.makedirs(directory, exist_ok=True)
+        self.salt = _load_salt(directory)
+        self.path = os.path.join(directory, f"capture-{os.getpid()}-{int(time.time())}.jsonl")
+        self.pending: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self.recorded = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+        self._thread.start()
+        logger.info(f"Capturing traffic to {self.path}")
+
+    def record(self, path: str, arrived: float, duration: float, status: int, body: bytes, response: bytes):
+        """Queue a raw exchange; never blocks the request"""
+        try:
+            self.pending.put_nowait((path, arrived, duration, status, body, response))
+        except queue.Full:
+            self.dropped += 1
+
+    def _ref(self, data: bytes) -> str:
+        return hmac.new(self.salt, data, hashlib.sha256).hexdigest()[:32]
+
+    def _run(self):
+        with open(self.path, "a", buffering=1) as log:
+            while True:
+                path, arrived, duration, status, body, response = self.pending.get()
+                try:
+                    entry = {
+                        "v": LOG_VERSION,
+                        "t": round(arrived, 6),
+                        "path": path,
+                        "ms": round(duration * 1000, 3),
+                        "status": status,
+                        "request": self._deidentify(path, body)
+                    }
+                    try:
+                        entry["cache_hit"] = json.loads(response).get("cache_hit")
+                    except (ValueError, AttributeError):
+                        entry["cache_hit"] = None
+                    log.write(json.dumps(entry, separators=(",", ":")) + "\n")
+                    self.recorded += 1
+                except Exception as e:
+                    logger.warning(f"Failed to capture {path} request: {e}")
+
+    def _deidentify(self, path: str, body: bytes) -> Dict[str, Any]:
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return {"invalid": True, "bytes": len(body)}
+
+        if path == "/predict":
+            shape: Dict[str, Any] = {"explain": bool(payload.get("explain", False))}
+            try:
+                image_bytes = base64.b64decode(payload.get("image_base64", ""))
+                shape.update({"image_ref": self._ref(image_bytes), "image_bytes": len(image_bytes)})
+                with Image.open(io.BytesIO(image_bytes)) as image:
+                    shape.update({"width": image.width, "height": image.height, "format": image.format})
+            except Exception:
+                shape["image_invalid"] = True
+            clinical = payload.get("clinical_data") or {}
+            shape["clinical_ref"] = self._ref(json.dumps(clinical, sort_keys=True).encode())
+            shape["localization"] = clinical.get("localization")
+            return shape
+
+        # /upload_record: only sizes, and a reference that groups records of the same patient
+        return {
+            "patient_ref": self._ref(str(payload.get("patient_id", "")).encode()),
+            "patient_data_bytes": len(json.dumps(payload.get("patient_data", {}))),
+            "signature_chars": len(str(payload.get("signature", ""))),
+            "public_key_chars": len(str(payload.get("public_key", "")))
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "recorded": self.recorded, "dropped": self.dropped,
+                "pending": self.pending.qsize()}
+
+
+class TrafficCaptureMiddleware:
+    """ASGI middleware that hands captured exchanges to a TrafficRecorder"""
+
+    def __init__(self, app, recorder: TrafficRecorder, paths: Sequence[str] = CAPTURE_PATHS):
+        self.app = app
+        self.recorder = recorder
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        arrived, start = time.time(), time.perf_counter()
+        body: List[bytes] = []
+        response = {"status": 500, "body": []}
+
+        async def capture_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                body.append(message.get("body", b""))
+            return message
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            self.recorder.record(scope["path"], arrived, time.perf_counter() - start, response["status"],
+                                 b"".join(body), b"".join(response["body"]))
+
+
+# --- Replay ---
+
+def _seed(ref: str) -> int:
+    return int(ref[:16], 16)
+
+
+def synthetic_image(ref: str, width: int, height: int, image_format: str = "PNG",
+                    target_bytes: Optional[int] = None) -> bytes:
+    """Deterministic image for a reference: same dimensions and format, about the same file size"""
+    rng = np.random.default_rng(_seed(ref))
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([160 + 40 * np.sin(x / (width / 3.0) + c) * np.cos(y / (height / 2.0)) for c in (0.0, 0.7, 1.4)], -1)
+    noise = rng.standard_normal((height, width, 3))
+    image_format = image_format if image_format in ("PNG", "JPEG", "WEBP", "BMP") else "PNG"
+
+    def encode(amplitude: float) -> bytes:
+        pixels = np.clip(base + amplitude * noise, 0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format=image_format, **({"quality": 90} if image_format == "JPEG" else {}))
+        return buffer.getvalue()
+
+    if not target_bytes:
+        return encode(8.0)
+    # Noise amplitude controls the compressed size; bisect towards the original size
+    low, high = 0.0, 96.0
+    best = encode(high)
+    for _ in range(7):
+        amplitude = (low + high) / 2
+        data = encode(amplitude)
+        if abs(len(data) - target_bytes) < abs(len(best) - target_bytes):
+            best = data
+        if len(data) < target_bytes:
+            low = amplitude
+        else:
+            high = amplitude
+    return best
+
+
+def synthetic_clinical(ref: str, localization: Optional[str] = None) -> Dict[str, Any]:
+    """Deterministic plausible clinical values for a reference"""
+    rng = np.random.default_rng(_seed(ref))
+    return {
+        "age": float(rng.integers(20, 86)),
+        "gender": int(rng.integers(0, 2)),
+        "bmi": round(float(rng.uniform(18, 35)), 1),
+        "blood_pressure_systolic": float(rng.integers(100, 161)),
+        "blood_pressure_diastolic": float(rng.integers(60, 101)),
+        "cholesterol": float(rng.integers(150, 261)),
+        "glucose": float(rng.integers(70, 141)),
+        "smoking": int(rng.integers(0, 2)),
+        "family_history": int(rng.integers(0, 2)),
+        "symptoms_severity": round(float(rng.uniform(0, 10)), 1),
+        "localization": localization
+    }
+
+
+def read_log(paths: Iterable[str]) -> List[Dict[str, Any]]:
+    """Captured entries from log files or capture directories, in arrival order"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if name.startswith("capture-") and name.endswith(".jsonl"))
+        else:
+            files.append(path)
+    entries = []
+    for file in files:
+        with open(file) as f:
+            entries += [json.loads(line) for line in f if line.strip()]
+    return sorted(entries, key=lambda entry: entry["t"])
+
+
+class RequestBuilder:
+    """Rebuilds request bodies from de-identified entries, caching synthetic images by reference"""
+
+    def __init__(self):
+        self.images: Dict[str, str] = {}
+
+    def __call__(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        request = entry["request"]
+        if entry["path"] == "/predict":
+            ref = request.get("image_ref", "invalid")
+            if ref not in self.images:
+                image = b"" if request.get("image_invalid") else synthetic_image(
+                    ref, request["width"], request["height"], request.get("format") or "PNG", request["image_bytes"])
+                self.images[ref] = base64.b64encode(image).decode()
+            return {
+                "clinical_data": synthetic_clinical(request["clinical_ref"], request.get("localization")),
+                "image_base64": self.images[ref],
+                "explain": request.get("explain", False)
+            }
+
+        rng = np.random.default_rng(_seed(request["patient_ref"]))
+        filler = max(request["patient_data_bytes"] - len('{"synthetic": ""}'), 0)
+        return {
+            "patient_id": f"replay-{request['patient_ref'][:12]}",
+            "patient_data": {"synthetic": "x" * filler},
+            "signature": base64.b64encode(rng.bytes(request["signature_chars"] * 3 // 4)).decode(),
+            "public_key": base64.b64encode(rng.bytes(request["public_key_chars"] * 3 // 4)).decode()
+        }
+
+
+def _percentiles(values: Sequence[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    array = np.asarray(values)
+    return {"p50": round(float(np.percentile(array, 50)), 2), "p90": round(float(np.percentile(array, 90)), 2),
+            "p99": round(float(np.percentile(array, 99)), 2), "max": round(float(array.max()), 2),
+            "mean": round(float(array.mean()), 2)}
+
+
+def replay(entries: Sequence[Dict[str, Any]], target: str, speed: float = 1.0,
+           concurrency: int = 32, timeout: float = 60.0, client: Any = None) -> Dict[str, Any]:
+    """
+    Re-drive captured traffic against target, keeping the original inter-arrival times
+    divided by speed (speed=0 sends as fast as concurrency allows). Returns latency
+    distributions and cache behaviour per path, next to the captured ones. An httpx-compatible
+    client (e.g. a TestClient for an in-process app) can be passed instead of a target URL.
+    """
+    import httpx
+
+    build = RequestBuilder()
+    # Synthetic content is built up front so generating it does not skew the schedule
+    bodies = [build(entry) for entry in entries]
+    results: List[Optional[Dict[str, Any]]] = [None] * len(entries)
+
+    def send(client, index: int):
+        start = time.perf_counter()
+        try:
+            response = client.post(entries[index]["path"], json=bodies[index])
+            status = response.status_code
+            cache_hit = response.json().get("cache_hit") if status == 200 else None
+            error = None
+        except Exception as e:
+            status, cache_hit, error = None, None, str(e)
+        results[index] = {"ms": (time.perf_counter() - start) * 1000, "status": status,
+                          "cache_hit": cache_hit, "error": error}
+
+    started = time.perf_counter()
+    first = entries[0]["t"] if entries else 0.0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    client = client or httpx.Client(base_url=target, timeout=timeout, limits=limits)
+    with client, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for index, entry in enumerate(entries):
+            if speed > 0:
+                delay = (entry["t"] - first) / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(send, client, index)
+    elapsed = time.perf_counter() - started
+
+    report: Dict[str, Any] = {"requests": len(entries), "target": target, "speed": speed,
+                              "elapsed_s": round(elapsed, 2), "by_path": {}}
+    for path in sorted({entry["path"] for entry in entries}):
+        indices = [i for i, entry in enumerate(entries) if entry["path"] == path]
+        captured_hits = [entries[i].get("cache_hit") for i in indices]
+        replayed_hits = [results[i]["cache_hit"] for i in indices]
+        comparable = [(a, b) for a, b in zip(captured_hits, replayed_hits) if a is not None and b is not None]
+        statuses: Dict[str, int] = {}
+        for i in indices:
+            key = str(results[i]["status"] or "error")
+            statuses[key] = statuses.get(key, 0) + 1
+        report["by_path"][path] = {
+            "count": len(indices),
+            "captured_server_ms": _percentiles([entries[i]["ms"] for i in indices]),
+            "replayed_client_ms": _percentiles([results[i]["ms"] for i in indices if results[i]["error"] is None]),
+            "status": statuses,
+            "captured_status": {str(s): sum(1 for i in indices if entries[i]["status"] == s)
+                                for s in sorted({entries[i]["status"] for i in indices})},
+            "captured_cache_hit_rate": _rate(captured_hits),
+            "replayed_cache_hit_rate": _rate(replayed_hits),
+            "cache_hit_mismatches": sum(1 for a, b in comparable if a != b),
+            "errors": sum(1 for i in indices if results[i]["error"] is not None)
+        }
+        first_error = next((results[i]["error"] for i in indices if results[i]["error"]), None)
+        if first_error:
+            report["by_path"][path]["first_error"] = first_error
+    return report
+
+
+def _rate(flags: Sequence[Optional[bool]]) -> Optional[float]:
+    known = [flag for flag in flags if flag is not None]
+    return round(sum(known) / len(known), 4) if known else None
+
+
+def main():
+    """Replay captured traffic against a running build"""
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    replay_parser = commands.add_parser("replay", help="Re-drive a capture log")
+    replay_parser.add_argument("logs", nargs="+", help="Capture log files or TRAFFIC_CAPTURE_DIR directories")
+    replay_parser.add_argument("--target", default="http://localhost:8001")
+    replay_parser.add_argument("--speed", type=float, default=1.0,
+                               help="Time scale: 2 replays twice as fast, 0 as fast as possible")
+    replay_parser.add_argument("--concurrency", type=int, default=32)
+    replay_parser.add_argument("--limit", type=int, help="Replay only the first N requests")
+    replay_parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    entries = read_log(args.logs)[:args.limit]
+    report = replay(entries, args.target, args.speed, args.concurrency)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
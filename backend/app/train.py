@@ -0,0 +1,411 @@
+# train.py
+# Data-parallel training of the hybrid DenseNet + QCNN model on HAM10000.
+# Follows the training notebook (weighted sampling and loss, AdamW with a lower learning
+# rate for the quantum weights, ReduceLROnPlateau, early stopping) but runs as
+# DistributedDataParallel over gloo, so it scales across the cores of one machine or
+# across CPU nodes, with bf16 autocast on CPU. Checkpoints are written every epoch and
+# training resumes from them; the best model is saved in the format load_model reads.
+#
+#   python -m app.train --metadata HAM10000_metadata.csv --images part_1 part_2 --nproc 4
+#   torchrun --nnodes 2 --nproc-per-node 4 ... -m app.train --metadata ... --images ...
+#   python -m app.train --metadata labelled_cases.csv --image-store   # stored inputs, by image_digest
+
+import os
+import sys
+import math
+import time
+import socket
+import logging
+import argparse
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Sampler
+from torch.utils.data.distributed import DistributedSampler
+
+from .autotune import usable_cores
+from .ham10000 import BINARY_CLASS_NAMES, read_metadata, find_images, split_rows, image_dataset, image_collate
+from .model_registry import MetadataFeatureEncoder
+from .models import HybridMultimodalHQCNN
+from .preprocessing import IMG_SIZE, DEFAULT_EVAL_RESIZE, array_inference_transform, array_train_transform
+from .quantum import NUM_QUBITS, NUM_WEIGHTS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Training configuration (defaults follow the notebook)
+MODEL_DIR = os.path.join(os.path.dirname(__file__), '../model')
+TRAIN_OUTPUT_PATH = os.getenv("TRAIN_OUTPUT_PATH", os.path.join(MODEL_DIR, "trained_multimodal_hqcnn.pth"))
+TRAIN_CHECKPOINT_DIR = os.getenv("TRAIN_CHECKPOINT_DIR", os.path.join(MODEL_DIR, "checkpoints"))
+TRAIN_EPOCHS = int(os.getenv("TRAIN_EPOCHS", "30"))
+TRAIN_BATCH_SIZE = int(os.getenv("TRAIN_BATCH_SIZE", "32"))  # per worker
+TRAIN_LEARNING_RATE = float(os.getenv("TRAIN_LEARNING_RATE", "0.001"))
+TRAIN_WEIGHT_DECAY = float(os.getenv("TRAIN_WEIGHT_DECAY", "1e-4"))
+TRAIN_PATIENCE = int(os.getenv("TRAIN_PATIENCE", "3"))  # early stopping
+TRAIN_NUM_WORKERS = int(os.getenv("TRAIN_NUM_WORKERS", "2"))  # dataloader workers per process
+TRAIN_PREFETCH_FACTOR = int(os.getenv("TRAIN_PREFETCH_FACTOR", "4"))
+TRAIN_SEED = 42
+
+QUANTUM_LR_FACTOR = 0.1
+LAST_CHECKPOINT = "last.pth"
+
+
+class DistributedWeightedSampler(Sampler):
+    """
+    WeightedRandomSampler split across ranks.
+
+    Every rank draws the same seeded stream for the epoch and keeps every world_size-th
+    index, so together the ranks sample num_samples indices with replacement.
+    """
+
+    def __init__(self, weights: torch.Tensor, num_samples: int, rank: int, world_size: int,
+                 seed: int = TRAIN_SEED):
+        self.weights = weights.double()
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = seed
+        self.epoch = 0
+        self.num_samples = math.ceil(num_samples / world_size)
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        total = self.num_samples * self.world_size
+        indices = torch.multinomial(self.weights, total, replacement=True, generator=generator)
+        return iter(indices[self.rank:total:self.world_size].tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+
+def fit_encoders(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Fit the metadata encoders on all rows, as the notebook does"""
+    from sklearn.preprocessing import LabelEncoder, MinMaxScaler
+
+    sex_encoder = LabelEncoder().fit([row["sex"] for row in rows])
+    localization_encoder = LabelEncoder().fit([row["localization"] for row in rows])
+    age_scaler = MinMaxScaler().fit(np.array([[row["age"]] for row in rows]))
+    return {
+        "sex_encoder": sex_encoder,
+        "localization_encoder": localization_encoder,
+        "age_scaler": age_scaler
+    }
+
+
+def class_weights(labels: torch.Tensor, num_classes: int) -> torch.Tensor:
+    """Inverse-frequency class weights"""
+    counts = torch.bincount(labels, minlength=num_classes).double().clamp(min=1)
+    return (len(labels) / (num_classes * counts)).float()
+
+
+def _build_optimizer(model: nn.Module, lr: float, weight_decay: float) -> torch.optim.Optimizer:
+    classical = [param for name, param in model.named_parameters() if "qnn" not in name]
+    quantum = [param for name, param in model.named_parameters() if "qnn" in name]
+    return torch.optim.AdamW([
+        {"params": classical, "lr": lr, "weight_decay": weight_decay},
+        {"params": quantum, "lr": lr * QUANTUM_LR_FACTOR, "weight_decay": 0}
+    ], lr=lr)
+
+
+def _save_atomic(state: Dict[str, Any], path: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _model_checkpoint(model: nn.Module, encoders: Dict[str, Any], weights: torch.Tensor,
+                      args: argparse.Namespace, **extra) -> Dict[str, Any]:
+    """Checkpoint contents that load_model_from_checkpoint understands"""
+    return {
+        "model_state_dict": model.state_dict(),
+        "model_architecture": "MultimodalHQCNN",
+        "num_classes": len(BINARY_CLASS_NAMES),
+        "class_names": BINARY_CLASS_NAMES,
+        "metadata_dim": MetadataFeatureEncoder.feature_dim,
+        "img_size": IMG_SIZE,
+        "eval_resize": DEFAULT_EVAL_RESIZE,  # array_inference_transform, used for validation
+        "encoders": encoders,
+        "class_weights": weights.tolist(),
+        "quantum_info": {"num_qubits": NUM_QUBITS, "num_quantum_params": NUM_WEIGHTS},
+        "hyperparameters": {
+            "epochs": args.epochs,
+            "batch_size": args.batch_size,
+            "learning_rate": args.lr,
+            "weight_decay": args.weight_decay,
+            "patience": args.patience,
+            "bf16": args.bf16
+        },
+        **extra
+    }
+
+
+def _reduce(values: List[float]) -> List[float]:
+    tensor = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(tensor)
+    return tensor.tolist()
+
+
+def evaluate(model: nn.Module, loader: DataLoader, criterion: nn.Module, bf16: bool) -> Dict[str, float]:
+    """Loss and accuracy over a sharded loader, summed across ranks"""
+    model.eval()
+    loss_sum, correct, total = 0.0, 0, 0
+    with torch.no_grad():
+        for images, features, labels in loader:
+            with torch.autocast("cpu", dtype=torch.bfloat16, enabled=bf16):
+                logits = model(images, features)[0]
+            logits = logits.float()
+            loss_sum += criterion(logits, labels).item() * labels.size(0)
+            correct += (logits.argmax(dim=1) == labels).sum().item()
+            total += labels.size(0)
+    loss_sum, correct, total = _reduce([loss_sum, correct, total])
+    return {"loss": loss_sum / max(total, 1), "acc": 100.0 * correct / max(total, 1)}
+
+
+def train_epoch(model: nn.Module, loader: DataLoader, criterion: nn.Module,
+                optimizer: torch.optim.Optimizer, bf16: bool) -> Dict[str, float]:
+    """One pass over this rank's shard; returns loss, accuracy and throughput for the rank"""
+    model.train()
+    loss_sum, correct, total = 0.0, 0, 0
+    data_seconds = 0.0
+    start = time.perf_counter()
+    batch_start = start
+    for images, features, labels in loader:
+        data_seconds += time.perf_counter() - batch_start
+        with torch.autocast("cpu", dtype=torch.bfloat16, enabled=bf16):
+            logits = model(images, features)[0]
+        # bf16 autocast needs no loss scaling; the loss is computed in fp32
+        loss = criterion(logits.float(), labels)
+        optimizer.zero_grad(set_to_none=True)
+        loss.backward()
+        optimizer.step()
+
+        loss_sum += loss.item() * labels.size(0)
+        correct += (logits.argmax(dim=1) == labels).sum().item()
+        total += labels.size(0)
+        batch_start = time.perf_counter()
+    seconds = time.perf_counter() - start
+    return {
+        "loss_sum": loss_sum,
+        "correct": correct,
+        "samples": total,
+        "seconds": seconds,
+        "samples_per_second": total / seconds if seconds else 0.0,
+        "data_wait_fraction": data_seconds / seconds if seconds else 0.0
+    }
+
+
+def _make_loader(dataset, batch_size: int, sampler: Sampler, transform, args: argparse.Namespace,
+                 drop_last: bool = False) -> DataLoader:
+    workers = args.num_workers
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        sampler=sampler,
+        num_workers=workers,
+        prefetch_factor=args.prefetch_factor if workers > 0 else None,
+        persistent_workers=workers > 0,
+        collate_fn=image_collate(dataset, transform),
+        drop_last=drop_last
+    )
+
+
+def _find_resume_checkpoint(args: argparse.Namespace) -> Optional[str]:
+    if args.resume == "auto":
+        path = os.path.join(args.checkpoint_dir, LAST_CHECKPOINT)
+        return path if os.path.exists(path) else None
+    return args.resume
+
+
+def run(args: argparse.Namespace):
+    """Training loop for one process of the job; the process group is already initialized"""
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+    torch.manual_seed(TRAIN_SEED)
+    np.random.seed(TRAIN_SEED + rank)
+
+    rows = read_metadata(args.metadata)
+    train_rows, val_rows, test_rows = split_rows(rows)
+    id2path = find_images(args.images)
+    encoders = fit_encoders(rows)
+    feature_encoder = MetadataFeatureEncoder(encoders)
+
+    train_dataset = image_dataset(train_rows, id2path, feature_encoder, args.image_store)
+    val_dataset = image_dataset(val_rows, id2path, feature_encoder, args.image_store)
+    weights = class_weights(train_dataset.labels, len(BINARY_CLASS_NAMES))
+
+    train_sampler = DistributedWeightedSampler(weights[train_dataset.labels], len(train_dataset), rank, world_size)
+    val_sampler = DistributedSampler(val_dataset, num_replicas=world_size, rank=rank, shuffle=False)
+    train_loader = _make_loader(train_dataset, args.batch_size, train_sampler, array_train_transform, args,
+                                drop_last=True)
+    val_loader = _make_loader(val_dataset, args.batch_size, val_sampler, array_inference_transform, args)
+
+    model = HybridMultimodalHQCNN(num_classes=len(BINARY_CLASS_NAMES), metadata_dim=feature_encoder.feature_dim)
+    optimizer = _build_optimizer(model, args.lr, args.weight_decay)
+    scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode="min", factor=0.5, patience=2,
+                                                           min_lr=1e-6)
+    criterion = nn.CrossEntropyLoss(weight=weights)
+
+    start_epoch, best_val_acc, stale_epochs = 0, 0.0, 0
+    history: Dict[str, List[float]] = {"train_loss": [], "train_acc": [], "val_loss": [], "val_acc": [],
+                                       "learning_rates": [], "samples_per_second": []}
+    resume_path = _find_resume_checkpoint(args)
+    if resume_path:
+        state = torch.load(resume_path, map_location="cpu", weights_only=False)
+        model.load_state_dict(state["model_state_dict"])
+        if "optimizer_state_dict" in state:
+            optimizer.load_state_dict(state["optimizer_state_dict"])
+            scheduler.load_state_dict(state["scheduler_state_dict"])
+        start_epoch = state.get("epoch", -1) + 1
+        best_val_acc = state.get("best_val_acc", 0.0)
+        stale_epochs = state.get("stale_epochs", 0)
+        history = state.get("training_history", history)
+        if rank == 0:
+            logger.info(f"Resumed from {resume_path} at epoch {start_epoch + 1}")
+
+    ddp_model = DistributedDataParallel(model, gradient_as_bucket_view=True)
+    if rank == 0:
+        logger.info(f"Training on {world_size} processes x {torch.get_num_threads()} threads, "
+                    f"{len(train_dataset)} train / {len(val_dataset)} val images, "
+                    f"batch {args.batch_size} per process, bf16={args.bf16}")
+
+    for epoch in range(start_epoch, args.epochs):
+        train_sampler.set_epoch(epoch)
+        stats = train_epoch(ddp_model, train_loader, criterion, optimizer, args.bf16)
+        per_worker = [None] * world_size
+        dist.all_gather_object(per_worker, stats)
+        loss_sum, correct, samples = _reduce([stats["loss_sum"], stats["correct"], stats["samples"]])
+        val = evaluate(ddp_model, val_loader, criterion, args.bf16)
+        scheduler.step(val["loss"])
+
+        train_loss, train_acc = loss_sum / max(samples, 1), 100.0 * correct / max(samples, 1)
+        total_throughput = sum(worker["samples_per_second"] for worker in per_worker)
+        history["train_loss"].append(train_loss)
+        history["train_acc"].append(train_acc)
+        history["val_loss"].append(val["loss"])
+        history["val_acc"].append(val["acc"])
+        history["learning_rates"].append(optimizer.param_groups[0]["lr"])
+        history["samples_per_second"].append(total_throughput)
+
+        improved = val["acc"] > best_val_acc
+        if improved:
+            best_val_acc = val["acc"]
+            stale_epochs = 0
+        else:
+            stale_epochs += 1
+
+        if rank == 0:
+            throughput = ", ".join(f"rank {i}: {worker['samples_per_second']:.1f}/s "
+                                   f"(data wait {worker['data_wait_fraction']:.0%})"
+                                   for i, worker in enumerate(per_worker))
+            logger.info(f"Epoch {epoch + 1}/{args.epochs}: train loss {train_loss:.4f} acc {train_acc:.2f}%, "
+                        f"val loss {val['loss']:.4f} acc {val['acc']:.2f}%, "
+                        f"{total_throughput:.1f} samples/s [{throughput}]")
+            if improved:
+                _save_atomic(_model_checkpoint(model, encoders, weights, args, epoch=epoch, val_acc=val["acc"],
+                                               best_val_acc=best_val_acc, training_history=history,
+                                               trained_at=datetime.utcnow().isoformat()),
+                             args.output)
+                logger.info(f"New best model ({best_val_acc:.2f}%) saved to {args.output}")
+            _save_atomic(_model_checkpoint(model, encoders, weights, args, epoch=epoch,
+                                           best_val_acc=best_val_acc, stale_epochs=stale_epochs,
+                                           training_history=history,
+                                           optimizer_state_dict=optimizer.state_dict(),
+                                           scheduler_state_dict=scheduler.state_dict()),
+                         os.path.join(args.checkpoint_dir, LAST_CHECKPOINT))
+        dist.barrier()
+
+        if stale_epochs >= args.patience:
+            if rank == 0:
+                logger.info(f"Early stopping after {epoch + 1} epochs")
+            break
+
+    # Held-out test accuracy of the best model, stored alongside it
+    if args.evaluate_test and os.path.exists(args.output):
+        best = torch.load(args.output, map_location="cpu", weights_only=False)
+        model.load_state_dict(best["model_state_dict"])
+        test_dataset = image_dataset(test_rows, id2path, feature_encoder, args.image_store)
+        test_sampler = DistributedSampler(test_dataset, num_replicas=world_size, rank=rank, shuffle=False)
+        test = evaluate(ddp_model, _make_loader(test_dataset, args.batch_size, test_sampler,
+                                                array_inference_transform, args), criterion, args.bf16)
+        if rank == 0:
+            best["test_acc"] = test["acc"]
+            _save_atomic(best, args.output)
+            logger.info(f"Test accuracy of the best model: {test['acc']:.2f}%")
+        dist.barrier()
+
+
+def _worker(local_rank: int, args: argparse.Namespace):
+    """Entry point of each process; joins the gloo group and trains"""
+    logging.basicConfig(level=logging.INFO, format=f"[rank {os.getenv('RANK', local_rank)}] %(message)s")
+    if "RANK" not in os.environ:
+        # Spawned by this script on one machine
+        os.environ.update(RANK=str(local_rank), LOCAL_RANK=str(local_rank),
+                          WORLD_SIZE=str(args.nproc), LOCAL_WORLD_SIZE=str(args.nproc))
+    local_world_size = int(os.getenv("LOCAL_WORLD_SIZE", "1"))
+    # Split the cores between the processes on this machine, leaving room for loader workers
+    torch.set_num_threads(args.threads or max(1, usable_cores() // local_world_size))
+
+    dist.init_process_group("gloo", init_method="env://")
+    try:
+        run(args)
+    finally:
+        dist.destroy_process_group()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    """Train the hybrid model with DistributedDataParallel on CPU"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--metadata", required=True, help="HAM10000_metadata.csv")
+    parser.add_argument("--images", nargs="*", default=[], help="HAM10000 image directories")
+    parser.add_argument("--image-store", action="store_true",
+                        help="read preprocessed inputs from the image store (keyed by the metadata's "
+                             "image_digest column, or by the digests of the --images files)")
+    parser.add_argument("--output", default=TRAIN_OUTPUT_PATH, help="best model checkpoint")
+    parser.add_argument("--checkpoint-dir", default=TRAIN_CHECKPOINT_DIR)
+    parser.add_argument("--resume", default="auto",
+                        help="checkpoint to resume from ('auto': last checkpoint if present, 'none': start over)")
+    parser.add_argument("--epochs", type=int, default=TRAIN_EPOCHS)
+    parser.add_argument("--batch-size", type=int, default=TRAIN_BATCH_SIZE, help="per process")
+    parser.add_argument("--lr", type=float, default=TRAIN_LEARNING_RATE)
+    parser.add_argument("--weight-decay", type=float, default=TRAIN_WEIGHT_DECAY)
+    parser.add_argument("--patience", type=int, default=TRAIN_PATIENCE)
+    parser.add_argument("--nproc", type=int, default=1, help="processes to spawn when not run under torchrun")
+    parser.add_argument("--threads", type=int, help="intra-op threads per process (default: cores / processes)")
+    parser.add_argument("--num-workers", type=int, default=TRAIN_NUM_WORKERS, help="dataloader workers per process")
+    parser.add_argument("--prefetch-factor", type=int, default=TRAIN_PREFETCH_FACTOR)
+    parser.add_argument("--no-bf16", dest="bf16", action="store_false", help="train in fp32")
+    parser.add_argument("--no-test", dest="evaluate_test", action="store_false",
+                        help="skip the test-split evaluation of the best model")
+    args = parser.parse_args()
+    if not args.images and not args.image_store:
+        parser.error("--images is required unless --image-store is given")
+    if args.resume == "none":
+        args.resume = None
+
+    if "RANK" in os.environ:
+        # Launched by torchrun: one process per rank already exists
+        _worker(int(os.getenv("LOCAL_RANK", "0")), args)
+    else:
+        os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+        os.environ.setdefault("MASTER_PORT", str(_free_port()))
+        mp.spawn(_worker, args=(args,), nprocs=args.nproc, join=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
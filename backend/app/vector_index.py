@@ -0,0 +1,426 @@
+# vector_index.py
+# Similar-case retrieval over stored image embeddings.
+# Embeddings are kept L2-normalized as float16 in memory-mapped files next to compact
+# categorical attribute codes used for filtering. Once the index is large enough, an IVF
+# layer (spherical k-means centroids + inverted lists) limits each query to a few lists.
+# The index is filled incrementally from the predictions collection, resuming after the
+# last synced document, and an fcntl lock keeps several workers from writing it at once.
+# Sync reads the primary and stops VECTOR_INDEX_SYNC_LAG seconds short of now: ObjectIds
+# come from the clocks of several API workers, so a document can become visible after one
+# with a larger _id, and the lag lets it arrive before the sync position passes it.
+
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Vector index configuration from environment variables
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join(os.path.dirname(__file__), '../vector_index'))
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "8"))
+VECTOR_INDEX_MIN_TRAIN = int(os.getenv("VECTOR_INDEX_MIN_TRAIN", "2048"))  # flat scan below this size
+VECTOR_INDEX_SYNC_INTERVAL = int(os.getenv("VECTOR_INDEX_SYNC_INTERVAL", "60"))  # seconds, 0 disables
+VECTOR_INDEX_SYNC_BATCH = int(os.getenv("VECTOR_INDEX_SYNC_BATCH", "1000"))
+VECTOR_INDEX_SYNC_LAG = int(os.getenv("VECTOR_INDEX_SYNC_LAG", "30"))  # seconds
+
+# Case attributes that can be used as query filters
+INDEX_ATTRIBUTES = ("predicted_class", "localization", "sex")
+ID_LENGTH = 24  # hex ObjectId
+DIGEST_LENGTH = 64  # hex SHA-256 of the case image
+INDEX_FORMAT = 2  # bumped when the on-disk layout changes; older indexes are rebuilt
+INITIAL_CAPACITY = 1024
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 50000
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def spherical_kmeans(data: np.ndarray, k: int, iterations: int = KMEANS_ITERATIONS,
+                     seed: int = 0) -> np.ndarray:
+    """Unit-norm centroids clustering normalized vectors by cosine similarity"""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = (data @ centroids.T).argmax(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+        counts = np.bincount(assignment, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            # Reseed empty clusters with random points
+            sums[empty] = data[rng.choice(len(data), size=int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class VectorIndex:
+    """Memory-mapped cosine-similarity index with IVF search and attribute filters"""
+
+    def __init__(self, directory: str = VECTOR_INDEX_DIR, nprobe: int = VECTOR_INDEX_NPROBE,
+                 min_train: int = VECTOR_INDEX_MIN_TRAIN):
+        self.directory = directory
+        self.nprobe = nprobe
+        self.min_train = min_train
+        self._lock = threading.RLock()
+        self._reset_state(None, 0)
+
+    # --- persistence ---
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _reset_state(self, embedding_id: Optional[str], dim: int):
+        self.state = {
+            "format": INDEX_FORMAT,
+            "embedding_id": embedding_id,
+            "dim": dim,
+            "count": 0,
+            "capacity": 0,
+            "last_id": None,
+            "trained_count": 0,
+            "vocab": {name: ["unknown"] for name in INDEX_ATTRIBUTES}
+        }
+        self._vectors = None
+        self._attributes = None
+        self._ids = None
+        self._digests = None
+        self._centroids = None
+        self._lists: List[np.ndarray] = []
+
+    def _open_arrays(self, mode: str = "r+"):
+        capacity, dim = self.state["capacity"], self.state["dim"]
+        if capacity == 0:
+            self._vectors = self._attributes = self._ids = self._digests = None
+            return
+        self._vectors = np.memmap(self._path("vectors.f16"), dtype=np.float16, mode=mode, shape=(capacity, dim))
+        self._attributes = np.memmap(self._path("attributes.i16"), dtype=np.int16, mode=mode,
+                                     shape=(capacity, len(INDEX_ATTRIBUTES)))
+        self._ids = np.memmap(self._path("ids.bin"), dtype=f"S{ID_LENGTH}", mode=mode, shape=(capacity,))
+        self._digests = np.memmap(self._path("digests.bin"), dtype=f"S{DIGEST_LENGTH}", mode=mode,
+                                  shape=(capacity,))
+
+    def _load_ivf(self):
+        count = self.state["count"]
+        centroids_path, assignment_path = self._path("centroids.npy"), self._path("assignment.i32")
+        if self.state["trained_count"] and os.path.exists(centroids_path):
+            self._centroids = np.load(centroids_path)
+            assignment = np.fromfile(assignment_path, dtype=np.int32, count=count)
+            order = np.argsort(assignment, kind="stable")
+            bounds = np.searchsorted(assignment[order], np.arange(len(self._centroids) + 1))
+            self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self._centroids))]
+        else:
+            self._centroids = None
+            self._lists = []
+
+    def load(self) -> bool:
+        """Load the index from disk; returns False when none exists"""
+        state_path = self._path("state.json")
+        if not os.path.exists(state_path):
+            return False
+        with self._lock:
+            with open(state_path) as f:
+                state = json.load(f)
+            if state.get("format") != INDEX_FORMAT:
+                # Written by an older layout: start empty, the next sync rebuilds it from MongoDB
+                logger.info(f"Vector index in {self.directory} has an old format and will be rebuilt")
+                self._reset_state(None, 0)
+                return False
+            self.state = state
+            self._open_arrays()
+            self._load_ivf()
+        logger.info(f"Vector index loaded: {self.state['count']} vectors ({self.directory})")
+        return True
+
+    def _save_state(self):
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._attributes.flush()
+            self._ids.flush()
+            self._digests.flush()
+        tmp_path = self._path("state.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self._path("state.json"))
+
+    @contextmanager
+    def _writer(self):
+        """Exclusive write access across processes sharing the index directory"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path("index.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with self._lock:
+                    # Another process may have advanced the index since we last read it
+                    self.load()
+                    yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _grow(self, needed: int):
+        capacity = self.state["capacity"]
+        if needed <= capacity:
+            return
+        new_capacity = max(INITIAL_CAPACITY, capacity)
+        while new_capacity < needed:
+            new_capacity *= 2
+        dim = self.state["dim"]
+        self._vectors = self._attributes = self._ids = self._digests = None
+        for name, row_bytes in (("vectors.f16", 2 * dim), ("attributes.i16", 2 * len(INDEX_ATTRIBUTES)),
+                                ("ids.bin", ID_LENGTH), ("digests.bin", DIGEST_LENGTH)):
+            with open(self._path(name), "ab") as f:
+                f.truncate(new_capacity * row_bytes)
+        self.state["capacity"] = new_capacity
+        self._open_arrays()
+
+    # --- writes ---
+
+    def _encode_attributes(self, case: Dict[str, Any]) -> List[int]:
+        codes = []
+        for name in INDEX_ATTRIBUTES:
+            vocab = self.state["vocab"][name]
+            value = str(case.get(name) or "unknown").strip().lower()
+            if value not in vocab:
+                vocab.append(value)
+            codes.append(vocab.index(value))
+        return codes
+
+    def _append(self, ids: Sequence[str], vectors: np.ndarray, cases: Sequence[Dict[str, Any]]):
+        start, count = self.state["count"], len(ids)
+        self._grow(start + count)
+        self._vectors[start:start + count] = _normalize(vectors).astype(np.float16)
+        self._attributes[start:start + count] = [self._encode_attributes(case) for case in cases]
+        self._ids[start:start + count] = [str(case_id).encode()[:ID_LENGTH] for case_id in ids]
+        self._digests[start:start + count] = [str(case.get("image_digest") or "").encode()[:DIGEST_LENGTH]
+                                              for case in cases]
+        self.state["count"] = start + count
+
+        if self.state["trained_count"]:
+            assignment = (self._vectors[start:start + count].astype(np.float32) @ self._centroids.T).argmax(axis=1)
+            with open(self._path("assignment.i32"), "ab") as f:
+                f.truncate(start * 4)
+                assignment.astype(np.int32).tofile(f)
+
+        # Retrain the coarse quantizer once the index has doubled since the last training
+        if self.state["count"] >= max(self.min_train, 2 * self.state["trained_count"]):
+            self._train()
+        else:
+            self._load_ivf()
+
+    def _train(self):
+        count = self.state["count"]
+        nlist = int(min(4096, max(1, 4 * np.sqrt(count))))
+        rng = np.random.default_rng(count)
+        sample = rng.choice(count, size=min(count, KMEANS_SAMPLE), replace=False)
+        centroids = spherical_kmeans(self._vectors[np.sort(sample)].astype(np.float32), nlist)
+
+        assignment = np.empty(count, dtype=np.int32)
+        for start in range(0, count, 65536):
+            end = min(start + 65536, count)
+            assignment[start:end] = (self._vectors[start:end].astype(np.float32) @ centroids.T).argmax(axis=1)
+        np.save(self._path("centroids.npy"), centroids)
+        assignment.tofile(self._path("assignment.i32"))
+        self.state["trained_count"] = count
+        self._load_ivf()
+        logger.info(f"Vector index trained: {nlist} lists over {count} vectors")
+
+    def add(self, ids: Sequence[str], vectors: np.ndarray, cases: Sequence[Dict[str, Any]],
+            embedding_id: str, last_id: Optional[str] = None) -> int:
+        """
+        Append embeddings with their case attributes; returns the number appended.
+
+        With last_id (a sync batch), ids at or below the sync position on disk are skipped:
+        another worker has indexed them since this one read the position.
+        """
+        if not len(ids):
+            return 0
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        with self._writer():
+            if self.state["embedding_id"] != embedding_id or self.state["dim"] != vectors.shape[1]:
+                self.reset(embedding_id, vectors.shape[1])
+            synced = self.state["last_id"]
+            if last_id is not None and synced is not None:
+                keep = [i for i, case_id in enumerate(ids) if str(case_id) > synced]
+                ids, vectors, cases = [ids[i] for i in keep], vectors[keep], [cases[i] for i in keep]
+                last_id = max(last_id, synced)
+            if len(ids):
+                self._append(ids, vectors, cases)
+            if last_id is not None:
+                self.state["last_id"] = last_id
+            self._save_state()
+        return len(ids)
+
+    def synced_id(self) -> Optional[str]:
+        """Sync position on disk, which other workers may have advanced"""
+        try:
+            with open(self._path("state.json")) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return state.get("last_id") if state.get("format") == INDEX_FORMAT else None
+
+    def reset(self, embedding_id: Optional[str], dim: int):
+        """Drop all vectors, e.g. when the embedding model changes"""
+        with self._lock:
+            for name in ("vectors.f16", "attributes.i16", "ids.bin", "digests.bin", "centroids.npy", "assignment.i32"):
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+            self._reset_state(embedding_id, dim)
+            if embedding_id is not None:
+                logger.info(f"Vector index reset for embedding model {embedding_id}")
+
+    # --- queries ---
+
+    def _filter_mask(self, rows: np.ndarray, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        if not filters:
+            return None
+        mask = np.ones(len(rows), dtype=bool)
+        attributes = self._attributes[rows]
+        for name, wanted in filters.items():
+            if name not in INDEX_ATTRIBUTES or wanted is None:
+                continue
+            values = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+            vocab = self.state["vocab"][name]
+            codes = [vocab.index(str(v).strip().lower()) for v in values if str(v).strip().lower() in vocab]
+            mask &= np.isin(attributes[:, INDEX_ATTRIBUTES.index(name)], codes)
+        return mask
+
+    def _candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        count = self.state["count"]
+        if self._centroids is None or nprobe >= len(self._centroids):
+            return np.arange(count)
+        probes = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self._lists[p] for p in probes])
+
+    def search(self, embedding: np.ndarray, k: int = 5, filters: Optional[Dict[str, Any]] = None,
+               exclude_ids: Iterable[str] = (), exclude_digests: Iterable[str] = (),
+               nprobe: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Top-k most similar cases, optionally restricted by attribute filters"""
+        query = _normalize(np.asarray(embedding, dtype=np.float32).reshape(-1))
+        exclude = {str(case_id).encode() for case_id in exclude_ids}
+        exclude_images = {str(digest).encode() for digest in exclude_digests}
+        with self._lock:
+            if not self.state["count"] or self.state["dim"] != len(query):
+                return []
+            nprobe = nprobe or self.nprobe
+            while True:
+                rows = self._candidates(query, nprobe)
+                mask = self._filter_mask(rows, filters)
+                if mask is not None:
+                    rows = rows[mask]
+                if exclude:
+                    rows = rows[~np.isin(self._ids[rows], list(exclude))]
+                if exclude_images:
+                    rows = rows[~np.isin(self._digests[rows], list(exclude_images))]
+                exhausted = self._centroids is None or nprobe >= len(self._centroids)
+                # Widen the probe when filters leave too few candidates
+                if len(rows) >= k or exhausted:
+                    break
+                nprobe *= 2
+
+            scores = self._vectors[rows].astype(np.float32) @ query
+            top = np.argsort(-scores)[:k] if len(scores) <= k else np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            results = []
+            for i in top:
+                row = rows[i]
+                codes = self._attributes[row]
+                results.append({
+                    "case_id": self._ids[row].decode(),
+                    "image_digest": self._digests[row].decode() or None,
+                    "similarity": round(float(scores[i]), 4),
+                    **{name: self.state["vocab"][name][codes[j]] for j, name in enumerate(INDEX_ATTRIBUTES)}
+                })
+            return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "vectors": self.state["count"],
+                "dim": self.state["dim"],
+                "embedding_id": self.state["embedding_id"],
+                "lists": 0 if self._centroids is None else len(self._centroids),
+                "nprobe": self.nprobe,
+                "last_synced_id": self.state["last_id"]
+            }
+
+
+def case_attributes(document: Dict[str, Any]) -> Dict[str, Any]:
+    """Filterable attributes of a stored prediction document"""
+    return {
+        "image_digest": document.get("image_digest"),
+        "predicted_class": document.get("predicted_class"),
+        "localization": document.get("localization"),
+        "sex": document.get("sex")
+    }
+
+
+def sync_from_mongo(index: VectorIndex, embedding_id: str, batch_size: int = VECTOR_INDEX_SYNC_BATCH,
+                    lag: int = VECTOR_INDEX_SYNC_LAG) -> int:
+    """Append predictions stored since the last sync; returns the number of vectors added"""
+    from bson import ObjectId
+    from .database import get_database, PREDICTIONS_COLLECTION, WORKLOAD_PRIMARY
+
+    # The primary, so nothing older than the lag is still in flight to this reader
+    db = get_database(WORKLOAD_PRIMARY)
+    if db is None:
+        return 0
+
+    if index.state["embedding_id"] != embedding_id:
+        index.load()
+    upper = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=lag))
+
+    added = 0
+    while True:
+        # Start from the position on disk: other workers sync the same index
+        last_id = index.synced_id() if index.state["embedding_id"] == embedding_id else None
+        id_range = {"$lt": upper}
+        if last_id:
+            id_range["$gt"] = ObjectId(last_id)
+        query = {"embedding_id": embedding_id, "embedding": {"$exists": True}, "_id": id_range}
+        projection = {"embedding": 1, "image_digest": 1, "predicted_class": 1, "localization": 1, "sex": 1}
+        documents = list(db[PREDICTIONS_COLLECTION].find(query, projection).sort("_id", 1).limit(batch_size))
+        if not documents:
+            break
+
+        ids = [str(doc["_id"]) for doc in documents]
+        vectors = np.stack([np.frombuffer(bytes(doc["embedding"]), dtype=np.float16) for doc in documents])
+        added += index.add(ids, vectors, [case_attributes(doc) for doc in documents], embedding_id, last_id=ids[-1])
+        if len(documents) < batch_size:
+            break
+
+    if added:
+        logger.info(f"Vector index synced {added} cases from MongoDB")
+    return added
+
+
+def start_sync(index: VectorIndex, embedding_id_fn, interval: int = VECTOR_INDEX_SYNC_INTERVAL) -> threading.Thread:
+    """Periodically sync the index from MongoDB on a background thread"""
+    def run():
+        while True:
+            try:
+                sync_from_mongo(index, embedding_id_fn())
+            except Exception as e:
+                logger.error(f"Vector index sync failed: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="vector-index-sync", daemon=True)
+    thread.start()
+    return thread
+
+
+# Global vector index instance
+vector_index = VectorIndex()
@@ -0,0 +1,7 @@
+# conftest.py
+# Shared pytest setup: makes the app package importable when pytest runs from backend/.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
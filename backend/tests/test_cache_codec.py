@@ -0,0 +1,83 @@
+# test_cache_codec.py
+# Cached values must decode to exactly what was encoded, whatever codec or compression wrote them.
+
+import base64
+import json
+
+import pytest
+
+from app import cache_codec
+
+
+def _prediction_record(token: bytes):
+    return {
+        "prediction": {
+            "predicted_class": "Malignant",
+            "probabilities": {"Benign": 0.125, "Malignant": 0.875},
+            "risk_level": "High"
+        },
+        "confidence": 0.875,
+        "encrypted_prediction": base64.b64encode(token).decode()
+    }
+
+
+def test_prediction_record_round_trip_fernet_token():
+    fernet = pytest.importorskip("cryptography.fernet")
+    token = fernet.Fernet(fernet.Fernet.generate_key()).encrypt(b'{"predicted_class": "Malignant"}')
+    record = _prediction_record(token)
+    data = cache_codec.encode(record, codec="prediction")
+    assert data[1] == cache_codec.PredictionCodec.codec_id
+    assert cache_codec.decode(data) == record
+    # Stored without either base64 layer, so smaller than the JSON text
+    assert len(data) < len(json.dumps(record))
+
+
+def test_prediction_record_round_trip_raw_token():
+    record = _prediction_record(b"\x00\xff not a fernet token")
+    assert cache_codec.decode(cache_codec.encode(record, codec="prediction")) == record
+
+
+def test_other_values_fall_back_to_default_codec():
+    value = {"patient_id": "p-1", "results": [1, 2.5, None, "x"], "nested": {"ok": True}}
+    data = cache_codec.encode(value, codec="prediction")
+    assert data[1] != cache_codec.PredictionCodec.codec_id
+    assert cache_codec.decode(data) == value
+
+
+@pytest.mark.parametrize("codec", sorted(set(cache_codec._codecs) - {"prediction"}))
+def test_generic_codecs_round_trip(codec):
+    value = {"name": "ünïcode", "values": list(range(10)), "score": 0.5, "flag": False}
+    data = cache_codec.encode(value, codec=codec)
+    assert data[0] == cache_codec.FORMAT_VERSION
+    assert cache_codec.decode(data) == value
+
+
+@pytest.mark.parametrize("compression", sorted(cache_codec._compressors))
+def test_large_values_are_compressed(monkeypatch, compression):
+    monkeypatch.setattr(cache_codec, "CACHE_COMPRESSION", compression)
+    value = {"rows": [{"id": i, "label": "Benign"} for i in range(200)]}
+    data = cache_codec.encode(value)
+    assert data[2] == cache_codec._compressors[compression][0]
+    assert cache_codec.decode(data) == value
+
+
+def test_legacy_json_values_decode():
+    value = {"prediction": {"predicted_class": "Benign"}, "confidence": 0.9}
+    assert cache_codec.decode(json.dumps(value)) == value
+    assert cache_codec.decode(json.dumps(value).encode()) == value
+    assert cache_codec.decode(b"plain text") == "plain text"
+
+
+def test_unknown_codec_id_raises():
+    data = cache_codec.HEADER.pack(cache_codec.FORMAT_VERSION, 250, cache_codec.COMPRESSION_NONE) + b"x"
+    with pytest.raises(cache_codec.CodecError):
+        cache_codec.decode(data)
+
+
+def test_codec_must_implement_encode_and_decode():
+    class EncodeOnly(cache_codec.Codec):
+        def encode(self, value):
+            return b""
+
+    with pytest.raises(TypeError):
+        EncodeOnly()
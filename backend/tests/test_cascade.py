@@ -0,0 +1,118 @@
+# test_cascade.py
+# Exit thresholds must keep the target precision on the data they were calibrated on.
+
+import numpy as np
+import pytest
+import torch
+
+from app.cascade import CascadeModel, calibrate_thresholds
+from app.embedding_cache import EmbeddingCache
+from app.model_registry import ClinicalFeatureEncoder, LoadedModel
+from app.models import MultimodalStudent
+
+CLASSES = ["Benign", "Malignant"]
+BENIGN, MALIGNANT = 0, 1
+
+
+def _probs(benign_scores):
+    benign_scores = np.asarray(benign_scores, dtype=np.float64)
+    return np.stack([benign_scores, 1.0 - benign_scores], axis=1)
+
+
+def _student(seed: int, class_names=CLASSES) -> LoadedModel:
+    torch.manual_seed(seed)
+    model = MultimodalStudent(num_clinical_features=ClinicalFeatureEncoder.feature_dim, num_classes=len(class_names))
+    return LoadedModel("MultimodalStudent", model.eval(), list(class_names), ClinicalFeatureEncoder(),
+                       returns_logits=True)
+
+
+def _exited(probs, thresholds):
+    """Rows a serving cascade with these thresholds answers from stage one"""
+    cascade = CascadeModel(_student(0), _student(1), thresholds)
+    return cascade.exit_mask(torch.from_numpy(probs)).numpy()
+
+
+def test_lowest_threshold_meeting_target():
+    scores = [0.99] * 10 + [0.9] + [0.8] * 5
+    labels = [BENIGN] * 10 + [MALIGNANT] + [BENIGN] * 5
+    result = calibrate_thresholds(_probs(scores), labels, CLASSES, ["Benign"], target_precision=0.9, min_exits=5)
+    assert result["thresholds"] == {"Benign": 0.8}
+    assert result["classes"]["Benign"]["exits"] == 16
+    assert result["classes"]["Benign"]["precision"] == pytest.approx(15 / 16, abs=1e-4)
+    assert result["exit_rate"] == 1.0
+
+    strict = calibrate_thresholds(_probs(scores), labels, CLASSES, ["Benign"], target_precision=0.95, min_exits=5)
+    assert strict["thresholds"] == {"Benign": 0.99}
+    assert strict["classes"]["Benign"]["exits"] == 10
+
+
+def test_tied_scores_are_admitted_together():
+    # Cutting inside the 0.95 tie would report 10/10 correct, but a 0.95 threshold admits both rows
+    scores = [0.99] * 9 + [0.95, 0.95] + [0.7] * 4
+    labels = [BENIGN] * 9 + [BENIGN, MALIGNANT] + [MALIGNANT] * 4
+    result = calibrate_thresholds(_probs(scores), labels, CLASSES, ["Benign"], target_precision=0.95, min_exits=1)
+    assert result["thresholds"] == {"Benign": 0.99}
+    assert result["classes"]["Benign"]["exits"] == 9
+
+
+def test_no_threshold_without_enough_exits():
+    scores = [0.99] * 10 + [0.2] * 10
+    labels = [BENIGN] * 10 + [MALIGNANT] * 10
+    result = calibrate_thresholds(_probs(scores), labels, CLASSES, ["Benign"], target_precision=0.99, min_exits=11)
+    assert result["thresholds"] == {"Benign": None}
+    assert result["classes"]["Benign"] == {"threshold": None, "exits": 0, "precision": None}
+    assert result["exit_rate"] == 0.0
+
+
+def test_other_classes_never_exit():
+    # Malignant-top rows are ignored when only Benign may exit
+    scores = [0.99] * 10 + [0.01] * 10
+    labels = [BENIGN] * 10 + [BENIGN] * 10
+    result = calibrate_thresholds(_probs(scores), labels, CLASSES, ["Benign"], target_precision=0.99, min_exits=1)
+    assert result["classes"]["Benign"]["exits"] == 10
+    assert result["exit_rate"] == 0.5
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_calibrated_exits_keep_target_precision(seed):
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(0, 2, size=2000)
+    # Noisy, quantized scores so ties are common
+    benign = np.clip(np.where(labels == BENIGN, 0.8, 0.3) + rng.normal(0, 0.2, size=labels.size), 0, 1).round(2)
+    probs = _probs(benign)
+    target = 0.97
+    result = calibrate_thresholds(probs, labels, CLASSES, ["Benign"], target_precision=target, min_exits=20)
+
+    mask = _exited(probs, result["thresholds"])
+    assert result["thresholds"]["Benign"] is not None
+    assert mask.sum() == result["classes"]["Benign"]["exits"]
+    assert (labels[mask] == BENIGN).mean() >= target
+    assert result["exit_rate"] == pytest.approx(mask.mean(), abs=1e-4)
+
+
+def test_explained_early_exit_caches_stage_two_embedding():
+    stage1, stage2 = _student(0), _student(1)
+    cascade = CascadeModel(stage1, stage2, {"Benign": 0.0, "Malignant": 0.0})
+    embeddings = EmbeddingCache(use_redis=False)
+    image = torch.randn(1, 3, 224, 224)
+    loads = []
+
+    def load_image():
+        loads.append(1)
+        return image
+
+    features = torch.zeros(1, cascade.feature_encoder.feature_dim)
+    probabilities, cam = cascade.predict_explained("digest", load_image, features, embeddings)
+    assert cascade.stats.snapshot()["early_exits"] == 1
+    assert cam.dim() == 2
+    # Probabilities are stage one's, the cached embedding is stage two's
+    assert torch.allclose(probabilities, stage1.predict_proba(image, features[:, :cascade.feature_encoder.split]))
+    cached = embeddings.peek(stage2.embedding_id, "digest")
+    assert cached is not None
+    with torch.no_grad():
+        assert torch.allclose(cached, stage2.embed(image), atol=1e-2)
+
+    # Grad-CAM needs the image again, but stage two's prediction is served from the cache
+    cascade.predict_explained("digest", load_image, features, embeddings)
+    cascade.stage2.predict_cached("digest", load_image, features[:, cascade.feature_encoder.split:], embeddings)
+    assert len(loads) == 2
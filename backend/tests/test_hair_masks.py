@@ -0,0 +1,16 @@
+# test_hair_masks.py
+# The batched torch hair masks must match the OpenCV black-hat pipeline they replace.
+
+import pytest
+
+pytest.importorskip("cv2")
+
+from app.preprocessing import compare_hair_masks_with_cv2
+
+
+def test_hair_masks_match_cv2():
+    assert compare_hair_masks_with_cv2(num_samples=8, seed=0) == 0
+
+
+def test_hair_masks_match_cv2_other_seed():
+    assert compare_hair_masks_with_cv2(num_samples=4, seed=3) == 0
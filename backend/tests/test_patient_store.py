@@ -0,0 +1,129 @@
+# test_patient_store.py
+# A cache fill that loaded a patient before a write must not store its stale copy after it.
+
+import threading
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # fakeredis runs the compare-and-set scripts through lupa
+
+from app import cache, database, patient_store
+
+PATIENT_ID = "patient-1"
+
+
+class FakeDatabase:
+    """In-memory patients and health records; the next load can be held on a stale snapshot"""
+
+    def __init__(self):
+        self.patients = {}
+        self.records = []
+        self.loaded = threading.Event()
+        self.release = threading.Event()
+        self.hold_next = False
+
+    def _hold(self):
+        if self.hold_next:
+            self.hold_next = False
+            self.loaded.set()
+            assert self.release.wait(10)
+
+    def get_patient(self, patient_id):
+        patient = self.patients.get(patient_id)
+        snapshot = dict(patient) if patient is not None else None
+        self._hold()
+        return snapshot
+
+    def upsert_patient(self, patient_data):
+        self.patients[patient_data["patient_id"]] = dict(patient_data)
+        return dict(patient_data)
+
+    def get_health_records(self, patient_id, limit=10, consistent=False):
+        snapshot = [dict(record) for record in self.records if record["patient_id"] == patient_id][:limit]
+        self._hold()
+        return snapshot
+
+    def insert_health_record(self, record):
+        self.records.insert(0, dict(record))
+        return dict(record)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    server = fakeredis.FakeServer()
+    client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    binary_client = fakeredis.FakeRedis(server=server)
+    monkeypatch.setattr(cache, "get_redis_client", lambda: client)
+    monkeypatch.setattr(cache, "get_binary_redis_client", lambda: binary_client)
+    monkeypatch.setattr(patient_store, "REDIS_CACHE_AVAILABLE", True)
+    fake = FakeDatabase()
+    for name in ("get_patient", "upsert_patient", "get_health_records", "insert_health_record"):
+        monkeypatch.setattr(database, name, getattr(fake, name))
+    return fake
+
+
+def _slow_read(db, read):
+    """Start read in a thread and return once it has loaded its snapshot from the database"""
+    db.hold_next = True
+    thread = threading.Thread(target=read)
+    thread.start()
+    assert db.loaded.wait(10)
+    return thread
+
+
+def _finish(db, thread):
+    db.release.set()
+    thread.join(10)
+    assert not thread.is_alive()
+
+
+def test_slow_reader_does_not_overwrite_upsert(db):
+    db.patients[PATIENT_ID] = {"patient_id": PATIENT_ID, "name": "old"}
+    reader = _slow_read(db, lambda: patient_store.get_patient(PATIENT_ID))
+
+    patient_store.upsert_patient({"patient_id": PATIENT_ID, "name": "new"})
+    _finish(db, reader)
+
+    assert cache.get_cached_patient_data(PATIENT_ID)["name"] == "new"
+    assert patient_store.get_patient(PATIENT_ID)["name"] == "new"
+
+
+def test_slow_reader_does_not_cache_miss_over_created_patient(db):
+    reader = _slow_read(db, lambda: patient_store.get_patient(PATIENT_ID))
+
+    patient_store.upsert_patient({"patient_id": PATIENT_ID, "name": "created"})
+    _finish(db, reader)
+
+    assert patient_store.get_patient(PATIENT_ID)["name"] == "created"
+
+
+def test_slow_reader_does_not_restore_invalidated_records(db):
+    db.records.append({"patient_id": PATIENT_ID, "diagnosis": "old"})
+    reader = _slow_read(db, lambda: patient_store.get_health_records(PATIENT_ID))
+
+    patient_store.insert_health_record({"patient_id": PATIENT_ID, "diagnosis": "new"})
+    _finish(db, reader)
+
+    records = patient_store.get_health_records(PATIENT_ID)
+    assert [record["diagnosis"] for record in records] == ["new", "old"]
+
+
+def test_warm_drops_fills_that_raced_with_upsert(db):
+    db.patients[PATIENT_ID] = {"patient_id": PATIENT_ID, "name": "old"}
+    db.patients["patient-2"] = {"patient_id": "patient-2", "name": "other"}
+    warmer = _slow_read(db, lambda: patient_store.warm_patients([PATIENT_ID, "patient-2"]))
+
+    patient_store.upsert_patient({"patient_id": PATIENT_ID, "name": "new"})
+    _finish(db, warmer)
+
+    assert cache.get_cached_patient_data(PATIENT_ID)["name"] == "new"
+    assert cache.get_cached_patient_data("patient-2")["name"] == "other"
+
+
+def test_unraced_fill_is_cached(db):
+    db.patients[PATIENT_ID] = {"patient_id": PATIENT_ID, "name": "stored"}
+    assert patient_store.get_patient(PATIENT_ID)["name"] == "stored"
+
+    db.patients[PATIENT_ID]["name"] = "changed behind the cache"
+    assert patient_store.get_patient(PATIENT_ID)["name"] == "stored"
@@ -0,0 +1,80 @@
+# test_preprocessing.py
+# Served models must see images preprocessed the way they were validated.
+
+import numpy as np
+import pytest
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+
+from app import preprocessing
+from app.model_registry import ModelLoadError, build_model
+from app.models import HybridMultimodalHQCNN
+
+
+def _notebook_checkpoint(**extra):
+    """Checkpoint in the layout the training notebook saves, with a small DenseNet"""
+    model = HybridMultimodalHQCNN(num_classes=2, metadata_dim=3, growth_rate=8, block_config=(1, 1, 1, 1),
+                                  num_init_features=16, bn_size=2)
+    return {
+        "model_state_dict": model.state_dict(),
+        "model_architecture": "MultimodalHQCNN",
+        "num_classes": 2,
+        "class_names": ["Benign", "Malignant"],
+        "metadata_dim": 3,
+        "img_size": 224,
+        **extra
+    }
+
+
+def _lesion_photo(width=600, height=450, seed=0):
+    """HAM10000-sized RGB photo with structure near the borders"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 / width, y * 255 / height, (x + y) * 127 / (width + height)], axis=-1)
+    noise = rng.integers(0, 40, size=(height, width, 3))
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+
+
+# val_transforms from the training notebook
+notebook_val_transforms = transforms.Compose([
+    transforms.Lambda(lambda img: preprocessing.remove_hair(np.array(img))),
+    transforms.ToPILImage(),
+    transforms.Resize(int(224 * 1.15)),
+    transforms.CenterCrop(224),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+])
+
+
+def test_notebook_checkpoint_uses_notebook_eval_transform():
+    loaded = build_model(_notebook_checkpoint())
+    assert loaded.eval_resize == preprocessing.EVAL_RESIZE_CENTER_CROP
+    assert loaded.metadata["eval_resize"] == preprocessing.EVAL_RESIZE_CENTER_CROP
+
+    photo = _lesion_photo()
+    served = preprocessing.inputs_from_arrays(preprocessing.prepare_images([photo], loaded.eval_resize))
+    expected = notebook_val_transforms(photo).unsqueeze(0)
+    assert served.shape == (1, 3, 224, 224)
+    assert torch.equal(served, expected)
+
+
+def test_squashing_differs_from_notebook_transform():
+    photo = _lesion_photo(seed=1)
+    squashed = preprocessing.inputs_from_arrays(preprocessing.prepare_images([photo], preprocessing.EVAL_RESIZE_SQUASH))
+    assert not torch.allclose(squashed, notebook_val_transforms(photo).unsqueeze(0), atol=0.05)
+
+
+def test_checkpoint_eval_resize_overrides_default():
+    loaded = build_model(_notebook_checkpoint(eval_resize=preprocessing.EVAL_RESIZE_SQUASH))
+    assert loaded.eval_resize == preprocessing.EVAL_RESIZE_SQUASH
+    with pytest.raises(ModelLoadError):
+        build_model(_notebook_checkpoint(eval_resize="letterbox"))
+
+
+def test_array_eval_transform_matches_prepare_images():
+    photo = _lesion_photo(seed=2)
+    cleaned = preprocessing.remove_hair(np.array(photo))
+    collated = preprocessing.array_eval_transform(preprocessing.EVAL_RESIZE_CENTER_CROP)(cleaned)
+    served = preprocessing.inputs_from_arrays(preprocessing.prepare_images([photo]))[0]
+    assert torch.equal(collated, served)
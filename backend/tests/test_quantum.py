@@ -0,0 +1,17 @@
+# test_quantum.py
+# The torch QCNN simulator must match the qiskit EstimatorQNN it replaces.
+
+import pytest
+
+pytest.importorskip("qiskit")
+pytest.importorskip("qiskit_machine_learning")
+
+from app.quantum import compare_with_qiskit
+
+
+def test_simulator_matches_qiskit():
+    assert compare_with_qiskit(num_samples=16, seed=0) < 1e-9
+
+
+def test_simulator_matches_qiskit_other_seed():
+    assert compare_with_qiskit(num_samples=8, seed=3) < 1e-9
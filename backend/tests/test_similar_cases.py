@@ -0,0 +1,124 @@
+# test_similar_cases.py
+# Cases answered by the cascade's first stage must still be indexed and retrievable.
+
+import base64
+import io
+import os
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+# Fail fast instead of waiting for services the test replaces
+os.environ.setdefault("MONGO_HOSTS", "localhost:1")
+os.environ.setdefault("HEALTH_PROBE_INTERVAL", "0")
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.cascade import CascadeModel
+from app.embedding_cache import EmbeddingCache, decode_embedding
+from app.model_manager import ModelManager, MODEL_NAME
+from app.model_registry import ClinicalFeatureEncoder, LoadedModel
+from app.models import MultimodalStudent
+from app.preprocessing import inputs_from_arrays, prepare_images
+from app.vector_index import VectorIndex
+
+CLINICAL = dict(age=50, gender=1, bmi=24, blood_pressure_systolic=120, blood_pressure_diastolic=80,
+                cholesterol=190, glucose=90, smoking=0, family_history=0, symptoms_severity=3,
+                localization="back")
+CLASSES = ["Benign", "Malignant", "Suspicious"]
+
+
+def _student(seed: int) -> LoadedModel:
+    torch.manual_seed(seed)
+    model = MultimodalStudent(num_clinical_features=ClinicalFeatureEncoder.feature_dim, num_classes=len(CLASSES))
+    return LoadedModel("MultimodalStudent", model.eval(), CLASSES, ClinicalFeatureEncoder(), returns_logits=True)
+
+
+class FakeImageStore:
+    """Keeps prepared inputs in memory, like the GridFS store keeps them next to the originals"""
+
+    def __init__(self):
+        self.inputs = {}
+        self.loads = 0
+
+    def put(self, image_bytes, digest=None, model_input=None, eval_resize=None):
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            self.inputs[digest] = model_input if model_input is not None else prepare_images([image], eval_resize)[0]
+        return {"digest": digest, "stored": True}
+
+    def load_inputs(self, digests, workload=None, eval_resize=None):
+        self.loads += 1
+        return inputs_from_arrays([self.inputs[digest] for digest in digests])
+
+
+@pytest.fixture
+def served(monkeypatch, tmp_path):
+    """A cascade whose first stage answers every request, served with in-memory stores"""
+    stage1, stage2 = _student(0), _student(1)
+    cascade = CascadeModel(stage1, stage2, {name: 0.0 for name in CLASSES})
+    manager = ModelManager()
+    manager.install(MODEL_NAME, "cascade-test", cascade, warmup=False)
+
+    stored_cases = []
+    store = FakeImageStore()
+    monkeypatch.setattr(main, "model_manager", manager)
+    monkeypatch.setattr(main, "embedding_cache", EmbeddingCache(use_redis=False))
+    monkeypatch.setattr(main, "vector_index", VectorIndex(str(tmp_path), min_train=100000))
+    monkeypatch.setattr(main, "image_store", store)
+    monkeypatch.setattr(main, "insert_prediction", stored_cases.append)
+    monkeypatch.setattr(main, "DB_AVAILABLE", True)
+    monkeypatch.setattr(main, "IMAGE_STORE_ENABLED", True)
+    monkeypatch.setattr(main, "CACHE_AVAILABLE", False)
+    return cascade, stored_cases, store
+
+
+def _predict(client, seed: int):
+    rng = np.random.default_rng(seed)
+    image = Image.fromarray(rng.integers(0, 255, size=(450, 600, 3), dtype=np.uint8))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    response = client.post("/predict", json={"clinical_data": CLINICAL,
+                                              "image_base64": base64.b64encode(buffer.getvalue()).decode()})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_early_exit_cases_are_stored_with_index_embedding(served):
+    cascade, stored_cases, _ = served
+    _predict(TestClient(main.app), seed=0)
+
+    assert cascade.stats.snapshot()["early_exits"] == 1
+    case, = stored_cases
+    assert case["embedding_id"] == cascade.index_model.embedding_id
+    # Embedded after responding, from the same prepared input stage two would have seen
+    expected = main.embedding_cache.peek(cascade.stage2.embedding_id, case["image_digest"])
+    assert expected is not None
+    assert torch.equal(decode_embedding(case["embedding"]), expected)
+
+
+def test_similar_cases_after_early_exit(served):
+    cascade, stored_cases, store = served
+    client = TestClient(main.app)
+    digests = [_predict(client, seed)["image_digest"] for seed in range(3)]
+    ids = [f"{i:024x}" for i in range(len(stored_cases))]
+    vectors = np.stack([np.frombuffer(case["embedding"], dtype=np.float16) for case in stored_cases])
+    main.vector_index.add(ids, vectors, stored_cases, cascade.index_model.embedding_id)
+
+    # Another worker served the prediction: nothing is cached here, so the stored input is embedded
+    main.embedding_cache._entries.clear()
+    response = client.post("/similar_cases", json={"image_digest": digests[0], "k": 5})
+    assert response.status_code == 200, response.text
+    assert store.loads == 1
+    returned = [case["image_digest"] for case in response.json()["cases"]]
+    assert sorted(returned) == sorted(digests[1:])
+    assert main.embedding_cache.peek(cascade.index_model.embedding_id, digests[0]) is not None
+
+
+def test_similar_cases_unknown_image(served):
+    response = TestClient(main.app).post("/similar_cases", json={"image_digest": "0" * 64})
+    assert response.status_code == 404
@@ -0,0 +1,135 @@
+# test_vector_index.py
+# Workers syncing one index directory concurrently must index every case exactly once.
+
+import multiprocessing
+import sys
+import threading
+import types
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+from bson import ObjectId
+
+from app.vector_index import VectorIndex, sync_from_mongo
+
+DIM = 16
+EMBEDDING_ID = "test-embedding"
+
+
+def _digest(i: int) -> str:
+    return f"{i:064x}"
+
+
+def _insert(collection, start: int, count: int, created: datetime, seed: int = 0):
+    rng = np.random.default_rng(seed + start)
+    collection.insert_many([{
+        "_id": ObjectId.from_datetime(created + timedelta(seconds=i)),
+        "embedding_id": EMBEDDING_ID,
+        "embedding": rng.standard_normal(DIM).astype(np.float16).tobytes(),
+        "image_digest": _digest(start + i),
+        "predicted_class": "Benign" if i % 3 else "Malignant",
+        "localization": "back",
+        "sex": "female" if i % 2 else "male"
+    } for i in range(count)])
+
+
+@pytest.fixture
+def predictions(monkeypatch):
+    """In-memory predictions collection behind a stand-in for app.database"""
+    db = mongomock.MongoClient().db
+    database = types.ModuleType("app.database")
+    database.get_database = lambda workload=None: db
+    database.PREDICTIONS_COLLECTION = "predictions"
+    database.WORKLOAD_PRIMARY = "primary"
+    monkeypatch.setitem(sys.modules, "app.database", database)
+    return db.predictions
+
+
+def _indexed_ids(directory):
+    index = VectorIndex(directory)
+    assert index.load()
+    return [value.decode() for value in index._ids[:index.state["count"]]]
+
+
+def test_concurrent_threads_index_each_case_once(predictions, tmp_path):
+    _insert(predictions, 0, 300, datetime.now(timezone.utc) - timedelta(minutes=10))
+    workers = [VectorIndex(str(tmp_path), min_train=100000) for _ in range(4)]
+    added = [0] * len(workers)
+
+    def run(i):
+        added[i] = sync_from_mongo(workers[i], EMBEDDING_ID, batch_size=25)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(workers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ids = _indexed_ids(str(tmp_path))
+    assert len(ids) == 300
+    assert len(set(ids)) == 300
+    assert sum(added) == 300
+
+
+def _sync_process(directory):
+    sync_from_mongo(VectorIndex(directory, min_train=100000), EMBEDDING_ID, batch_size=20)
+
+
+def test_concurrent_processes_index_each_case_once(predictions, tmp_path):
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("needs fork to share the in-memory collection")
+    _insert(predictions, 0, 200, datetime.now(timezone.utc) - timedelta(minutes=10))
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_sync_process, args=(str(tmp_path),)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    ids = _indexed_ids(str(tmp_path))
+    assert len(ids) == 200
+    assert len(set(ids)) == 200
+
+
+def test_stale_batch_is_skipped(tmp_path):
+    first, second = VectorIndex(str(tmp_path)), VectorIndex(str(tmp_path))
+    ids = [str(ObjectId()) for _ in range(4)]
+    vectors = np.random.default_rng(0).standard_normal((4, DIM))
+    cases = [{"image_digest": _digest(i)} for i in range(4)]
+
+    assert first.add(ids[:3], vectors[:3], cases[:3], EMBEDDING_ID, last_id=ids[2]) == 3
+    # second read the sync position before first advanced it and fetched an overlapping batch
+    assert second.add(ids[1:], vectors[1:], cases[1:], EMBEDDING_ID, last_id=ids[3]) == 1
+    assert _indexed_ids(str(tmp_path)) == ids
+    assert second.synced_id() == ids[3]
+
+
+def test_recent_documents_wait_for_the_lag(predictions, tmp_path):
+    _insert(predictions, 0, 10, datetime.now(timezone.utc) - timedelta(minutes=10))
+    _insert(predictions, 10, 5, datetime.now(timezone.utc) - timedelta(seconds=10))
+    index = VectorIndex(str(tmp_path))
+
+    assert sync_from_mongo(index, EMBEDDING_ID, lag=60) == 10
+    # A document committed late with an older _id is still picked up inside the lag window
+    _insert(predictions, 15, 1, datetime.now(timezone.utc) - timedelta(seconds=30))
+    assert sync_from_mongo(index, EMBEDDING_ID, lag=0) == 6
+    assert len(set(_indexed_ids(str(tmp_path)))) == 16
+
+
+def test_search_excludes_query_image(predictions, tmp_path):
+    _insert(predictions, 0, 50, datetime.now(timezone.utc) - timedelta(minutes=10))
+    index = VectorIndex(str(tmp_path))
+    sync_from_mongo(index, EMBEDDING_ID)
+
+    query = np.frombuffer(predictions.find_one({"image_digest": _digest(7)})["embedding"], dtype=np.float16)
+    assert index.search(query, k=3)[0]["image_digest"] == _digest(7)
+    results = index.search(query, k=3, exclude_digests=[_digest(7)])
+    assert len(results) == 3
+    assert _digest(7) not in [result["image_digest"] for result in results]
+
+    malignant = index.search(query, k=50, filters={"predicted_class": "Malignant"})
+    assert malignant and all(result["predicted_class"] == "malignant" for result in malignant)
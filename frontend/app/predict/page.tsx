@@ -10,7 +10,7 @@ import { Progress } from "@/components/ui/progress"
 import { Alert, AlertDescription } from "@/components/ui/alert"
 import { Separator } from "@/components/ui/separator"
 import { usePrediction } from "@/lib/hooks/use-api"
-import { PredictionRequest, PredictionResponse } from "@/lib/api/types"
+import { PredictionRequest, PredictionResponse, PreparedImage } from "@/lib/api/types"
 import { toast } from "sonner"
 import { 
   Brain, 
@@ -28,6 +28,7 @@ type PredictionStep = 'clinical-data' | 'image-upload' | 'review' | 'results'
 interface PredictionState {
   clinicalData: PatientData | null
   imageBase64: string | null
+  imageMaxSide?: number
   results: PredictionResponse | null
   error: string | null
 }
@@ -59,8 +60,8 @@ export default function PredictPage() {
     setCurrentStep('image-upload')
   }
 
-  const handleImageSelect = (base64: string) => {
-    setState(prev => ({ ...prev, imageBase64: base64 }))
+  const handleImageSelect = (base64: string, image?: PreparedImage) => {
+    setState(prev => ({ ...prev, imageBase64: base64, imageMaxSide: image?.maxSide }))
     // Auto-advance to review step
     setTimeout(() => {
       setCurrentStep('review')
@@ -86,7 +87,8 @@ export default function PredictPage() {
         family_history: state.clinicalData.family_history,
         symptoms_severity: state.clinicalData.symptoms_severity
       },
-      image_base64: state.imageBase64
+      image_base64: state.imageBase64,
+      image_max_side: state.imageMaxSide
     }
 
     try {
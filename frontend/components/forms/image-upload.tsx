@@ -16,9 +16,11 @@ import {
   FileImage,
   Camera
 } from "lucide-react"
+import { PredictionService } from "@/lib/api/services"
+import { PreparedImage } from "@/lib/api/types"
 
 interface ImageUploadProps {
-  onImageSelect: (base64: string) => void
+  onImageSelect: (base64: string, image?: PreparedImage) => void
   isLoading?: boolean
   acceptedFormats?: string[]
   maxSizeKB?: number
@@ -38,6 +40,7 @@ export function ImageUpload({
     name: string
     size: string
     type: string
+    dimensions: string
   } | null>(null)
   const [uploadProgress, setUploadProgress] = useState(0)
   const [error, setError] = useState<string | null>(null)
@@ -51,65 +54,42 @@ export function ImageUpload({
     return parseFloat((bytes / Math.pow(k, i)).toFixed(2)) + ' ' + sizes[i]
   }
 
-  const processFile = useCallback((file: File) => {
-    const validateFile = (file: File): boolean => {
-      setError(null)
-      
-      // Check file type
-      if (!acceptedFormats.includes(file.type)) {
-        setError(`Invalid file type. Accepted formats: ${acceptedFormats.join(', ')}`)
-        return false
-      }
-
-      // Check file size
-      if (file.size > maxSizeKB * 1024) {
-        setError(`File size too large. Maximum size: ${formatFileSize(maxSizeKB * 1024)}`)
-        return false
-      }
+  const processFile = useCallback(async (file: File) => {
+    setError(null)
 
-      return true
+    // Check file type
+    if (!acceptedFormats.includes(file.type)) {
+      setError(`Invalid file type. Accepted formats: ${acceptedFormats.join(', ')}`)
+      return
     }
 
-    if (!validateFile(file)) return
+    setUploadProgress(10)
 
-    setUploadProgress(0)
-    setImageInfo({
-      name: file.name,
-      size: formatFileSize(file.size),
-      type: file.type
-    })
+    try {
+      // Downscale and re-encode to the size the server negotiated, instead of uploading the original
+      const prepared = await PredictionService.prepareImage(file)
+      setUploadProgress(90)
 
-    const reader = new FileReader()
-    
-    reader.onloadstart = () => {
-      setUploadProgress(10)
-    }
-    
-    reader.onprogress = (event) => {
-      if (event.lengthComputable) {
-        const progress = Math.round((event.loaded / event.total) * 80) + 10
-        setUploadProgress(progress)
+      // Check the size of what will actually be uploaded
+      if (prepared.bytes > maxSizeKB * 1024) {
+        setError(`File size too large. Maximum size: ${formatFileSize(maxSizeKB * 1024)}`)
+        setUploadProgress(0)
+        return
       }
-    }
-    
-    reader.onload = (event) => {
-      setUploadProgress(90)
-      const base64 = event.target?.result as string
-      
-      // Remove data:image/jpeg;base64, prefix for API compatibility
-      const base64Data = base64.split(',')[1]
-      
-      setSelectedImage(base64)
+
+      setImageInfo({
+        name: file.name,
+        size: `${formatFileSize(prepared.bytes)} (from ${formatFileSize(prepared.originalBytes)})`,
+        type: prepared.type,
+        dimensions: `${prepared.width} × ${prepared.height}`
+      })
+      setSelectedImage(prepared.dataUrl)
       setUploadProgress(100)
-      onImageSelect(base64Data)
-    }
-    
-    reader.onerror = () => {
+      onImageSelect(prepared.base64, prepared)
+    } catch {
       setError('Error reading file. Please try again.')
       setUploadProgress(0)
     }
-
-    reader.readAsDataURL(file)
   }, [acceptedFormats, maxSizeKB, onImageSelect])
 
   const handleDrop = useCallback((e: React.DragEvent<HTMLDivElement>) => {
@@ -222,7 +202,7 @@ export function ImageUpload({
               </div>
 
               <p className="text-xs text-muted-foreground">
-                Maximum file size: {formatFileSize(maxSizeKB * 1024)}
+                Images are downscaled before upload. Maximum upload size: {formatFileSize(maxSizeKB * 1024)}
               </p>
             </div>
           </div>
@@ -258,7 +238,7 @@ export function ImageUpload({
               {/* Image Information */}
               <div className="flex-1 space-y-4">
                 {imageInfo && (
-                  <div className="grid grid-cols-1 sm:grid-cols-3 gap-4">
+                  <div className="grid grid-cols-1 sm:grid-cols-2 gap-4">
                     <div>
                       <label className="text-sm font-medium text-muted-foreground">Filename</label>
                       <p className="text-sm font-mono truncate">{imageInfo.name}</p>
@@ -271,6 +251,10 @@ export function ImageUpload({
                       <label className="text-sm font-medium text-muted-foreground">Format</label>
                       <p className="text-sm">{imageInfo.type}</p>
                     </div>
+                    <div>
+                      <label className="text-sm font-medium text-muted-foreground">Dimensions</label>
+                      <p className="text-sm">{imageInfo.dimensions}</p>
+                    </div>
                   </div>
                 )}
 
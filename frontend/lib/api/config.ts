@@ -15,6 +15,7 @@ export const API_ENDPOINTS = {
   
   // AI Predictions
   PREDICT: '/predict',
+  CAPABILITIES: '/capabilities',
   
   // Health Records
   UPLOAD_RECORD: '/upload_record',
@@ -40,5 +41,6 @@ export const ENDPOINT_TIMEOUTS = {
   [API_ENDPOINTS.PREDICT]: 60000, // 60 seconds for AI predictions
   [API_ENDPOINTS.UPLOAD_RECORD]: 30000, // 30 seconds for file uploads
   [API_ENDPOINTS.HEALTH]: 5000, // 5 seconds for health checks
+  [API_ENDPOINTS.CAPABILITIES]: 5000, // 5 seconds, falls back to defaults
   DEFAULT: 15000, // 15 seconds default
 } as const
\ No newline at end of file
@@ -1,7 +1,10 @@
 import { apiClient, ApiClientError } from './client'
 import { API_ENDPOINTS } from './config'
+import { downscaleImage, readAsDataUrl } from '../image'
 import {
   HealthCheckResponse,
+  CapabilitiesResponse,
+  PreparedImage,
   PredictionRequest,
   PredictionResponse,
   UploadRecordRequest,
@@ -45,8 +48,65 @@ class HealthService {
   }
 }
 
+// Upload settings used when /capabilities cannot be reached (the backend defaults)
+const DEFAULT_CAPABILITIES: CapabilitiesResponse = {
+  model_input: { width: 224, height: 224 },
+  upload: {
+    max_side: 600,
+    resize: "fit",
+    formats: ['image/jpeg', 'image/webp', 'image/png'],
+    preferred_format: 'image/jpeg',
+    quality: 0.9,
+    enforced: false
+  }
+}
+
 // AI Prediction Service
 class PredictionService {
+  private static capabilities: Promise<CapabilitiesResponse | null> | null = null
+
+  /**
+   * Model input size and upload settings advertised by the backend (fetched once)
+   */
+  static getCapabilities(): Promise<CapabilitiesResponse | null> {
+    if (!PredictionService.capabilities) {
+      PredictionService.capabilities = apiClient
+        .get<CapabilitiesResponse>(API_ENDPOINTS.CAPABILITIES)
+        .then(response => response.data ?? null)
+        .catch(error => {
+          console.warn('Capabilities endpoint not available:', error)
+          PredictionService.capabilities = null // retry on the next upload
+          return null
+        })
+    }
+    return PredictionService.capabilities
+  }
+
+  /**
+   * Downscale and re-encode an image to the negotiated upload size before sending it
+   */
+  static async prepareImage(file: File): Promise<PreparedImage> {
+    const capabilities = await PredictionService.getCapabilities()
+    const upload = (capabilities ?? DEFAULT_CAPABILITIES).upload
+    const { blob, width, height } = await downscaleImage(file, {
+      maxSide: upload.max_side,
+      type: upload.preferred_format,
+      quality: upload.quality
+    })
+    const dataUrl = await readAsDataUrl(blob)
+    return {
+      base64: dataUrl.split(',')[1],
+      dataUrl,
+      type: blob.type,
+      width,
+      height,
+      bytes: blob.size,
+      originalBytes: file.size,
+      // Only ask the server to validate against settings it actually advertised
+      maxSide: capabilities ? upload.max_side : undefined
+    }
+  }
+
   /**
    * Submit image and clinical data for AI analysis
    */
@@ -70,6 +130,10 @@ class PredictionService {
           throw new Error('Invalid input data. Please check image format and clinical information.')
         } else if (error.status === 413) {
           throw new Error('Image file too large. Please use a smaller image (max 10MB).')
+        } else if (error.status === 422 && request.image_max_side !== undefined) {
+          // Upload settings may have changed since they were fetched
+          PredictionService.capabilities = null
+          throw new Error(`${error.message} Please select the image again.`)
         } else if (error.status === 422) {
           // Validation errors - pass through the detailed message
           throw new Error(`Validation Error: ${error.message}`)
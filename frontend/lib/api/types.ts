@@ -35,6 +35,35 @@ export interface PredictionRequest {
     symptoms_severity: number // 1.0-10.0
   }
   image_base64: string // base64 encoded image
+  image_max_side?: number // negotiated upload.max_side the image was downscaled to
+}
+
+// Upload negotiation (GET /capabilities)
+export interface CapabilitiesResponse {
+  model_input: {
+    width: number
+    height: number
+  }
+  upload: {
+    max_side: number // longest side after downscaling, aspect ratio kept
+    resize: "fit"
+    formats: string[]
+    preferred_format: string
+    quality: number // 0-1, for lossy formats
+    enforced: boolean
+  }
+}
+
+// Image after client-side downscaling and re-encoding
+export interface PreparedImage {
+  base64: string // without the data URL prefix
+  dataUrl: string
+  type: string
+  width: number
+  height: number
+  bytes: number
+  originalBytes: number
+  maxSide?: number // set when the image was prepared against server capabilities
 }
 
 export interface PredictionResponse {
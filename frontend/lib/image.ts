@@ -0,0 +1,68 @@
+// Client-side image downscaling and re-encoding before upload
+
+export interface DownscaleOptions {
+  maxSide: number // longest side of the result, aspect ratio kept
+  type: string // output MIME type
+  quality: number // 0-1, for lossy formats
+}
+
+export interface DownscaledImage {
+  blob: Blob
+  width: number
+  height: number
+}
+
+/**
+ * Size that fits within maxSide on the longest side (never upscales)
+ */
+export function fitWithin(width: number, height: number, maxSide: number) {
+  const scale = Math.min(1, maxSide / Math.max(width, height))
+  return {
+    width: Math.max(1, Math.min(maxSide, Math.round(width * scale))),
+    height: Math.max(1, Math.min(maxSide, Math.round(height * scale)))
+  }
+}
+
+/**
+ * Decode an image file, downscale it and re-encode it in the browser
+ */
+export async function downscaleImage(file: Blob, options: DownscaleOptions): Promise<DownscaledImage> {
+  // createImageBitmap applies EXIF orientation, so phone photos keep their rotation
+  const bitmap = await createImageBitmap(file)
+  try {
+    const { width, height } = fitWithin(bitmap.width, bitmap.height, options.maxSide)
+    const canvas = document.createElement('canvas')
+    canvas.width = width
+    canvas.height = height
+
+    const context = canvas.getContext('2d')
+    if (!context) {
+      throw new Error('Canvas 2D context not available')
+    }
+    context.imageSmoothingEnabled = true
+    context.imageSmoothingQuality = 'high'
+    context.drawImage(bitmap, 0, 0, width, height)
+
+    const blob = await new Promise<Blob | null>(resolve =>
+      canvas.toBlob(resolve, options.type, options.quality)
+    )
+    if (!blob) {
+      throw new Error(`Could not encode image as ${options.type}`)
+    }
+    return { blob, width, height }
+  } finally {
+    bitmap.close()
+  }
+}
+
+/**
+ * Read a blob as a data URL
+ */
+export function readAsDataUrl(blob: Blob): Promise<string> {
+  return new Promise((resolve, reject) => {
+    const reader = new FileReader()
+    reader.onload = () => resolve(reader.result as string)
+    reader.onerror = () => reject(reader.error)
+    reader.readAsDataURL(blob)
+  })
+}